@@ -2,7 +2,8 @@
 import os
 import logging
 from flask import Flask, render_template, request, jsonify, send_from_directory, Response
-from werkzeug.utils import secure_filename
+from werkzeug.security import safe_join
+from werkzeug.utils import secure_filename, send_file as werkzeug_send_file
 import uuid
 import threading
 import time
@@ -10,6 +11,9 @@ import webbrowser
 import json
 import requests
 import shutil # For moving files
+import copy
+import contextlib
+from urllib.parse import quote
 
 
 import os
@@ -20,49 +24,50 @@ from dotenv import load_dotenv
 env_path = Path('.') / '.env'
 load_dotenv(dotenv_path=env_path)
 
-# 立即验证
-print(f"Working directory: {os.getcwd()}")
-print(f".env file exists: {env_path.exists()}")
-print(f"OPENROUTER_API_KEY loaded: {os.getenv('OPENROUTER_API_KEY') is not None}")
-
-# 在报错的地方之前添加
-print(f"Looking for platform: Openrouter")
-print(f"Environment variable OPENROUTER_API_KEY: {os.getenv('OPENROUTER_API_KEY')}")
-
-
-
 # ==============================================================================
 # Load .env file variables into environment at the very beginning
-from dotenv import load_dotenv
 load_dotenv() # Call only ONCE at the top
-# Your DEBUG prints for initial .env load check (KEEP THESE for now):
-print(f"DEBUG_ENV_LOAD [app.py top]: MODELSCOPE_API_KEY after load_dotenv: {os.getenv('MODELSCOPE_API_KEY')}")
-print(f"DEBUG_ENV_LOAD [app.py top]: SILICONFLOW_API_KEY after load_dotenv: {os.getenv('SILICONFLOW_API_KEY')}")
-print(f"DEBUG_ENV_LOAD [app.py top]: OPENROUTER_API_KEY after load_dotenv: {os.getenv('OPENROUTER_API_KEY')}")
 # ==============================================================================
 
 # Import our existing translators and file processing logic
-from translator import SiliconFlowTranslator
-from file_translator import translate_text_file
-from docx_translator import translate_docx_file
+from sse_relay import FRAME_FORMAT_COMPACT, FRAME_FORMAT_JSON, StreamRelay, error_frame, iter_relay_frames
+from jobs import FAILED, JobManager, JobFailed, open_job_store
+from checkpoints import build_translator_for_manifest, delete_job_manifest, document_hash, load_job_manifest, open_journal, save_job_manifest
+from rate_limiter import rate_limiter_snapshot
+from metrics import render_prometheus
+from tracing import ChromeTraceExporter, span, trace_to
+from platforms import get_translator, install_reload_signal, load_platform_registry, resolve_platform_settings
+from router import ROUTER_PLATFORM_ID, get_router, routing_snapshot
+from hedging import HedgedStream, hedging_snapshot, start_stream
+from single_flight import single_flight_snapshot
+from output_store import is_digest, open_output_store, purge_stale_files
+# 文件翻译后端 (file_translator / text_stream_translator / docx_translator / docx_full_translator，
+# 其中 docx_translator 依赖 python-docx 和 lxml) 在第一次文件任务中才导入，见 run_file_translation
+
+
+def translate_docx_file_formatted(*args, **kwargs):
+    """Formatted DOCX translation via docx_full_translator, imported on first use."""
+    try:
+        from docx_full_translator import translate_docx_file_formatted as formatted_translator
+    except ImportError:
+        logging.warning("docx_full_translator.py or translate_docx_file_formatted function not found. Formatted DOCX translation will not be available.")
+        return "Error: Formatted DOCX translator module or function is not configured."
+    return formatted_translator(*args, **kwargs)
+
 try:
-    from docx_full_translator import translate_docx_file_formatted
-    logging.info("Successfully imported translate_docx_file_formatted from docx_full_translator.")
+    from config import JOB_EVENTS_KEEPALIVE_SECONDS, TRACE_DIR, CHUNK_CONCURRENCY_MAX
 except ImportError:
-    logging.warning("docx_full_translator.py or translate_docx_file_formatted function not found. Formatted DOCX translation will not be available.")
-    def translate_docx_file_formatted(*args, **kwargs): # Fallback dummy function
-        return "Error: Formatted DOCX translator module or function is not configured."
+    JOB_EVENTS_KEEPALIVE_SECONDS = 15
+    TRACE_DIR = ""
+    CHUNK_CONCURRENCY_MAX = 32
 
-# Import fallback configurations from config.py (ensure config.py is generic now)
 try:
-    from config import API_KEY as DEFAULT_FALLBACK_API_KEY, \
-                       BASE_URL as DEFAULT_FALLBACK_BASE_URL, \
-                       DEFAULT_MODEL as DEFAULT_FALLBACK_MODEL
+    from config import OUTPUT_STORE_TTL_SECONDS, DOWNLOAD_CACHE_MAX_AGE, DOWNLOAD_OFFLOAD, DOWNLOAD_ACCEL_PREFIX
 except ImportError:
-    logging.warning("config.py not found or missing default fallback constants. Global fallbacks will be None.")
-    DEFAULT_FALLBACK_API_KEY = None
-    DEFAULT_FALLBACK_BASE_URL = None
-    DEFAULT_FALLBACK_MODEL = None
+    OUTPUT_STORE_TTL_SECONDS = 7 * 24 * 3600
+    DOWNLOAD_CACHE_MAX_AGE = 24 * 3600
+    DOWNLOAD_OFFLOAD = ""
+    DOWNLOAD_ACCEL_PREFIX = "/_translated/"
 
 # Configure logging
 logging.basicConfig(
@@ -71,6 +76,9 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# .env 加载检查。Key 是否已设置由 load_platform_registry 以掩码形式记录，这里不输出 Key (serve.py 下每个 worker 都会导入 app.py)
+logger.debug(f"Working directory: {os.getcwd()}, .env file exists: {env_path.exists()}")
+
 app = Flask(__name__)
 
 # Configure upload and translated folders
@@ -85,13 +93,185 @@ os.makedirs(TRANSLATED_FOLDER, exist_ok=True)
 
 ALLOWED_EXTENSIONS = {'txt', 'docx'}
 
+# Background workers for file translations (see jobs.py)
+# 任务状态保存在 JOB_STORE_DB (SQLite) 中，serve.py 的多个 worker 进程共享同一个任务存储
+job_manager = JobManager(open_job_store())
+
+# 译文的内容寻址存储 (output_store.py)：相同文件 + 相同设置直接返回已有结果；OUTPUT_STORE_ENABLED=false 时为 None
+output_store = open_output_store()
+# 下载目录中不归存储管理的结果 (存储关闭时的输出) 按同一 TTL 清理
+purge_stale_files(TRANSLATED_FOLDER, OUTPUT_STORE_TTL_SECONDS)
+
+# 优雅关闭 (serve.py 收到 SIGTERM) 时设置：任务事件流提示客户端重连到其他 worker，
+# 正在进行的文字翻译流照常结束
+draining = threading.Event()
+
+def begin_drain():
+    """Called by serve.py when a worker is asked to stop; in-flight requests are left to finish."""
+    if not draining.is_set():
+        draining.set()
+        logger.info("Draining: no new jobs; job event streams will ask clients to reconnect.")
+        job_manager.drain()
+
+# 平台配置在启动时解析一次 (.env 变化或 SIGHUP 时重新加载)
+load_platform_registry()
+install_reload_signal()
+
 def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 @app.route('/')
 def index():
-    return render_template('index.html')
+    return render_template('index.html', chunk_concurrency_max=CHUNK_CONCURRENCY_MAX)
+
+def run_file_translation(input_filepath, file_extension, translation_format, encoding, actual_output_dir,
+                         target_lang, source_lang, translator_instance, unique_filename_base, job_id=None,
+                         incremental_manifest=None, output_key=None, download_name=None):
+    """
+    Translate an uploaded file and stage the result in TRANSLATED_FOLDER. Runs inside a background job.
+    Returns {"translated_file_url", "filename"} (plus "incremental" with reused/translated segment counts when
+    incremental_manifest is set); raises JobFailed with a user-facing message on failure.
+    With output_key the result is moved into the output store and served as `download_name`.
+
+    Completed chunks are journaled on disk (checkpoints.py). On failure the upload, journal and job manifest are
+    kept so that POST /jobs/<job_id>/resume (or uploading the same file again) continues where it stopped.
+    """
+    translated_filepath_or_error = None 
+    journal = open_journal(input_filepath, translator_instance, target_lang, source_lang,
+                           file_type=file_extension, translation_format=translation_format, encoding=encoding)
+    translator_instance.journal = journal
+    incremental = None
+    if incremental_manifest:
+        # 修订版文档：与上一版相同的片段复用译文 (incremental.py)
+        from incremental import open_incremental_manifest
+        incremental = open_incremental_manifest(incremental_manifest, translator_instance, target_lang, source_lang,
+                                                journal=journal, file_type=file_extension,
+                                                translation_format=translation_format, encoding=encoding)
+        translator_instance.journal = incremental
+    incremental_summary = None
+    try:
+        if file_extension == 'txt':
+            logger.info(f"Translating TXT file with encoding '{encoding}'.")
+            # 大文件走恒定内存的流式模式；增量模式 (分块边界由段落内容决定) 和指定并发数时也用它
+            # (并发数由 chunk_executor 实现，file_translator 不支持)
+            from text_stream_translator import should_stream
+            if incremental is not None or translator_instance.chunk_concurrency or should_stream(input_filepath):
+                from text_stream_translator import translate_text_file_streaming as text_translate_func
+            else:
+                from file_translator import translate_text_file as text_translate_func
+            translated_filepath_or_error = text_translate_func(
+                input_filepath, actual_output_dir, target_lang, translator_instance, 
+                source_lang, encoding, unique_filename_base
+            )
+        elif file_extension == 'docx':
+            if translation_format == 'formatted':
+                logger.info(f"Attempting formatted DOCX translation.")
+                translated_filepath_or_error = translate_docx_file_formatted(
+                    input_filepath, actual_output_dir, target_lang, translator_instance, 
+                    source_lang, unique_filename_base
+                )
+            else: 
+                logger.info(f"Attempting unformatted DOCX translation.")
+                from docx_translator import translate_docx_file
+                translated_filepath_or_error = translate_docx_file(
+                    input_filepath, actual_output_dir, target_lang, translator_instance, 
+                    source_lang, unique_filename_base
+                )
+    finally:
+        succeeded = isinstance(translated_filepath_or_error, str) and not translated_filepath_or_error.startswith("Error:")
+        if incremental is not None:
+            if succeeded:
+                incremental_summary = incremental.commit()
+            else:
+                incremental.abort()
+        if journal is not None:
+            if succeeded:
+                journal.complete()
+                delete_job_manifest(job_id)
+            else:
+                journal.close()
+                logger.info(f"Checkpoint kept for job {job_id}: {len(journal)} completed chunk(s) in {journal.path}")
+        try:
+            if os.path.exists(input_filepath) and (succeeded or journal is None):
+                os.remove(input_filepath)
+                logger.info(f"Temporary uploaded file removed: {input_filepath}")
+        except Exception as e:
+            logger.warning(f"Failed to remove temporary uploaded file {input_filepath}: {e}")
+
+    if isinstance(translated_filepath_or_error, str) and not translated_filepath_or_error.startswith("Error:"):
+        if not os.path.exists(translated_filepath_or_error):
+             logger.error(f"Translated file path reported ('{translated_filepath_or_error}') but file not found on server.")
+             raise JobFailed("Translated file not found on server after processing.")
+
+        output_filename = os.path.basename(translated_filepath_or_error)
+        final_downloadable_path_in_translated_folder = os.path.join(app.config['TRANSLATED_FOLDER'], output_filename)
+
+        if os.path.abspath(translated_filepath_or_error) != os.path.abspath(final_downloadable_path_in_translated_folder):
+            try:
+                shutil.move(translated_filepath_or_error, final_downloadable_path_in_translated_folder)
+                logger.info(f"Moved translated file from '{translated_filepath_or_error}' to download folder '{final_downloadable_path_in_translated_folder}'")
+            except Exception as e:
+                logger.error(f"Failed to move translated file to download folder: {e}")
+                if os.path.exists(translated_filepath_or_error):
+                     logger.warning(f"Serving from original translated path '{translated_filepath_or_error}' as move failed.")
+                     raise JobFailed(f"File translated but failed to stage for download: {e}")
+                else:
+                     raise JobFailed(f"File translated, move failed, and original also missing: {e}")
+        
+        output_file_url = f"/download/{output_filename}" 
+        if output_key and output_store is not None:
+            try:
+                stored = output_store.put(output_key, final_downloadable_path_in_translated_folder,
+                                          download_name or output_filename)
+                output_filename = stored["filename"]
+                output_file_url = f"/download/{stored['digest']}/{quote(output_filename)}"
+                final_downloadable_path_in_translated_folder = output_store.blob_path(stored["digest"])
+            except Exception as e:
+                logger.warning(f"Could not add the translated file to the output store, serving it directly: {e}")
+        purge_stale_files(app.config['TRANSLATED_FOLDER'], OUTPUT_STORE_TTL_SECONDS)
+        logger.info(f"File translation successful. URL: {output_file_url}, Path in download folder: {final_downloadable_path_in_translated_folder}")
+        result = {"translated_file_url": output_file_url, "filename": output_filename}
+        if incremental_summary is not None:
+            result["incremental"] = {key: incremental_summary[key] for key in ("segments", "reused", "translated", "resumed")}
+        return result
+    else: 
+        error_message = str(translated_filepath_or_error) if translated_filepath_or_error else "Unknown error during file translation."
+        logger.error(f"File translation failed: {error_message}")
+        raise JobFailed(error_message)
+
+
+def submit_file_job(job_id, manifest, translator_instance):
+    """Save the job manifest (for resume by id) and queue the translation described by it."""
+    def file_translation_job(reporter):
+        translator_instance.progress_callback = reporter.progress # 每个分块完成时推送进度事件
+        # 开启 TRACE_DIR 时记录本任务的时间线 (分块并发、限流等待、连接、首 token...)
+        exporter = ChromeTraceExporter() if TRACE_DIR else None
+        try:
+            with trace_to(exporter) if exporter else contextlib.nullcontext(), \
+                    span("file_translation", job_id=job_id, file=manifest["original_filename"]):
+                return run_file_translation(
+                    manifest["input_filepath"], manifest["file_extension"], manifest["translation_format"], manifest["encoding"],
+                    manifest["output_dir"], manifest["target_lang"], manifest["source_lang"], translator_instance,
+                    manifest["output_base"], job_id, manifest.get("incremental_manifest"),
+                    manifest.get("output_key"), manifest.get("download_name")
+                )
+        finally:
+            if exporter is not None:
+                exporter.write(os.path.join(TRACE_DIR, f"{job_id}.json"))
+
+    save_job_manifest(job_id, manifest)
+    job_manager.submit(file_translation_job, job_id=job_id, meta={
+        "filename": manifest["original_filename"], "platform": manifest["platform"], "model": translator_instance.model,
+        "target_lang": manifest["target_lang"], "translation_format": manifest["translation_format"],
+    })
+    return jsonify({
+        "job_id": job_id,
+        "status_url": f"/jobs/{job_id}",
+        "events_url": f"/jobs/{job_id}/events",
+        "resume_url": f"/jobs/{job_id}/resume",
+    }), 202
+
 
 @app.route('/translate_api', methods=['POST'])
 def translate_api():
@@ -105,7 +285,7 @@ def translate_api():
     frontend_base_url = data.get('base_url', '').strip()
     frontend_model = data.get('model', '').strip()
     
-    logger.info(f"Frontend inputs - API Key: {'SET (length ' + str(len(frontend_api_key)) + ')' if frontend_api_key else 'Not provided'}, Base URL: '{frontend_base_url}', Model: '{frontend_model}'")
+    logger.debug(f"Frontend inputs - API Key: {'SET (length ' + str(len(frontend_api_key)) + ')' if frontend_api_key else 'Not provided'}, Base URL: '{frontend_base_url}', Model: '{frontend_model}'")
 
     target_lang = data.get('target_lang')
     source_lang = data.get('source_lang')
@@ -114,140 +294,26 @@ def translate_api():
         logger.error("Target language is required.")
         return jsonify({"error": "Target language is required."}), 400
 
-    # ==============================================================================
-    # >>>>>>>>>> START OF REVISED CONFIGURATION LOADING LOGIC <<<<<<<<<<
-    # --- Platform-specific configuration loading ---
-    platform_configs = {
-        "siliconflow": {
-            "api_key_env": "SILICONFLOW_API_KEY",
-            "base_url_env": "SILICONFLOW_BASE_URL",
-            "model_env": "SILICONFLOW_MODEL",
-            "default_base_url": "https://api.siliconflow.cn/v1",
-            "default_model": "THUDM/GLM-4-9B-0414" 
-        },
-        "deepseek": {
-            "api_key_env": "DEEPSEEK_API_KEY",
-            "base_url_env": "DEEPSEEK_BASE_URL",
-            "model_env": "DEEPSEEK_MODEL",
-            "default_base_url": "https://api.deepseek.com/v1",
-            "default_model": "deepseek-chat"
-        },
-        "moonshot": {
-            "api_key_env": "MOONSHOT_API_KEY",
-            "base_url_env": "MOONSHOT_BASE_URL",
-            "model_env": "MOONSHOT_MODEL",
-            "default_base_url": "https://api.moonshot.cn/v1",
-            "default_model": "moonshot-v1-8k"
-        },
-        "openai": {
-            "api_key_env": "OPENAI_API_KEY",
-            "base_url_env": "OPENAI_BASE_URL",
-            "model_env": "OPENAI_MODEL",
-            "default_base_url": "https://api.openai.com/v1",
-            "default_model": "gpt-3.5-turbo"
-        },
-        "ollama": {
-            "api_key_env": "OLLAMA_API_KEY", 
-            "base_url_env": "OLLAMA_BASE_URL",
-            "model_env": "OLLAMA_MODEL",
-            "default_base_url": "http://localhost:11434/v1",
-            "default_model": "llama3"
-        },
-        "modelscope": { 
-            "api_key_env": "MODELSCOPE_API_KEY",
-            "base_url_env": "MODELSCOPE_BASE_URL",
-            "model_env": "MODELSCOPE_MODEL",
-            "default_base_url": "https://api-inference.modelscope.cn/v1",
-            "default_model": "Qwen/Qwen2.5-72B-Instruct"
-        },
-        "openrouter": { 
-            "api_key_env": "OPENROUTER_API_KEY",
-            "base_url_env": "OPENROUTER_BASE_URL",
-            "model_env": "OPENROUTER_MODEL",
-            "default_base_url": "https://openrouter.ai/api/v1",
-            "default_model": "google/gemini-2.0-flash-exp:free"
-        }
-    }
-
-    api_key_to_use = frontend_api_key
-    base_url_to_use = frontend_base_url
-    model_to_use = frontend_model
-
-    selected_platform_config = platform_configs.get(api_platform)
-
-    if selected_platform_config:
-        logger.info(f"Processing config for known platform: {api_platform}")
-        # Try to get API Key from .env if not provided by frontend
-        if not api_key_to_use and selected_platform_config.get("api_key_env"):
-            env_var_name = selected_platform_config["api_key_env"]
-            key_from_env = os.getenv(env_var_name)
-            logger.info(f"Attempting to load API Key from env var '{env_var_name}': {'Found' if key_from_env else 'Not Found'}")
-            if key_from_env:
-                api_key_to_use = key_from_env
-        
-        # Try to get Base URL from .env if not provided by frontend
-        if not base_url_to_use and selected_platform_config.get("base_url_env"):
-            env_var_name = selected_platform_config["base_url_env"]
-            url_from_env = os.getenv(env_var_name)
-            logger.info(f"Attempting to load Base URL from env var '{env_var_name}': {'Found' if url_from_env else 'Not Found'}")
-            if url_from_env:
-                base_url_to_use = url_from_env
-        
-        # Try to get Model from .env if not provided by frontend
-        if not model_to_use and selected_platform_config.get("model_env"):
-            env_var_name = selected_platform_config["model_env"]
-            model_from_env = os.getenv(env_var_name)
-            logger.info(f"Attempting to load Model from env var '{env_var_name}': {'Found' if model_from_env else 'Not Found'}")
-            if model_from_env:
-                model_to_use = model_from_env
-
-        # Fallback to platform hardcoded defaults if still not set
-        if not base_url_to_use:
-            base_url_to_use = selected_platform_config.get("default_base_url")
-            if base_url_to_use: logger.info(f"Using platform default Base URL for '{api_platform}': {base_url_to_use}")
-        if not model_to_use:
-            model_to_use = selected_platform_config.get("default_model")
-            if model_to_use: logger.info(f"Using platform default Model for '{api_platform}': {model_to_use}")
-    else:
-        logger.info(f"Platform '{api_platform}' is 'custom' or not in predefined configs. Relying on frontend inputs or global fallbacks.")
-    
-    # Final fallback to global defaults from config.py (which should be generic or None)
-    if not api_key_to_use:
-        api_key_to_use = DEFAULT_FALLBACK_API_KEY # This is from config.py
-        if api_key_to_use: logger.info(f"Using global fallback API Key (from config.py) for '{api_platform}'.")
-    if not base_url_to_use:
-        base_url_to_use = DEFAULT_FALLBACK_BASE_URL # This is from config.py
-        if base_url_to_use: logger.info(f"Using global fallback Base URL (from config.py) for '{api_platform}'.")
-    if not model_to_use:
-        model_to_use = DEFAULT_FALLBACK_MODEL # This is from config.py
-        if model_to_use: logger.info(f"Using global fallback Model (from config.py) for '{api_platform}'.")
-    
-    logger.info(f"Final config for API call - Platform: '{api_platform}', API Key: {'SET (ends ...' + api_key_to_use[-4:] + ')' if api_key_to_use and len(api_key_to_use) > 4 else ('PROVIDED (short/empty)' if api_key_to_use else 'NOT SET (CRITICAL!)')}, Base URL: {base_url_to_use}, Model: {model_to_use}")
-
-    # Validate final configurations
-    if not api_key_to_use: # This check is now more critical
-        err_msg = f"API Key for platform '{api_platform}' is ultimately missing. Please configure it via UI or .env file."
-        logger.error(err_msg)
-        return jsonify({"error": err_msg}), 400
-    # Similar checks for base_url_to_use and model_to_use
-    if not base_url_to_use:
-        err_msg = f"Base URL for platform '{api_platform}' is ultimately missing. Please configure it."
-        logger.error(err_msg)
-        return jsonify({"error": err_msg}), 400
-    if not model_to_use:
-        err_msg = f"Model for platform '{api_platform}' is ultimately missing. Please configure it."
-        logger.error(err_msg)
-        return jsonify({"error": err_msg}), 400
-    # >>>>>>>>>> END OF REVISED CONFIGURATION LOADING LOGIC <<<<<<<<<<
-    # ==============================================================================
-    
     try:
-        translator_instance = SiliconFlowTranslator(
-    api_key=api_key_to_use,
-    base_url=base_url_to_use,
-    model=model_to_use,
-    platform_id=api_platform # <--- 新增传递 platform_id
-)
+        if api_platform == ROUTER_PLATFORM_ID:
+            # 多平台路由：目标列表来自表单 (route_targets) 或 .env 中的 ROUTING_TARGETS
+            translator_instance = get_router(data.get('route_targets', '').strip() or None,
+                                             data.get('route_mode', '').strip() or None)
+            model_to_use = translator_instance.model
+        else:
+            # ==============================================================================
+            # >>>>>>>>>> START OF REVISED CONFIGURATION LOADING LOGIC <<<<<<<<<<
+            # --- Platform-specific configuration loading (see resolve_platform_settings) ---
+            api_key_to_use, base_url_to_use, model_to_use, config_error = resolve_platform_settings(
+                api_platform, frontend_api_key, frontend_base_url, frontend_model
+            )
+            if config_error:
+                return jsonify({"error": config_error}), 400
+            # >>>>>>>>>> END OF REVISED CONFIGURATION LOADING LOGIC <<<<<<<<<<
+            # ==============================================================================
+
+            # 按解析后的配置复用已创建的翻译器实例
+            translator_instance = get_translator(api_platform, api_key_to_use, base_url_to_use, model_to_use)
     except ValueError as e:
         logger.error(f"Translator initialization error with resolved config: {e}")
         return jsonify({"error": str(e)}), 400
@@ -264,65 +330,42 @@ def translate_api():
 
         logger.info(f"Processing text translation: '{text_to_translate[:50]}...' to {target_lang} via {api_platform}")
 
+        hedge = data.get('hedge', '').lower() in ('1', 'true', 'on') or None # None: 使用 HEDGE_ENABLED
+
+        # 前端可选择紧凑帧格式 (纯 SSE data 行，无 JSON)；默认保持原来的 JSON 帧
+        frame_format = FRAME_FORMAT_COMPACT if data.get('frame_format') == FRAME_FORMAT_COMPACT else FRAME_FORMAT_JSON
+
         def generate_translation_stream():
             response_stream = None
             try:
-                response_stream = translator_instance.translate(text_to_translate, target_lang, source_lang, stream=True)
-                if not isinstance(response_stream, requests.Response):
+                response_stream = start_stream(translator_instance, text_to_translate, target_lang, source_lang, hedge=hedge)
+                if not isinstance(response_stream, (requests.Response, HedgedStream)):
                     error_msg = f"Translation API for {api_platform} did not return a valid stream. Type: {type(response_stream)}. Content: {str(response_stream)[:200]}"
                     logger.error(error_msg)
-                    yield f"data: {json.dumps({'error': error_msg})}\n\n"
+                    yield error_frame(error_msg, frame_format)
                     return
 
-                for chunk in response_stream.iter_lines(): 
-                    if chunk:
-                        chunk_str = chunk.decode('utf-8')
-                        if chunk_str.startswith("data: "):
-                            json_part_str = chunk_str[len("data: "):].strip()
-                        elif chunk_str.strip().startswith("{") and chunk_str.strip().endswith("}"): 
-                             json_part_str = chunk_str.strip()
-                             logger.debug(f"Received non-standard JSON line, processing as data: {json_part_str}")
-                        else:
-                            logger.debug(f"Skipping non-data line from stream: {chunk_str}")
-                            continue
-                        if json_part_str == "[DONE]":
-                            logger.info("Stream finished with [DONE] marker from API.")
-                            yield f"data: {json.dumps({'done': True})}\n\n"
-                            break
-                        try:
-                            json_part = json.loads(json_part_str)
-                            if json_part.get("choices") and isinstance(json_part["choices"], list) and len(json_part["choices"]) > 0 and \
-                               json_part["choices"][0].get("delta") and "content" in json_part["choices"][0]["delta"]:
-                                content = json_part["choices"][0]["delta"]["content"]
-                                if content is not None: 
-                                    yield f"data: {json.dumps({'text_chunk': content})}\n\n"
-                            elif json_part.get("error"): 
-                                error_detail = json_part["error"].get("message", str(json_part["error"])) if isinstance(json_part["error"], dict) else str(json_part["error"])
-                                logger.error(f"Error in stream from API ({api_platform}): {error_detail}")
-                                yield f"data: {json.dumps({'error': error_detail})}\n\n"
-                                break 
-                            elif json_part.get("done") is True :
-                                logger.info(f"Stream finished with 'done: true' marker from API ({api_platform}).")
-                                yield f"data: {json.dumps({'done': True})}\n\n"
-                                break
-                        except json.JSONDecodeError:
-                            logger.warning(f"Could not decode JSON from stream chunk ({api_platform}): {json_part_str}")
-                            continue 
+                # 在原始字节上增量解析，增量按时间窗口/长度合并后再发送 (上游停顿到窗口结束时发出已缓冲的译文)
+                relay = StreamRelay(api_platform, frame_format)
+                for frame in iter_relay_frames(relay, response_stream):
+                    yield frame
+                logger.debug(f"Relayed {relay.deltas} deltas in {relay.frames} frames for {api_platform}.")
             except requests.exceptions.RequestException as e:
                 logger.error(f"RequestException during streaming to {api_platform} API: {e}")
-                yield f"data: {json.dumps({'error': f'API request error: {e}'})}\n\n"
+                yield error_frame(f'API request error: {e}', frame_format)
             except Exception as e:
                 import traceback
                 logger.error(f"Unexpected error in generate_translation_stream ({api_platform}): {e}\n{traceback.format_exc()}")
-                yield f"data: {json.dumps({'error': f'Server error during streaming: {str(e)}'})}\n\n"
+                yield error_frame(f'Server error during streaming: {str(e)}', frame_format)
             finally:
                 if response_stream and hasattr(response_stream, 'close'):
                     response_stream.close()
                 logger.info(f"Translation stream generation ended for {api_platform}.")
-        return Response(generate_translation_stream(), mimetype='text/event-stream')
+        return Response(generate_translation_stream(), mimetype='text/event-stream',
+                        headers={'X-Frame-Format': frame_format})
 
     # --- File Input Translation ---
-    # ... (保持你原有的文件翻译逻辑不变，它会使用上面已确定的 translator_instance) ...
+    # 上传在请求内保存，翻译本身交给后台任务 (run_file_translation)
     elif 'file' in request.files:
         file = request.files['file']
         if not file or file.filename == '': 
@@ -335,6 +378,12 @@ def translate_api():
 
         original_filename = secure_filename(file.filename)
         file_extension = original_filename.rsplit('.', 1)[1].lower()
+        translation_format = data.get('translation_format', 'unformatted')
+        chunk_concurrency = data.get('chunk_concurrency', '').strip()
+        if chunk_concurrency and file_extension == 'docx' and translation_format != 'formatted':
+            # 不带格式的 .docx 由 docx_translator 处理，不经过 chunk_executor，并发数对它无效
+            logger.error("chunk_concurrency requested for an unformatted DOCX translation.")
+            return jsonify({"error": "chunk_concurrency only applies to .txt and formatted .docx translations."}), 400
         unique_filename_base = str(uuid.uuid4())
         input_unique_filename = unique_filename_base + '.' + file_extension
         input_filepath = os.path.join(app.config['UPLOAD_FOLDER'], input_unique_filename)
@@ -362,70 +411,195 @@ def translate_api():
         
         logger.info(f"Translations will be saved to: {actual_output_dir}")
 
-        translated_filepath_or_error = None 
-        translation_format = data.get('translation_format', 'unformatted')
+        # 翻译器实例在请求间共享：任务级设置 (并发数、进度回调) 放在浅拷贝上，连接池和缓存仍然共用
+        translator_instance = copy.copy(translator_instance)
+        if chunk_concurrency:
+            try:
+                requested_concurrency = int(chunk_concurrency)
+            except ValueError:
+                logger.warning(f"Ignoring invalid chunk_concurrency value '{chunk_concurrency}', using platform default.")
+            else:
+                # 由客户端指定的线程池大小，限制在 CHUNK_CONCURRENCY_MAX 以内
+                translator_instance.chunk_concurrency = max(1, min(requested_concurrency, CHUNK_CONCURRENCY_MAX))
+                if requested_concurrency > CHUNK_CONCURRENCY_MAX:
+                    logger.warning(f"chunk_concurrency {requested_concurrency} exceeds CHUNK_CONCURRENCY_MAX; using {CHUNK_CONCURRENCY_MAX}.")
+        logger.info(f"Chunk concurrency: {translator_instance.chunk_concurrency or 'platform default'}")
+
+        encoding = data.get('encoding', 'utf-8')
         
         logger.info(f"Processing file '{original_filename}', format: {translation_format if file_extension == 'docx' else 'N/A'}")
 
-        if file_extension == 'txt':
-            encoding = data.get('encoding', 'utf-8')
-            logger.info(f"Translating TXT file with encoding '{encoding}'.")
-            translated_filepath_or_error = translate_text_file(
-                input_filepath, actual_output_dir, target_lang, translator_instance, 
-                source_lang, encoding, unique_filename_base
+        # 翻译在后台任务中执行，请求立即返回 job id；进度通过 /jobs/<job_id>/events 推送
+        # 清单不含 API Key：续传时使用表单中重新提供的 Key 或 .env 中的配置
+        manifest = {
+            "input_filepath": input_filepath, "file_extension": file_extension, "original_filename": original_filename,
+            "translation_format": translation_format, "encoding": encoding, "output_dir": actual_output_dir,
+            "output_base": unique_filename_base, "target_lang": target_lang, "source_lang": source_lang,
+            "platform": api_platform, "base_url": frontend_base_url, "model": model_to_use,
+            "route_targets": data.get('route_targets', '').strip(), "route_mode": data.get('route_mode', '').strip(),
+            "chunk_concurrency": translator_instance.chunk_concurrency,
+        }
+        if data.get('incremental', '').strip().lower() in ("1", "true", "yes", "on"):
+            # 增量翻译：同一文档名 (默认为上传的文件名，可用 incremental_name 指定) 和相同设置的上一版清单
+            from incremental import incremental_manifest_path
+            incremental_name = data.get('incremental_name', '').strip() or original_filename
+            manifest["incremental_manifest"] = incremental_manifest_path(
+                incremental_name, file_type=file_extension, translation_format=translation_format,
+                platform=api_platform, model=model_to_use, target_lang=target_lang, source_lang=source_lang,
+                route_targets=manifest["route_targets"],
             )
-        elif file_extension == 'docx':
-            if translation_format == 'formatted':
-                logger.info(f"Attempting formatted DOCX translation.")
-                translated_filepath_or_error = translate_docx_file_formatted(
-                    input_filepath, actual_output_dir, target_lang, translator_instance, 
-                    source_lang, unique_filename_base
-                )
-            else: 
-                logger.info(f"Attempting unformatted DOCX translation.")
-                translated_filepath_or_error = translate_docx_file(
-                    input_filepath, actual_output_dir, target_lang, translator_instance, 
-                    source_lang, unique_filename_base
-                )
-        
-        try:
-            if os.path.exists(input_filepath):
+            logger.info(f"Incremental translation of '{incremental_name}' using manifest {manifest['incremental_manifest']}")
+        if output_store is not None:
+            # 同一文件以相同设置翻译过：直接返回存储中的结果，不创建任务、不调用上游
+            manifest["output_key"] = output_store.make_key(document_hash(input_filepath), {
+                key: manifest[key] for key in ("file_extension", "translation_format", "encoding", "target_lang",
+                                               "source_lang", "platform", "base_url", "model", "route_targets", "route_mode")
+            })
+            manifest["download_name"] = download_filename(original_filename, target_lang)
+            stored = output_store.get(manifest["output_key"])
+            if stored is not None:
                 os.remove(input_filepath)
-                logger.info(f"Temporary uploaded file removed: {input_filepath}")
-        except Exception as e:
-            logger.warning(f"Failed to remove temporary uploaded file {input_filepath}: {e}")
-
-        if isinstance(translated_filepath_or_error, str) and not translated_filepath_or_error.startswith("Error:"):
-            if not os.path.exists(translated_filepath_or_error):
-                 logger.error(f"Translated file path reported ('{translated_filepath_or_error}') but file not found on server.")
-                 return jsonify({"error": "Translated file not found on server after processing."}), 500
-
-            output_filename = os.path.basename(translated_filepath_or_error)
-            final_downloadable_path_in_translated_folder = os.path.join(app.config['TRANSLATED_FOLDER'], output_filename)
-
-            if os.path.abspath(translated_filepath_or_error) != os.path.abspath(final_downloadable_path_in_translated_folder):
-                try:
-                    shutil.move(translated_filepath_or_error, final_downloadable_path_in_translated_folder)
-                    logger.info(f"Moved translated file from '{translated_filepath_or_error}' to download folder '{final_downloadable_path_in_translated_folder}'")
-                except Exception as e:
-                    logger.error(f"Failed to move translated file to download folder: {e}")
-                    if os.path.exists(translated_filepath_or_error):
-                         logger.warning(f"Serving from original translated path '{translated_filepath_or_error}' as move failed.")
-                         return jsonify({"error": f"File translated but failed to stage for download: {e}"}), 500
-                    else:
-                         return jsonify({"error": f"File translated, move failed, and original also missing: {e}"}), 500
-            
-            output_file_url = f"/download/{output_filename}" 
-            logger.info(f"File translation successful. URL: {output_file_url}, Path in download folder: {final_downloadable_path_in_translated_folder}")
-            return jsonify({"translated_file_url": output_file_url})
-        else: 
-            error_message = str(translated_filepath_or_error) if translated_filepath_or_error else "Unknown error during file translation."
-            logger.error(f"File translation failed: {error_message}")
-            return jsonify({"error": error_message}), 500
+                logger.info(f"'{original_filename}' was already translated with these settings: serving stored output {stored['digest']}.")
+                return jsonify({"translated_file_url": f"/download/{stored['digest']}/{quote(manifest['download_name'])}",
+                                "filename": manifest["download_name"], "cached": True})
+        return submit_file_job(uuid.uuid4().hex, manifest, translator_instance)
     else:
         logger.error("No valid text or file input provided to /translate_api.")
         return jsonify({"error": "No valid text or file input provided."}), 400
 
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    job = job_manager.store.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found (unknown id or expired)."}), 404
+    return jsonify(job)
+
+@app.route('/jobs/<job_id>/resume', methods=['POST'])
+def resume_job(job_id):
+    """Rerun an interrupted or failed file job from its checkpoint journal (also after a server restart)."""
+    job = job_manager.store.get(job_id)
+    if job is not None and job["status"] not in (FAILED,):
+        return jsonify({"error": f"Job is {job['status']}; only failed or interrupted jobs can be resumed."}), 409
+    manifest = load_job_manifest(job_id)
+    if manifest is None:
+        return jsonify({"error": "No checkpoint found for this job (unknown id, already completed, or expired)."}), 404
+    if not os.path.exists(manifest["input_filepath"]):
+        return jsonify({"error": "The uploaded file for this job is no longer available. Please upload it again."}), 410
+    try:
+        translator_instance = copy.copy(build_translator_for_manifest(manifest, request.form.get('api_key', '').strip()))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    translator_instance.chunk_concurrency = manifest.get("chunk_concurrency")
+    logger.info(f"Resuming file translation job {job_id} ({manifest['original_filename']}).")
+    return submit_file_job(job_id, manifest, translator_instance)
+
+@app.route('/jobs/<job_id>/trace')
+def job_trace(job_id):
+    """Chrome trace / Perfetto JSON of a file job (only when TRACE_DIR is set)."""
+    if not TRACE_DIR or not job_id.isalnum():
+        return jsonify({"error": "No trace available. Set TRACE_DIR to record file job traces."}), 404
+    if not os.path.exists(os.path.join(TRACE_DIR, f"{job_id}.json")):
+        return jsonify({"error": "No trace for this job (yet)."}), 404
+    return send_from_directory(os.path.abspath(TRACE_DIR), f"{job_id}.json", mimetype='application/json')
+
+@app.route('/jobs/<job_id>/events')
+def job_events(job_id):
+    """SSE stream of a job's status/progress events. Honors Last-Event-ID so reconnecting clients resume."""
+    if job_manager.store.get(job_id) is None:
+        return jsonify({"error": "Job not found (unknown id or expired)."}), 404
+    try:
+        last_seq = int(request.headers.get('Last-Event-ID') or request.args.get('after', 0))
+    except ValueError:
+        last_seq = 0
+
+    def generate_job_events():
+        seq = last_seq
+        while True:
+            if draining.is_set():
+                # EventSource 会带着 Last-Event-ID 自动重连 (通常连到其他 worker)，从共享任务存储继续
+                yield "retry: 1000\n\n"
+                return
+            events = job_manager.store.events_after(job_id, seq, timeout=JOB_EVENTS_KEEPALIVE_SECONDS)
+            if not events:
+                if job_manager.store.get(job_id) is None:
+                    return
+                yield ": keepalive\n\n"
+                continue
+            for event in events:
+                seq = event["seq"]
+                yield f"id: {seq}\ndata: {json.dumps(event)}\n\n"
+                if event["type"] in ("done", "error"):
+                    return
+
+    return Response(generate_job_events(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus text exposition of the translator metrics (requests, latency/TTFT histograms, tokens, streams)."""
+    return Response(render_prometheus(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/debug/rate_limits')
+def debug_rate_limits():
+    """Current state of the per-platform rate limiters (window, in-flight, buckets, counters)."""
+    return jsonify(rate_limiter_snapshot())
+
+@app.route('/debug/routing')
+def debug_routing():
+    """Health of every routing target: circuit state, error rate and median latency."""
+    return jsonify(routing_snapshot())
+
+@app.route('/debug/hedging')
+def debug_hedging():
+    """Hedged streaming counters per primary target: hedge rate, wins, current hedge delay."""
+    return jsonify(hedging_snapshot())
+
+@app.route('/debug/single_flight')
+def debug_single_flight():
+    """Identical requests currently sharing one upstream call, with follower/subscriber counts."""
+    return jsonify(single_flight_snapshot())
+
+@app.route('/debug/output_store')
+def debug_output_store():
+    """Stored translation outputs: entries, distinct files, bytes against the quota, hits and evictions."""
+    if output_store is None:
+        return jsonify({"enabled": False})
+    return jsonify({"enabled": True, **output_store.snapshot()})
+
+def download_filename(original_filename, target_lang):
+    """Name of a translated upload as offered for download: {stem}_translated_{lang}.{ext}."""
+    stem, extension = os.path.splitext(original_filename)
+    lang = secure_filename(target_lang.strip().lower()) or "translated"
+    return f"{stem}_translated_{lang}{extension}"
+
+def send_download(path, download_name, etag=True):
+    """
+    Send a translated file as an attachment. Werkzeug answers If-None-Match / If-Modified-Since with 304 and Range
+    with 206. With DOWNLOAD_OFFLOAD the body is left to the front proxy (X-Sendfile / X-Accel-Redirect header).
+    """
+    environ = request.environ
+    if DOWNLOAD_OFFLOAD:
+        environ = {key: value for key, value in environ.items() if key != 'HTTP_RANGE'}  # Range 由前置代理处理
+    response = werkzeug_send_file(path, environ, as_attachment=True, download_name=download_name,
+                                  etag=etag, conditional=True, use_x_sendfile=bool(DOWNLOAD_OFFLOAD))
+    if DOWNLOAD_OFFLOAD == "x-accel-redirect" and response.headers.pop("X-Sendfile", None):
+        # nginx 按内部 location 发送文件 (它自己处理 Range)；路径相对于下载目录
+        relative_path = os.path.relpath(path, os.path.abspath(app.config['TRANSLATED_FOLDER'])).replace(os.sep, '/')
+        response.headers["X-Accel-Redirect"] = DOWNLOAD_ACCEL_PREFIX.rstrip('/') + '/' + quote(relative_path)
+    return response
+
+@app.route('/download/<digest>/<filename>')
+def download_stored_file(digest, filename):
+    """A file from the output store. Its content never changes, so the digest is a strong ETag and it may be cached."""
+    if output_store is None or not is_digest(digest) or not output_store.touch(digest):
+        return jsonify({"error": "File not found for download (unknown or expired)."}), 404
+    response = send_download(output_store.blob_path(digest), secure_filename(filename) or digest, etag=digest)
+    response.cache_control.no_cache = None
+    response.cache_control.private = True
+    response.cache_control.max_age = DOWNLOAD_CACHE_MAX_AGE
+    response.cache_control.immutable = True
+    return response
+
 @app.route('/download/<filename>')
 def download_file(filename):
     if '..' in filename or filename.startswith('/'): 
@@ -434,7 +608,10 @@ def download_file(filename):
     
     try:
         logger.info(f"Attempting to send file for download: {filename} from {app.config['TRANSLATED_FOLDER']}")
-        return send_from_directory(app.config['TRANSLATED_FOLDER'], filename, as_attachment=True)
+        path = safe_join(os.path.abspath(app.config['TRANSLATED_FOLDER']), filename)
+        if path is None or not os.path.isfile(path):
+            raise FileNotFoundError(filename)
+        return send_download(path, filename)
     except FileNotFoundError:
         logger.error(f"File not found for download in TRANSLATED_FOLDER: {filename}")
         return jsonify({"error": "File not found for download."}), 404
@@ -443,6 +620,8 @@ def download_file(filename):
         return jsonify({"error": "Could not download file due to server error."}), 500
 
 if __name__ == '__main__':
+    # 开发模式：Werkzeug 调试服务器 + 自动重载 + 打开浏览器。生产环境请使用 python serve.py (gunicorn)
+    logger.warning("Running the development server. For production use: python serve.py")
     server_url = "http://127.0.0.1:5000"
     if not os.environ.get("WERKZEUG_RUN_MAIN"): 
         def open_browser_once():
@@ -0,0 +1,204 @@
+# async_app.py
+"""
+asyncio 服务入口: 文字翻译的 /translate_api 流式路径在事件循环中直接转发上游 SSE，
+不再为每个客户端占用一个线程；其余路由 (页面、静态文件、文件上传、下载) 通过一个
+简单的 WSGI 桥交给 app.py 中的 Flask 应用处理。
+
+    python async_app.py --host 0.0.0.0 --port 5000
+"""
+import argparse
+import asyncio
+import io
+import logging
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from aiohttp import web
+from werkzeug.formparser import parse_form_data
+
+from app import app as flask_app
+from async_translator import AsyncSiliconFlowTranslator, close_async_sessions
+from platforms import get_translator, resolve_platform_settings
+from router import ROUTER_PLATFORM_ID
+from hedging import HEDGE_ENABLED
+from sse_relay import FRAME_FORMAT_COMPACT, FRAME_FORMAT_JSON, StreamRelay
+
+try:
+    from config import ASYNC_BRIDGE_THREADS
+except ImportError:
+    ASYNC_BRIDGE_THREADS = 64
+
+logger = logging.getLogger(__name__)
+
+# WSGI 桥专用的线程池：每个桥接的 SSE 响应 (例如 /jobs/<id>/events 每个事件最多等 15 秒) 读取时占用一个线程，
+# 不能和 asyncio.to_thread 使用的默认线程池 (文字翻译的缓存读写) 共用，否则少量监听者就会卡住所有异步翻译
+_bridge_executor = ThreadPoolExecutor(max_workers=ASYNC_BRIDGE_THREADS, thread_name_prefix="wsgi-bridge")
+
+# 不应从 WSGI 响应原样转发的逐跳头 (由 aiohttp 自己管理)
+_HOP_BY_HOP_HEADERS = {"connection", "keep-alive", "transfer-encoding", "te", "trailer", "upgrade",
+                       "proxy-authenticate", "proxy-authorization"}
+
+
+def _build_wsgi_environ(request: web.Request, body: bytes) -> dict:
+    host, _, port = request.host.partition(':')
+    environ = {
+        "REQUEST_METHOD": request.method,
+        "SCRIPT_NAME": "",
+        "PATH_INFO": request.path,
+        "QUERY_STRING": request.query_string,
+        "CONTENT_TYPE": request.headers.get("Content-Type", ""),
+        "CONTENT_LENGTH": str(len(body)),
+        "SERVER_NAME": host or "localhost",
+        "SERVER_PORT": port or ("443" if request.secure else "80"),
+        "SERVER_PROTOCOL": f"HTTP/{request.version.major}.{request.version.minor}",
+        "REMOTE_ADDR": request.remote or "",
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": request.scheme,
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+    }
+    for name, value in request.headers.items():
+        key = "HTTP_" + name.upper().replace("-", "_")
+        if key in ("HTTP_CONTENT_TYPE", "HTTP_CONTENT_LENGTH"):
+            continue
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+async def _call_flask(request: web.Request, body: bytes) -> web.StreamResponse:
+    """Run the Flask app for this request in the bridge executor and stream its body back."""
+    loop = asyncio.get_running_loop()
+    environ = _build_wsgi_environ(request, body)
+    started = {}
+
+    def start_response(status, headers, exc_info=None):
+        started["status"] = status
+        started["headers"] = headers
+        return lambda data: None  # Flask 不使用 write() 回调
+
+    result = await loop.run_in_executor(_bridge_executor, flask_app, environ, start_response)
+    iterator = iter(result)
+    sentinel = object()
+    try:
+        first_chunk = await loop.run_in_executor(_bridge_executor, next, iterator, sentinel)
+        response = web.StreamResponse(status=int(started["status"].split(" ", 1)[0]))
+        for name, value in started["headers"]:
+            if name.lower() not in _HOP_BY_HOP_HEADERS:
+                response.headers.add(name, value)
+        await response.prepare(request)
+        chunk = first_chunk
+        while chunk is not sentinel:
+            if chunk:
+                await response.write(chunk)
+            chunk = await loop.run_in_executor(_bridge_executor, next, iterator, sentinel)
+        await response.write_eof()
+        return response
+    finally:
+        if hasattr(result, "close"):
+            await loop.run_in_executor(_bridge_executor, result.close)
+
+
+async def translate_api(request: web.Request) -> web.StreamResponse:
+    body = await request.read()
+    loop = asyncio.get_running_loop()
+    _, form, _ = await loop.run_in_executor(None, parse_form_data, _build_wsgi_environ(request, body))
+
+    if not form.get('text_input') or form.get('api_platform') == ROUTER_PLATFORM_ID or \
+       form.get('hedge', '').lower() in ('1', 'true', 'on') or HEDGE_ENABLED:
+        # 文件翻译、多平台路由和对冲流式请求仍由 Flask 视图处理
+        return await _call_flask(request, body)
+
+    api_platform = form.get('api_platform', 'custom')
+    target_lang = form.get('target_lang')
+    source_lang = form.get('source_lang')
+    text_to_translate = form['text_input']
+    logger.info(f"Received async text translation request for platform: {api_platform}")
+
+    if not target_lang:
+        logger.error("Target language is required.")
+        return web.json_response({"error": "Target language is required."}, status=400)
+    if not text_to_translate.strip():
+        logger.error("Text to translate cannot be empty.")
+        return web.json_response({"error": "Text to translate cannot be empty."}, status=400)
+
+    api_key_to_use, base_url_to_use, model_to_use, config_error = resolve_platform_settings(
+        api_platform, form.get('api_key', '').strip(), form.get('base_url', '').strip(), form.get('model', '').strip()
+    )
+    if config_error:
+        return web.json_response({"error": config_error}, status=400)
+    try:
+        translator_instance = get_translator(api_platform, api_key_to_use, base_url_to_use, model_to_use,
+                                             translator_class=AsyncSiliconFlowTranslator)
+    except ValueError as e:
+        logger.error(f"Translator initialization error with resolved config: {e}")
+        return web.json_response({"error": str(e)}, status=400)
+
+    frame_format = FRAME_FORMAT_COMPACT if form.get('frame_format') == FRAME_FORMAT_COMPACT else FRAME_FORMAT_JSON
+    response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache",
+                                           "X-Frame-Format": frame_format})
+    await response.prepare(request)
+    upstream = translator_instance.astream(text_to_translate, target_lang, source_lang)
+    relay = StreamRelay(api_platform, frame_format)
+    next_line = None  # 等待上游下一行的任务；合并窗口到期时不取消它，只先发出已缓冲的译文
+    try:
+        while True:
+            if next_line is None:
+                next_line = asyncio.ensure_future(upstream.__anext__())
+            done, _ = await asyncio.wait({next_line}, timeout=relay.flush_delay())
+            if not done:
+                frames = relay.flush()  # 上游暂时没有新数据：按时发出已缓冲的译文
+            else:
+                try:
+                    line = next_line.result()
+                except StopAsyncIteration:
+                    frames = relay.close()
+                    if frames:
+                        await response.write("".join(frames).encode('utf-8'))
+                    next_line = None
+                    break
+                next_line = None
+                frames = relay.feed(line + b"\n")
+            if frames:
+                await response.write("".join(frames).encode('utf-8'))
+            if relay.finished:
+                break
+        await response.write_eof()
+    except (ConnectionResetError, asyncio.CancelledError):
+        logger.info(f"Client disconnected from async translation stream ({api_platform}).")
+        raise
+    finally:
+        if next_line is not None:
+            next_line.cancel()
+            await asyncio.gather(next_line, return_exceptions=True)
+        await upstream.aclose()  # 关闭上游连接 (客户端断开时同样执行)
+        logger.info(f"Async translation stream ended for {api_platform}.")
+    return response
+
+
+async def flask_fallback(request: web.Request) -> web.StreamResponse:
+    return await _call_flask(request, await request.read())
+
+
+async def _on_cleanup(_app: web.Application):
+    await close_async_sessions()
+    _bridge_executor.shutdown(wait=False, cancel_futures=True)
+
+
+def create_app() -> web.Application:
+    aio_app = web.Application(client_max_size=flask_app.config['MAX_CONTENT_LENGTH'])
+    aio_app.router.add_post('/translate_api', translate_api)
+    aio_app.router.add_route('*', '/{tail:.*}', flask_fallback)
+    aio_app.on_cleanup.append(_on_cleanup)
+    return aio_app
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Async server for the translator web UI (streams text translations without a thread per client).")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=5000)
+    args = parser.parse_args()
+    logger.info(f"Async translator server starting on http://{args.host}:{args.port}")
+    web.run_app(create_app(), host=args.host, port=args.port)
@@ -0,0 +1,234 @@
+# async_translator.py
+import asyncio
+import json
+import logging
+import time
+from typing import AsyncIterator, Dict, Optional, Tuple
+
+import aiohttp
+
+from metrics import StreamMeter, record_request
+from rate_limiter import RateLimitTimeout, asend_with_rate_limit, get_rate_limiter
+from token_budget import TRANSLATION_OUTPUT_EXPANSION, estimate_tokens
+from tracing import span
+from translator import SiliconFlowTranslator
+from translation_cache import sse_frames
+
+try:
+    from config import HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT, HTTP_STREAM_READ_TIMEOUT, \
+                       ASYNC_HTTP_MAX_CONNECTIONS, ASYNC_HTTP_MAX_CONNECTIONS_PER_HOST
+except ImportError:
+    HTTP_CONNECT_TIMEOUT = 10
+    HTTP_READ_TIMEOUT = 60
+    HTTP_STREAM_READ_TIMEOUT = 180
+    ASYNC_HTTP_MAX_CONNECTIONS = 4096
+    ASYNC_HTTP_MAX_CONNECTIONS_PER_HOST = 0
+
+logger = logging.getLogger(__name__)
+
+# aiohttp 的 ClientSession 绑定在创建它的事件循环上，所以按 (loop, base_url, platform_id) 缓存
+_async_sessions: Dict[Tuple[int, str, str], aiohttp.ClientSession] = {}
+
+
+def get_async_session(base_url: str, platform_id: str) -> aiohttp.ClientSession:
+    """Return the pooled ClientSession for (base_url, platform_id) on the running event loop."""
+    loop = asyncio.get_running_loop()
+    key = (id(loop), base_url.rstrip('/'), platform_id)
+    session = _async_sessions.get(key)
+    if session is None or session.closed:
+        connector = aiohttp.TCPConnector(limit=ASYNC_HTTP_MAX_CONNECTIONS, limit_per_host=ASYNC_HTTP_MAX_CONNECTIONS_PER_HOST)
+        session = aiohttp.ClientSession(connector=connector)
+        _async_sessions[key] = session
+        logger.info(f"Created pooled async HTTP session for platform: {platform_id}, Base URL: {key[1]} (connection limit {ASYNC_HTTP_MAX_CONNECTIONS})")
+    return session
+
+
+async def close_async_sessions():
+    """Close every ClientSession that belongs to the running event loop (call on server shutdown)."""
+    loop_id = id(asyncio.get_running_loop())
+    for key in [k for k in _async_sessions if k[0] == loop_id]:
+        session = _async_sessions.pop(key)
+        await session.close()
+
+
+def _error_line(error_message: str) -> bytes:
+    """An upstream-style SSE line carrying an error, understood by sse_relay.relay_upstream_line."""
+    return f"data: {json.dumps({'error': error_message})}".encode('utf-8')
+
+
+def _is_terminal_line(line: bytes) -> bool:
+    return line.strip() == b"data: [DONE]" or b'"done": true' in line or b'"done":true' in line
+
+
+class AsyncSiliconFlowTranslator(SiliconFlowTranslator):
+    """
+    asyncio 版本的翻译器。
+    平台推断、请求头和请求体构造全部继承自 SiliconFlowTranslator，只替换 HTTP 传输层，
+    这样一个事件循环就能同时承载成千上万个流，而不是每个流占用一个线程。
+    请求与同步路径共用同一个上游的限流器 (aacquire 在事件循环上等待)，并记录相同的指标和 tracing span。
+    """
+
+    def _estimate_tokens(self, payload: dict) -> Tuple[int, int]:
+        """(prompt tokens, prompt + expected completion tokens) for the limiter's TPM bucket, as in _post_chat."""
+        prompt_tokens = sum(estimate_tokens(m.get("content", ""), self.model) for m in payload.get("messages", []))
+        return prompt_tokens, int(prompt_tokens * (1 + TRANSLATION_OUTPUT_EXPANSION))
+
+    async def atranslate(self, text: str, target_lang: str, source_lang: Optional[str] = None) -> str:
+        """Non-streaming translation. Like translate(), failures are returned as error strings."""
+        with span("translate", platform=self.platform_id, model=self.model, stream=False, chars=len(text or "")):
+            return await self._atranslate(text, target_lang, source_lang)
+
+    async def _atranslate(self, text: str, target_lang: str, source_lang: Optional[str]) -> str:
+        if not text:
+            return "Error: Text to translate cannot be empty."
+        if not target_lang:
+            return "Error: Target language cannot be empty."
+
+        cache_key = None
+        if self.cache is not None:
+            cache_key = self.cache.make_key(self.platform_id, self.base_url, self.model, source_lang, target_lang, text)
+            cached_translation = await asyncio.to_thread(self.cache.get, cache_key)
+            if cached_translation is not None:
+                record_request(self.platform_id, self.model, "non_stream", "cache_hit")
+                logger.info(f"Translation cache HIT for platform {self.platform_id} with model {self.model} (ASYNC NON-STREAM).")
+                return cached_translation
+
+        session = get_async_session(self.base_url, self.platform_id)
+        timeout = aiohttp.ClientTimeout(total=None, connect=HTTP_CONNECT_TIMEOUT, sock_read=HTTP_READ_TIMEOUT)
+        payload = self._build_payload(text, target_lang, source_lang, stream=False)
+        limiter = get_rate_limiter(self.platform_id, self.base_url)
+        prompt_tokens, estimated_tokens = self._estimate_tokens(payload)
+        started = time.perf_counter()
+        try:
+            response = await asend_with_rate_limit(limiter, lambda: session.post(self._chat_completions_url(), headers=self._get_headers(),
+                                                                                 json=payload, timeout=timeout), estimated_tokens)
+            async with response:
+                if response.status >= 400:
+                    full_error_output, detail_json_str = self._format_http_error(response.status, await response.text())
+                    record_request(self.platform_id, self.model, "non_stream", "error", time.perf_counter() - started, response.status)
+                    logger.error(f"HTTPError for {self.platform_id} (ASYNC): {full_error_output}. Raw response: {detail_json_str[:500]}")
+                    return full_error_output
+                data = await response.json(content_type=None)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            error_msg = f"Network/Request Error for {self.platform_id}: {type(e).__name__} - {e}"
+            logger.error(error_msg)
+            record_request(self.platform_id, self.model, "non_stream", "error", time.perf_counter() - started, "network")
+            return error_msg
+        except RateLimitTimeout as e:
+            error_msg = f"Rate Limit Error for {self.platform_id}: {e}"
+            logger.error(error_msg)
+            record_request(self.platform_id, self.model, "non_stream", "error", time.perf_counter() - started, "rate_limit")
+            return error_msg
+        except json.JSONDecodeError as e:
+            error_msg = f"JSON Decode Error from {self.platform_id}: Could not decode API response. {e}"
+            logger.error(error_msg)
+            record_request(self.platform_id, self.model, "non_stream", "error", time.perf_counter() - started)
+            return error_msg
+
+        with span("post_process"):
+            if data and data.get("choices") and data["choices"][0].get("message") and data["choices"][0]["message"].get("content"):
+                translated_text = data["choices"][0]["message"]["content"].strip()
+                usage = data.get("usage") or {"prompt_tokens": prompt_tokens, "estimated": True,
+                                              "completion_tokens": estimate_tokens(translated_text, self.model)}
+                record_request(self.platform_id, self.model, "non_stream", "success", time.perf_counter() - started,
+                               response.status, usage)
+                if cache_key is not None:
+                    await asyncio.to_thread(self.cache.set, cache_key, translated_text)
+                return translated_text
+            error_msg = f"No translation found in non-stream response or unexpected format from {self.platform_id}. Raw: {json.dumps(data, indent=2)[:500]}"
+            logger.error(error_msg)
+            record_request(self.platform_id, self.model, "non_stream", "error", time.perf_counter() - started, response.status)
+            return f"Error: {error_msg}"
+
+    async def astream(self, text: str, target_lang: str, source_lang: Optional[str] = None) -> AsyncIterator[bytes]:
+        """
+        Streaming translation. Yields the upstream SSE lines (without line terminators), the same
+        items requests.Response.iter_lines() produces for the synchronous translator. Errors are
+        yielded as `data: {"error": ...}` lines so callers need only one code path.
+        """
+        with span("translate", platform=self.platform_id, model=self.model, stream=True, chars=len(text or "")):
+            lines = self._astream(text, target_lang, source_lang)
+            try:
+                async for line in lines:
+                    yield line
+            finally:
+                await lines.aclose()  # 调用者提前停止时立即归还流名额并记录指标，不等垃圾回收
+
+    async def _astream(self, text: str, target_lang: str, source_lang: Optional[str]) -> AsyncIterator[bytes]:
+        if not text:
+            yield _error_line("Text to translate cannot be empty.")
+            return
+        if not target_lang:
+            yield _error_line("Target language cannot be empty.")
+            return
+
+        cache_key = None
+        if self.cache is not None:
+            cache_key = self.cache.make_key(self.platform_id, self.base_url, self.model, source_lang, target_lang, text)
+            cached_translation = await asyncio.to_thread(self.cache.get, cache_key)
+            if cached_translation is not None:
+                record_request(self.platform_id, self.model, "stream", "cache_hit")
+                logger.info(f"Translation cache HIT for platform {self.platform_id} with model {self.model} (ASYNC STREAM replay).")
+                for frame in sse_frames(cached_translation):
+                    yield frame.strip().encode('utf-8')
+                return
+
+        session = get_async_session(self.base_url, self.platform_id)
+        timeout = aiohttp.ClientTimeout(total=None, connect=HTTP_CONNECT_TIMEOUT, sock_read=HTTP_STREAM_READ_TIMEOUT)
+        full_api_url = self._chat_completions_url()
+        logger.info(f"Sending ASYNC STREAM request to: {full_api_url} for platform {self.platform_id} with model {self.model}")
+        payload = self._build_payload(text, target_lang, source_lang, stream=True)
+        limiter = get_rate_limiter(self.platform_id, self.base_url)
+        prompt_tokens, estimated_tokens = self._estimate_tokens(payload)
+        recorded = [] if cache_key is not None else None
+        started = time.perf_counter()
+        try:
+            response = await asend_with_rate_limit(limiter, lambda: session.post(full_api_url, headers=self._get_headers(),
+                                                                                 json=payload, timeout=timeout),
+                                                   estimated_tokens, stream=True)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            error_msg = f"Network/Request Error for {self.platform_id}: {type(e).__name__} - {e}"
+            logger.error(error_msg)
+            record_request(self.platform_id, self.model, "stream", "error", time.perf_counter() - started, "network")
+            yield _error_line(error_msg)
+            return
+        except RateLimitTimeout as e:
+            error_msg = f"Rate Limit Error for {self.platform_id}: {e}"
+            logger.error(error_msg)
+            record_request(self.platform_id, self.model, "stream", "error", time.perf_counter() - started, "rate_limit")
+            yield _error_line(error_msg)
+            return
+
+        if response.status >= 400:
+            async with response:
+                error_content = await response.text()
+            record_request(self.platform_id, self.model, "stream", "error", time.perf_counter() - started, response.status)
+            logger.error(f"Initial API HTTP Error {response.status} for ASYNC STREAM request to {full_api_url}. Platform: {self.platform_id}. Response: {error_content[:500]}")
+            yield _error_line(f"API Error {response.status}: {error_content[:200]}")
+            return
+        # 和同步路径的 MeteredRaw 一样：流结束 (或被提前关闭) 时记录首 token 时间、耗时和 token 数
+        meter = StreamMeter(self.platform_id, self.model, started, response.status, prompt_tokens)
+        outcome = "cancelled"
+        try:
+            async for raw_line in response.content:
+                meter.observe(raw_line)
+                line = raw_line.rstrip(b"\r\n")
+                if not line:
+                    continue
+                if recorded is not None:
+                    recorded.append(line)
+                    # 调用者通常在收到结束标记后就停止迭代，所以必须在交出结束标记之前写缓存
+                    if _is_terminal_line(line):
+                        await asyncio.to_thread(self.cache.store_stream_body, cache_key, b"\n".join(recorded))
+                        recorded = None
+                yield line
+            outcome = "success"
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            outcome = "error"
+            error_msg = f"Network/Request Error for {self.platform_id}: {type(e).__name__} - {e}"
+            logger.error(error_msg)
+            yield _error_line(error_msg)
+        finally:
+            meter.finish(outcome)
+            response.release()
+            limiter.release_stream()  # 流名额在流结束 (或被调用者关闭) 时归还
@@ -0,0 +1,228 @@
+# batch_translator.py
+import contextvars
+import logging
+import re
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from chunk_executor import get_chunk_concurrency
+from token_budget import estimate_tokens, max_input_tokens
+from translator import is_translation_error, is_upstream_overload_error
+
+try:
+    from config import BATCH_MAX_SEGMENTS, CHUNK_MAX_RETRIES, CHUNK_RETRY_BACKOFF
+except ImportError:
+    BATCH_MAX_SEGMENTS = 40
+    CHUNK_MAX_RETRIES = 2
+    CHUNK_RETRY_BACKOFF = 1.0
+
+logger = logging.getLogger(__name__)
+
+BATCH_SYSTEM_PROMPT = (
+    "You are a professional and helpful translator. Translate accurately and naturally. "
+    "The user sends numbered segments, each introduced by a marker line such as <<<1>>>. "
+    "Translate every segment independently and reply with the same marker lines in the same order, "
+    "each followed by the translation of that segment only. Do not merge, split, skip or add segments, "
+    "and do not output anything other than the markers and translations."
+)
+# 片段中带有行内格式标记 (docx_full_translator 的 <g1>…</g1>) 时追加到系统提示
+INLINE_TAG_INSTRUCTION = (
+    "Some segments contain inline formatting tags such as <g1>...</g1>. Keep every tag exactly once, "
+    "wrapped around the translation of the text it encloses; do not add, remove, rename or nest tags."
+)
+_INLINE_TAG_RE = re.compile(r"</?g\d+>")
+_MARKER_RE = re.compile(r"^[ \t]*<<<\s*(\d+)\s*>>>[ \t]*\n?", re.M)
+
+
+def _build_batch_messages(texts: List[str], target_lang: str, source_lang: Optional[str]) -> List[dict]:
+    direction = f"from {source_lang} to {target_lang}" if source_lang else f"to {target_lang}"
+    body = "\n".join(f"<<<{i}>>>\n{text}" for i, text in enumerate(texts, start=1))
+    system_prompt = BATCH_SYSTEM_PROMPT
+    if any(_INLINE_TAG_RE.search(text) for text in texts):
+        system_prompt = f"{system_prompt} {INLINE_TAG_INSTRUCTION}"
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": f"Translate the following {len(texts)} segments {direction}:\n\n{body}"},
+    ]
+
+
+def parse_batch_reply(reply: str, expected_count: int) -> Optional[List[str]]:
+    """Split a batch reply on its <<<n>>> markers. Returns None unless markers 1..expected_count appear exactly once, in order."""
+    parts = _MARKER_RE.split(reply)
+    # parts = [前导文本, 编号1, 译文1, 编号2, 译文2, ...]
+    numbers = [int(n) for n in parts[1::2]]
+    if numbers != list(range(1, expected_count + 1)):
+        return None
+    translations = [t.strip() for t in parts[2::2]]
+    if any(not t for t in translations):
+        return None
+    return translations
+
+
+def with_original_padding(source: str, translation: str) -> str:
+    """保留原片段首尾的空白，便于把译文放回 docx 的 run 中"""
+    leading = source[:len(source) - len(source.lstrip())]
+    trailing = source[len(source.rstrip()):]
+    return f"{leading}{translation}{trailing}"
+
+
+def _translate_range(translator, items: List[Tuple[int, str]], target_lang: str,
+                     source_lang: Optional[str]) -> Dict[int, str]:
+    """
+    Translate one batch; on a misaligned reply bisect and re-request only the halves. A lone segment is sent with
+    the plain translation prompt, unless it has inline tags, which only the batch prompt tells the model to keep.
+    """
+    if len(items) == 1 and not _INLINE_TAG_RE.search(items[0][1]):
+        index, text = items[0]
+        return {index: translator.translate(text, target_lang, source_lang)}
+
+    texts = [text for _, text in items]
+    payload = translator._build_payload("", target_lang, source_lang, stream=False)
+    payload["messages"] = _build_batch_messages(texts, target_lang, source_lang)
+    reply = translator._post_chat(payload, stream=False)
+    if is_translation_error(reply):
+        # 上游错误 (不是对齐问题)：整批标记为失败，由调用者决定是否重试
+        return {index: reply for index, _ in items}
+
+    translations = parse_batch_reply(reply, len(items))
+    if translations is None and len(items) == 1:
+        index, text = items[0]
+        return {index: translator.translate(text, target_lang, source_lang)}
+    if translations is None:
+        middle = len(items) // 2
+        logger.warning(f"Batch reply from {translator.platform_id} misaligned for {len(items)} segments; bisecting into {middle} + {len(items) - middle}.")
+        results = _translate_range(translator, items[:middle], target_lang, source_lang)
+        results.update(_translate_range(translator, items[middle:], target_lang, source_lang))
+        return results
+
+    results = {}
+    for (index, text), translation in zip(items, translations):
+        results[index] = translation
+        if translator.cache is not None:
+            translator.cache.set(translator.cache.make_key(translator.platform_id, translator.base_url, translator.model, source_lang, target_lang, text), translation)
+    return results
+
+
+def _group_batches(items: Iterable[Tuple[int, str]], model: str, max_segments: int) -> Iterator[List[Tuple[int, str]]]:
+    """按 token 预算和片段数上限把片段分组 (按需读取 items)"""
+    limit = max_input_tokens(model)
+    current, current_tokens = [], 0
+    for item in items:
+        tokens = estimate_tokens(item[1], model) + 4  # 编号标记行的开销
+        if current and (current_tokens + tokens > limit or len(current) >= max_segments):
+            yield current
+            current, current_tokens = [], 0
+        current.append(item)
+        current_tokens += tokens
+    if current:
+        yield current
+
+
+def translate_batch(translator, segments: List[str], target_lang: str, source_lang: Optional[str] = None,
+                    max_segments: int = BATCH_MAX_SEGMENTS) -> List[str]:
+    """
+    在尽量少的请求中翻译多个片段，返回与输入一一对应的译文列表。
+
+    空白片段原样返回；命中翻译缓存的片段不会发送；其余片段按 token 预算分批并发请求。
+    失败的片段保留错误字符串 (可用 is_translation_error 判断)。
+    """
+    results: List[Optional[str]] = list(segments)
+    pending: List[Tuple[int, str]] = []
+    for index, segment in enumerate(segments):
+        if not segment or not segment.strip():
+            continue
+        text = segment.strip()
+        if translator.cache is not None:
+            cached = translator.cache.get(translator.cache.make_key(translator.platform_id, translator.base_url, translator.model, source_lang, target_lang, text))
+            if cached is not None:
+                results[index] = with_original_padding(segment, cached)
+                continue
+        pending.append((index, text))
+    if not pending:
+        return results
+
+    batches = list(_group_batches(pending, translator.model, max(1, max_segments)))
+    workers = max(1, min(len(batches), translator.chunk_concurrency or get_chunk_concurrency(translator.platform_id)))
+    logger.info(f"Batch translating {len(pending)} segments ({len(segments) - len(pending)} blank or cached) in {len(batches)} request(s) with concurrency {workers}.")
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="batch") as executor:
+        # 每批在提交线程上下文的副本中运行：路由器关闭的限流重试、tracing 的 span 和监听器随之进入工作线程
+        futures = [executor.submit(contextvars.copy_context().run, _translate_range, translator, batch, target_lang,
+                                   source_lang) for batch in batches]
+        for future in futures:
+            for index, translation in future.result().items():
+                results[index] = translation if is_translation_error(translation) else with_original_padding(segments[index], translation)
+    return results
+
+
+def _translate_batch_with_retries(translator, texts: List[str], target_lang: str, source_lang: Optional[str],
+                                  max_retries: int) -> List[str]:
+    """
+    One batch through translator.translate_batch. With a checkpoint journal (translator.journal) completed segments
+    are reused and new results are recorded. Failed segments are re-sent with exponential backoff, except 429/5xx,
+    which send_with_rate_limit has already retried.
+    """
+    journal = translator.journal
+    results: List[Optional[str]] = [journal.get(text) for text in texts] if journal is not None else [None] * len(texts)
+    pending = [i for i, result in enumerate(results) if result is None]
+    attempt = 0
+    while pending:
+        if attempt:
+            delay = CHUNK_RETRY_BACKOFF * (2 ** (attempt - 1))
+            logger.warning(f"Retrying {len(pending)} failed segment(s) in {delay:.1f}s (attempt {attempt + 1}/{max_retries + 1}). Last error: {str(results[pending[0]])[:200]}")
+            time.sleep(delay)
+        translations = translator.translate_batch([texts[i] for i in pending], target_lang, source_lang)
+        failed = []
+        for index, translation in zip(pending, translations):
+            results[index] = translation
+            if not is_translation_error(translation):
+                if journal is not None:
+                    journal.record(texts[index], translation)
+            elif not is_upstream_overload_error(translation):
+                failed.append(index)
+        attempt += 1
+        pending = failed if attempt <= max_retries else []
+    return results
+
+
+def iter_translated_batches(translator, segments: Iterable[str], target_lang: str, source_lang: Optional[str] = None,
+                            max_workers: Optional[int] = None, window: Optional[int] = None,
+                            max_segments: int = BATCH_MAX_SEGMENTS, max_retries: int = CHUNK_MAX_RETRIES) -> Iterator[str]:
+    """
+    translate_batch 的流式版本 (对应 chunk_executor.iter_translated_chunks)：按需从 segments (可以是生成器) 读取片段，
+    按 token 预算打包，每批通过 translator.translate_batch 发送 (所以路由器可以逐批切换目标)，最多 window 批在途，
+    并按原始顺序逐个产出译文。progress_callback 以 (已完成片段数, None) 调用。
+    """
+    if max_workers is None:
+        max_workers = translator.chunk_concurrency or get_chunk_concurrency(translator.platform_id)
+    max_workers = max(1, max_workers)
+    window = max(max_workers, window or max_workers * 2)
+    logger.info(f"Streaming batch translation with concurrency {max_workers}, window {window} batches via {translator.platform_id} ({translator.model}).")
+
+    progress_callback = translator.progress_callback
+    # 这里的分组只决定每次 translate_batch 带多少片段；超出目标模型预算的批次会在 translate_batch 中再拆分
+    batches = _group_batches(enumerate(segments), translator.model, max(1, max_segments))
+    pending = deque()
+    completed = 0
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="batch") as executor:
+        def fill():
+            while len(pending) < window:
+                batch = next(batches, None)
+                if batch is None:
+                    return
+                pending.append(executor.submit(contextvars.copy_context().run, _translate_batch_with_retries, translator,
+                                               [text for _, text in batch], target_lang, source_lang, max_retries))
+
+        try:
+            fill()
+            while pending:
+                for translation in pending.popleft().result():
+                    completed += 1
+                    if progress_callback is not None:
+                        progress_callback(completed, None)
+                    yield translation
+                fill()
+        finally:
+            for future in pending:  # 调用者提前停止 (例如某个片段失败)：不再启动排队中的批次
+                future.cancel()
@@ -0,0 +1,137 @@
+# bench_relay.py
+"""
+CPU-per-token comparison of the SSE relay paths used by generate_translation_stream.
+
+  legacy  - iter_lines() + relay_upstream_line(): json.loads and one JSON frame per token
+  json    - iter_relay_frames + StreamRelay on raw bytes, coalesced deltas, JSON frames (current default)
+  compact - iter_relay_frames + StreamRelay on raw bytes, coalesced deltas, compact frames (static/script.js opts in)
+
+Upstream tokens are replayed from memory on a virtual clock (--interval-ms between tokens), so the numbers
+are pure relay CPU (time.process_time) and do not depend on network or sleep accuracy. The json/compact runs go
+through iter_relay_frames, including its timed flushes: waiting for the upstream advances the virtual clock
+instead of polling a socket.
+
+    python bench_relay.py --tokens 20000 --interval-ms 20
+"""
+import argparse
+import json
+import time
+
+import requests
+
+import sse_relay
+from sse_relay import FRAME_FORMAT_COMPACT, FRAME_FORMAT_JSON, StreamRelay, iter_relay_frames, relay_upstream_line
+
+
+class _VirtualClock:
+    """Stands in for the `time` module inside sse_relay so coalescing windows follow the simulated token pacing."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+class _ChunkRaw:
+    """Minimal urllib3-like raw object: hands requests one upstream network chunk per read, one every `interval`."""
+
+    def __init__(self, chunks, clock, interval):
+        self._chunks = chunks
+        self._clock = clock
+        self._interval = interval
+        self._next_at = clock.now + interval
+
+    def stream(self, amt=None, decode_content=None):
+        for chunk in self._chunks:
+            self._clock.now = max(self._clock.now, self._next_at)
+            self._next_at = self._clock.now + self._interval
+            yield chunk
+
+    def wait_readable(self, timeout):
+        """What iter_relay_frames polls the upstream socket with, on the virtual clock."""
+        if self._next_at <= self._clock.now + timeout:
+            return True
+        self._clock.now += timeout
+        return False
+
+    def close(self):
+        pass
+
+
+def make_upstream_chunks(tokens: int):
+    """One OpenAI-style SSE event per network chunk, like a typical chunked upstream."""
+    words = ["Le", " renard", " brun", " rapide", " saute", " par-dessus", " le", " chien", " paresseux", ".\n"]
+    chunks = []
+    for i in range(tokens):
+        event = {"id": "chatcmpl-bench", "object": "chat.completion.chunk", "created": 0, "model": "bench",
+                 "choices": [{"index": 0, "delta": {"content": words[i % len(words)]}, "finish_reason": None}]}
+        chunks.append(f"data: {json.dumps(event)}\n\n".encode("utf-8"))
+    chunks.append(b"data: [DONE]\n\n")
+    return chunks
+
+
+def _response(chunks, clock, interval) -> requests.Response:
+    response = requests.Response()
+    response.status_code = 200
+    response.raw = _ChunkRaw(chunks, clock, interval)
+    return response
+
+
+def run_legacy(chunks, clock, interval):
+    frames = out_bytes = 0
+    for line in _response(chunks, clock, interval).iter_lines():
+        if line:
+            frame, finished = relay_upstream_line(line, "bench")
+            if frame:
+                out_bytes += len(frame.encode("utf-8"))  # WSGI 服务器对每个 yield 都要编码并写出
+                frames += 1
+            if finished:
+                break
+    return frames, out_bytes
+
+
+def run_relay(chunks, clock, interval, frame_format):
+    frames = out_bytes = 0
+    relay = StreamRelay("bench", frame_format)
+    for frame in iter_relay_frames(relay, _response(chunks, clock, interval)):
+        out_bytes += len(frame.encode("utf-8"))
+        frames += 1
+    return frames, out_bytes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare CPU per token of the legacy and coalescing SSE relays.")
+    parser.add_argument("--tokens", type=int, default=20000, help="Upstream deltas per run (default: 20000).")
+    parser.add_argument("--interval-ms", type=float, default=20.0, help="Simulated time between upstream deltas (default: 20).")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per variant; the fastest is reported (default: 5).")
+    args = parser.parse_args()
+
+    chunks = make_upstream_chunks(args.tokens)
+    clock = _VirtualClock()
+    sse_relay.time = clock  # 合并窗口按模拟时间计算
+    interval = args.interval_ms / 1000.0
+    variants = [
+        ("legacy", lambda: run_legacy(chunks, clock, interval)),
+        ("json", lambda: run_relay(chunks, clock, interval, FRAME_FORMAT_JSON)),
+        ("compact", lambda: run_relay(chunks, clock, interval, FRAME_FORMAT_COMPACT)),
+    ]
+    backend = "orjson" if sse_relay._loads is not json.loads else "json"
+    print(f"{args.tokens} tokens, {args.interval_ms:g} ms apart, coalesce window {sse_relay.SSE_COALESCE_MS:g} ms / "
+          f"{sse_relay.SSE_COALESCE_CHARS} chars, JSON backend: {backend}")
+    print(f"{'variant':<8} {'us/token':>9} {'frames':>8} {'bytes out':>10} {'vs legacy':>10}")
+    baseline = None
+    for name, run in variants:
+        best = None
+        for _ in range(args.repeat):
+            started = time.process_time()
+            frames, out_bytes = run()
+            elapsed = time.process_time() - started
+            best = elapsed if best is None else min(best, elapsed)
+        per_token = best / args.tokens * 1e6
+        baseline = baseline or per_token
+        print(f"{name:<8} {per_token:>9.2f} {frames:>8} {out_bytes:>10} {baseline / per_token:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,372 @@
+# bench_translator.py
+"""
+End-to-end benchmarks for SiliconFlowTranslator, the Flask SSE relay and file translation, run against a local
+mock /chat/completions server (mock_openai_server.py) so the numbers do not depend on a real provider.
+
+Scenarios (--scenarios, default: all):
+  stream    - time to first token and tokens/s of translate(stream=True)
+  overhead  - client-side cost per non-streaming call against an instant server (wall and CPU)
+  relay     - time to first frame and CPU per token through Flask /translate_api (text stream)
+  txt       - .txt file translation throughput (file_translator and the streaming pipeline)
+  docx      - .docx file translation throughput (needs python-docx)
+  faults    - chunk throughput and failures with injected 429s and 500s
+  startup   - cold start of main.py: `python -X importtime` of the module and a full `-t` run; fails if a file
+              backend (or requests, python-docx, lxml) is imported up front or --startup-budget-ms is exceeded
+
+Results are written as JSON (--output). With --baseline, each metric is compared against a previous run and the
+exit status is 1 if any metric regressed by more than --tolerance (or a budget check failed), so the script can
+gate CI.
+
+    python bench_translator.py --output bench.json
+    python bench_translator.py --baseline bench.json --tolerance 0.15
+    python bench_translator.py --scenarios startup --startup-budget-ms 60
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from mock_openai_server import MockSettings, start_mock_server
+
+logger = logging.getLogger(__name__)
+
+SCENARIOS = ("stream", "overhead", "relay", "txt", "docx", "faults", "startup")
+
+BENCH_PLATFORM_ID = "bench"  # 独立的限流器/连接池键，不受真实平台配置影响
+BENCH_MODEL = "Qwen/Qwen2.5-7B-Instruct"
+
+# `import main` 不应加载的模块：这些后端只在对应模式 (-i/-id/-b/-j/--resume) 中导入，
+# requests 只在真正发出请求时导入 (缓存命中的 -t 不需要)
+STARTUP_DEFERRED_MODULES = ("requests", "urllib3", "docx", "lxml", "file_translator", "docx_translator",
+                            "docx_full_translator", "text_stream_translator", "chunk_executor", "bulk_translator",
+                            "jsonl_translator", "checkpoints", "router", "flask")
+STARTUP_RUNS = 5
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+SAMPLE_PARAGRAPH = ("The quick brown fox jumps over the lazy dog while the committee reviews the quarterly "
+                    "report on regional logistics, energy prices and supplier lead times.")
+
+
+class Results:
+    """Collects metrics as {name: {"value", "unit", "better"}}; `better` is "lower" or "higher"."""
+
+    def __init__(self):
+        self.metrics: Dict[str, dict] = {}
+        self.skipped: Dict[str, str] = {}
+        self.failures: List[str] = []
+
+    def add(self, name: str, value: float, unit: str, better: str = "lower"):
+        self.metrics[name] = {"value": round(value, 3), "unit": unit, "better": better}
+        print(f"  {name:<36} {value:>12.3f} {unit}")
+
+    def skip(self, scenario: str, reason: str):
+        self.skipped[scenario] = reason
+        print(f"  skipped: {reason}")
+
+    def fail(self, reason: str):
+        self.failures.append(reason)
+        print(f"  FAILED: {reason}")
+
+
+def _percentile(values: List[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def _make_translator(base_url: str, model: str):
+    from translator import SiliconFlowTranslator
+    return SiliconFlowTranslator(api_key="bench", base_url=base_url, model=model, platform_id=BENCH_PLATFORM_ID,
+                                 use_cache=False)
+
+
+def _content_of(line: bytes) -> Optional[str]:
+    if not line.startswith(b"data:"):
+        return None
+    payload = line[5:].strip()
+    if payload == b"[DONE]":
+        return None
+    choices = json.loads(payload).get("choices") or [{}]
+    return (choices[0].get("delta") or {}).get("content")
+
+
+def bench_stream(results: Results, settings: MockSettings, base_url: str, args):
+    translator = _make_translator(base_url, args.model)
+    ttfts, rates = [], []
+    for call in range(args.calls):
+        started = time.perf_counter()
+        response = translator.translate(f"{SAMPLE_PARAGRAPH} ({call})", "French", stream=True)
+        first = None
+        tokens = 0
+        for line in response.iter_lines():
+            if _content_of(line):
+                tokens += 1
+                if first is None:
+                    first = time.perf_counter()
+        finished = time.perf_counter()
+        response.close()
+        ttfts.append((first - started) * 1000)
+        if tokens > 1 and finished > first:
+            rates.append((tokens - 1) / (finished - first))
+    results.add("stream.ttft_p50_ms", statistics.median(ttfts), "ms")
+    results.add("stream.ttft_p95_ms", _percentile(ttfts, 0.95), "ms")
+    results.add("stream.tokens_per_second", statistics.mean(rates), "tokens/s", "higher")
+    results.add("stream.ttft_overhead_ms", statistics.median(ttfts) - settings.latency_ms, "ms")
+
+
+def bench_overhead(results: Results, settings: MockSettings, base_url: str, args):
+    settings.latency_ms, settings.tokens_per_second = 0.0, 0.0
+    translator = _make_translator(base_url, args.model)
+    translator.translate("warm up", "French")  # 建立 keep-alive 连接
+    walls = []
+    cpu_started = time.process_time()
+    for call in range(args.calls * 5):
+        started = time.perf_counter()
+        translator.translate(f"{SAMPLE_PARAGRAPH} ({call})", "French")
+        walls.append((time.perf_counter() - started) * 1e6)
+    cpu = (time.process_time() - cpu_started) / len(walls) * 1e6  # 包含同进程 mock 服务器的 CPU
+    results.add("overhead.call_p50_us", statistics.median(walls), "us")
+    results.add("overhead.call_p95_us", _percentile(walls, 0.95), "us")
+    results.add("overhead.cpu_per_call_us", cpu, "us")
+
+
+def bench_relay(results: Results, settings: MockSettings, base_url: str, args):
+    try:
+        import app as flask_app  # 导入时会读取 .env 并初始化任务管理器
+    except ImportError as e:
+        results.skip("relay", f"app.py could not be imported ({e}).")
+        return
+    client = flask_app.app.test_client()
+    ttfts, cpu_per_token = [], []
+    for call in range(args.calls):
+        cpu_started = time.process_time()
+        started = time.perf_counter()
+        response = client.post("/translate_api", buffered=False, data={
+            "api_platform": "custom", "api_key": "bench", "base_url": base_url, "model": args.model,
+            "text_input": f"{SAMPLE_PARAGRAPH} ({call})", "target_lang": "French", "frame_format": "compact",
+        })
+        first = None
+        frames = 0
+        for chunk in response.response:
+            if first is None:
+                first = time.perf_counter()
+            frames += 1
+        response.close()
+        ttfts.append((first - started) * 1000)
+        tokens = len(f"{settings.reply_prefix}{SAMPLE_PARAGRAPH} ({call})".split())
+        cpu_per_token.append((time.process_time() - cpu_started) / max(tokens, 1) * 1e6)
+    results.add("relay.first_frame_p50_ms", statistics.median(ttfts), "ms")
+    results.add("relay.cpu_per_token_us", statistics.median(cpu_per_token), "us")
+
+
+def _write_text_file(path: str, kilobytes: int):
+    paragraphs = []
+    size = 0
+    index = 0
+    while size < kilobytes * 1024:
+        paragraph = f"{index}. {SAMPLE_PARAGRAPH}"
+        paragraphs.append(paragraph)
+        size += len(paragraph) + 2
+        index += 1
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n\n".join(paragraphs))
+
+
+def _time_file(results: Results, name: str, func: Callable[[], str], input_path: str):
+    started = time.perf_counter()
+    output = func()
+    elapsed = time.perf_counter() - started
+    if not output or output.startswith("Error:"):
+        results.skip(name, f"translation failed: {str(output)[:200]}")
+        return
+    results.add(f"{name}.seconds", elapsed, "s")
+    results.add(f"{name}.kb_per_second", os.path.getsize(input_path) / 1024 / elapsed, "KB/s", "higher")
+
+
+def bench_txt(results: Results, settings: MockSettings, base_url: str, args):
+    from text_stream_translator import translate_text_file_streaming
+    translator = _make_translator(base_url, args.model)
+    with tempfile.TemporaryDirectory() as workdir:
+        input_path = os.path.join(workdir, "bench.txt")
+        _write_text_file(input_path, args.txt_kb)
+        try:
+            from file_translator import translate_text_file
+        except ImportError as e:
+            results.skip("txt", f"file_translator is not available ({e}).")
+        else:
+            _time_file(results, "txt", lambda: translate_text_file(input_path, workdir, "French", translator), input_path)
+        _time_file(results, "txt_stream",
+                   lambda: translate_text_file_streaming(input_path, workdir, "French", translator), input_path)
+
+
+def bench_docx(results: Results, settings: MockSettings, base_url: str, args):
+    try:
+        import docx
+        from docx_translator import translate_docx_file
+    except ImportError as e:
+        results.skip("docx", f"python-docx or docx_translator is not available ({e}).")
+        return
+    translator = _make_translator(base_url, args.model)
+    with tempfile.TemporaryDirectory() as workdir:
+        input_path = os.path.join(workdir, "bench.docx")
+        document = docx.Document()
+        for index in range(args.docx_paragraphs):
+            if index % 20 == 0:
+                document.add_heading(f"Section {index // 20 + 1}", level=1)
+            paragraph = document.add_paragraph(f"{index}. ")
+            paragraph.add_run(SAMPLE_PARAGRAPH).bold = index % 3 == 0
+        document.save(input_path)
+        _time_file(results, "docx", lambda: translate_docx_file(input_path, workdir, "French", translator), input_path)
+
+
+def bench_faults(results: Results, settings: MockSettings, base_url: str, args):
+    settings.latency_ms, settings.tokens_per_second = args.latency_ms, 0.0
+    settings.rate_limit_rate, settings.error_rate, settings.retry_after = args.rate_limit_rate, args.error_rate, 0.05
+    translator = _make_translator(base_url, args.model)
+    chunks = [f"{index}. {SAMPLE_PARAGRAPH}" for index in range(args.calls * 4)]
+    before = settings.snapshot()
+    started = time.perf_counter()
+    translations = translator.translate_chunks(chunks, "French")
+    elapsed = time.perf_counter() - started
+    after = settings.snapshot()
+    from translator import is_translation_error
+    failed = sum(1 for translation in translations if is_translation_error(translation))
+    results.add("faults.chunks_per_second", (len(chunks) - failed) / elapsed, "chunks/s", "higher")
+    results.add("faults.failed_chunks", failed, "chunks")
+    results.add("faults.requests_per_chunk", (after["requests"] - before["requests"]) / len(chunks), "requests")
+    settings.rate_limit_rate = settings.error_rate = 0.0
+
+
+def _import_profile(module: str) -> Tuple[float, List[str]]:
+    """Import `module` in a fresh interpreter with -X importtime; returns (its cumulative ms, all modules imported)."""
+    completed = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], cwd=PACKAGE_DIR,
+                               capture_output=True, text=True, check=True)
+    cumulative_us, imported = 0, []
+    for line in completed.stderr.splitlines():
+        parts = line.split("|")
+        if not line.startswith("import time:") or len(parts) != 3 or not parts[1].strip().isdigit():
+            continue  # 表头或其他输出
+        name = parts[2].strip()
+        imported.append(name)
+        if name == module:
+            cumulative_us = int(parts[1])
+    return cumulative_us / 1000, imported
+
+
+def bench_startup(results: Results, settings: MockSettings, base_url: str, args):
+    settings.latency_ms, settings.tokens_per_second = 0.0, 0.0
+    import_ms, imported = [], []
+    for _ in range(STARTUP_RUNS):
+        milliseconds, imported = _import_profile("main")
+        import_ms.append(milliseconds)
+    run_ms = []
+    command = [sys.executable, os.path.join(PACKAGE_DIR, "main.py"), "-t", SAMPLE_PARAGRAPH, "-l", "French",
+               "-k", "bench", "-u", base_url, "-m", args.model]
+    for _ in range(STARTUP_RUNS):
+        started = time.perf_counter()
+        subprocess.run(command, cwd=PACKAGE_DIR, capture_output=True, check=True)
+        run_ms.append((time.perf_counter() - started) * 1000)
+    results.add("startup.import_main_ms", statistics.median(import_ms), "ms")
+    results.add("startup.cli_text_ms", statistics.median(run_ms), "ms")
+
+    loaded = sorted({name.split(".")[0] for name in imported} & set(STARTUP_DEFERRED_MODULES))
+    if loaded:
+        results.fail(f"`import main` loads deferred module(s): {', '.join(loaded)}. Import them inside the mode that uses them.")
+    if args.startup_budget_ms and statistics.median(import_ms) > args.startup_budget_ms:
+        results.fail(f"`import main` takes {statistics.median(import_ms):.1f} ms, over the {args.startup_budget_ms:g} ms budget.")
+
+
+BENCHMARKS = {
+    "stream": bench_stream, "overhead": bench_overhead, "relay": bench_relay,
+    "txt": bench_txt, "docx": bench_docx, "faults": bench_faults, "startup": bench_startup,
+}
+
+
+def compare(current: Dict[str, dict], baseline: Dict[str, dict], tolerance: float) -> List[str]:
+    """Print a comparison table and return the names of metrics that regressed by more than `tolerance`."""
+    regressions = []
+    print(f"\n{'metric':<36} {'baseline':>12} {'current':>12} {'change':>8}")
+    for name, metric in current.items():
+        base = baseline.get(name)
+        if not base or not base["value"]:
+            continue
+        change = (metric["value"] - base["value"]) / abs(base["value"])
+        worse = change > tolerance if metric["better"] == "lower" else change < -tolerance
+        flag = "  REGRESSION" if worse else ""
+        print(f"{name:<36} {base['value']:>12.3f} {metric['value']:>12.3f} {change:>+7.1%}{flag}")
+        if worse:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the translator, relay and file pipelines against a mock API.")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help=f"Comma-separated subset of: {', '.join(SCENARIOS)}.")
+    parser.add_argument("--model", default=BENCH_MODEL, help="Model name sent to the mock (selects the token budget).")
+    parser.add_argument("--calls", type=int, default=20, help="Calls per latency scenario (default: 20).")
+    parser.add_argument("--latency-ms", type=float, default=50.0, help="Mock time to first token (default: 50).")
+    parser.add_argument("--tokens-per-second", type=float, default=200.0, help="Mock token pacing (default: 200).")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.1, help="429 share in the faults scenario (default: 0.1).")
+    parser.add_argument("--error-rate", type=float, default=0.05, help="500 share in the faults scenario (default: 0.05).")
+    parser.add_argument("--txt-kb", type=int, default=64, help="Size of the generated .txt file (default: 64 KB).")
+    parser.add_argument("--docx-paragraphs", type=int, default=400, help="Paragraphs in the generated .docx (default: 400).")
+    parser.add_argument("--startup-budget-ms", type=float, default=0.0,
+                        help="Fail the startup scenario if `import main` takes longer than this (default: 0, no budget).")
+    parser.add_argument("--output", help="Write results as JSON to this file.")
+    parser.add_argument("--baseline", help="Compare against a previous --output file; exit 1 on regressions.")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="Allowed relative regression (default: 0.10).")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    os.environ.setdefault("TRANSLATION_CACHE_ENABLED", "false")
+    scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"Unknown scenario(s): {', '.join(sorted(unknown))}.")
+
+    settings = MockSettings(args.latency_ms, args.tokens_per_second, seed=1)
+    server, base_url = start_mock_server(settings)
+    results = Results()
+    try:
+        for name in scenarios:
+            print(f"[{name}]")
+            settings.latency_ms, settings.tokens_per_second = args.latency_ms, args.tokens_per_second
+            BENCHMARKS[name](results, settings, base_url, args)
+    finally:
+        server.shutdown()
+
+    report = {
+        "created_at": time.time(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "settings": {key: value for key, value in vars(args).items() if key not in ("output", "baseline")},
+        "metrics": results.metrics,
+        "skipped": results.skipped,
+        "failures": results.failures,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults written to {args.output}")
+    if results.failures:
+        print(f"\n{len(results.failures)} budget check(s) failed.")
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(results.metrics, baseline.get("metrics", {}), args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} metric(s) regressed by more than {args.tolerance:.0%}: {', '.join(regressions)}")
+            sys.exit(1)
+        print("\nNo regressions.")
+    if results.failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
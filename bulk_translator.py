@@ -0,0 +1,217 @@
+# bulk_translator.py
+"""
+批量文件翻译：一次运行处理目录或通配符匹配到的大量 .txt / .docx 文件。
+所有文件在同一进程内由一个线程池并发处理，共享 HTTP 连接池 (http_pool) 和限流状态 (rate_limiter)，
+避免每个文件都重新启动解释器、重新建立连接。已存在且比输入新的输出会被跳过；
+结束时写出汇总清单 (输出路径、跳过和失败的文件)。
+"""
+import copy
+import glob
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Iterable, List, Optional, Tuple
+
+from checkpoints import open_journal
+from text_stream_translator import output_filename, should_stream
+
+try:
+    from config import BULK_WORKERS, BULK_MANIFEST_NAME
+except ImportError:
+    BULK_WORKERS = 4
+    BULK_MANIFEST_NAME = "bulk_manifest.json"
+
+logger = logging.getLogger(__name__)
+
+BULK_EXTENSIONS = (".txt", ".docx")
+
+STATUS_TRANSLATED = "translated"
+STATUS_SKIPPED = "skipped"
+STATUS_FAILED = "failed"
+STATUS_CANCELLED = "cancelled"
+
+
+def _glob_root(pattern: str) -> str:
+    """The directory part of a glob pattern before its first wildcard; outputs are laid out relative to it."""
+    parts = []
+    for part in os.path.normpath(pattern).split(os.sep):
+        if glob.has_magic(part):
+            break
+        parts.append(part)
+    root = os.sep.join(parts) or "."
+    return root if os.path.isdir(root) else (os.path.dirname(root) or ".")
+
+
+def collect_inputs(patterns: Iterable[str], recursive: bool = True) -> List[Tuple[str, str]]:
+    """
+    Expand files, directories and glob patterns into (input_path, relative_path) pairs for supported file types.
+    relative_path is relative to the directory (or glob prefix) it was found under, so that the output tree can
+    mirror the input tree without name collisions. Duplicates are dropped; order is stable (sorted per pattern).
+    """
+    found = []
+    seen = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            root = pattern
+            matches = glob.glob(os.path.join(glob.escape(pattern), "**", "*") if recursive else os.path.join(glob.escape(pattern), "*"),
+                                recursive=recursive)
+        elif glob.has_magic(pattern):
+            root = _glob_root(pattern)
+            matches = glob.glob(pattern, recursive=True)
+        else:
+            root = os.path.dirname(pattern) or "."
+            matches = [pattern]
+        for path in sorted(matches):
+            if not os.path.isfile(path) or not path.lower().endswith(BULK_EXTENSIONS):
+                continue
+            real = os.path.realpath(path)
+            if real in seen:
+                continue
+            seen.add(real)
+            found.append((path, os.path.relpath(path, root)))
+    return found
+
+
+def expected_output_path(relative_path: str, output_dir: str, target_lang: str) -> str:
+    extension = os.path.splitext(relative_path)[1].lower()
+    return os.path.join(output_dir, os.path.dirname(relative_path),
+                        output_filename(relative_path, target_lang, extension=extension))
+
+
+def _is_up_to_date(input_path: str, output_path: str) -> bool:
+    try:
+        return os.path.getmtime(output_path) >= os.path.getmtime(input_path)
+    except OSError:
+        return False
+
+
+class BulkProgress:
+    """Thread-safe counters plus a one-line progress report (files, bytes and throughput)."""
+
+    def __init__(self, total_files: int, total_bytes: int, stream=None):
+        self.total_files = total_files
+        self.total_bytes = total_bytes
+        self.stream = stream or sys.stdout
+        self.started = time.monotonic()
+        self.counts = {STATUS_TRANSLATED: 0, STATUS_SKIPPED: 0, STATUS_FAILED: 0}
+        self.done_bytes = 0
+        self._lock = threading.Lock()
+
+    @property
+    def done_files(self) -> int:
+        return sum(self.counts.values())
+
+    def update(self, entry: dict):
+        with self._lock:
+            self.counts[entry["status"]] += 1
+            self.done_bytes += entry["bytes"]
+            elapsed = max(time.monotonic() - self.started, 1e-6)
+            rate = self.done_files / elapsed
+            remaining = (self.total_files - self.done_files) / rate if rate else 0
+            line = (f"[{self.done_files}/{self.total_files}] {entry['status']:<10} {entry['input']} "
+                    f"({entry['seconds']:.1f}s) | {rate:.2f} files/s, {self.done_bytes / 1024 / elapsed:.1f} KB/s, "
+                    f"ETA {remaining:.0f}s")
+            if entry["status"] == STATUS_FAILED:
+                line += f"\n    {entry['error']}"
+            print(line, file=self.stream, flush=True)
+
+
+def translate_one(input_path: str, relative_path: str, output_dir: str, target_lang: str, translator,
+                  source_lang: Optional[str] = None, encoding: str = 'utf-8', overwrite: bool = False,
+                  stream: bool = False) -> dict:
+    """Translate a single file of a bulk run and return its manifest entry (never raises)."""
+    from file_translator import translate_text_file # 延迟导入：只在真正翻译时需要
+    from docx_translator import translate_docx_file
+    from text_stream_translator import translate_text_file_streaming
+
+    started = time.monotonic()
+    target_path = expected_output_path(relative_path, output_dir, target_lang)
+    entry = {"input": input_path, "output": target_path, "status": STATUS_SKIPPED, "error": None,
+             "bytes": os.path.getsize(input_path), "seconds": 0.0}
+    if not overwrite and _is_up_to_date(input_path, target_path):
+        return entry
+
+    file_output_dir = os.path.dirname(target_path)
+    os.makedirs(file_output_dir, exist_ok=True)
+    file_translator_instance = copy.copy(translator) # 共享会话和限流器，journal 按文件设置
+    is_docx = input_path.lower().endswith(".docx")
+    journal = open_journal(input_path, file_translator_instance, target_lang, source_lang,
+                           file_type="docx" if is_docx else "txt", translation_format="", encoding=encoding)
+    file_translator_instance.journal = journal
+    try:
+        if is_docx:
+            result = translate_docx_file(input_path, file_output_dir, target_lang, file_translator_instance, source_lang)
+        else:
+            text_translate_func = translate_text_file_streaming if stream or should_stream(input_path) else translate_text_file
+            result = text_translate_func(input_path, file_output_dir, target_lang, file_translator_instance,
+                                         source_lang, encoding)
+    except Exception as e:
+        logger.exception(f"Unexpected error translating '{input_path}': {e}")
+        result = f"Error: Unexpected error: {type(e).__name__} - {e}"
+
+    entry["seconds"] = round(time.monotonic() - started, 3)
+    if not result or result.startswith("Error:"):
+        entry.update(status=STATUS_FAILED, error=result or "Error: Translator returned no output.", output=None)
+        if journal is not None:
+            journal.close()
+        return entry
+    if journal is not None:
+        journal.complete()
+    if os.path.abspath(result) != os.path.abspath(target_path):
+        os.replace(result, target_path) # 统一命名，保证下次运行能识别并跳过
+    entry.update(status=STATUS_TRANSLATED)
+    return entry
+
+
+def run_bulk_translation(patterns: Iterable[str], output_dir: str, target_lang: str, translator,
+                         source_lang: Optional[str] = None, encoding: str = 'utf-8', workers: Optional[int] = None,
+                         overwrite: bool = False, stream: bool = False, manifest_path: Optional[str] = None,
+                         recursive: bool = True) -> dict:
+    """
+    Translate every .txt/.docx file matched by `patterns` into `output_dir` (mirroring the input layout) with a
+    pool of `workers` threads sharing one translator. Writes and returns the summary manifest.
+    """
+    inputs = collect_inputs(patterns, recursive)
+    workers = max(1, workers or BULK_WORKERS)
+    manifest_path = manifest_path or os.path.join(output_dir, BULK_MANIFEST_NAME)
+    manifest = {
+        "started_at": time.time(), "finished_at": None, "target_lang": target_lang, "source_lang": source_lang,
+        "model": translator.model, "output_dir": os.path.abspath(output_dir), "workers": workers, "files": [],
+    }
+    progress = BulkProgress(len(inputs), sum(os.path.getsize(path) for path, _ in inputs))
+    logger.info(f"Bulk translation: {len(inputs)} file(s), {progress.total_bytes} bytes, {workers} worker(s), "
+                f"output to '{output_dir}'.")
+
+    entries = {}
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bulk")
+    try:
+        futures = {
+            executor.submit(translate_one, path, relative, output_dir, target_lang, translator, source_lang,
+                            encoding, overwrite, stream): path
+            for path, relative in inputs
+        }
+        for future in as_completed(futures):
+            entry = future.result()
+            entries[entry["input"]] = entry
+            progress.update(entry)
+    except KeyboardInterrupt:
+        logger.warning("Bulk translation interrupted; waiting for files in progress and writing the manifest.")
+        raise
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+        manifest["files"] = [entries.get(path) or {"input": path, "output": None, "status": STATUS_CANCELLED,
+                                                   "error": None, "bytes": os.path.getsize(path), "seconds": 0.0}
+                             for path, _ in inputs]
+        manifest["finished_at"] = time.time()
+        manifest["elapsed_seconds"] = round(manifest["finished_at"] - manifest["started_at"], 3)
+        manifest["summary"] = {status: sum(1 for e in manifest["files"] if e["status"] == status)
+                               for status in (STATUS_TRANSLATED, STATUS_SKIPPED, STATUS_FAILED, STATUS_CANCELLED)}
+        os.makedirs(os.path.dirname(os.path.abspath(manifest_path)), exist_ok=True)
+        with open(manifest_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        manifest["manifest_path"] = manifest_path
+    return manifest
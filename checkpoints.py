@@ -0,0 +1,190 @@
+# checkpoints.py
+"""
+文件翻译的断点续传。
+
+- ChunkJournal: 追加写入的 JSONL 日志，记录已完成分块的译文。按 (文档哈希, 平台, 模型, 语言, 格式...) 命名，
+  所以无论是 CLI 重新运行还是网页重新上传同一文件，都会自动复用已完成的分块。
+  chunk_executor 在翻译每个分块前查询 translator.journal，成功后写入。
+- 任务清单 (jobs/<job_id>.json): 记录重新运行一个任务所需的全部设置 (不含 API Key)，用于按任务 id 续传。
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from typing import Optional
+
+try:
+    from config import CHECKPOINT_ENABLED, CHECKPOINT_DIR, CHECKPOINT_RETENTION_SECONDS
+except ImportError:
+    CHECKPOINT_ENABLED = True
+    CHECKPOINT_DIR = "checkpoints"
+    CHECKPOINT_RETENTION_SECONDS = 7 * 24 * 3600
+
+logger = logging.getLogger(__name__)
+
+HASH_READ_SIZE = 1024 * 1024
+
+
+def document_hash(filepath: str) -> str:
+    """SHA-256 of the file contents, read in blocks."""
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_READ_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class ChunkJournal:
+    """
+    Append-only journal of completed chunks: one JSON line {"h": sha256(chunk), "t": translation} per chunk.
+    Only the hash -> (offset, length) index is kept in memory; translations are read back from disk on demand,
+    so resuming a very large streamed file does not load its whole translation.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.hits = 0
+        self._index = {}
+        self._lock = threading.Lock()
+        self._load()
+        self._file = open(path, 'ab')
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'rb') as f:
+            offset = 0
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                    self._index[entry["h"]] = (offset, len(line))
+                except (ValueError, KeyError):
+                    logger.warning(f"Ignoring damaged entry at byte {offset} of checkpoint journal {self.path}")  # 例如写到一半时进程被杀
+                offset += len(line)
+        logger.info(f"Checkpoint journal {self.path}: {len(self._index)} completed chunk(s) found, resuming.")
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def get(self, chunk: str) -> Optional[str]:
+        with self._lock:
+            location = self._index.get(_text_hash(chunk))
+            if location is None:
+                return None
+            with open(self.path, 'rb') as f:
+                f.seek(location[0])
+                line = f.read(location[1])
+            self.hits += 1
+        return json.loads(line)["t"]
+
+    def record(self, chunk: str, translation: str):
+        line = (json.dumps({"h": _text_hash(chunk), "t": translation}, ensure_ascii=False) + "\n").encode('utf-8')
+        with self._lock:
+            if self._file.closed:
+                return
+            offset = self._file.seek(0, os.SEEK_END)
+            self._file.write(line)
+            self._file.flush()  # 进程崩溃后已完成的分块仍在磁盘上
+            self._index[_text_hash(chunk)] = (offset, len(line))
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
+
+    def complete(self):
+        """The file was translated successfully: the journal is no longer needed."""
+        self.close()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+        logger.info(f"Checkpoint journal {self.path} removed after successful translation ({self.hits} chunk(s) reused).")
+
+
+def _purge_stale_journals():
+    cutoff = time.time() - CHECKPOINT_RETENTION_SECONDS
+    for directory in (CHECKPOINT_DIR, os.path.join(CHECKPOINT_DIR, "jobs")):
+        try:
+            names = os.listdir(directory)
+        except OSError:
+            continue
+        for name in names:
+            path = os.path.join(directory, name)
+            try:
+                if os.path.isfile(path) and os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+                    logger.info(f"Removed stale checkpoint file {path}")
+            except OSError:
+                pass
+
+
+def open_journal(input_filepath: str, translator, target_lang: str, source_lang: Optional[str] = None,
+                 **settings) -> Optional[ChunkJournal]:
+    """
+    Open (or create) the journal for this document and these settings; None when checkpointing is disabled.
+    `settings` are extra values that change the output, e.g. file_type, translation_format, encoding.
+    """
+    if not CHECKPOINT_ENABLED:
+        return None
+    os.makedirs(CHECKPOINT_DIR, exist_ok=True)
+    _purge_stale_journals()
+    key_material = json.dumps({
+        "document": document_hash(input_filepath), "platform": translator.platform_id, "model": translator.model,
+        "target_lang": target_lang, "source_lang": source_lang or "", "settings": settings,
+    }, sort_keys=True)
+    key = hashlib.sha256(key_material.encode('utf-8')).hexdigest()[:32]
+    return ChunkJournal(os.path.join(CHECKPOINT_DIR, f"{key}.jsonl"))
+
+
+# --- 任务清单：按任务 id 续传 ---
+
+def _manifest_path(job_id: str) -> str:
+    if not job_id or not all(c.isalnum() or c in "-_" for c in job_id):
+        raise ValueError(f"Invalid job id '{job_id}'.")
+    return os.path.join(CHECKPOINT_DIR, "jobs", f"{job_id}.json")
+
+
+def save_job_manifest(job_id: str, manifest: dict):
+    """Persist what is needed to rerun a job (input path, output dir, platform, model, languages...). Never the API key."""
+    if not CHECKPOINT_ENABLED:
+        return
+    path = _manifest_path(job_id)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(dict(manifest, job_id=job_id, saved_at=time.time()), f, ensure_ascii=False, indent=2)
+
+
+def load_job_manifest(job_id: str) -> Optional[dict]:
+    try:
+        with open(_manifest_path(job_id), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def delete_job_manifest(job_id: str):
+    try:
+        os.remove(_manifest_path(job_id))
+    except (OSError, ValueError):
+        pass
+
+
+def build_translator_for_manifest(manifest: dict, api_key: Optional[str] = None):
+    """Recreate the translator a manifest was run with; the API key comes from `api_key` or the platform's .env setting."""
+    from platforms import get_translator, resolve_platform_settings # 延迟导入，避免循环依赖
+    from router import ROUTER_PLATFORM_ID, get_router
+    if manifest.get("platform") == ROUTER_PLATFORM_ID:
+        return get_router(manifest.get("route_targets") or None, manifest.get("route_mode") or None)
+    api_key, base_url, model, error = resolve_platform_settings(
+        manifest.get("platform") or "custom", api_key or "", manifest.get("base_url") or "", manifest.get("model") or ""
+    )
+    if error:
+        raise ValueError(error)
+    return get_translator(manifest.get("platform") or "custom", api_key, base_url, model)
@@ -0,0 +1,160 @@
+# chunk_executor.py
+import contextvars
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, Iterator, List, Optional
+
+from translator import is_translation_error, is_upstream_overload_error
+from tracing import span
+
+try:
+    from config import CHUNK_CONCURRENCY_DEFAULT, PLATFORM_CHUNK_CONCURRENCY, CHUNK_MAX_RETRIES, CHUNK_RETRY_BACKOFF
+except ImportError:
+    CHUNK_CONCURRENCY_DEFAULT = 4
+    PLATFORM_CHUNK_CONCURRENCY = {}
+    CHUNK_MAX_RETRIES = 2
+    CHUNK_RETRY_BACKOFF = 1.0
+
+logger = logging.getLogger(__name__)
+
+
+def get_chunk_concurrency(platform_id: str) -> int:
+    """Concurrency for a platform: CHUNK_CONCURRENCY_<PLATFORM> env var > PLATFORM_CHUNK_CONCURRENCY > default."""
+    env_value = os.getenv(f"CHUNK_CONCURRENCY_{platform_id.upper()}")
+    if env_value:
+        try:
+            return max(1, int(env_value))
+        except ValueError:
+            logger.warning(f"Ignoring invalid CHUNK_CONCURRENCY_{platform_id.upper()}={env_value!r}")
+    return max(1, PLATFORM_CHUNK_CONCURRENCY.get(platform_id, CHUNK_CONCURRENCY_DEFAULT))
+
+
+def _translate_with_retries(translator, text: str, target_lang: str, source_lang: Optional[str],
+                            max_retries: int, label: str) -> str:
+    """
+    Translate one chunk, retrying with exponential backoff. Returns the last error string if all attempts fail.
+    429/5xx errors are not retried here: send_with_rate_limit has already backed off and retried them.
+    With a checkpoint journal (translator.journal) completed chunks are reused and new results are recorded.
+    """
+    with span("chunk", label=label, chars=len(text)) as chunk_span:
+        journal = translator.journal
+        if journal is not None:
+            result = journal.get(text)
+            if result is not None:
+                chunk_span.set(journal_hit=True)
+                return result
+        result = None
+        for attempt in range(max_retries + 1):
+            if attempt:
+                delay = CHUNK_RETRY_BACKOFF * (2 ** (attempt - 1))
+                logger.warning(f"Retrying chunk {label} in {delay:.1f}s (attempt {attempt + 1}/{max_retries + 1}). Last error: {str(result)[:200]}")
+                with span("chunk_retry_backoff", seconds=delay):
+                    time.sleep(delay)
+            try:
+                result = translator.translate(text, target_lang, source_lang)
+            except Exception as e:  # translate() 本身会捕获异常，这里只是保险
+                result = f"Error: Unexpected error translating chunk {label}: {type(e).__name__} - {e}"
+            if not is_translation_error(result):
+                break
+            if is_upstream_overload_error(result):
+                logger.error(f"Chunk {label} failed: upstream still overloaded after rate-limit retries: {str(result)[:200]}")
+                chunk_span.set(attempts=attempt + 1, error=str(result)[:200])
+                return result
+        else:
+            logger.error(f"Chunk {label} failed after {max_retries + 1} attempts: {str(result)[:200]}")
+            chunk_span.set(attempts=max_retries + 1, error=str(result)[:200])
+            return result
+        chunk_span.set(attempts=attempt + 1)
+        if journal is not None:
+            journal.record(text, result)
+        return result
+
+
+def translate_chunks(translator, chunks: List[str], target_lang: str, source_lang: Optional[str] = None,
+                     max_workers: Optional[int] = None, max_retries: int = CHUNK_MAX_RETRIES,
+                     on_chunk_done: Optional[Callable[[int, str], None]] = None) -> List[str]:
+    """
+    并发翻译多个分块，并按原始顺序返回结果。
+
+    每个分块单独重试 (带指数退避)；重试用尽后该位置保留最后一次的错误字符串，
+    由调用者决定是整体失败还是保留原文。on_chunk_done(index, result) 在每个分块完成时
+    (从工作线程中) 调用；若设置了 translator.progress_callback，也会以 (已完成数, 总数) 调用它。
+    """
+    if not chunks:
+        return []
+    if max_workers is None:
+        max_workers = translator.chunk_concurrency or get_chunk_concurrency(translator.platform_id)
+    max_workers = max(1, min(max_workers, len(chunks)))
+    logger.info(f"Translating {len(chunks)} chunks with concurrency {max_workers} via {translator.platform_id} ({translator.model}).")
+
+    progress_callback = translator.progress_callback
+    progress_lock = threading.Lock()
+    completed = [0]
+
+    def translate_one(index: int) -> str:
+        result = _translate_with_retries(translator, chunks[index], target_lang, source_lang, max_retries,
+                                         f"{index + 1}/{len(chunks)}")
+        if on_chunk_done is not None:
+            on_chunk_done(index, result)
+        if progress_callback is not None:
+            with progress_lock:
+                completed[0] += 1
+                progress_callback(completed[0], len(chunks))
+        return result
+
+    with span("translate_chunks", chunks=len(chunks), concurrency=max_workers):
+        if max_workers == 1:
+            return [translate_one(i) for i in range(len(chunks))]
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="chunk") as executor:
+            # 每个分块在提交线程上下文的副本中运行，tracing 的 span 和监听器随之进入工作线程
+            futures = [executor.submit(contextvars.copy_context().run, translate_one, i) for i in range(len(chunks))]
+            # 按提交顺序取结果，保证输出与原文顺序一致
+            return [future.result() for future in futures]
+
+
+def iter_translated_chunks(translator, chunks: Iterable[str], target_lang: str, source_lang: Optional[str] = None,
+                           max_workers: Optional[int] = None, window: Optional[int] = None,
+                           max_retries: int = CHUNK_MAX_RETRIES) -> Iterator[str]:
+    """
+    translate_chunks 的流式版本：按需从 chunks (可以是生成器) 读取分块，最多 window 个分块在途，
+    并按原始顺序逐个产出结果。内存占用只与 window 有关，与分块总数无关。
+    progress_callback 以 (已完成数, None) 调用，因为总数事先未知。
+    """
+    if max_workers is None:
+        max_workers = translator.chunk_concurrency or get_chunk_concurrency(translator.platform_id)
+    max_workers = max(1, max_workers)
+    window = max(max_workers, window or max_workers * 2)
+    logger.info(f"Streaming chunk translation with concurrency {max_workers}, window {window} via {translator.platform_id} ({translator.model}).")
+
+    progress_callback = translator.progress_callback
+    chunk_iter = iter(chunks)
+    pending = deque()
+    submitted = 0
+    completed = 0
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="chunk") as executor:
+        def fill():
+            nonlocal submitted
+            while len(pending) < window:
+                chunk = next(chunk_iter, None)
+                if chunk is None:
+                    return
+                submitted += 1
+                pending.append(executor.submit(contextvars.copy_context().run, _translate_with_retries, translator,
+                                               chunk, target_lang, source_lang, max_retries, str(submitted)))
+
+        try:
+            fill()
+            while pending:
+                result = pending.popleft().result()  # 队首完成前，后面完成的结果留在 future 中等待
+                completed += 1
+                if progress_callback is not None:
+                    progress_callback(completed, None)
+                yield result
+                fill()
+        finally:
+            for future in pending:  # 调用者提前停止 (例如某个分块失败)：不再启动排队中的分块
+                future.cancel()
@@ -42,4 +42,239 @@ DEFAULT_MODEL = "default-fallback-model" # 只是一个示例，请替换或设
 # 你可以选择在启动时打印这些后备值以供参考（主要用于开发阶段）
 # print(f"CONFIG.PY: Fallback API_KEY = {API_KEY}")
 # print(f"CONFIG.PY: Fallback BASE_URL = {BASE_URL}")
-# print(f"CONFIG.PY: Fallback DEFAULT_MODEL = {DEFAULT_MODEL}")
\ No newline at end of file
+# print(f"CONFIG.PY: Fallback DEFAULT_MODEL = {DEFAULT_MODEL}")
+
+# ==============================================================================
+# HTTP 连接池设置 (translator.py / http_pool.py 使用)
+# 这些是通用的调优参数，不涉及任何平台密钥，因此可以安全地从环境变量读取。
+# 每个 (base_url, platform_id) 组合共享一个 requests.Session，复用 keep-alive 连接。
+HTTP_POOL_CONNECTIONS = int(os.getenv("HTTP_POOL_CONNECTIONS", "10"))  # 每个 Session 缓存的 host 连接池数量
+HTTP_POOL_MAXSIZE = int(os.getenv("HTTP_POOL_MAXSIZE", "32"))          # 每个 host 的最大保活连接数
+HTTP_MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", "2"))             # 建立连接失败时的重试次数 (429/5xx 由 rate_limiter.py 处理)
+HTTP_BACKOFF_FACTOR = float(os.getenv("HTTP_BACKOFF_FACTOR", "0.5"))   # 重试间隔: factor * 2^(n-1) 秒
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "10"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "60"))                # 非流式请求的读超时
+HTTP_STREAM_READ_TIMEOUT = float(os.getenv("HTTP_STREAM_READ_TIMEOUT", "180")) # 流式请求的读超时
+
+
+# ==============================================================================
+# 翻译记忆缓存设置 (translation_cache.py 使用)
+# 两级缓存: 进程内 LRU + 磁盘上的 SQLite。相同 (平台, 模型, 语言对, 文本) 的请求不再重复调用 API。
+TRANSLATION_CACHE_ENABLED = os.getenv("TRANSLATION_CACHE_ENABLED", "1").lower() not in ("0", "false", "no", "off")
+TRANSLATION_CACHE_DB = os.getenv("TRANSLATION_CACHE_DB", os.path.join("cache", "translation_cache.sqlite3"))
+TRANSLATION_CACHE_MEMORY_ENTRIES = int(os.getenv("TRANSLATION_CACHE_MEMORY_ENTRIES", "2048"))
+TRANSLATION_CACHE_DISK_MAX_ENTRIES = int(os.getenv("TRANSLATION_CACHE_DISK_MAX_ENTRIES", "200000"))
+TRANSLATION_CACHE_TTL_SECONDS = int(os.getenv("TRANSLATION_CACHE_TTL_SECONDS", str(30 * 24 * 3600)))  # 默认 30 天
+
+
+# ==============================================================================
+# 异步服务设置 (async_translator.py / async_app.py 使用)
+# 异步服务器用单个事件循环承载大量并发 SSE 流，这里限制到上游的总连接数。
+ASYNC_HTTP_MAX_CONNECTIONS = int(os.getenv("ASYNC_HTTP_MAX_CONNECTIONS", "4096"))
+ASYNC_HTTP_MAX_CONNECTIONS_PER_HOST = int(os.getenv("ASYNC_HTTP_MAX_CONNECTIONS_PER_HOST", "0"))  # 0 表示不单独限制
+# async_app.py 转交给 Flask 的请求 (文件上传、任务事件流、路由/对冲流等) 使用的线程数，与缓存 I/O 的默认线程池分开
+ASYNC_BRIDGE_THREADS = int(os.getenv("ASYNC_BRIDGE_THREADS", "64"))
+
+
+# ==============================================================================
+# 文件分块并发翻译设置 (chunk_executor.py 使用)
+# 同一文档的多个分块会并发发送，结果按原始顺序重新拼接。
+CHUNK_CONCURRENCY_DEFAULT = int(os.getenv("CHUNK_CONCURRENCY_DEFAULT", "4"))
+CHUNK_CONCURRENCY_MAX = int(os.getenv("CHUNK_CONCURRENCY_MAX", "32"))      # Web 端请求中 chunk_concurrency 的上限
+# 各平台的默认并发数 (未列出的平台使用 CHUNK_CONCURRENCY_DEFAULT)。
+# 也可以用环境变量 CHUNK_CONCURRENCY_<PLATFORM> 覆盖，例如 CHUNK_CONCURRENCY_OPENAI=16
+PLATFORM_CHUNK_CONCURRENCY = {
+    "siliconflow": 8,
+    "deepseek": 8,
+    "moonshot": 4,
+    "openai": 8,
+    "openrouter": 4,
+    "modelscope": 2,
+    "ollama": 1,  # 本地模型通常一次只能处理一个请求
+}
+CHUNK_MAX_RETRIES = int(os.getenv("CHUNK_MAX_RETRIES", "2"))            # 单个分块失败后的重试次数
+CHUNK_RETRY_BACKOFF = float(os.getenv("CHUNK_RETRY_BACKOFF", "1.0"))    # 重试间隔: backoff * 2^(n-1) 秒
+
+
+# ==============================================================================
+# 后台任务设置 (jobs.py 使用)
+# 文件翻译作为后台任务运行，上传请求立即返回 job id。
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))                          # 同时运行的文件翻译任务数
+JOB_RETENTION_SECONDS = int(os.getenv("JOB_RETENTION_SECONDS", "3600"))   # 已结束任务的保留时间
+JOB_EVENTS_KEEPALIVE_SECONDS = int(os.getenv("JOB_EVENTS_KEEPALIVE_SECONDS", "15"))  # SSE 心跳间隔
+# 任务存储：SQLite 文件，多个服务进程 (serve.py 的 worker) 共享任务状态和事件；设为空则只保存在进程内存中
+JOB_STORE_DB = os.getenv("JOB_STORE_DB", os.path.join("cache", "jobs.sqlite3"))
+JOB_STORE_POLL_SECONDS = float(os.getenv("JOB_STORE_POLL_SECONDS", "0.5"))  # 等待其他进程写入的任务事件时的轮询间隔
+
+
+# ==============================================================================
+# 按 token 预算分块设置 (token_budget.py 使用)
+# 翻译结果的 token 数通常比原文多一些，按这个系数为输出预留空间
+TRANSLATION_OUTPUT_EXPANSION = float(os.getenv("TRANSLATION_OUTPUT_EXPANSION", "1.3"))
+# token 估算是近似值，只使用预算的这一部分以免输出被截断
+TOKEN_BUDGET_SAFETY_MARGIN = float(os.getenv("TOKEN_BUDGET_SAFETY_MARGIN", "0.85"))
+
+
+# ==============================================================================
+# 多段批量翻译设置 (batch_translator.py 使用)
+# 把多个短片段 (段落、表格单元格、标题) 编号后放进同一个请求，再按编号拆回。
+BATCH_MAX_SEGMENTS = int(os.getenv("BATCH_MAX_SEGMENTS", "40"))  # 单个请求最多包含的片段数
+
+
+# ==============================================================================
+# 按平台的自适应限流设置 (rate_limiter.py 使用)
+# rpm = 每分钟请求数, tpm = 每分钟 token 数 (估算)；0 表示不限制。请按你的账户等级调整。
+RATE_LIMIT_DEFAULT = {"rpm": 0, "tpm": 0}
+PLATFORM_RATE_LIMITS = {
+    "siliconflow": {"rpm": 1000, "tpm": 50000},
+    "deepseek": {"rpm": 0, "tpm": 0},  # DeepSeek 不公布固定限额，依靠 429 自适应
+    "moonshot": {"rpm": 200, "tpm": 128000},
+    "openai": {"rpm": 500, "tpm": 200000},
+    "openrouter": {"rpm": 20, "tpm": 0},
+    "modelscope": {"rpm": 60, "tpm": 0},
+    "ollama": {"rpm": 0, "tpm": 0},
+}
+# AIMD 并发窗口：延迟正常时每个往返 +1，遇到 429/5xx 时减半
+AIMD_INITIAL_WINDOW = float(os.getenv("AIMD_INITIAL_WINDOW", "4"))
+AIMD_MIN_WINDOW = float(os.getenv("AIMD_MIN_WINDOW", "1"))
+AIMD_MAX_WINDOW = float(os.getenv("AIMD_MAX_WINDOW", "64"))
+AIMD_DECREASE_FACTOR = float(os.getenv("AIMD_DECREASE_FACTOR", "0.5"))
+RATE_LIMIT_MAX_RETRIES = int(os.getenv("RATE_LIMIT_MAX_RETRIES", "4"))      # 429/5xx 后的最大重试次数
+RATE_LIMIT_BACKOFF_BASE = float(os.getenv("RATE_LIMIT_BACKOFF_BASE", "1.0"))  # 指数退避基数 (秒)
+RATE_LIMIT_BACKOFF_MAX = float(os.getenv("RATE_LIMIT_BACKOFF_MAX", "60"))     # 单次等待上限 (秒)
+RATE_LIMIT_ACQUIRE_TIMEOUT = float(os.getenv("RATE_LIMIT_ACQUIRE_TIMEOUT", "60"))  # 等待限流许可的上限 (秒)，超时返回过载错误；0 表示不限
+RATE_LIMIT_MAX_OPEN_STREAMS = int(os.getenv("RATE_LIMIT_MAX_OPEN_STREAMS", "64"))  # 每个上游同时打开的流数上限 (与 AIMD 窗口分开计数)；0 表示不限
+
+
+# ==============================================================================
+# 多平台路由设置 (router.py 使用，api_platform = "router" 时生效)
+# 目标列表格式: "平台[:模型][@权重]"，逗号分隔，例如
+#   ROUTING_TARGETS="siliconflow:THUDM/GLM-4-9B-0414@3,deepseek:deepseek-chat@1,openai"
+# 每个平台的 API Key / Base URL 仍按 .env 中的平台变量解析。
+ROUTING_TARGETS = os.getenv("ROUTING_TARGETS", "")
+ROUTING_MODE = os.getenv("ROUTING_MODE", "ordered")  # ordered (按顺序优先) | weighted (按权重) | latency (最低延迟优先)
+ROUTING_HEALTH_WINDOW = int(os.getenv("ROUTING_HEALTH_WINDOW", "50"))              # 每个目标保留的最近请求数
+CIRCUIT_ERROR_RATE_THRESHOLD = float(os.getenv("CIRCUIT_ERROR_RATE_THRESHOLD", "0.5"))  # 错误率达到此值时熔断
+CIRCUIT_MIN_SAMPLES = int(os.getenv("CIRCUIT_MIN_SAMPLES", "5"))                   # 计算错误率前的最少样本数
+CIRCUIT_CONSECUTIVE_FAILURES = int(os.getenv("CIRCUIT_CONSECUTIVE_FAILURES", "3")) # 连续失败这么多次立即熔断
+CIRCUIT_OPEN_SECONDS = float(os.getenv("CIRCUIT_OPEN_SECONDS", "30"))              # 熔断后多久放行一个探测请求
+
+
+# ==============================================================================
+# 对冲请求设置 (hedging.py 使用，仅用于网页端文字流式翻译)
+# 首个 token 在阈值内未到达时，向同一目标 (或 HEDGE_TARGET) 再发一次相同请求，先出 token 的流胜出。
+HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "false").lower() in ("1", "true", "yes")  # 默认关闭；表单字段 hedge=1 可单次开启
+HEDGE_DELAY_SECONDS = float(os.getenv("HEDGE_DELAY_SECONDS", "0"))                    # 固定阈值；0 表示使用学习到的首 token 延迟分位数
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "0.95"))                       # 学习阈值使用的分位数
+HEDGE_INITIAL_DELAY_SECONDS = float(os.getenv("HEDGE_INITIAL_DELAY_SECONDS", "2.0"))  # 样本不足时使用的阈值
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))                         # 开始使用学习阈值前的最少样本数
+HEDGE_MIN_DELAY_SECONDS = float(os.getenv("HEDGE_MIN_DELAY_SECONDS", "0.2"))          # 学习阈值的下限，避免几乎每个请求都被对冲
+HEDGE_BUDGET_RATIO = float(os.getenv("HEDGE_BUDGET_RATIO", "0.2"))                    # 被对冲的请求最多占总请求的比例
+HEDGE_TARGET = os.getenv("HEDGE_TARGET", "")                                          # 对冲请求的目标 "平台[:模型]"；留空表示同一目标
+
+
+# ==============================================================================
+# 相同请求合并设置 (single_flight.py 使用)
+# 并发的相同请求 (平台、模型、语言对、文本都相同) 只调用一次上游；流式请求的所有订阅者共享同一个 SSE 流，
+# 中途加入的先回放已收到的部分。
+SINGLE_FLIGHT_ENABLED = os.getenv("SINGLE_FLIGHT_ENABLED", "true").lower() in ("1", "true", "yes", "on")
+SINGLE_FLIGHT_READ_SIZE = int(os.getenv("SINGLE_FLIGHT_READ_SIZE", "1024"))  # 从共享上游流每次读取的字节数
+
+# ==============================================================================
+# 平台注册表与翻译器实例缓存 (platforms.py 使用)
+# 平台配置在启动时解析一次；.env 文件变化或收到 SIGHUP 时重新加载。
+PLATFORM_ENV_FILE = os.getenv("PLATFORM_ENV_FILE", ".env")                                  # 监视并重新加载的 .env 文件
+PLATFORM_RELOAD_CHECK_SECONDS = float(os.getenv("PLATFORM_RELOAD_CHECK_SECONDS", "2"))      # 检查 .env 修改时间的最小间隔；0 表示不监视
+TRANSLATOR_CACHE_SIZE = int(os.getenv("TRANSLATOR_CACHE_SIZE", "32"))                       # 缓存的翻译器实例上限 (LRU)
+
+
+# ==============================================================================
+# SSE 转发设置 (sse_relay.py 使用)
+# 上游的逐 token 增量会合并成较大的帧再发给浏览器，减少每个 token 一次的序列化和写入。
+SSE_COALESCE_MS = float(os.getenv("SSE_COALESCE_MS", "30"))           # 合并窗口 (毫秒)；0 表示每次读取后立即发送
+SSE_COALESCE_CHARS = int(os.getenv("SSE_COALESCE_CHARS", "256"))      # 缓冲文本达到此长度时立即发送
+SSE_USE_ORJSON = os.getenv("SSE_USE_ORJSON", "true").lower() in ("1", "true", "yes")  # 安装了 orjson 时用它解析/生成 JSON
+
+
+# ==============================================================================
+# 大文本文件流式翻译设置 (text_stream_translator.py 使用)
+# 流式模式按块读取、按段落切分、边翻译边按顺序写出，内存占用与文件大小无关。
+TEXT_STREAM_THRESHOLD_BYTES = int(os.getenv("TEXT_STREAM_THRESHOLD_BYTES", str(16 * 1024 * 1024)))  # 超过此大小的 .txt 自动使用流式模式
+TEXT_STREAM_READ_SIZE = int(os.getenv("TEXT_STREAM_READ_SIZE", str(64 * 1024)))                   # 每次从磁盘读取的字节数
+TEXT_STREAM_WINDOW = int(os.getenv("TEXT_STREAM_WINDOW", "0"))                                      # 最多在途的分块数；0 表示并发数的 2 倍
+
+
+# ==============================================================================
+# 保留格式的 Word 翻译设置 (docx_full_translator.py 使用)
+# document.xml、页眉、页脚、脚注和尾注按块增量解析并边翻译边写出，不把整个文档加载为对象模型。
+DOCX_STREAM_READ_SIZE = int(os.getenv("DOCX_STREAM_READ_SIZE", str(64 * 1024)))                   # 每次从 zip 条目读取的字节数
+DOCX_STREAM_WINDOW = int(os.getenv("DOCX_STREAM_WINDOW", "0"))                                      # 最多在途的批次数；0 表示并发数的 2 倍
+
+
+# ==============================================================================
+# 文件翻译断点续传设置 (checkpoints.py 使用)
+# 每个文件翻译在磁盘上记录已完成分块的译文 (按文档哈希 + 翻译设置区分)，重新运行同一输入时跳过已完成的分块。
+CHECKPOINT_ENABLED = os.getenv("CHECKPOINT_ENABLED", "true").lower() in ("1", "true", "yes")
+CHECKPOINT_DIR = os.getenv("CHECKPOINT_DIR", "checkpoints")                                          # 日志和任务清单所在目录
+CHECKPOINT_RETENTION_SECONDS = int(os.getenv("CHECKPOINT_RETENTION_SECONDS", str(7 * 24 * 3600)))   # 未完成的日志保留多久
+
+
+# ==============================================================================
+# 增量翻译设置 (incremental.py / main.py --incremental 使用)
+# 修订版文档只翻译相对上一版新增或修改的片段；片段清单按文档记录上一次成功翻译的 (片段指纹 -> 译文)。
+INCREMENTAL_DIR = os.getenv("INCREMENTAL_DIR", os.path.join("cache", "incremental"))              # Web 端增量翻译的清单目录 (按文档名和设置命名)
+INCREMENTAL_ANCHOR_PARAGRAPHS = int(os.getenv("INCREMENTAL_ANCHOR_PARAGRAPHS", "8"))               # .txt 增量模式下平均每多少个段落强制断开一个分块
+
+
+# ==============================================================================
+# Web 端输出存储与下载设置 (output_store.py / app.py 使用)
+# 译文按 (上传文件内容, 翻译设置) 寻址：相同文件以相同设置再次上传时直接返回已有结果；内容相同的结果只存一份。
+OUTPUT_STORE_ENABLED = os.getenv("OUTPUT_STORE_ENABLED", "true").lower() in ("1", "true", "yes")
+OUTPUT_STORE_DIR = os.getenv("OUTPUT_STORE_DIR", os.path.join("translated_output_web", "store"))  # 结果文件和索引 (SQLite) 所在目录
+OUTPUT_STORE_MAX_BYTES = int(os.getenv("OUTPUT_STORE_MAX_BYTES", str(2 * 1024 ** 3)))            # 超出时淘汰最久未访问的结果
+OUTPUT_STORE_TTL_SECONDS = int(os.getenv("OUTPUT_STORE_TTL_SECONDS", str(7 * 24 * 3600)))        # 多久未访问的结果被淘汰；也用于清理下载目录中的旧文件；0 表示不按时间淘汰
+DOWNLOAD_CACHE_MAX_AGE = int(os.getenv("DOWNLOAD_CACHE_MAX_AGE", str(24 * 3600)))                # 存储结果的浏览器缓存秒数 (内容不可变，ETag 为内容哈希)
+# 由前置代理发送文件：""(Flask 自己发送)、"x-sendfile" (Apache mod_xsendfile / lighttpd) 或 "x-accel-redirect" (nginx)。
+# nginx 需要一个 internal location 把 DOWNLOAD_ACCEL_PREFIX 映射到下载目录 (translated_output_web/，OUTPUT_STORE_DIR 需位于其中)，例如：
+#   location /_translated/ { internal; alias /path/to/translated_output_web/; }
+DOWNLOAD_OFFLOAD = os.getenv("DOWNLOAD_OFFLOAD", "").strip().lower()
+DOWNLOAD_ACCEL_PREFIX = os.getenv("DOWNLOAD_ACCEL_PREFIX", "/_translated/")
+
+
+# ==============================================================================
+# 批量翻译设置 (bulk_translator.py / main.py -b 使用)
+# 同一进程内用线程池并发处理多个文件，共享连接池和限流状态。
+BULK_WORKERS = int(os.getenv("BULK_WORKERS", "4"))                                                   # 同时翻译的文件数
+BULK_MANIFEST_NAME = os.getenv("BULK_MANIFEST_NAME", "bulk_manifest.json")                           # 汇总清单文件名 (写在输出目录中)
+
+
+# ==============================================================================
+# JSONL 字段翻译设置 (jsonl_translator.py / main.py -j 使用)
+JSONL_WORKERS = int(os.getenv("JSONL_WORKERS", "8"))                                                 # 并发翻译的记录数
+JSONL_WINDOW = int(os.getenv("JSONL_WINDOW", "0"))                                                   # 最多在途的记录数；0 表示并发数的 2 倍
+JSONL_META_FIELD = os.getenv("JSONL_META_FIELD", "_translation")                                     # 输出记录中元数据 (耗时、用量、错误) 的字段名
+
+
+# ==============================================================================
+# 指标设置 (metrics.py 使用；Web 端通过 /metrics 以 Prometheus 文本格式导出)
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() in ("1", "true", "yes")
+METRICS_CLI_SUMMARY = os.getenv("METRICS_CLI_SUMMARY", "true").lower() in ("1", "true", "yes")      # CLI 结束时打印按平台/模型汇总的指标
+
+
+# ==============================================================================
+# 追踪设置 (tracing.py 使用)
+# 设置目录后，每个 Web 文件翻译任务写出 Chrome trace / Perfetto JSON：<TRACE_DIR>/<job_id>.json (可通过 /jobs/<job_id>/trace 下载)。
+# CLI 使用 --trace <文件> 单独开启。
+TRACE_DIR = os.getenv("TRACE_DIR", "")
+
+# ==============================================================================
+# 生产服务设置 (serve.py 使用)
+# gunicorn 多进程 + 每进程多线程；gthread 下每个 SSE 流只占用一个线程。
+# 翻译缓存 (TRANSLATION_CACHE_DB)、任务存储 (JOB_STORE_DB)、上传文件和检查点都在磁盘上，由所有 worker 共享。
+SERVER_BIND = os.getenv("SERVER_BIND", "0.0.0.0:5000")
+SERVER_WORKERS = int(os.getenv("SERVER_WORKERS", "2"))                        # worker 进程数
+SERVER_THREADS = int(os.getenv("SERVER_THREADS", "32"))                       # 每个 worker 的线程数 (= 并发流数)
+SERVER_WORKER_CLASS = os.getenv("SERVER_WORKER_CLASS", "gthread")             # gthread，或已安装时的 gevent / eventlet
+SERVER_TIMEOUT = int(os.getenv("SERVER_TIMEOUT", "120"))                      # worker 无响应多久后被重启 (不限制流的时长)
+SERVER_GRACEFUL_TIMEOUT = int(os.getenv("SERVER_GRACEFUL_TIMEOUT", "60"))     # 关闭/重载时等待在途流和任务结束的秒数
+SERVER_KEEPALIVE = int(os.getenv("SERVER_KEEPALIVE", "5"))                    # HTTP keep-alive 秒数
@@ -0,0 +1,415 @@
+# docx_full_translator.py
+"""
+保留格式的 Word (.docx) 翻译，不依赖 python-docx / lxml，也不构建整个文档的对象模型：
+
+- word/document.xml、页眉、页脚、脚注和尾注用 expat 按块增量解析 (DOCX_STREAM_READ_SIZE)，原始 XML 按字节原样复制，
+  只替换可翻译的 run 序列，命名空间前缀、未知元素和属性 (mc:Ignorable 依赖的前缀等) 保持不变。
+- 同一容器 (段落、超链接、修订、文本框中的段落等) 中相邻的纯文本 run 合并成一个片段；格式等价 (rPr 相同，忽略 rsid)
+  的相邻 run 合并为一组，整段只有一组时直接翻译文本，多组时用 <g1>…</g1> 标记送去翻译 (批量提示要求保留标记)，
+  译文按标记放回各自的格式；标记与原文对不上时去掉标记，整段译文放进无格式的那组 (没有时用文字最多的那组)。含图片、域代码、符号等的 run 原样保留，并把片段在此处断开。
+- 片段按 token 预算打包，通过 batch_translator.iter_translated_batches 以 <<<n>>> 编号批量翻译 (有界窗口并发，
+  回复对不上时二分重试，支持检查点续传和进度回调)，译文按原始顺序边完成边写入输出 zip，其他条目流式复制。
+
+内存占用只取决于读取块大小和窗口大小，与文档大小无关。
+"""
+import copy
+import logging
+import os
+import re
+import shutil
+import zipfile
+from collections import deque
+from typing import BinaryIO, Iterator, List, Optional, Union
+from xml.parsers import expat
+from xml.sax.saxutils import escape
+
+from batch_translator import iter_translated_batches, with_original_padding
+from text_stream_translator import output_filename
+from tracing import span
+from translator import is_translation_error
+
+try:
+    from config import DOCX_STREAM_READ_SIZE, DOCX_STREAM_WINDOW
+except ImportError:
+    DOCX_STREAM_READ_SIZE = 64 * 1024
+    DOCX_STREAM_WINDOW = 0
+
+logger = logging.getLogger(__name__)
+
+W_NS = "http://schemas.openxmlformats.org/wordprocessingml/2006/main"
+
+# 需要翻译的部件；其余条目 (样式、图片、关系等) 原样复制
+TRANSLATABLE_PARTS_RE = re.compile(r"word/(document|header\d*|footer\d*|footnotes|endnotes)\.xml")
+
+# run 中可以表示成文本的子元素 (w:tab -> \t，无属性的 w:br / w:cr -> \n)
+_TEXT_CHILDREN = {"t", "tab", "br", "cr"}
+# 没有内容的排版 / 拼写检查状态标记：在合并的 run 之间直接丢弃，Word 打开时会重新生成
+_DROPPED = {"lastRenderedPageBreak", "proofErr"}
+# 位于合并的 run 之间的书签：起点移到片段之前，终点移到片段之后
+_MOVABLE = {"bookmarkStart", "bookmarkEnd"}
+
+_GROUP_TAG_RE = re.compile(r"<g(\d+)>(.*?)</g\1>", re.S)
+_ANY_GROUP_TAG_RE = re.compile(r"</?g\d+>")
+_TAG_END_RE = re.compile(rb"(?:[^>\"']|\"[^\"]*\"|'[^']*')*>")
+_INVALID_XML_CHARS_RE = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+
+class _Run:
+    __slots__ = ("start", "end", "tag", "rpr", "rpr_key", "text", "simple")
+
+    def __init__(self, start: int, tag: bytes):
+        self.start = start
+        self.end = start
+        self.tag = tag        # 原始的 <w:r ...> 起始标签
+        self.rpr = b""        # 原始的 <w:rPr>...</w:rPr>
+        self.rpr_key = []     # 用于判断格式是否等价
+        self.text = []
+        self.simple = True    # 只含 rPr 和文本类子元素
+
+
+class _Span:
+    """Consecutive plain-text runs under one parent, translated and written back as a unit."""
+
+    __slots__ = ("start", "end", "runs", "markers", "prefix", "groups", "before", "after", "source")
+
+    def __init__(self, start: int):
+        self.start = start
+        self.end = start
+        self.runs: List[_Run] = []
+        self.markers = []  # [(local name, start, end)]
+
+    def text(self) -> str:
+        return "".join("".join(run.text) for run in self.runs)
+
+    def seal(self, raw: bytes, base: int, prefix: str):
+        """Merge runs into formatting groups and capture the bytes this span still needs from the parse buffer."""
+        groups = []  # [[run, text]]，run 提供起始标签和 rPr
+        for run in self.runs:
+            text = "".join(run.text)
+            if groups and groups[-1][0].rpr_key == run.rpr_key:
+                groups[-1][1] += text
+            else:
+                groups.append([run, text])
+        merged = []
+        for group in groups:  # 只有空白的组 (例如两段加粗文字之间的普通空格) 并入前一组
+            if merged and not group[1].strip():
+                merged[-1][1] += group[1]
+            elif merged and not merged[-1][1].strip():
+                group[1] = merged.pop()[1] + group[1]
+                merged.append(group)
+            else:
+                merged.append(group)
+        self.prefix = prefix
+        self.groups = [(run.tag, run.rpr, text) for run, text in merged]
+        markers = [(name, raw[start - base:end - base]) for name, start, end in self.markers if end <= self.end]
+        self.before = b"".join(data for name, data in markers if name == "bookmarkStart")
+        self.after = b"".join(data for name, data in markers if name == "bookmarkEnd")
+        if len(self.groups) == 1:
+            self.source = self.groups[0][2]
+        else:
+            self.source = "".join(f"<g{i}>{text}</g{i}>" for i, (_, _, text) in enumerate(self.groups, 1))
+        self.runs = self.markers = None
+
+    def _split(self, translation: str) -> List[str]:
+        """
+        Translated text for each group. Unless the reply has each of the source's markers exactly once, the untagged
+        translation goes to the unformatted group (or the group with the most text) as a single run.
+        """
+        texts = [""] * len(self.groups)
+        matches = list(_GROUP_TAG_RE.finditer(translation))
+        if sorted(int(m.group(1)) for m in matches) != list(range(1, len(self.groups) + 1)) or \
+                len(_ANY_GROUP_TAG_RE.findall(translation)) != 2 * len(self.groups):
+            fallback = next((i for i, (_, rpr, _) in enumerate(self.groups) if not rpr), None)
+            if fallback is None:
+                fallback = max(range(len(self.groups)), key=lambda i: len(self.groups[i][2].strip()))
+            logger.debug(f"Inline markers in the translation do not match {len(self.groups)} groups; using one run.")
+            plain = "".join(text for _, _, text in self.groups)
+            texts[fallback] = with_original_padding(plain, _ANY_GROUP_TAG_RE.sub("", translation).strip())
+            return texts
+        position, last = 0, int(matches[0].group(1)) - 1
+        for match in matches:
+            outside = _ANY_GROUP_TAG_RE.sub("", translation[position:match.start()])
+            texts[last] += outside  # 标记之外的文字归入前一组
+            last = int(match.group(1)) - 1
+            texts[last] += match.group(2)
+            position = match.end()
+        texts[last] += _ANY_GROUP_TAG_RE.sub("", translation[position:])
+        return [with_original_padding(source, text.strip()) if text.strip() else ""
+                for (_, _, source), text in zip(self.groups, texts)]
+
+    def render(self, translation: str) -> bytes:
+        prefix = self.prefix
+        translation = _INVALID_XML_CHARS_RE.sub("", translation.replace("\r\n", "\n"))
+        if len(self.groups) == 1:
+            texts = [with_original_padding(self.source, translation.strip())]
+        else:
+            texts = self._split(translation)
+        parts = [self.before]
+        for (tag, rpr, _), text in zip(self.groups, texts):
+            if not text:
+                continue
+            if tag.endswith(b"/>"):
+                tag = tag[:-2].rstrip() + b">"
+            parts.append(tag + rpr)
+            for piece in re.split(r"(\t|\n)", text):
+                if piece == "\t":
+                    parts.append(f"<{prefix}tab/>".encode("utf-8"))
+                elif piece == "\n":
+                    parts.append(f"<{prefix}br/>".encode("utf-8"))
+                elif piece:
+                    parts.append(f'<{prefix}t xml:space="preserve">{escape(piece)}</{prefix}t>'.encode("utf-8"))
+            parts.append(f"</{prefix}r>".encode("utf-8"))
+        parts.append(self.after)
+        return b"".join(parts)
+
+
+class _Frame:
+    __slots__ = ("local", "start", "span", "run", "run_child", "rpr_of")
+
+    def __init__(self, local: Optional[str], start: int):
+        self.local = local
+        self.start = start
+        self.span: Optional[_Span] = None  # 子元素中正在累积的 run 序列
+        self.run: Optional[_Run] = None    # 本元素是候选 run
+        self.run_child = None              # 本元素是 run 的直接子元素 (所属的 run)
+        self.rpr_of = None                 # 本元素位于该 run 的 rPr 之内
+
+
+class _PartRewriter:
+    """
+    Incremental expat parser over one XML part. feed() returns the part as a sequence of raw byte pieces (copied
+    verbatim) and _Span placeholders (to be replaced by their translation), in document order.
+    """
+
+    def __init__(self):
+        self.parser = expat.ParserCreate()
+        self.parser.buffer_text = True
+        self.parser.StartElementHandler = self._start
+        self.parser.EndElementHandler = self._end
+        self.parser.CharacterDataHandler = self._data
+        self.buf = bytearray()
+        self.base = 0       # buf[0] 在整个部件中的字节偏移
+        self.cursor = 0     # 此偏移之前的字节已经输出
+        self.parsed_to = 0  # 之后出现的 run 都从此偏移之后开始
+        self.prefix = None  # w 命名空间的前缀，例如 "w:"
+        self.stack: List[_Frame] = []
+        self.out = []
+        self.runs = 0
+        self.spans = 0
+
+    def feed(self, block: bytes) -> list:
+        final = not block
+        self.buf.extend(block)
+        self.parser.Parse(block, final)
+        safe = self.base + len(self.buf) if final else self._safe_offset()
+        if safe > self.cursor:
+            self.out.append(bytes(self.buf[self.cursor - self.base:safe - self.base]))
+            self.cursor = safe
+        del self.buf[:self.cursor - self.base]
+        self.base = self.cursor
+        out, self.out = self.out, []
+        return out
+
+    def _safe_offset(self) -> int:
+        """Everything before this offset can no longer become part of a span."""
+        safe = self.parsed_to
+        for frame in self.stack:
+            if frame.span is not None:
+                safe = min(safe, frame.span.start)
+            if frame.run is not None and frame.run.simple:
+                safe = min(safe, frame.run.start)
+        return safe
+
+    def _raw(self, start: int, end: int) -> bytes:
+        return bytes(self.buf[start - self.base:end - self.base])
+
+    def _tag_end(self, pos: int) -> int:
+        return self.base + _TAG_END_RE.match(self.buf, pos - self.base).end()
+
+    def _local(self, name: str) -> Optional[str]:
+        if self.prefix and name.startswith(self.prefix):
+            return name[len(self.prefix):]
+        if self.prefix == "" and ":" not in name:
+            return name
+        return None
+
+    def _start(self, name: str, attrs: dict):
+        pos = self.parser.CurrentByteIndex
+        self.parsed_to = pos
+        if self.prefix is None:
+            self.prefix = next((key[6:] + ":" if key.startswith("xmlns:") else "" for key, value in attrs.items()
+                                if value == W_NS and (key == "xmlns" or key.startswith("xmlns:"))), "")
+        local = self._local(name)
+        parent = self.stack[-1] if self.stack else None
+        frame = _Frame(local, pos)
+        self.stack.append(frame)
+        if parent is None:
+            return
+
+        if parent.rpr_of is not None:
+            frame.rpr_of = parent.rpr_of
+            frame.rpr_of.rpr_key.append((name, sorted((k, v) for k, v in attrs.items() if "rsid" not in k)))
+        elif parent.run is not None:
+            run = parent.run
+            frame.run_child = run
+            if local == "rPr":
+                frame.rpr_of = run
+            elif local == "t" or local in _DROPPED:
+                pass
+            elif local in _TEXT_CHILDREN and not attrs:
+                run.text.append("\t" if local == "tab" else "\n")
+            elif run.simple:
+                run.simple = False  # 图片、域代码、分页符等：run 原样保留，在此处结束当前片段
+                self._close_span(self.stack[-3])
+        elif parent.run_child is not None:
+            if parent.run_child.simple:  # w:t 内不应出现子元素
+                parent.run_child.simple = False
+                self._close_span(self.stack[-4])
+        elif local == "r":
+            frame.run = _Run(pos, self._raw(pos, self._tag_end(pos)))
+            self.runs += 1
+        elif local not in _DROPPED and local not in _MOVABLE:  # 书签的位置在结束标签处记录
+            self._close_span(parent)
+
+    def _end(self, name: str):
+        pos = self.parser.CurrentByteIndex
+        frame = self.stack.pop()
+        if frame.span is not None:
+            self._close_span(frame)
+        if not self.stack:
+            return
+        parent = self.stack[-1]
+        run = frame.run if frame.run is not None else parent.run
+        if (run is not None and run.simple and (frame.run is not None or frame.local == "rPr")) or \
+                (frame.local in _MOVABLE and parent.span is not None):
+            end = self._tag_end(frame.start)
+            if self.buf[end - self.base - 2:end - self.base] != b"/>":  # 不是空元素 (<w:r/>)：找到结束标签的末尾
+                end = self.buf.index(b">", pos - self.base) + 1 + self.base
+            if frame.run is not None:
+                run.end = end
+                if parent.span is None:
+                    parent.span = _Span(run.start)
+                parent.span.runs.append(run)
+                parent.span.end = end
+            elif frame.local == "rPr":
+                parent.run.rpr = self._raw(frame.start, end)
+            else:
+                parent.span.markers.append((frame.local, frame.start, end))
+
+    def _data(self, data: str):
+        frame = self.stack[-1] if self.stack else None
+        if frame is not None and frame.local == "t" and frame.run_child is not None:
+            frame.run_child.text.append(data)
+
+    def _close_span(self, frame: _Frame):
+        closing, frame.span = frame.span, None
+        if closing is None or not closing.text().strip():
+            return
+        closing.seal(self.buf, self.base, self.prefix)
+        if closing.start > self.cursor:
+            self.out.append(self._raw(self.cursor, closing.start))
+        self.out.append(closing)
+        self.cursor = closing.end
+        self.spans += 1
+
+
+def iter_part_pieces(source: BinaryIO, read_size: int = DOCX_STREAM_READ_SIZE) -> Iterator[Union[bytes, _Span]]:
+    """Raw byte pieces and translatable spans of one WordprocessingML part, read incrementally from `source`."""
+    rewriter = _PartRewriter()
+    while True:
+        block = source.read(read_size)
+        yield from rewriter.feed(block)
+        if not block:
+            logger.debug(f"Parsed part: {rewriter.runs} runs merged into {rewriter.spans} segments.")
+            return
+
+
+def translate_part(source: BinaryIO, target: BinaryIO, translator, target_lang: str,
+                   source_lang: Optional[str] = None) -> Optional[str]:
+    """Stream one part from `source` to `target` with its text translated. Returns an error string or None."""
+    pending = deque()  # 等待译文的片段及其后的原始字节；为空时原始字节直接写出
+
+    def segments():
+        for piece in iter_part_pieces(source):
+            if isinstance(piece, _Span):
+                pending.append(piece)
+                yield piece.source
+            elif pending:
+                pending.append(piece)
+            else:
+                target.write(piece)
+
+    for translation in iter_translated_batches(translator, segments(), target_lang, source_lang,
+                                               window=DOCX_STREAM_WINDOW or None):
+        if is_translation_error(translation):
+            return translation
+        target.write(pending.popleft().render(translation))
+        while pending and not isinstance(pending[0], _Span):
+            target.write(pending.popleft())
+    while pending:
+        target.write(pending.popleft())
+    return None
+
+
+def translate_docx_file_formatted(input_filepath: str, output_dir: str, target_lang: str, translator,
+                                  source_lang: Optional[str] = None, base: Optional[str] = None) -> str:
+    """
+    Translate a .docx keeping run formatting, styles, tables, images and everything else in the package.
+    Returns the output path, or an "Error: ..." string (no partial output file is left behind).
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    output_filepath = os.path.join(output_dir, output_filename(input_filepath, target_lang, base, ".docx"))
+    partial_filepath = output_filepath + ".part"
+
+    # 每个部件单独走一次 iter_translated_batches，进度按整个文档累计
+    part_translator = copy.copy(translator)
+    progress_callback = translator.progress_callback
+    progress = {"before": 0, "done": 0}
+
+    def part_progress(done: int, total: Optional[int]):
+        progress["done"] = progress["before"] + done
+        progress_callback(progress["done"], None)
+
+    if progress_callback is not None:
+        part_translator.progress_callback = part_progress
+
+    try:
+        with zipfile.ZipFile(input_filepath) as source:
+            parts = [info for info in source.infolist() if TRANSLATABLE_PARTS_RE.fullmatch(info.filename)]
+            if not any(info.filename == "word/document.xml" for info in parts):
+                return "Error: The file is not a Word document (word/document.xml is missing)."
+            logger.info(f"Formatted DOCX translation of '{input_filepath}' to {target_lang}: "
+                        f"{', '.join(info.filename for info in parts)}.")
+            with zipfile.ZipFile(partial_filepath, "w", zipfile.ZIP_DEFLATED) as output:
+                for info in source.infolist():
+                    entry_info = zipfile.ZipInfo(info.filename, info.date_time)
+                    entry_info.compress_type = info.compress_type
+                    entry_info.external_attr = info.external_attr
+                    translate = info in parts
+                    # 译文可能比原文长，接近 4 GiB 的部件预先使用 ZIP64
+                    force_zip64 = info.file_size * (2 if translate else 1) > zipfile.ZIP64_LIMIT
+                    with source.open(info) as entry, output.open(entry_info, "w", force_zip64=force_zip64) as target:
+                        if not translate:
+                            shutil.copyfileobj(entry, target, DOCX_STREAM_READ_SIZE)
+                            continue
+                        with span("docx_part", part=info.filename, bytes=info.file_size):
+                            error = translate_part(entry, target, part_translator, target_lang, source_lang)
+                        if error is not None:
+                            logger.error(f"Formatted DOCX translation stopped in {info.filename}: {error[:200]}")
+                            return f"Error: Translation failed in {info.filename}: {error}"
+                    progress["before"] = progress["done"]
+        os.replace(partial_filepath, output_filepath)
+        logger.info(f"Formatted DOCX translation complete: '{output_filepath}'.")
+        return output_filepath
+    except zipfile.BadZipFile as e:
+        logger.error(f"'{input_filepath}' is not a valid .docx (zip) file: {e}")
+        return f"Error: The file is not a valid .docx file: {e}"
+    except expat.ExpatError as e:
+        logger.error(f"Malformed XML in '{input_filepath}': {e}")
+        return f"Error: The document contains malformed XML: {e}"
+    except OSError as e:
+        logger.error(f"File error during formatted DOCX translation of '{input_filepath}': {e}")
+        return f"Error: File error during formatted DOCX translation: {e}"
+    finally:
+        if os.path.exists(partial_filepath):
+            os.remove(partial_filepath)
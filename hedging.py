@@ -0,0 +1,348 @@
+# hedging.py
+"""
+对冲流式请求：主请求在阈值内没有产出第一个 token 时，再发一个相同的请求 (同一目标或 HEDGE_TARGET)，
+转发先产出 token 的那个流，并关闭另一个 requests.Response。用于降低文字翻译首 token 延迟的长尾。
+"""
+import contextlib
+import contextvars
+import json
+import logging
+import queue
+import socket
+import threading
+import time
+from collections import deque
+from typing import Optional
+
+import requests
+
+from single_flight import bypass_single_flight
+from sse_relay import relay_upstream_line
+from translator import is_upstream_overload_error
+
+try:
+    from config import HEDGE_ENABLED, HEDGE_DELAY_SECONDS, HEDGE_PERCENTILE, HEDGE_INITIAL_DELAY_SECONDS, \
+                       HEDGE_MIN_SAMPLES, HEDGE_MIN_DELAY_SECONDS, HEDGE_BUDGET_RATIO, HEDGE_TARGET
+except ImportError:
+    HEDGE_ENABLED = False
+    HEDGE_DELAY_SECONDS = 0.0
+    HEDGE_PERCENTILE = 0.95
+    HEDGE_INITIAL_DELAY_SECONDS = 2.0
+    HEDGE_MIN_SAMPLES = 20
+    HEDGE_MIN_DELAY_SECONDS = 0.2
+    HEDGE_BUDGET_RATIO = 0.2
+    HEDGE_TARGET = ""
+
+logger = logging.getLogger(__name__)
+
+TTFT_WINDOW = 200  # 每个目标保留的首 token 延迟样本数
+
+
+class HedgeStats:
+    """Time-to-first-token samples and hedge counters for one (platform, model) primary target."""
+
+    def __init__(self):
+        self.ttft = deque(maxlen=TTFT_WINDOW)
+        self.requests = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.primary_wins = 0
+        self.failures = 0
+        self._lock = threading.Lock()
+
+    def hedge_delay(self) -> float:
+        if HEDGE_DELAY_SECONDS > 0:
+            return HEDGE_DELAY_SECONDS
+        with self._lock:
+            samples = sorted(self.ttft)
+        if len(samples) < HEDGE_MIN_SAMPLES:
+            return HEDGE_INITIAL_DELAY_SECONDS
+        index = min(len(samples) - 1, int(len(samples) * HEDGE_PERCENTILE))
+        return max(HEDGE_MIN_DELAY_SECONDS, samples[index])
+
+    def may_hedge(self) -> bool:
+        """Hedge budget: keep duplicated requests below HEDGE_BUDGET_RATIO of all requests."""
+        with self._lock:
+            return self.hedged < HEDGE_BUDGET_RATIO * self.requests
+
+    def record(self, field: str):
+        with self._lock:
+            setattr(self, field, getattr(self, field) + 1)
+
+    def record_ttft(self, seconds: float):
+        with self._lock:
+            self.ttft.append(seconds)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {"requests": self.requests, "hedged": self.hedged, "hedge_wins": self.hedge_wins,
+                    "primary_wins": self.primary_wins, "failures": self.failures,
+                    "hedge_rate": round(self.hedged / self.requests, 3) if self.requests else 0.0,
+                    "ttft_samples": len(self.ttft)}
+
+
+_stats = {}
+_stats_lock = threading.Lock()
+
+
+def _get_stats(translator) -> HedgeStats:
+    key = f"{translator.platform_id}:{translator.model}"
+    with _stats_lock:
+        if key not in _stats:
+            _stats[key] = HedgeStats()
+        return _stats[key]
+
+
+def hedging_snapshot() -> dict:
+    with _stats_lock:
+        items = list(_stats.items())
+    return {key: dict(stats.snapshot(), hedge_delay=round(stats.hedge_delay(), 3)) for key, stats in items}
+
+
+_secondary = None
+_secondary_lock = threading.Lock()
+
+
+def get_hedge_target(primary):
+    """Translator used for the duplicate request: HEDGE_TARGET if configured, else the primary itself."""
+    global _secondary
+    if not HEDGE_TARGET.strip():
+        return primary
+    with _secondary_lock:
+        if _secondary is None:
+            from platforms import get_translator, resolve_platform_settings # 延迟导入，避免循环依赖
+            from router import parse_route_spec
+            platform, model, _ = parse_route_spec(HEDGE_TARGET)[0]
+            api_key, base_url, resolved_model, error = resolve_platform_settings(platform, "", "", model or "")
+            if error:
+                raise ValueError(f"HEDGE_TARGET '{HEDGE_TARGET}': {error}")
+            _secondary = get_translator(platform, api_key, base_url, resolved_model)
+        return _secondary
+
+
+def _first_token_kind(line: bytes, platform_id: str) -> Optional[str]:
+    """'token' for a line carrying output, 'error' for an in-stream error, None for anything else (role deltas, comments)."""
+    frame, _ = relay_upstream_line(line, platform_id)
+    if frame is None:
+        return None
+    return "error" if frame.startswith('data: {"error"') else "token"
+
+
+def _is_overload_frame(line: bytes) -> bool:
+    """Whether an error line carries a 429/5xx that the rate limiter has already retried (see _yield_error_stream)."""
+    try:
+        error = json.loads(line.decode("utf-8", errors="replace").partition("data:")[2]).get("error")
+    except (ValueError, AttributeError):
+        return False
+    return is_upstream_overload_error(error.get("message") if isinstance(error, dict) else error)
+
+
+def _abort(response: requests.Response):
+    """
+    Interrupt a streaming response whose reader thread may be blocked waiting for upstream bytes.
+    Response.close() from another thread would wait for that read to return, so shut the socket down instead;
+    the reader then fails fast and closes the response itself.
+    """
+    raw = getattr(response.raw, "_raw", response.raw) # 缓存包装的 _RecordingRaw
+    sock = getattr(getattr(raw, "_connection", None), "sock", None)
+    if sock is None:
+        response.close()
+        return
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass # 连接已经关闭
+
+
+class HedgedStream:
+    """
+    一次对冲请求。对外表现得像流式 requests.Response：iter_lines() 产出胜出流的原始上游行，close() 关闭所有连接。
+    每个尝试在自己的线程中读取上游，行通过队列交给调用者；胜出者确定前的行先缓冲。
+    """
+
+    def __init__(self, primary, text: str, target_lang: str, source_lang: Optional[str] = None, secondary=None):
+        self.attempts = [primary]
+        self.secondary = secondary or primary
+        self.text = text
+        self.target_lang = target_lang
+        self.source_lang = source_lang
+        self.platform_id = primary.platform_id
+        self.stats = _get_stats(primary)
+        self._queue = queue.Queue()
+        self._held = None  # wait_readable() 已取出、尚未交给 iter_lines 的事件
+        self._responses = {}
+        self._cancelled = set()
+        self._lock = threading.Lock()
+        # 创建时的上下文 (tracing 的 span 和监听器、路由器的限流重试开关)，每个尝试的读取线程在它的副本中运行
+        self._context = contextvars.copy_context()
+        self.stats.record("requests")
+        self._start(0)
+
+    def _start(self, index: int):
+        threading.Thread(target=self._context.copy().run, args=(self._read, index, time.monotonic()), daemon=True,
+                         name=f"hedge-{self.platform_id}-{index}").start()
+
+    def _read(self, index: int, started: float):
+        translator = self.attempts[index]
+        try:
+            # 对冲请求必须真正发到上游，不能挂到主请求的 single-flight 上
+            with bypass_single_flight() if index > 0 else contextlib.nullcontext():
+                response = translator.translate(self.text, self.target_lang, self.source_lang, stream=True)
+            if not isinstance(response, requests.Response):
+                # 翻译器把错误包装成 SSE 错误帧的生成器 (见 _yield_error_stream)，按上游错误行转发
+                frames = response if isinstance(response, str) else "".join(response)
+                for frame in frames.splitlines():
+                    if frame.strip():
+                        self._queue.put((index, "line", frame.strip().encode("utf-8")))
+                self._queue.put((index, "end", "no stream returned"))
+                return
+            with self._lock:
+                if index in self._cancelled:
+                    response.close()
+                    return
+                self._responses[index] = response
+            try:
+                seen_token = False
+                for line in response.iter_lines():
+                    if index in self._cancelled:
+                        return
+                    if not line:
+                        continue
+                    if not seen_token and _first_token_kind(line, translator.platform_id) == "token":
+                        seen_token = True
+                        self.stats.record_ttft(time.monotonic() - started)
+                    self._queue.put((index, "line", line))
+                self._queue.put((index, "end", None))
+            finally:
+                response.close() # 在读取线程中关闭；其他线程只负责中断 socket
+        except Exception as e:
+            if index not in self._cancelled:
+                self._queue.put((index, "end", f"{type(e).__name__} - {e}"))
+
+    def _cancel(self, index: int):
+        with self._lock:
+            self._cancelled.add(index)
+            response = self._responses.get(index)
+        if response is not None:
+            _abort(response)
+
+    def iter_lines(self):
+        buffers = {0: []}
+        alive = {0}
+        winner = None
+        hedged = False
+        deadline = time.monotonic() + self.stats.hedge_delay()
+        try:
+            while True:
+                timeout = None if (winner is not None or hedged) else max(0.0, deadline - time.monotonic())
+                try:
+                    index, kind, payload = self._next_event(timeout)
+                except queue.Empty:
+                    if self.stats.may_hedge():
+                        self._hedge(buffers, alive, "no first token after threshold")
+                    hedged = True # 预算用尽时也不再等待阈值
+                    continue
+
+                if winner is not None:
+                    if index != winner:
+                        continue
+                    if kind == "line":
+                        yield payload
+                        continue
+                    if payload:
+                        raise requests.exceptions.ConnectionError(payload)
+                    return
+
+                if index not in alive:
+                    continue # 已判定失败的尝试的后续事件
+                if kind == "line":
+                    buffers[index].append(payload)
+                    token_kind = _first_token_kind(payload, self.attempts[index].platform_id)
+                    if token_kind == "error":
+                        kind, payload = "end", "error in stream"
+                    elif token_kind == "token":
+                        winner = self._declare_winner(index, alive)
+                        yield from buffers.pop(index)
+                        continue
+                    else:
+                        continue
+
+                # kind == "end" 且还没有胜出者
+                alive.discard(index)
+                self._cancel(index)
+                if payload is None:
+                    # 流正常结束但没有任何 token (例如空译文)：直接采用
+                    winner = self._declare_winner(index, alive)
+                    yield from buffers.pop(index)
+                    return
+                error_lines = buffers.pop(index, [])
+                logger.warning(f"Hedged attempt {index} for {self.platform_id} failed before first token: {str(payload)[:200]}")
+                # 429/5xx 已由限流器重试过，同一目标上的对冲只会是又一次重试
+                overloaded = self.secondary is self.attempts[0] and any(_is_overload_frame(l) for l in error_lines)
+                if not hedged and len(self.attempts) == 1 and not overloaded:
+                    # 主请求在阈值前就失败了：立即发出第二个请求，不必再等
+                    self._hedge(buffers, alive, "primary failed")
+                    hedged = True
+                    continue
+                if not alive:
+                    self.stats.record("failures")
+                    if error_lines:
+                        yield from error_lines # 原样转发最后一个尝试的上游错误行
+                    else:
+                        yield f"data: {json.dumps({'error': {'message': payload}})}".encode("utf-8")
+                    return
+        finally:
+            self.close()
+
+    def _next_event(self, timeout: Optional[float]):
+        if self._held is not None:
+            event, self._held = self._held, None
+            return event
+        return self._queue.get(timeout=timeout)
+
+    def wait_readable(self, timeout: float) -> bool:
+        """True once an event from the attempt threads is waiting (sse_relay.iter_relay_frames' flush timer)."""
+        if self._held is None:
+            try:
+                self._held = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                return False
+        return True
+
+    def iter_content(self, chunk_size=None):
+        """Raw-bytes view of iter_lines() for relays that parse SSE incrementally (chunk_size is ignored)."""
+        for line in self.iter_lines():
+            yield line + b"\n"
+
+    def _hedge(self, buffers, alive, reason: str):
+        index = len(self.attempts)
+        self.attempts.append(self.secondary)
+        buffers[index] = []
+        alive.add(index)
+        self.stats.record("hedged")
+        logger.info(f"Hedging stream request for {self.platform_id} ({reason}); duplicate sent to "
+                    f"{self.secondary.platform_id}:{self.secondary.model}.")
+        self._start(index)
+
+    def _declare_winner(self, index: int, alive) -> int:
+        self.stats.record("hedge_wins" if index > 0 else "primary_wins")
+        for other in list(alive):
+            if other != index:
+                self._cancel(other)
+        alive.clear()
+        if len(self.attempts) > 1:
+            logger.info(f"Hedged stream for {self.platform_id}: attempt {index} produced the first token.")
+        return index
+
+    def close(self):
+        for index in range(len(self.attempts)):
+            self._cancel(index)
+
+
+def start_stream(translator, text: str, target_lang: str, source_lang: Optional[str] = None, hedge: Optional[bool] = None):
+    """Entry point for streaming text translation: a HedgedStream when hedging is on, else the plain upstream response."""
+    if hedge is None:
+        hedge = HEDGE_ENABLED
+    if not hedge:
+        return translator.translate(text, target_lang, source_lang, stream=True)
+    return HedgedStream(translator, text, target_lang, source_lang, secondary=get_hedge_target(translator))
@@ -0,0 +1,120 @@
+# http_pool.py
+import atexit
+import logging
+import threading
+from typing import Dict, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util.retry import Retry
+
+from tracing import span
+
+try:
+    from config import HTTP_POOL_CONNECTIONS, HTTP_POOL_MAXSIZE, HTTP_MAX_RETRIES, \
+                       HTTP_BACKOFF_FACTOR, HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT, \
+                       HTTP_STREAM_READ_TIMEOUT
+except ImportError:
+    HTTP_POOL_CONNECTIONS = 10
+    HTTP_POOL_MAXSIZE = 32
+    HTTP_MAX_RETRIES = 2
+    HTTP_BACKOFF_FACTOR = 0.5
+    HTTP_CONNECT_TIMEOUT = 10
+    HTTP_READ_TIMEOUT = 60
+    HTTP_STREAM_READ_TIMEOUT = 180
+
+logger = logging.getLogger(__name__)
+
+# 进程级别的 Session 池: (base_url, platform_id) -> requests.Session
+# 跨调用、跨 Flask 请求复用 TCP/TLS 连接，避免每个 chunk 都重新握手。
+_sessions: Dict[Tuple[str, str], requests.Session] = {}
+_sessions_lock = threading.Lock()
+
+
+class _TracedHTTPConnection(HTTPConnection):
+    def connect(self):
+        with span("connect", host=self.host, port=self.port): # DNS 解析 + TCP 握手；复用 keep-alive 连接时不会出现
+            super().connect()
+
+
+class _TracedHTTPSConnection(HTTPSConnection):
+    def connect(self):
+        with span("connect", host=self.host, port=self.port, tls=True): # DNS 解析 + TCP + TLS 握手
+            super().connect()
+
+
+class _TracedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TracedHTTPConnection
+
+
+class _TracedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TracedHTTPSConnection
+
+
+class _PooledAdapter(HTTPAdapter):
+    """HTTPAdapter whose connections report a tracing span when they are (re)established."""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {"http": _TracedHTTPConnectionPool, "https": _TracedHTTPSConnectionPool}
+
+
+def _build_session() -> requests.Session:
+    """Create a Session whose adapter keeps a bounded pool of keep-alive connections."""
+    retry = Retry(
+        total=HTTP_MAX_RETRIES,
+        connect=HTTP_MAX_RETRIES,
+        read=0,  # 读阶段失败时请求可能已被上游处理 (并计费)，不自动重发
+        status=0,  # 429/5xx 的重试由 rate_limiter.py 负责 (Retry-After、退避、AIMD 窗口)
+        allowed_methods=frozenset({"POST"}),
+        backoff_factor=HTTP_BACKOFF_FACTOR,
+        raise_on_status=False,
+    )
+    adapter = _PooledAdapter(
+        pool_connections=HTTP_POOL_CONNECTIONS,
+        pool_maxsize=HTTP_POOL_MAXSIZE,
+        max_retries=retry,
+    )
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def get_session(base_url: str, platform_id: str) -> requests.Session:
+    """Return the shared Session for a (base_url, platform_id) pair, creating it on first use."""
+    key = (base_url.rstrip('/'), platform_id)
+    session = _sessions.get(key)
+    if session is not None:
+        return session
+    with _sessions_lock:
+        session = _sessions.get(key)
+        if session is None:
+            session = _build_session()
+            _sessions[key] = session
+            logger.info(f"Created pooled HTTP session for platform: {platform_id}, Base URL: {key[0]} (pool maxsize {HTTP_POOL_MAXSIZE}, retries {HTTP_MAX_RETRIES})")
+        return session
+
+
+def get_timeout(stream: bool) -> Tuple[float, float]:
+    """(connect, read) timeout tuple for the given request mode."""
+    return (HTTP_CONNECT_TIMEOUT, HTTP_STREAM_READ_TIMEOUT if stream else HTTP_READ_TIMEOUT)
+
+
+def close_all_sessions():
+    """Close every pooled Session. Registered with atexit; safe to call more than once."""
+    with _sessions_lock:
+        sessions = list(_sessions.items())
+        _sessions.clear()
+    for (base_url, platform_id), session in sessions:
+        try:
+            session.close()
+        except Exception as e:
+            logger.warning(f"Error closing HTTP session for {platform_id} ({base_url}): {e}")
+    if sessions:
+        logger.info(f"Closed {len(sessions)} pooled HTTP session(s).")
+
+
+atexit.register(close_all_sessions)
@@ -0,0 +1,180 @@
+# incremental.py
+"""
+修订版文档的增量翻译：同一份文档的 v2、v3… 只把新增或修改的片段发送到上游。
+
+片段清单 (segment manifest) 是一个 JSONL 文件：首行记录生成它的设置 (平台、模型、语言、文件类型…)，
+其余每行 {"h": sha256(片段原文), "t": 译文}。以增量模式翻译新版本时：
+
+- 指纹与上一版清单相同的片段直接复用原译文 (按原位置写回)，其余片段照常翻译；
+- 本次用到的全部片段写入新清单，成功后原子替换旧清单，所以清单只包含最新版本的片段，不会无限增长；
+  翻译失败时旧清单保持不变；
+- .txt 的分块边界由段落内容决定：指纹满足 is_chunk_anchor 的段落之后强制断开，插入或删除段落只影响附近的分块，
+  后面的分块仍与上一版对齐 (否则按 token 预算装箱的分块会整体错位，全部需要重新翻译)。
+
+IncrementalManifest 实现了 checkpoints.ChunkJournal 的 get / record 接口，通过 translator.journal 接入
+chunk_executor，并把调用转发给检查点日志，所以增量模式下断点续传照常工作。
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+from typing import Optional
+
+from checkpoints import _text_hash
+
+try:
+    from config import INCREMENTAL_DIR, INCREMENTAL_ANCHOR_PARAGRAPHS
+except ImportError:
+    INCREMENTAL_DIR = os.path.join("cache", "incremental")
+    INCREMENTAL_ANCHOR_PARAGRAPHS = 8
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_VERSION = 1
+
+
+def is_chunk_anchor(paragraph: str) -> bool:
+    """Content-defined chunk boundary: about one paragraph in INCREMENTAL_ANCHOR_PARAGRAPHS ends a chunk."""
+    return int(_text_hash(paragraph.strip())[:8], 16) % max(1, INCREMENTAL_ANCHOR_PARAGRAPHS) == 0
+
+
+class IncrementalManifest:
+    """
+    Translation reuse against the manifest of a previous run, plus the manifest for this run.
+    Only the hash -> (offset, length) index of the previous manifest is kept in memory.
+    """
+
+    anchor = staticmethod(is_chunk_anchor)  # text_stream_translator 据此切分分块
+
+    def __init__(self, path: str, settings: dict, journal=None):
+        self.path = path
+        self.settings = settings
+        self.journal = journal  # 检查点日志 (可选)：续传时优先使用
+        self.reused = 0
+        self.translated = 0
+        self.resumed = 0
+        self._previous_index = {}
+        self._previous_file = None
+        self._written = set()
+        self._lock = threading.Lock()
+        self._load_previous()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._next_path = path + ".next"
+        self._file = open(self._next_path, 'wb')
+        self._file.write(self._line({"manifest": MANIFEST_VERSION, "settings": settings}))
+
+    @staticmethod
+    def _line(entry: dict) -> bytes:
+        return (json.dumps(entry, ensure_ascii=False) + "\n").encode('utf-8')
+
+    def _load_previous(self):
+        if not os.path.exists(self.path):
+            logger.info(f"Incremental manifest {self.path} not found: every segment will be translated.")
+            return
+        self._previous_file = open(self.path, 'rb')
+        header = None
+        offset = 0
+        for line in self._previous_file:
+            try:
+                entry = json.loads(line)
+                if header is None:
+                    header = entry
+                    if header.get("manifest") != MANIFEST_VERSION or header.get("settings") != self.settings:
+                        logger.warning(f"Incremental manifest {self.path} was made with different settings "
+                                       f"({header.get('settings')}); every segment will be translated.")
+                        break
+                else:
+                    self._previous_index[entry["h"]] = (offset, len(line))
+            except (ValueError, KeyError, AttributeError):
+                logger.warning(f"Ignoring damaged entry at byte {offset} of incremental manifest {self.path}")
+            offset += len(line)
+        logger.info(f"Incremental manifest {self.path}: {len(self._previous_index)} segment(s) from the previous run.")
+
+    def _write(self, text_hash: str, translation: str):
+        with self._lock:
+            if self._file.closed or text_hash in self._written:
+                return
+            self._written.add(text_hash)
+            self._file.write(self._line({"h": text_hash, "t": translation}))
+
+    def get(self, chunk: str) -> Optional[str]:
+        text_hash = _text_hash(chunk)
+        if self.journal is not None:
+            result = self.journal.get(chunk)
+            if result is not None:
+                with self._lock:
+                    self.resumed += 1
+                self._write(text_hash, result)
+                return result
+        with self._lock:
+            location = self._previous_index.get(text_hash)
+            if location is None:
+                return None
+            self._previous_file.seek(location[0])
+            line = self._previous_file.read(location[1])
+            self.reused += 1
+        result = json.loads(line)["t"]
+        self._write(text_hash, result)
+        return result
+
+    def record(self, chunk: str, translation: str):
+        with self._lock:
+            self.translated += 1
+        self._write(_text_hash(chunk), translation)
+        if self.journal is not None:
+            self.journal.record(chunk, translation)
+
+    def summary(self) -> dict:
+        with self._lock:
+            return {"segments": self.reused + self.translated + self.resumed, "reused": self.reused,
+                    "translated": self.translated, "resumed": self.resumed, "manifest": self.path}
+
+    def _close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
+            if self._previous_file is not None:
+                self._previous_file.close()
+
+    def commit(self) -> dict:
+        """The translation succeeded: this run's manifest replaces the previous one. Returns summary()."""
+        self._close()
+        os.replace(self._next_path, self.path)
+        summary = self.summary()
+        logger.info(f"Incremental translation: {format_incremental_summary(summary)}; manifest saved to {self.path}.")
+        return summary
+
+    def abort(self):
+        """The translation failed: keep the previous manifest for the next attempt."""
+        self._close()
+        try:
+            os.remove(self._next_path)
+        except OSError:
+            pass
+
+
+def open_incremental_manifest(path: str, translator, target_lang: str, source_lang: Optional[str] = None,
+                              journal=None, **settings) -> IncrementalManifest:
+    """
+    Open the manifest at `path` for an incremental run. A previous manifest is only reused when it was made with the
+    same platform, model, languages and `settings` (e.g. file_type, translation_format).
+    """
+    return IncrementalManifest(path, {
+        "platform": translator.platform_id, "model": translator.model, "target_lang": target_lang,
+        "source_lang": source_lang or "", **settings,
+    }, journal)
+
+
+def incremental_manifest_path(name: str, **settings) -> str:
+    """Manifest location under INCREMENTAL_DIR for a document name (all versions upload under the same name)."""
+    key = json.dumps({"name": name, **settings}, sort_keys=True)
+    stem = re.sub(r"[^\w\-]+", "_", os.path.splitext(os.path.basename(name))[0]).strip("_")[:60] or "document"
+    return os.path.join(INCREMENTAL_DIR, f"{stem}-{hashlib.sha256(key.encode('utf-8')).hexdigest()[:16]}.jsonl")
+
+
+def format_incremental_summary(summary: dict) -> str:
+    return (f"{summary['reused']} of {summary['segments']} segment(s) reused from the previous version, "
+            f"{summary['translated']} translated, {summary['resumed']} resumed from checkpoint")
@@ -0,0 +1,349 @@
+# jobs.py
+import contextlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional
+
+try:
+    from config import JOB_WORKERS, JOB_RETENTION_SECONDS, JOB_STORE_DB, JOB_STORE_POLL_SECONDS
+except ImportError:
+    JOB_WORKERS = 2
+    JOB_RETENTION_SECONDS = 3600
+    JOB_STORE_DB = os.path.join("cache", "jobs.sqlite3")
+    JOB_STORE_POLL_SECONDS = 0.5
+
+logger = logging.getLogger(__name__)
+
+# 任务状态
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+FINISHED_STATES = (SUCCEEDED, FAILED)
+
+# 运行任务的进程已退出 (重启、崩溃或优雅关闭时仍在排队) 时报告的错误；检查点还在，可以续传
+INTERRUPTED_ERROR = "Job was interrupted because the server stopped. Resume it to continue from its checkpoint."
+
+
+class JobFailed(Exception):
+    """Raised by a job function to fail the job with a user-facing message."""
+
+
+class JobStore:
+    """
+    线程安全的内存任务存储。每个任务保存状态、进度和一个有序事件列表，
+    事件列表供 SSE 端点按序号 (seq) 增量读取。
+    """
+
+    def __init__(self, retention_seconds: int = JOB_RETENTION_SECONDS):
+        self.retention_seconds = retention_seconds
+        self._jobs = {}
+        self._events = {}
+        self._cond = threading.Condition()
+
+    def create(self, meta: Optional[dict] = None, job_id: Optional[str] = None) -> dict:
+        """New job record; passing an existing job_id (e.g. when resuming) replaces that job's record and events."""
+        job_id = job_id or uuid.uuid4().hex
+        job = {
+            "job_id": job_id,
+            "status": QUEUED,
+            "created_at": time.time(),
+            "started_at": None,
+            "finished_at": None,
+            "progress": {"done": 0, "total": None},
+            "result": None,
+            "error": None,
+            "meta": meta or {},
+        }
+        with self._cond:
+            self._purge_expired()
+            self._jobs[job_id] = job
+            self._events[job_id] = []
+        self.add_event(job_id, "status", status=QUEUED)
+        return dict(job)
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self._cond:
+            job = self._jobs.get(job_id)
+            return dict(job, progress=dict(job["progress"])) if job else None
+
+    def update(self, job_id: str, **fields):
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                job.update(fields)
+
+    def add_event(self, job_id: str, event_type: str, **data) -> int:
+        with self._cond:
+            events = self._events.get(job_id)
+            if events is None:
+                return -1
+            seq = len(events) + 1
+            events.append(dict(data, type=event_type, seq=seq, job_id=job_id))
+            self._cond.notify_all()
+            return seq
+
+    def events_after(self, job_id: str, seq: int, timeout: Optional[float] = None) -> List[dict]:
+        """Events with sequence number > seq; blocks up to `timeout` seconds when none are available yet."""
+        with self._cond:
+            self._cond.wait_for(lambda: len(self._events.get(job_id, ())) > seq or job_id not in self._events,
+                                timeout=timeout)
+            return list(self._events.get(job_id, ())[seq:])
+
+    def _purge_expired(self):
+        """Forget finished jobs older than retention_seconds. Caller must hold the lock."""
+        cutoff = time.time() - self.retention_seconds
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job["status"] in FINISHED_STATES and job["finished_at"] and job["finished_at"] < cutoff]
+        for job_id in expired:
+            del self._jobs[job_id]
+            del self._events[job_id]
+        if expired:
+            logger.info(f"Purged {len(expired)} expired job(s) from the job store.")
+
+
+def _process_alive(pid: int) -> bool:
+    if os.name == "nt" or pid == os.getpid():
+        return True  # Windows 上 os.kill(pid, 0) 会发送 CTRL_C_EVENT，不做检查
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True  # 进程存在但属于其他用户
+    return True
+
+
+class SQLiteJobStore(JobStore):
+    """
+    与 JobStore 接口相同，但任务和事件保存在 SQLite 中 (WAL 模式)，多个服务进程共享：
+    任何 worker 都能查询任务状态、推送事件流和续传。同一进程内的等待者由条件变量立即唤醒，
+    其他进程写入的事件通过每 poll_seconds 查询一次获得。
+    由已退出的进程拥有、却仍处于排队/运行状态的任务在读取时被标记为失败 (可续传)。
+    每个进程启动时登记 (pid, token)，因此重启后 pid 被复用 (例如容器中) 也不会把旧任务当作仍在运行。
+    """
+
+    def __init__(self, db_path: str = JOB_STORE_DB, retention_seconds: int = JOB_RETENTION_SECONDS,
+                 poll_seconds: float = JOB_STORE_POLL_SECONDS):
+        super().__init__(retention_seconds)
+        self.db_path = db_path
+        self.poll_seconds = poll_seconds
+        self.process_token = uuid.uuid4().hex
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, timeout=30, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")  # 允许多个进程/线程同时读
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " job_id TEXT PRIMARY KEY, data TEXT NOT NULL, owner_pid INTEGER NOT NULL, owner_token TEXT NOT NULL,"
+            " finished_at REAL)"
+        )
+        self._conn.execute("CREATE TABLE IF NOT EXISTS job_processes (pid INTEGER PRIMARY KEY, token TEXT NOT NULL)")
+        self._conn.execute("INSERT OR REPLACE INTO job_processes (pid, token) VALUES (?, ?)",
+                           (os.getpid(), self.process_token))
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS job_events ("
+            " job_id TEXT NOT NULL, seq INTEGER NOT NULL, data TEXT NOT NULL, PRIMARY KEY (job_id, seq))"
+        )
+        logger.info(f"Job store: {db_path} (shared between server processes).")
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        """BEGIN IMMEDIATE takes the write lock up front, so read-modify-write is atomic across processes."""
+        with self._cond:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def _insert_event(self, conn, job_id: str, event_type: str, data: dict) -> int:
+        seq = conn.execute("SELECT COALESCE(MAX(seq), 0) + 1 FROM job_events WHERE job_id = ?", (job_id,)).fetchone()[0]
+        conn.execute("INSERT INTO job_events (job_id, seq, data) VALUES (?, ?, ?)",
+                     (job_id, seq, json.dumps(dict(data, type=event_type, seq=seq, job_id=job_id))))
+        self._cond.notify_all()
+        return seq
+
+    def create(self, meta: Optional[dict] = None, job_id: Optional[str] = None) -> dict:
+        job_id = job_id or uuid.uuid4().hex
+        job = {
+            "job_id": job_id,
+            "status": QUEUED,
+            "created_at": time.time(),
+            "started_at": None,
+            "finished_at": None,
+            "progress": {"done": 0, "total": None},
+            "result": None,
+            "error": None,
+            "meta": meta or {},
+        }
+        with self._transaction() as conn:
+            self._purge_expired()
+            conn.execute("INSERT OR REPLACE INTO jobs (job_id, data, owner_pid, owner_token, finished_at)"
+                         " VALUES (?, ?, ?, ?, NULL)", (job_id, json.dumps(job), os.getpid(), self.process_token))
+            conn.execute("DELETE FROM job_events WHERE job_id = ?", (job_id,))
+            self._insert_event(conn, job_id, "status", {"status": QUEUED})
+        return dict(job)
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self._cond:
+            row = self._conn.execute(
+                "SELECT data, owner_pid, owner_token = (SELECT token FROM job_processes WHERE pid = owner_pid)"
+                " FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = json.loads(row[0])
+        if job["status"] in FINISHED_STATES or (row[2] and _process_alive(row[1])):
+            return job
+        with self._transaction() as conn:  # 重新读取：其他进程可能已经处理过
+            row = conn.execute("SELECT data FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+            if row is None:
+                return None
+            job = json.loads(row[0])
+            if job["status"] not in FINISHED_STATES:
+                logger.warning(f"Job {job_id} belonged to a server process that is gone; marking it as interrupted.")
+                job.update(status=FAILED, finished_at=time.time(), error=INTERRUPTED_ERROR)
+                conn.execute("UPDATE jobs SET data = ?, finished_at = ? WHERE job_id = ?",
+                             (json.dumps(job), job["finished_at"], job_id))
+                self._insert_event(conn, job_id, "error", {"status": FAILED, "error": INTERRUPTED_ERROR})
+        return job
+
+    def update(self, job_id: str, **fields):
+        with self._transaction() as conn:
+            row = conn.execute("SELECT data FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+            if row is not None:
+                job = json.loads(row[0])
+                job.update(fields)
+                conn.execute("UPDATE jobs SET data = ?, finished_at = ? WHERE job_id = ?",
+                             (json.dumps(job), job["finished_at"], job_id))
+
+    def add_event(self, job_id: str, event_type: str, **data) -> int:
+        with self._transaction() as conn:
+            if conn.execute("SELECT 1 FROM jobs WHERE job_id = ?", (job_id,)).fetchone() is None:
+                return -1
+            return self._insert_event(conn, job_id, event_type, data)
+
+    def events_after(self, job_id: str, seq: int, timeout: Optional[float] = None) -> List[dict]:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while True:
+                rows = self._conn.execute("SELECT data FROM job_events WHERE job_id = ? AND seq > ? ORDER BY seq",
+                                          (job_id, seq)).fetchall()
+                if rows:
+                    return [json.loads(row[0]) for row in rows]
+                if self._conn.execute("SELECT 1 FROM jobs WHERE job_id = ?", (job_id,)).fetchone() is None:
+                    return []
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return []
+                self._cond.wait(self.poll_seconds if remaining is None else min(self.poll_seconds, remaining))
+
+    def _purge_expired(self):
+        """Caller must hold the write transaction."""
+        cutoff = time.time() - self.retention_seconds
+        expired = [row[0] for row in self._conn.execute(
+            "SELECT job_id FROM jobs WHERE finished_at IS NOT NULL AND finished_at < ?", (cutoff,))]
+        for job_id in expired:
+            self._conn.execute("DELETE FROM jobs WHERE job_id = ?", (job_id,))
+            self._conn.execute("DELETE FROM job_events WHERE job_id = ?", (job_id,))
+        if expired:
+            logger.info(f"Purged {len(expired)} expired job(s) from the job store.")
+
+
+def open_job_store(db_path: str = JOB_STORE_DB) -> JobStore:
+    """SQLiteJobStore when a path is configured (shared by all server processes), else the in-memory JobStore."""
+    return SQLiteJobStore(db_path) if db_path else JobStore()
+
+
+class JobReporter:
+    """Handed to a running job function so it can report progress without knowing about the store."""
+
+    def __init__(self, store: JobStore, job_id: str):
+        self.store = store
+        self.job_id = job_id
+
+    def progress(self, done: int, total: Optional[int] = None, message: Optional[str] = None):
+        self.store.update(self.job_id, progress={"done": done, "total": total})
+        event = {"done": done, "total": total}
+        if message:
+            event["message"] = message
+        self.store.add_event(self.job_id, "progress", **event)
+
+    def info(self, message: str):
+        self.store.add_event(self.job_id, "info", message=message)
+
+
+class JobManager:
+    """本地工作线程池 + 任务存储。submit() 立即返回 job id，任务在后台执行。"""
+
+    def __init__(self, store: Optional[JobStore] = None, max_workers: int = JOB_WORKERS):
+        self.store = store or JobStore()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._queued = {}  # future -> job_id，优雅关闭时用于把尚未开始的任务标记为中断
+        self._lock = threading.Lock()
+        self._draining = False
+        logger.info(f"Job manager started with {max_workers} worker(s).")
+
+    def submit(self, func: Callable[[JobReporter], dict], meta: Optional[dict] = None, job_id: Optional[str] = None) -> str:
+        """Queue func(reporter) -> result dict. Raising JobFailed (or anything else) fails the job."""
+        job = self.store.create(meta, job_id)
+        with self._lock:
+            if self._draining:
+                self._finish_failed(job["job_id"], INTERRUPTED_ERROR)
+                return job["job_id"]
+            future = self._executor.submit(self._run, job["job_id"], func)
+            self._queued[future] = job["job_id"]
+        future.add_done_callback(self._forget)
+        logger.info(f"Job {job['job_id']} queued. Meta: {meta}")
+        return job["job_id"]
+
+    def _forget(self, future):
+        with self._lock:
+            self._queued.pop(future, None)
+
+    def drain(self):
+        """
+        Graceful shutdown: stop taking jobs and fail the queued ones as interrupted (resumable from any server
+        process); running jobs keep going until they finish or the process is stopped.
+        """
+        with self._lock:
+            self._draining = True
+            queued = list(self._queued.items())
+        cancelled = [job_id for future, job_id in queued if future.cancel()]  # 只有尚未开始的任务能取消
+        for job_id in cancelled:
+            self._finish_failed(job_id, INTERRUPTED_ERROR)
+        logger.info(f"Job manager draining: {len(cancelled)} queued job(s) cancelled.")
+
+    def _run(self, job_id: str, func: Callable[[JobReporter], dict]):
+        self.store.update(job_id, status=RUNNING, started_at=time.time())
+        self.store.add_event(job_id, "status", status=RUNNING)
+        try:
+            result = func(JobReporter(self.store, job_id)) or {}
+        except JobFailed as e:
+            self._finish_failed(job_id, str(e))
+        except Exception as e:
+            logger.error(f"Job {job_id} crashed: {type(e).__name__} - {e}\n{traceback.format_exc()}")
+            self._finish_failed(job_id, f"Server error during job: {type(e).__name__} - {e}")
+        else:
+            self.store.update(job_id, status=SUCCEEDED, finished_at=time.time(), result=result)
+            self.store.add_event(job_id, "done", status=SUCCEEDED, **result)
+            logger.info(f"Job {job_id} succeeded. Result: {result}")
+
+    def _finish_failed(self, job_id: str, error_message: str):
+        self.store.update(job_id, status=FAILED, finished_at=time.time(), error=error_message)
+        self.store.add_event(job_id, "error", status=FAILED, error=error_message)
+        logger.error(f"Job {job_id} failed: {error_message}")
+
+    def shutdown(self, wait: bool = True):
+        self._executor.shutdown(wait=wait)
@@ -0,0 +1,191 @@
+# jsonl_translator.py
+"""
+JSONL 记录的流式字段翻译：逐行读取 (文件或 stdin)，只翻译指定字段，
+通过有界窗口并发处理，记录一完成就写出 (可选严格保持输入顺序)。
+在途记录数不超过窗口大小，内存占用与输入大小无关，可处理数 GB 的输入。
+每条输出记录附带 _translation 元数据：行号、耗时、token 用量和字段错误。
+"""
+import json
+import logging
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import IO, Iterable, Iterator, List, Optional, Tuple
+
+from chunk_executor import _translate_with_retries
+from translator import is_translation_error, last_call_usage
+
+try:
+    from config import JSONL_WORKERS, JSONL_WINDOW, JSONL_META_FIELD, CHUNK_MAX_RETRIES
+except ImportError:
+    JSONL_WORKERS = 8
+    JSONL_WINDOW = 0
+    JSONL_META_FIELD = "_translation"
+    CHUNK_MAX_RETRIES = 2
+
+logger = logging.getLogger(__name__)
+
+# 每处理这么多条记录记录一次进度日志
+LOG_EVERY_RECORDS = 1000
+
+
+def parse_field_paths(fields: str) -> List[Tuple[str, ...]]:
+    """'title,body,meta.summary' -> [('title',), ('body',), ('meta', 'summary')]"""
+    paths = [tuple(field.strip().split(".")) for field in fields.split(",") if field.strip()]
+    if not paths or any("" in path for path in paths):
+        raise ValueError(f"Invalid field list '{fields}'. Use comma-separated names, with dots for nested fields.")
+    return paths
+
+
+def _resolve(record, path: Tuple[str, ...]):
+    """Return (container, key) holding the value at `path`, or (None, None) if the path does not exist."""
+    container = record
+    for key in path[:-1]:
+        if not isinstance(container, dict) or not isinstance(container.get(key), dict):
+            return None, None
+        container = container[key]
+    if not isinstance(container, dict) or path[-1] not in container:
+        return None, None
+    return container, path[-1]
+
+
+def _add_usage(total: dict, usage: Optional[dict]):
+    if not usage:
+        return
+    for name in ("prompt_tokens", "completion_tokens"):
+        total[name] += int(usage.get(name) or 0)
+    total["estimated"] = total["estimated"] or bool(usage.get("estimated"))
+
+
+def translate_record(record, line_number: int, field_paths: List[Tuple[str, ...]], translator, target_lang: str,
+                     source_lang: Optional[str] = None, max_retries: int = CHUNK_MAX_RETRIES) -> dict:
+    """
+    Translate the selected string fields (or lists of strings) of one record in place and attach metadata.
+    A field that fails keeps its original value and is listed under errors; the record is still emitted.
+    """
+    started = time.monotonic()
+    usage = {"prompt_tokens": 0, "completion_tokens": 0, "estimated": False}
+    errors = []
+    translated_fields = 0
+    if isinstance(record, dict):
+        for path in field_paths:
+            container, key = _resolve(record, path)
+            if container is None:
+                continue
+            values = container[key]
+            items = list(enumerate(values)) if isinstance(values, list) else [(None, values)]
+            for index, value in items:
+                if not isinstance(value, str) or not value.strip():
+                    continue
+                label = f"{'.'.join(path)}{'' if index is None else f'[{index}]'} (line {line_number})"
+                translation = _translate_with_retries(translator, value, target_lang, source_lang, max_retries, label)
+                if is_translation_error(translation):
+                    errors.append({"field": label.split(" ")[0], "error": translation})
+                    continue
+                _add_usage(usage, last_call_usage())
+                if index is None:
+                    container[key] = translation
+                else:
+                    values[index] = translation
+                translated_fields += 1
+    else:
+        errors.append({"field": None, "error": "Error: Record is not a JSON object."})
+    usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+    meta = {"line": line_number, "latency_ms": round((time.monotonic() - started) * 1000, 1),
+            "fields": translated_fields, "usage": usage, "errors": errors}
+    if isinstance(record, dict):
+        record[JSONL_META_FIELD] = meta
+        return record
+    return {"record": record, JSONL_META_FIELD: meta}
+
+
+class _InvalidLine:
+    __slots__ = ("raw", "error")
+
+    def __init__(self, raw: bytes, error: Exception):
+        self.raw = raw
+        self.error = error
+
+
+def iter_records(stream: IO[bytes]) -> Iterator[Tuple[int, object]]:
+    """Yield (line_number, record) for each non-blank line; lines that are not valid JSON yield an _InvalidLine."""
+    for line_number, raw_line in enumerate(stream, 1):
+        if not raw_line.strip():
+            continue
+        try:
+            yield line_number, json.loads(raw_line)
+        except ValueError as e:
+            yield line_number, _InvalidLine(raw_line, e)
+
+
+def _invalid_record(line_number: int, invalid: _InvalidLine) -> dict:
+    logger.warning(f"Passing through invalid JSON on line {line_number}: {invalid.error}")
+    return {"raw": invalid.raw.decode("utf-8", errors="replace").rstrip("\r\n"),
+            JSONL_META_FIELD: {"line": line_number, "latency_ms": 0.0, "fields": 0, "usage": None,
+                               "errors": [{"field": None, "error": f"Error: Invalid JSON: {invalid.error}"}]}}
+
+
+def iter_translated_records(records: Iterable[Tuple[int, object]], field_paths: List[Tuple[str, ...]], translator,
+                            target_lang: str, source_lang: Optional[str] = None, workers: Optional[int] = None,
+                            window: Optional[int] = None, ordered: bool = False) -> Iterator[dict]:
+    """
+    Translate records through a pool of `workers` threads with at most `window` records in flight, yielding each
+    output record as soon as it is done (or in input order when `ordered`; a slow record then holds back the
+    ones after it, but never more than `window` of them).
+    """
+    workers = max(1, workers or JSONL_WORKERS)
+    window = max(workers, window or JSONL_WINDOW or workers * 2)
+    pending = deque()  # 按提交顺序排列的在途 future
+    source = iter(records)
+    exhausted = False
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="jsonl") as executor:
+        try:
+            while True:
+                while not exhausted and len(pending) < window:
+                    try:
+                        line_number, record = next(source)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    if isinstance(record, _InvalidLine):
+                        future = executor.submit(_invalid_record, line_number, record)
+                    else:
+                        future = executor.submit(translate_record, record, line_number, field_paths, translator,
+                                                 target_lang, source_lang)
+                    pending.append(future)
+                if not pending:
+                    return
+                if ordered:
+                    yield pending.popleft().result()
+                    continue
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in [f for f in pending if f in done]:
+                    pending.remove(future)
+                    yield future.result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def run_jsonl_translation(input_stream: IO[bytes], output_stream: IO[str], fields: str, translator, target_lang: str,
+                          source_lang: Optional[str] = None, workers: Optional[int] = None, ordered: bool = False) -> dict:
+    """Stream records from input_stream to output_stream (one JSON object per line). Returns run totals."""
+    field_paths = parse_field_paths(fields)
+    totals = {"records": 0, "failed_records": 0, "prompt_tokens": 0, "completion_tokens": 0, "seconds": 0.0}
+    started = time.monotonic()
+    logger.info(f"JSONL translation of fields {fields} to {target_lang} ({'ordered' if ordered else 'as completed'}).")
+    for output in iter_translated_records(iter_records(input_stream), field_paths, translator, target_lang,
+                                          source_lang, workers, ordered=ordered):
+        output_stream.write(json.dumps(output, ensure_ascii=False) + "\n")
+        output_stream.flush()
+        meta = output[JSONL_META_FIELD]
+        totals["records"] += 1
+        totals["failed_records"] += bool(meta["errors"])
+        if meta["usage"]:
+            totals["prompt_tokens"] += meta["usage"]["prompt_tokens"]
+            totals["completion_tokens"] += meta["usage"]["completion_tokens"]
+        if totals["records"] % LOG_EVERY_RECORDS == 0:
+            elapsed = time.monotonic() - started
+            logger.info(f"JSONL translation: {totals['records']} records written ({totals['records'] / elapsed:.1f} records/s).")
+    totals["seconds"] = round(time.monotonic() - started, 3)
+    return totals
@@ -2,10 +2,14 @@
 import argparse
 import logging
 import os
+import sys
+import uuid
 from translator import SiliconFlowTranslator
-from file_translator import translate_text_file
-from docx_translator import translate_docx_file # <--- 确保此行存在
-from config import API_KEY, DEFAULT_MODEL, BASE_URL
+from config import API_KEY, DEFAULT_MODEL, BASE_URL, METRICS_CLI_SUMMARY, BULK_MANIFEST_NAME
+from metrics import format_summary
+from tracing import ChromeTraceExporter, add_listener
+# 文件、Word、批量、JSONL 和检查点后端在对应模式中才导入 (python-docx/lxml 等很重)，
+# 保持 -t 的冷启动最小；预算检查见 bench_translator.py --scenarios startup
 
 # 配置日志记录器
 logging.basicConfig(
@@ -29,9 +33,30 @@ Usage Examples:
   Translate a plain text file (e.g., input.txt to output_dir/input_translated_english.txt):
     python main.py -i input.txt -o output_dir -l "English"
 
+  Translate a very large plain text file with constant memory (streaming mode):
+    python main.py -i corpus.txt -o output_dir -l "English" --stream
+
   Translate a Word document (.docx) (e.g., document.docx to translated_docx/document_translated_english.docx):
     python main.py -id document.docx -od translated_docx -l "English" -s "简体中文"
 
+  Translate a Word document with 8 chunks in flight at once:
+    python main.py -id document.docx -od translated_docx -l "English" -c 8
+
+  Route across several platforms with failover (keys come from .env):
+    python main.py -id document.docx -od translated_docx -l "English" --route "siliconflow@3,deepseek:deepseek-chat@1" --route-mode weighted
+
+  Translate every .txt/.docx under a directory (and a glob) with 8 files in flight, skipping finished outputs:
+    python main.py -b docs/ "more/**/*.txt" -o translated -l "English" -w 8
+
+  Translate the "title" and "meta.summary" fields of a JSONL stream, keeping input order:
+    cat records.jsonl | python main.py -j - --fields title,meta.summary -l "English" --ordered > translated.jsonl
+
+  Translate a revised version of a document, reusing the translation of every unchanged paragraph:
+    python main.py -id contract_v3.docx -od translated_docx -l "English" --incremental contract.manifest.jsonl
+
+  Resume an interrupted file translation (the job id is printed when the translation starts):
+    python main.py --resume 3f2c9a1e5b7d4c0e8a6b2d4f1e3c5a7b
+
   Override default model and base URL for any translation type:
     python main.py -t "Test" -l "French" -m "gemma-7b-it" -u "https://api.another-platform.com/v1"
 
@@ -56,8 +81,7 @@ def main():
     # -l / --target_lang: 必需，目标语言
     parser.add_argument(
         "-l", "--target_lang",
-        required=True, # 无论是文本还是文件翻译，目标语言都是必需的
-        help="The target language (e.g., 'English', 'French', '简体中文')."
+        help="The target language (e.g., 'English', 'French', '简体中文'). Required unless --resume is used."
     )
     # -s / --source_lang: 可选，源语言
     parser.add_argument(
@@ -80,6 +104,14 @@ def main():
         default="utf-8",
         help="Encoding of the input and output plain text files (default: utf-8). Common alternatives: gbk, latin-1."
     )
+    # --stream: 用于纯文本文件翻译，恒定内存的流式模式
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Translate -i/--input_file in streaming mode: read incrementally, translate through a bounded window and "
+             "write results in order, so memory stays flat for very large files. "
+             "Used automatically above TEXT_STREAM_THRESHOLD_BYTES (see config.py)."
+    )
     # -id / --input_docx: 用于 Word 文档翻译
     parser.add_argument(
         "-id", "--input_docx",
@@ -90,6 +122,93 @@ def main():
         "-od", "--output_docx_dir",
         help="Directory where the translated Word document will be saved. Required if -id/--input_docx is used."
     )
+    # -b / --bulk: 批量翻译目录或通配符匹配到的 .txt / .docx 文件
+    parser.add_argument(
+        "-b", "--bulk",
+        nargs="+",
+        metavar="PATH_OR_GLOB",
+        help="Directories, files or glob patterns (quote them) of .txt/.docx files to translate in one run. "
+             "Outputs go to -o/--output_dir, mirroring the input layout; up-to-date outputs are skipped. "
+             "Cannot be used with -t, -i or -id."
+    )
+    # -j / --jsonl: 流式翻译 JSONL 记录中的指定字段
+    parser.add_argument(
+        "-j", "--jsonl",
+        metavar="PATH",
+        help="JSONL file to translate record by record ('-' reads stdin). Only the --fields are translated; output "
+             "records carry latency and token usage under '_translation'. Cannot be used with -t, -i, -id or -b."
+    )
+    parser.add_argument(
+        "--fields",
+        help="Comma-separated fields to translate in -j/--jsonl mode; use dots for nested fields (e.g. 'title,meta.summary'). "
+             "String and list-of-string values are translated."
+    )
+    parser.add_argument(
+        "--jsonl-output",
+        metavar="PATH",
+        help="Where -j/--jsonl writes translated records (default: stdout)."
+    )
+    parser.add_argument(
+        "--ordered",
+        action="store_true",
+        help="In -j/--jsonl mode, write records in input order instead of as soon as each one completes."
+    )
+    parser.add_argument(
+        "-w", "--workers",
+        type=int,
+        help="Number of files (-b/--bulk) or records (-j/--jsonl) translated at the same time "
+             "(default: BULK_WORKERS / JSONL_WORKERS from .env/config). All workers share one connection pool and rate limiter."
+    )
+    parser.add_argument(
+        "--overwrite",
+        action="store_true",
+        help="In -b/--bulk mode, translate files again even if an up-to-date output already exists."
+    )
+    parser.add_argument(
+        "--manifest",
+        help=f"Where -b/--bulk writes its summary of outputs and failures (default: <output_dir>/{BULK_MANIFEST_NAME})."
+    )
+    # -c / --concurrency: 用于文件翻译 (-i / -id)
+    parser.add_argument(
+        "-c", "--concurrency",
+        type=int,
+        help="Number of chunks translated in parallel for -i/--input_file and -id/--input_docx "
+             "(default: per-platform setting, see PLATFORM_CHUNK_CONCURRENCY in config.py)."
+    )
+    # --route / --route-mode: 可选，在多个平台之间路由并自动故障切换
+    parser.add_argument(
+        "--route",
+        help="Comma-separated routing targets 'platform[:model][@weight]' (e.g. 'siliconflow@3,deepseek:deepseek-chat'). "
+             "API keys and base URLs are read from .env per platform; -m/-u/-k are ignored."
+    )
+    parser.add_argument(
+        "--route-mode",
+        choices=["ordered", "weighted", "latency"],
+        help="How --route picks a target: ordered (first healthy), weighted (by @weight) or latency (lowest median latency). "
+             "Default: ROUTING_MODE from .env/config."
+    )
+    # --resume: 按任务 id 续传中断的文件翻译 (输入、输出、语言和模型来自保存的任务清单)
+    parser.add_argument(
+        "--resume",
+        metavar="JOB_ID",
+        help="Resume an interrupted -i/--input_file or -id/--input_docx translation by the job id printed when it started. "
+             "Completed chunks are read from the checkpoint journal (see CHECKPOINT_DIR in config.py)."
+    )
+    # --incremental: 只翻译相对上一版新增或修改的片段 (片段清单见 incremental.py)
+    parser.add_argument(
+        "--incremental",
+        metavar="MANIFEST",
+        help="Incremental re-translation of a revised -i/--input_file or -id/--input_docx: segments whose fingerprint "
+             "is in MANIFEST (written by the previous run with the same settings) reuse their translation, only changed "
+             "or new segments are sent upstream. MANIFEST is created if missing and updated after a successful run."
+    )
+    # --trace: 把请求生命周期 span 写成 Chrome trace / Perfetto JSON
+    parser.add_argument(
+        "--trace",
+        metavar="PATH",
+        help="Write a Chrome trace / Perfetto JSON timeline of this run (rate-limit waits, connects, upstream requests, "
+             "first delta, chunk spans per worker thread). Open it in chrome://tracing or ui.perfetto.dev."
+    )
     # -m / --model: 可选，覆盖默认模型
     parser.add_argument(
         "-m", "--model",
@@ -111,34 +230,161 @@ def main():
     # 解析命令行参数
     args = parser.parse_args()
 
+    # 0. 续传：用任务清单补全输入、输出、语言和模型参数 (命令行中显式给出的 -m/-u/-c 仍然优先)
+    if args.resume:
+        from checkpoints import load_job_manifest
+        if args.text or args.input_file or args.input_docx:
+            parser.error("--resume cannot be combined with -t/--text, -i/--input_file or -id/--input_docx.")
+        manifest = load_job_manifest(args.resume)
+        if manifest is None:
+            parser.error(f"No checkpoint found for job '{args.resume}' (unknown id, already completed, or expired).")
+        if manifest.get("file_extension") == "docx":
+            args.input_docx, args.output_docx_dir = manifest["input_filepath"], manifest["output_dir"]
+        else:
+            args.input_file, args.output_dir = manifest["input_filepath"], manifest["output_dir"]
+            args.encoding = manifest.get("encoding") or args.encoding
+            args.stream = args.stream or bool(manifest.get("stream"))
+        args.target_lang = manifest["target_lang"]
+        args.source_lang = manifest.get("source_lang") or None
+        args.route = args.route or manifest.get("route_targets") or None
+        args.route_mode = args.route_mode or manifest.get("route_mode") or None
+        args.model = args.model or manifest.get("model")
+        args.base_url = args.base_url or manifest.get("base_url")
+        args.concurrency = args.concurrency or manifest.get("chunk_concurrency")
+        args.incremental = args.incremental or manifest.get("incremental") or None
+    elif not args.target_lang:
+        parser.error("Argument -l/--target_lang is required.")
+
     # --- 参数逻辑检查 ---
     # 1. 确保只有一种输入类型被提供：文本(-t), 纯文本文件(-i), Word文档(-id)
-    input_modes = [args.text, args.input_file, args.input_docx]
+    input_modes = [args.text, args.input_file, args.input_docx, args.bulk, args.jsonl]
     active_input_modes = [mode for mode in input_modes if mode is not None]
 
     if len(active_input_modes) > 1:
-        parser.error("Only one input type (-t/--text, -i/--input_file, or -id/--input_docx) can be provided at a time. Please choose one.")
+        parser.error("Only one input type (-t/--text, -i/--input_file, -id/--input_docx, -b/--bulk or -j/--jsonl) can be provided at a time. Please choose one.")
     if len(active_input_modes) == 0:
-        parser.error("At least one input type (-t/--text, -i/--input_file, or -id/--input_docx) must be provided.")
+        parser.error("At least one input type (-t/--text, -i/--input_file, -id/--input_docx, -b/--bulk or -j/--jsonl) must be provided.")
     
-    # 2. 如果使用了 -i (纯文本文件)，则 -o (输出目录) 必需
+    # 2. 如果使用了 -i (纯文本文件) 或 -b (批量)，则 -o (输出目录) 必需
     if args.input_file and not args.output_dir:
         parser.error("Argument -o/--output_dir is required when -i/--input_file is used.")
+    if args.bulk and not args.output_dir:
+        parser.error("Argument -o/--output_dir is required when -b/--bulk is used.")
 
     # 3. 如果使用了 -id (Word文档)，则 -od (Word输出目录) 必需
     if args.input_docx and not args.output_docx_dir:
         parser.error("Argument -od/--output_docx_dir is required when -id/--input_docx is used.")
 
+    # 4. 如果使用了 -j (JSONL)，则 --fields 必需
+    if args.jsonl and not args.fields:
+        parser.error("Argument --fields is required when -j/--jsonl is used.")
+    if args.jsonl:
+        from jsonl_translator import parse_field_paths
+        try:
+            parse_field_paths(args.fields)
+        except ValueError as e:
+            parser.error(str(e))
+
+    # 5. 并发数必须为正整数
+    if args.concurrency is not None and args.concurrency < 1:
+        parser.error("Argument -c/--concurrency must be a positive integer.")
+    if args.workers is not None and args.workers < 1:
+        parser.error("Argument -w/--workers must be a positive integer.")
+
+    # 6. --incremental 只用于单个文件 (-i / -id)
+    if args.incremental and not (args.input_file or args.input_docx):
+        parser.error("--incremental can only be used with -i/--input_file or -id/--input_docx.")
+
+    trace_exporter = None
+    incremental = None
+    if args.trace:
+        trace_exporter = ChromeTraceExporter()
+        add_listener(trace_exporter)
+
     try:
         logger.info("Translator application started.")
         # 根据命令行参数或 config.py 中的默认值初始化翻译器
-        translator = SiliconFlowTranslator(
-            api_key=args.api_key,
-            base_url=args.base_url,
-            model=args.model
-        )
+        if args.route:
+            from router import get_router # 仅在使用路由时导入
+            translator = get_router(args.route, args.route_mode)
+        else:
+            translator = SiliconFlowTranslator(
+                api_key=args.api_key,
+                base_url=args.base_url,
+                model=args.model
+            )
+        translator.chunk_concurrency = args.concurrency # None 时使用平台默认并发数
+
+        # 文件翻译：已完成的分块写入检查点日志，中断后重新运行相同命令或 --resume <job_id> 即可从断点继续
+        input_filepath = args.input_docx or args.input_file
+        journal = None
+        job_id = args.resume
+        if input_filepath and os.path.exists(input_filepath):
+            from checkpoints import delete_job_manifest, open_journal, save_job_manifest
+            file_extension = "docx" if args.input_docx else "txt"
+            journal = open_journal(input_filepath, translator, args.target_lang, args.source_lang,
+                                   file_type=file_extension, translation_format="", encoding=args.encoding)
+            translator.journal = journal
+            if journal is not None:
+                job_id = job_id or uuid.uuid4().hex
+                save_job_manifest(job_id, {
+                    "input_filepath": os.path.abspath(input_filepath), "file_extension": file_extension,
+                    "output_dir": os.path.abspath(args.output_docx_dir or args.output_dir), "encoding": args.encoding,
+                    "stream": args.stream, "target_lang": args.target_lang, "source_lang": args.source_lang or "",
+                    "platform": "router" if args.route else "custom", "route_targets": args.route or "",
+                    "route_mode": args.route_mode or "", "base_url": translator.base_url if not args.route else "",
+                    "model": translator.model if not args.route else "", "chunk_concurrency": args.concurrency,
+                    "incremental": os.path.abspath(args.incremental) if args.incremental else "",
+                })
+                if len(journal):
+                    print(f"Resuming from checkpoint: {len(journal)} chunk(s) already translated.")
+                print(f"Job id: {job_id} (if interrupted, continue with: python main.py --resume {job_id})")
+            if args.incremental:
+                from incremental import open_incremental_manifest
+                incremental = open_incremental_manifest(args.incremental, translator, args.target_lang, args.source_lang,
+                                                        journal=journal, file_type=file_extension, translation_format="",
+                                                        encoding=args.encoding)
+                translator.journal = incremental
+
+        if args.jsonl:
+            # 执行 JSONL 字段翻译：译文记录写到 stdout 或 --jsonl-output，日志和汇总写到 stderr
+            from jsonl_translator import run_jsonl_translation
+            input_stream = sys.stdin.buffer if args.jsonl == "-" else open(args.jsonl, 'rb')
+            output_stream = sys.stdout if not args.jsonl_output else open(args.jsonl_output, 'w', encoding='utf-8')
+            try:
+                totals = run_jsonl_translation(
+                    input_stream, output_stream, args.fields, translator, args.target_lang, args.source_lang,
+                    workers=args.workers, ordered=args.ordered
+                )
+            finally:
+                if input_stream is not sys.stdin.buffer:
+                    input_stream.close()
+                if output_stream is not sys.stdout:
+                    output_stream.close()
+            print(f"JSONL translation complete: {totals['records']} records ({totals['failed_records']} with errors) "
+                  f"in {totals['seconds']:.1f}s, {totals['prompt_tokens']} prompt + {totals['completion_tokens']} "
+                  f"completion tokens.", file=sys.stderr)
 
-        if args.input_docx:
+        elif args.bulk:
+            # 执行批量翻译：一个进程、一个线程池，所有文件共享连接和限流状态
+            from bulk_translator import run_bulk_translation
+            logger.info(f"Starting bulk translation for: {' '.join(args.bulk)}")
+            manifest = run_bulk_translation(
+                args.bulk, args.output_dir, args.target_lang, translator, args.source_lang,
+                encoding=args.encoding, workers=args.workers, overwrite=args.overwrite, stream=args.stream,
+                manifest_path=args.manifest
+            )
+            summary = manifest["summary"]
+            print(f"\n--- Bulk Translation Complete ({manifest['elapsed_seconds']:.1f}s) ---")
+            print(f"Translated: {summary['translated']}, skipped (up to date): {summary['skipped']}, "
+                  f"failed: {summary['failed']}, cancelled: {summary['cancelled']}")
+            for entry in manifest["files"]:
+                if entry["status"] == "failed":
+                    print(f"  FAILED {entry['input']}: {entry['error']}")
+            print(f"Manifest written to: {manifest['manifest_path']}")
+            print("------------------------------------------")
+
+        elif args.input_docx:
             # 执行 Word 文档翻译
             logger.info(f"Starting Word document translation for: {args.input_docx}")
             # 预检查输入文件是否存在
@@ -147,6 +393,7 @@ def main():
                 logger.error(f"Input Word document not found: {args.input_docx}")
                 return # 提前退出
             
+            from docx_translator import translate_docx_file
             output_filepath_or_error = translate_docx_file(
                 input_filepath=args.input_docx,
                 output_dir=args.output_docx_dir,
@@ -161,8 +408,14 @@ def main():
                 print("----------------------------------------")
                 # 错误日志已在 docx_translator 中记录
             else:
+                if journal is not None:
+                    journal.complete()
+                    delete_job_manifest(job_id)
                 print(f"\n--- Word Document Translation Complete ---")
                 print(f"Translated document saved to: {output_filepath_or_error}")
+                if incremental is not None:
+                    from incremental import format_incremental_summary
+                    print(f"Incremental: {format_incremental_summary(incremental.commit())}. Manifest: {args.incremental}")
                 print("------------------------------------------")
                 # 成功日志已在 docx_translator 中记录
 
@@ -174,7 +427,13 @@ def main():
                 logger.error(f"Input file not found: {args.input_file}")
                 return
             
-            output_filepath_or_error = translate_text_file(
+            from text_stream_translator import should_stream
+            if args.stream or incremental is not None or should_stream(args.input_file):
+                logger.info("Using streaming mode for plain text file translation.")
+                from text_stream_translator import translate_text_file_streaming as text_translate_func
+            else:
+                from file_translator import translate_text_file as text_translate_func
+            output_filepath_or_error = text_translate_func(
                 input_filepath=args.input_file,
                 output_dir=args.output_dir,
                 target_lang=args.target_lang,
@@ -187,8 +446,14 @@ def main():
                 print(output_filepath_or_error)
                 print("------------------------------------------")
             else:
+                if journal is not None:
+                    journal.complete()
+                    delete_job_manifest(job_id)
                 print(f"\n--- Plain Text File Translation Complete ---")
                 print(f"Translated file saved to: {output_filepath_or_error}")
+                if incremental is not None:
+                    from incremental import format_incremental_summary
+                    print(f"Incremental: {format_incremental_summary(incremental.commit())}. Manifest: {args.incremental}")
                 print("------------------------------------------")
 
         elif args.text:
@@ -211,6 +476,16 @@ def main():
     except Exception as e:
         logger.exception(f"An unexpected error occurred during execution: {e}")
         print(f"\nAn unexpected error occurred: {e}")
+    finally:
+        if incremental is not None:
+            incremental.abort()  # 失败时保留上一版清单；成功时清单已提交，这里什么也不做
+        if trace_exporter is not None:
+            trace_exporter.write(args.trace)
+            print(f"Trace written to: {args.trace}", file=sys.stderr)
+        # 与 Web 端 /metrics 相同的数据：请求数、错误、延迟分位数、首 token 时间和 token 用量
+        summary = format_summary() if METRICS_CLI_SUMMARY else ""
+        if summary:
+            print(f"\n--- Request Metrics ---\n{summary}", file=sys.stderr)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,319 @@
+# metrics.py
+"""
+进程内的翻译指标 (无外部依赖)：计数器、仪表和直方图，按 Prometheus 文本格式导出 (app.py 的 /metrics)，
+也可以汇总成表格 (CLI 退出时打印)。埋点在 SiliconFlowTranslator 中，Web 和 CLI 共用同一份数据。
+"""
+import bisect
+import json
+import logging
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from tracing import record_span
+
+try:
+    from config import METRICS_ENABLED
+except ImportError:
+    METRICS_ENABLED = True
+
+logger = logging.getLogger(__name__)
+
+LabelValues = Tuple[str, ...]
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0, 120.0)
+TTFT_BUCKETS = (0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0)
+TOKEN_RATE_BUCKETS = (1, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+# SSE 流末尾保留的字节数，用于解析部分平台在最后一个事件中返回的 usage
+_STREAM_TAIL_BYTES = 4096
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Iterable[str], values: LabelValues, extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, label_names: Tuple[str, ...]):
+        self.name = name
+        self.help = help_text
+        self.label_names = label_names
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, help_text, label_names=()):
+        super().__init__(name, help_text, label_names)
+        self.values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0.0) + amount
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            return [f"{self.name}{_format_labels(self.label_names, key)} {value:g}" for key, value in sorted(self.values.items())]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, label_names=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, label_names)
+        self.buckets = tuple(buckets)
+        self.series: Dict[LabelValues, list] = {}  # key -> [每个桶的计数..., +Inf 计数, 总和]
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def quantile(self, fraction: float, **labels) -> Optional[float]:
+        """Estimate a quantile by linear interpolation inside the bucket (like Prometheus' histogram_quantile)."""
+        with self._lock:
+            series = self.series.get(self._key(labels))
+            if not series:
+                return None
+            counts = list(series[:-1])
+        total = sum(counts)
+        if not total:
+            return None
+        rank = fraction * total
+        cumulative = 0
+        for index, count in enumerate(counts):
+            if cumulative + count >= rank and count:
+                lower = self.buckets[index - 1] if index else 0.0
+                upper = self.buckets[index] if index < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * ((rank - cumulative) / count)
+            cumulative += count
+        return self.buckets[-1]
+
+    def _samples(self) -> List[str]:
+        lines = []
+        with self._lock:
+            items = sorted((key, list(series)) for key, series in self.series.items())
+        for key, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                bucket_label = 'le="%g"' % bound
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, bucket_label)} {cumulative}")
+            cumulative += series[len(self.buckets)]
+            inf_label = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, inf_label)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, key)} {series[-1]:g}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, key)} {cumulative}")
+        return lines
+
+
+REQUESTS = Counter("translator_requests_total", "Translation requests by platform, model, mode and outcome.",
+                   ("platform", "model", "mode", "outcome"))
+UPSTREAM_STATUS = Counter("translator_upstream_responses_total", "Upstream HTTP status codes (or 'network' for failures without a response).",
+                          ("platform", "status"))
+LATENCY = Histogram("translator_request_duration_seconds", "Total request latency (streams: until the last byte).",
+                    ("platform", "model", "mode"), LATENCY_BUCKETS)
+TTFT = Histogram("translator_time_to_first_token_seconds", "Time from sending a streaming request to its first body bytes.",
+                 ("platform", "model"), TTFT_BUCKETS)
+TOKEN_RATE = Histogram("translator_tokens_per_second", "Completion tokens per second of successful requests.",
+                       ("platform", "model", "mode"), TOKEN_RATE_BUCKETS)
+STREAMS_IN_FLIGHT = Gauge("translator_streams_in_flight", "Streaming responses currently being relayed.", ("platform",))
+TOKENS = Counter("translator_tokens_total", "Token usage reported by providers (estimated when a provider reports none).",
+                 ("platform", "model", "kind"))
+
+ALL_METRICS = (REQUESTS, UPSTREAM_STATUS, LATENCY, TTFT, TOKEN_RATE, STREAMS_IN_FLIGHT, TOKENS)
+
+
+def record_request(platform: str, model: str, mode: str, outcome: str, duration: Optional[float] = None,
+                   status=None, usage: Optional[dict] = None):
+    """
+    One finished request: outcome is success, error, cache_hit, shared (attached to an identical in-flight request)
+    or cancelled; status is the HTTP code, 'network' or 'rate_limit' (no limiter capacity in time).
+    """
+    if not METRICS_ENABLED:
+        return
+    REQUESTS.inc(platform=platform, model=model, mode=mode, outcome=outcome)
+    if status is not None:
+        UPSTREAM_STATUS.inc(platform=platform, status=status)
+    if duration is not None and outcome not in ("cache_hit", "shared"):
+        LATENCY.observe(duration, platform=platform, model=model, mode=mode)
+    if usage:
+        prompt_tokens = int(usage.get("prompt_tokens") or 0)
+        completion_tokens = int(usage.get("completion_tokens") or 0)
+        TOKENS.inc(prompt_tokens, platform=platform, model=model, kind="prompt")
+        TOKENS.inc(completion_tokens, platform=platform, model=model, kind="completion")
+        if outcome == "success" and duration and completion_tokens:
+            TOKEN_RATE.observe(completion_tokens / duration, platform=platform, model=model, mode=mode)
+
+
+class StreamMeter:
+    """
+    Metrics for one streaming response: time to first bytes, SSE data events counted as completion tokens, and
+    the finished request (with tracing spans) when the stream ends or is abandoned. Keeps an in-flight gauge for
+    the platform. MeteredRaw feeds it from requests; async_translator feeds it the aiohttp lines.
+    """
+
+    def __init__(self, platform: str, model: str, started: float, status=200, prompt_tokens: int = 0):
+        self._status = status
+        self._prompt_tokens = prompt_tokens
+        self._platform = platform
+        self._model = model
+        self._started = started
+        self._first = None
+        self._events = 0
+        self._tail = b""
+        self._done = False
+        self._finished = False
+        STREAMS_IN_FLIGHT.inc(platform=platform)
+
+    def observe(self, chunk: bytes):
+        if not chunk:
+            return
+        if self._first is None:
+            self._first = time.perf_counter()
+            TTFT.observe(self._first - self._started, platform=self._platform, model=self._model)
+        self._events += chunk.count(b"data:")
+        self._tail = (self._tail + chunk)[-_STREAM_TAIL_BYTES:]
+        self._done = self._done or b"[DONE]" in self._tail
+
+    def _usage(self) -> dict:
+        """Provider usage from the last events if present; otherwise an estimate (data events minus [DONE] as completion tokens)."""
+        for line in reversed(self._tail.split(b"\n")):
+            if b'"usage"' in line and line.startswith(b"data:"):
+                try:
+                    usage = json.loads(line[5:]).get("usage")
+                except ValueError:
+                    continue
+                if usage:
+                    return usage
+        return {"prompt_tokens": self._prompt_tokens, "completion_tokens": max(0, self._events - 1), "estimated": True}
+
+    def finish(self, outcome: str):
+        if self._finished:
+            return
+        self._finished = True
+        STREAMS_IN_FLIGHT.dec(platform=self._platform)
+        if outcome == "cancelled" and self._done:
+            outcome = "success"  # 转发方读到 [DONE] 后就关闭响应，不会把底层流读到 EOF
+        if b'"error"' in self._tail and outcome == "success":
+            outcome = "error"
+        finished = time.perf_counter()
+        record_request(self._platform, self._model, "stream", outcome, finished - self._started,
+                       self._status, self._usage() if outcome == "success" else None)
+        # tracing：从发出请求到流结束；首个增量之后为生成阶段
+        marks = [("first_delta", self._first, {})] if self._first is not None else []
+        record_span("stream", self._started, finished, marks=marks, platform=self._platform, outcome=outcome,
+                    events=self._events)
+        if self._first is not None:
+            record_span("generation", self._first, finished, platform=self._platform, events=self._events)
+
+
+class MeteredRaw(StreamMeter):
+    """
+    Proxy for a streaming response's urllib3 raw object (same idea as translation_cache._RecordingRaw) that feeds
+    a StreamMeter: the request is recorded when the stream ends or is closed early.
+    """
+
+    def __init__(self, raw, platform: str, model: str, started: float, status=200, prompt_tokens: int = 0):
+        self._raw = raw
+        super().__init__(platform, model, started, status, prompt_tokens)
+
+    def stream(self, amt=2 ** 16, decode_content=None):
+        try:
+            for chunk in self._raw.stream(amt, decode_content=decode_content):
+                self.observe(chunk)
+                yield chunk
+        except Exception:
+            self.finish("error")
+            raise
+        self.finish("success")
+
+    def read(self, *args, **kwargs):
+        data = self._raw.read(*args, **kwargs)
+        if data:
+            self.observe(data)
+        else:
+            self.finish("success")
+        return data
+
+    def close(self):
+        self.finish("cancelled")
+        return self._raw.close()
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+
+def render_prometheus() -> str:
+    lines = []
+    for metric in ALL_METRICS:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def _format_seconds(value: Optional[float]) -> str:
+    return "-" if value is None else f"{value * 1000:.0f}ms" if value < 1 else f"{value:.2f}s"
+
+
+def format_summary() -> str:
+    """Per platform/model table for the CLI: requests, errors, latency and TTFT quantiles, tokens."""
+    rows = {}
+    with REQUESTS._lock:
+        request_counts = dict(REQUESTS.values)
+    for (platform, model, mode, outcome), count in request_counts.items():
+        row = rows.setdefault((platform, model, mode), {"requests": 0, "errors": 0, "cache_hits": 0})
+        row["requests"] += int(count)
+        row["errors"] += int(count) if outcome == "error" else 0
+        row["cache_hits"] += int(count) if outcome in ("cache_hit", "shared") else 0  # 没有调用上游的请求
+    if not rows:
+        return ""
+    with TOKENS._lock:
+        token_counts = dict(TOKENS.values)
+    with UPSTREAM_STATUS._lock:
+        statuses = dict(UPSTREAM_STATUS.values)
+    lines = [f"{'platform':<12} {'model':<32} {'mode':<10} {'reqs':>6} {'errors':>6} {'cached':>6} "
+             f"{'p50':>8} {'p95':>8} {'ttft p50':>9} {'tokens in/out':>15}"]
+    for (platform, model, mode), row in sorted(rows.items()):
+        labels = {"platform": platform, "model": model, "mode": mode}
+        prompt_tokens = int(token_counts.get((platform, model, "prompt"), 0))
+        completion_tokens = int(token_counts.get((platform, model, "completion"), 0))
+        ttft = TTFT.quantile(0.5, platform=platform, model=model) if mode == "stream" else None
+        lines.append(f"{platform:<12} {model[:32]:<32} {mode:<10} {row['requests']:>6} {row['errors']:>6} "
+                     f"{row['cache_hits']:>6} {_format_seconds(LATENCY.quantile(0.5, **labels)):>8} "
+                     f"{_format_seconds(LATENCY.quantile(0.95, **labels)):>8} {_format_seconds(ttft):>9} "
+                     f"{f'{prompt_tokens}/{completion_tokens}':>15}")
+    status_text = ", ".join(f"{platform} {status}: {int(count)}" for (platform, status), count in sorted(statuses.items()))
+    if status_text:
+        lines.append(f"Upstream responses: {status_text}")
+    return "\n".join(lines)
@@ -0,0 +1,184 @@
+# mock_openai_server.py
+"""
+Local stand-in for an OpenAI-compatible /chat/completions endpoint, used by bench_translator.py.
+
+Replies echo the text of the last user message (after the instruction line) with a prefix, paced like a real
+model: `latency_ms` before the first token, then `tokens_per_second` (0 = as fast as possible). Errors can be
+injected at random: `error_rate` answers 500, `rate_limit_rate` answers 429 with a Retry-After header. Streaming
+and non-streaming replies are both supported; non-streaming replies include a `usage` object.
+
+    python mock_openai_server.py --port 8765 --latency-ms 300 --tokens-per-second 50 --rate-limit-rate 0.05
+"""
+import argparse
+import json
+import random
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Optional, Tuple
+
+# 近似一个 token：一个词加上其后的空白，或单个非空白字符 (中文等)
+_TOKEN_RE = re.compile(r"\w+\s*|[^\w\s]\s*|\s+")
+
+
+class MockSettings:
+    """Behaviour of a running mock server; attributes may be changed between benchmark scenarios."""
+
+    def __init__(self, latency_ms: float = 0.0, tokens_per_second: float = 0.0, error_rate: float = 0.0,
+                 rate_limit_rate: float = 0.0, retry_after: float = 0.0, reply_prefix: str = "T:",
+                 seed: Optional[int] = None):
+        self.latency_ms = latency_ms
+        self.tokens_per_second = tokens_per_second
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.reply_prefix = reply_prefix
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.injected_errors = 0
+        self.injected_rate_limits = 0
+
+    def pick_failure(self) -> Optional[int]:
+        with self.lock:
+            self.requests += 1
+            roll = self.random.random()
+            if roll < self.rate_limit_rate:
+                self.injected_rate_limits += 1
+                return 429
+            if roll < self.rate_limit_rate + self.error_rate:
+                self.injected_errors += 1
+                return 500
+        return None
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {"requests": self.requests, "injected_errors": self.injected_errors,
+                    "injected_rate_limits": self.injected_rate_limits}
+
+
+def split_tokens(text: str) -> List[str]:
+    return _TOKEN_RE.findall(text) or [text]
+
+
+class _ChatHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True  # 否则小的 SSE 分块会被延迟 ACK 拖慢约 40ms
+    settings: MockSettings = None  # 由 make_server 设置
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, body: dict, headers: Optional[dict] = None):
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _write_chunk(self, data: bytes):
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+            return
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        settings = self.settings
+        failure = settings.pick_failure()
+        if failure == 429:
+            self._send_json(429, {"error": {"message": "Rate limit exceeded (injected)."}},
+                            {"Retry-After": f"{settings.retry_after:g}"})
+            return
+        if failure == 500:
+            self._send_json(500, {"error": {"message": "Internal error (injected)."}})
+            return
+
+        messages = body.get("messages") or [{}]
+        prompt = messages[-1].get("content", "")
+        reply = settings.reply_prefix + prompt.split("\n\n", 1)[-1]  # 去掉 "Translate the following text to X:" 指令行
+        tokens = split_tokens(reply)
+        interval = 1.0 / settings.tokens_per_second if settings.tokens_per_second > 0 else 0.0
+        if settings.latency_ms > 0:
+            time.sleep(settings.latency_ms / 1000.0)
+
+        if not body.get("stream"):
+            if interval:
+                time.sleep(interval * len(tokens))
+            prompt_tokens = sum(len(split_tokens(m.get("content", ""))) for m in messages)
+            self._send_json(200, {
+                "id": "chatcmpl-mock", "object": "chat.completion", "model": body.get("model", "mock"),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": reply}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": len(tokens),
+                          "total_tokens": prompt_tokens + len(tokens)},
+            })
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            for token in tokens:
+                event = {"id": "chatcmpl-mock", "object": "chat.completion.chunk", "model": body.get("model", "mock"),
+                         "choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}]}
+                self._write_chunk(f"data: {json.dumps(event)}\n\n".encode("utf-8"))
+                if interval:
+                    time.sleep(interval)
+            self._write_chunk(b"data: [DONE]\n\n")
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # 客户端提前断开 (例如对冲请求中落败的一方)
+
+
+class _MockHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        if not isinstance(sys.exc_info()[1], (BrokenPipeError, ConnectionResetError)):
+            super().handle_error(request, client_address)  # 客户端断开连接是正常情况，不打印堆栈
+
+
+def make_server(settings: MockSettings, host: str = "127.0.0.1", port: int = 0) -> ThreadingHTTPServer:
+    handler = type("ChatHandler", (_ChatHandler,), {"settings": settings})
+    return _MockHTTPServer((host, port), handler)
+
+
+def start_mock_server(settings: Optional[MockSettings] = None, host: str = "127.0.0.1",
+                      port: int = 0) -> Tuple[ThreadingHTTPServer, str]:
+    """Serve in a background thread; returns (server, base_url). Stop with server.shutdown()."""
+    server = make_server(settings or MockSettings(), host, port)
+    threading.Thread(target=server.serve_forever, name="mock-openai", daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/v1"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock OpenAI-compatible /chat/completions server for benchmarks.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Delay before the first token / the reply.")
+    parser.add_argument("--tokens-per-second", type=float, default=0.0, help="Token pacing; 0 sends as fast as possible.")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with HTTP 500.")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Fraction of requests answered with HTTP 429.")
+    parser.add_argument("--retry-after", type=float, default=0.0, help="Retry-After seconds sent with injected 429s.")
+    parser.add_argument("--seed", type=int, help="Seed for error injection.")
+    args = parser.parse_args()
+
+    settings = MockSettings(args.latency_ms, args.tokens_per_second, args.error_rate, args.rate_limit_rate,
+                            args.retry_after, seed=args.seed)
+    server = make_server(settings, args.host, args.port)
+    print(f"Mock chat completions server on http://{args.host}:{server.server_address[1]}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
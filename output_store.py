@@ -0,0 +1,206 @@
+# output_store.py
+"""
+Web 端文件翻译结果的内容寻址存储。
+
+- 键 = sha256(上传文件内容的哈希 + 影响输出的全部设置)。同一文件以相同设置再次上传时直接返回已有结果，不调用上游。
+- 文件按内容哈希保存为 <OUTPUT_STORE_DIR>/objects/<前两位>/<sha256>，内容相同的结果只存一份；
+  索引 (键 -> 内容哈希、下载文件名、大小、时间) 保存在 SQLite (WAL) 中，serve.py 的多个 worker 共享。
+- 淘汰：超过 OUTPUT_STORE_TTL_SECONDS 未被访问的条目，以及总大小超过 OUTPUT_STORE_MAX_BYTES 时最久未访问的条目；
+  不再被任何条目引用的文件随之删除。
+- 内容哈希同时是下载的 ETag：文件内容不可变，浏览器和代理可以长期缓存 (见 app.py 的 /download/<digest>/<filename>)。
+"""
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+from checkpoints import document_hash
+
+try:
+    from config import OUTPUT_STORE_ENABLED, OUTPUT_STORE_DIR, OUTPUT_STORE_MAX_BYTES, OUTPUT_STORE_TTL_SECONDS
+except ImportError:
+    OUTPUT_STORE_ENABLED = True
+    OUTPUT_STORE_DIR = os.path.join("translated_output_web", "store")
+    OUTPUT_STORE_MAX_BYTES = 2 * 1024 ** 3
+    OUTPUT_STORE_TTL_SECONDS = 7 * 24 * 3600
+
+logger = logging.getLogger(__name__)
+
+# 修改输出格式 (例如 docx 引擎的行为) 时递增，旧条目自然失效
+OUTPUT_KEY_VERSION = 1
+# 两次淘汰检查之间至少间隔的秒数 (每次写入都会触发检查)
+_EVICTION_INTERVAL_SECONDS = 60
+
+
+def is_digest(value: str) -> bool:
+    return len(value) == 64 and all(c in "0123456789abcdef" for c in value)
+
+
+class OutputStore:
+    """Translated files addressed by (input document, settings), stored once per distinct content."""
+
+    def __init__(self, root: str = OUTPUT_STORE_DIR, max_bytes: int = OUTPUT_STORE_MAX_BYTES,
+                 ttl_seconds: int = OUTPUT_STORE_TTL_SECONDS):
+        self.root = os.path.abspath(root)
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._last_eviction = 0.0
+        self._counters = {"hits": 0, "misses": 0, "stored": 0, "deduplicated": 0, "evicted": 0}
+        os.makedirs(os.path.join(self.root, "objects"), exist_ok=True)
+        self._conn = sqlite3.connect(os.path.join(self.root, "index.sqlite3"), check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")  # 允许多个进程/线程同时读
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS outputs ("
+            " key TEXT PRIMARY KEY, digest TEXT NOT NULL, filename TEXT NOT NULL, size INTEGER NOT NULL,"
+            " created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_outputs_digest ON outputs(digest)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_outputs_accessed ON outputs(accessed_at)")
+        self._conn.commit()
+        logger.info(f"Output store: {self.root} (max {max_bytes} bytes, TTL {ttl_seconds}s).")
+
+    @staticmethod
+    def make_key(document_hash: str, settings: dict) -> str:
+        raw_key = json.dumps([OUTPUT_KEY_VERSION, document_hash, settings], sort_keys=True)
+        return hashlib.sha256(raw_key.encode("utf-8")).hexdigest()
+
+    def blob_path(self, digest: str) -> str:
+        return os.path.join(self.root, "objects", digest[:2], digest)
+
+    def _is_expired(self, accessed_at: float, now: float) -> bool:
+        return self.ttl_seconds > 0 and now - accessed_at > self.ttl_seconds
+
+    def get(self, key: str) -> Optional[dict]:
+        """The stored output for `key` ({"digest", "filename", "size"}), or None. Counts as an access."""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT digest, filename, size, accessed_at FROM outputs WHERE key = ?",
+                                     (key,)).fetchone()
+            if row is None or self._is_expired(row[3], now) or not os.path.exists(self.blob_path(row[0])):
+                if row is not None:  # 过期，或文件已被其他进程淘汰
+                    self._conn.execute("DELETE FROM outputs WHERE key = ?", (key,))
+                    self._conn.commit()
+                self._counters["misses"] += 1
+                return None
+            self._conn.execute("UPDATE outputs SET accessed_at = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self._counters["hits"] += 1
+        return {"digest": row[0], "filename": row[1], "size": row[2]}
+
+    def touch(self, digest: str) -> bool:
+        """Whether `digest` is still stored (for downloads); refreshes its entries' access time."""
+        with self._lock:
+            updated = self._conn.execute("UPDATE outputs SET accessed_at = ? WHERE digest = ?",
+                                         (time.time(), digest)).rowcount
+            self._conn.commit()
+        return bool(updated) and os.path.exists(self.blob_path(digest))
+
+    def put(self, key: str, filepath: str, filename: str) -> dict:
+        """Move `filepath` into the store under `key`; returns {"digest", "filename", "size"}."""
+        digest = document_hash(filepath)
+        size = os.path.getsize(filepath)
+        path = self.blob_path(digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        now = time.time()
+        with self._lock:
+            if os.path.exists(path):
+                os.remove(filepath)  # 内容相同的结果已存在：只增加一个索引条目
+                self._counters["deduplicated"] += 1
+            else:
+                shutil.move(filepath, path)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO outputs (key, digest, filename, size, created_at, accessed_at)"
+                " VALUES (?, ?, ?, ?, ?, ?)", (key, digest, filename, size, now, now))
+            self._conn.commit()
+            self._counters["stored"] += 1
+        self.evict()
+        return {"digest": digest, "filename": filename, "size": size}
+
+    def evict(self, force: bool = False) -> int:
+        """Drop expired entries, then least recently used content beyond max_bytes. Returns the number of files removed."""
+        now = time.time()
+        with self._lock:
+            if not force and now - self._last_eviction < _EVICTION_INTERVAL_SECONDS:
+                return 0
+            self._last_eviction = now
+            self._conn.execute("BEGIN IMMEDIATE")  # 与其他进程的写入互斥，删除文件前确认没有条目引用它
+            try:
+                if self.ttl_seconds > 0:
+                    self._conn.execute("DELETE FROM outputs WHERE accessed_at < ?", (now - self.ttl_seconds,))
+                rows = self._conn.execute(
+                    "SELECT digest, MAX(size), MAX(accessed_at) FROM outputs GROUP BY digest ORDER BY MAX(accessed_at) ASC"
+                ).fetchall()
+                total = sum(size for _, size, _ in rows)
+                for digest, size, _ in rows:
+                    if total <= self.max_bytes:
+                        break
+                    self._conn.execute("DELETE FROM outputs WHERE digest = ?", (digest,))
+                    total -= size
+                referenced = {digest for (digest,) in self._conn.execute("SELECT DISTINCT digest FROM outputs")}
+                removed = 0
+                objects = os.path.join(self.root, "objects")
+                for prefix in os.listdir(objects):
+                    directory = os.path.join(objects, prefix)
+                    for name in os.listdir(directory) if os.path.isdir(directory) else ():
+                        # 刚移入、尚未写入索引的文件 (其他进程的 put) 不删除
+                        path = os.path.join(directory, name)
+                        if name not in referenced and now - os.path.getmtime(path) > _EVICTION_INTERVAL_SECONDS:
+                            os.remove(path)
+                            removed += 1
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._counters["evicted"] += removed
+        if removed:
+            logger.info(f"Output store evicted {removed} file(s); {total} bytes stored.")
+        return removed
+
+    def snapshot(self) -> dict:
+        """Entries, distinct files and bytes stored, limits and counters, for /debug/output_store."""
+        with self._lock:
+            entries, files = self._conn.execute("SELECT COUNT(*), COUNT(DISTINCT digest) FROM outputs").fetchone()
+            (stored_bytes,) = self._conn.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM (SELECT MAX(size) AS size FROM outputs GROUP BY digest)"
+            ).fetchone()
+            return {"root": self.root, "entries": entries, "files": files, "bytes": stored_bytes,
+                    "max_bytes": self.max_bytes, "ttl_seconds": self.ttl_seconds, **self._counters}
+
+
+def purge_stale_files(directory: str, ttl_seconds: int = OUTPUT_STORE_TTL_SECONDS) -> int:
+    """Remove files directly in `directory` (outputs not managed by the store) older than ttl_seconds."""
+    if ttl_seconds <= 0:
+        return 0
+    cutoff = time.time() - ttl_seconds
+    removed = 0
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return 0
+    for name in names:
+        path = os.path.join(directory, name)
+        try:
+            if os.path.isfile(path) and os.path.getmtime(path) < cutoff:
+                os.remove(path)
+                removed += 1
+        except OSError:
+            pass
+    if removed:
+        logger.info(f"Removed {removed} stale output file(s) from {directory}.")
+    return removed
+
+
+def open_output_store() -> Optional[OutputStore]:
+    """The store configured by OUTPUT_STORE_*; None when OUTPUT_STORE_ENABLED is off."""
+    if not OUTPUT_STORE_ENABLED:
+        return None
+    store = OutputStore()
+    store.evict(force=True)
+    return store
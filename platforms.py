@@ -0,0 +1,251 @@
+# platforms.py
+import logging
+import os
+import signal
+import threading
+import time
+from collections import OrderedDict
+from types import MappingProxyType
+from typing import Mapping, NamedTuple, Optional
+
+# Import fallback configurations from config.py (ensure config.py is generic now)
+try:
+    from config import API_KEY as DEFAULT_FALLBACK_API_KEY, \
+                       BASE_URL as DEFAULT_FALLBACK_BASE_URL, \
+                       DEFAULT_MODEL as DEFAULT_FALLBACK_MODEL
+except ImportError:
+    logging.warning("config.py not found or missing default fallback constants. Global fallbacks will be None.")
+    DEFAULT_FALLBACK_API_KEY = None
+    DEFAULT_FALLBACK_BASE_URL = None
+    DEFAULT_FALLBACK_MODEL = None
+
+try:
+    from config import PLATFORM_ENV_FILE, PLATFORM_RELOAD_CHECK_SECONDS, TRANSLATOR_CACHE_SIZE
+except ImportError:
+    PLATFORM_ENV_FILE = ".env"
+    PLATFORM_RELOAD_CHECK_SECONDS = 2.0
+    TRANSLATOR_CACHE_SIZE = 32
+
+logger = logging.getLogger(__name__)
+
+# --- Platform-specific configuration ---
+PLATFORM_CONFIGS = {
+    "siliconflow": {
+        "api_key_env": "SILICONFLOW_API_KEY",
+        "base_url_env": "SILICONFLOW_BASE_URL",
+        "model_env": "SILICONFLOW_MODEL",
+        "default_base_url": "https://api.siliconflow.cn/v1",
+        "default_model": "THUDM/GLM-4-9B-0414" 
+    },
+    "deepseek": {
+        "api_key_env": "DEEPSEEK_API_KEY",
+        "base_url_env": "DEEPSEEK_BASE_URL",
+        "model_env": "DEEPSEEK_MODEL",
+        "default_base_url": "https://api.deepseek.com/v1",
+        "default_model": "deepseek-chat"
+    },
+    "moonshot": {
+        "api_key_env": "MOONSHOT_API_KEY",
+        "base_url_env": "MOONSHOT_BASE_URL",
+        "model_env": "MOONSHOT_MODEL",
+        "default_base_url": "https://api.moonshot.cn/v1",
+        "default_model": "moonshot-v1-8k"
+    },
+    "openai": {
+        "api_key_env": "OPENAI_API_KEY",
+        "base_url_env": "OPENAI_BASE_URL",
+        "model_env": "OPENAI_MODEL",
+        "default_base_url": "https://api.openai.com/v1",
+        "default_model": "gpt-3.5-turbo"
+    },
+    "ollama": {
+        "api_key_env": "OLLAMA_API_KEY", 
+        "base_url_env": "OLLAMA_BASE_URL",
+        "model_env": "OLLAMA_MODEL",
+        "default_base_url": "http://localhost:11434/v1",
+        "default_model": "llama3"
+    },
+    "modelscope": { 
+        "api_key_env": "MODELSCOPE_API_KEY",
+        "base_url_env": "MODELSCOPE_BASE_URL",
+        "model_env": "MODELSCOPE_MODEL",
+        "default_base_url": "https://api-inference.modelscope.cn/v1",
+        "default_model": "Qwen/Qwen2.5-72B-Instruct"
+    },
+    "openrouter": { 
+        "api_key_env": "OPENROUTER_API_KEY",
+        "base_url_env": "OPENROUTER_BASE_URL",
+        "model_env": "OPENROUTER_MODEL",
+        "default_base_url": "https://openrouter.ai/api/v1",
+        "default_model": "google/gemini-2.0-flash-exp:free"
+    }
+}
+
+
+
+class PlatformSettings(NamedTuple):
+    """Settings for one platform after .env > platform default > config.py resolution (frontend input not applied)."""
+    api_key: Optional[str]
+    base_url: Optional[str]
+    model: Optional[str]
+
+
+# 未知平台 (包括 'custom') 只使用 config.py 中的全局默认值
+CUSTOM_PLATFORM_ID = "custom"
+
+_registry: Optional[Mapping[str, PlatformSettings]] = None
+_registry_lock = threading.Lock()
+_env_mtime: Optional[float] = None
+_next_reload_check = 0.0
+_reload_requested = False  # 收到 SIGHUP：下一次 get_platform_registry() 重新加载
+_reload_callbacks = []
+
+
+def _env_file_mtime() -> Optional[float]:
+    try:
+        return os.path.getmtime(PLATFORM_ENV_FILE)
+    except OSError:
+        return None
+
+
+def _mask(api_key: Optional[str]) -> str:
+    if not api_key:
+        return "NOT SET"
+    return f"SET (ends ...{api_key[-4:]})" if len(api_key) > 4 else "PROVIDED (short)"
+
+
+def load_platform_registry() -> Mapping[str, PlatformSettings]:
+    """Resolve every known platform from the current environment into an immutable registry."""
+    global _registry, _env_mtime
+    registry = {CUSTOM_PLATFORM_ID: PlatformSettings(DEFAULT_FALLBACK_API_KEY, DEFAULT_FALLBACK_BASE_URL, DEFAULT_FALLBACK_MODEL)}
+    for platform_id, platform_config in PLATFORM_CONFIGS.items():
+        registry[platform_id] = PlatformSettings(
+            api_key=os.getenv(platform_config["api_key_env"]) or DEFAULT_FALLBACK_API_KEY,
+            base_url=os.getenv(platform_config["base_url_env"]) or platform_config.get("default_base_url") or DEFAULT_FALLBACK_BASE_URL,
+            model=os.getenv(platform_config["model_env"]) or platform_config.get("default_model") or DEFAULT_FALLBACK_MODEL,
+        )
+    with _registry_lock:
+        _registry = MappingProxyType(registry)
+        _env_mtime = _env_file_mtime()
+    for platform_id, settings in registry.items():
+        logger.info(f"Platform registry: {platform_id} - API Key: {_mask(settings.api_key)}, Base URL: {settings.base_url}, Model: {settings.model}")
+    return _registry
+
+
+def reload_platform_registry(reason: str = "manual") -> Mapping[str, PlatformSettings]:
+    """Re-read PLATFORM_ENV_FILE (values in the file win over the current environment) and rebuild the registry."""
+    logger.info(f"Reloading platform registry ({reason}).")
+    try:
+        from dotenv import load_dotenv
+        load_dotenv(dotenv_path=PLATFORM_ENV_FILE, override=True)
+    except ImportError:
+        logger.warning("python-dotenv not installed; reloading platform registry from the current environment only.")
+    registry = load_platform_registry()
+    clear_translator_cache()
+    for callback in _reload_callbacks:
+        callback()
+    return registry
+
+
+def on_registry_reload(callback):
+    """Register a callback run after every reload (e.g. to drop objects built from the old settings)."""
+    _reload_callbacks.append(callback)
+
+
+def get_platform_registry() -> Mapping[str, PlatformSettings]:
+    """
+    The current registry; reloads it after SIGHUP and checks the .env modification time at most every
+    PLATFORM_RELOAD_CHECK_SECONDS.
+    """
+    global _next_reload_check, _reload_requested
+    registry = _registry
+    if registry is None:
+        return load_platform_registry()
+    if _reload_requested:
+        _reload_requested = False
+        return reload_platform_registry("SIGHUP")
+    if PLATFORM_RELOAD_CHECK_SECONDS > 0:
+        now = time.monotonic()
+        if now >= _next_reload_check:
+            _next_reload_check = now + PLATFORM_RELOAD_CHECK_SECONDS
+            if _env_file_mtime() != _env_mtime:
+                return reload_platform_registry(f"{PLATFORM_ENV_FILE} changed")
+    return registry
+
+
+def _request_reload(signum, frame):
+    # 信号处理函数在主线程被打断的位置运行，那里可能正持有 _registry_lock / _translators_lock (不可重入)，
+    # 所以这里只设置标志，真正的重新加载由下一次 get_platform_registry() 完成
+    global _reload_requested
+    _reload_requested = True
+
+
+def install_reload_signal():
+    """Reload the registry after SIGHUP, on the next get_platform_registry() call (POSIX only; main thread only)."""
+    if not hasattr(signal, "SIGHUP"):
+        return
+    try:
+        signal.signal(signal.SIGHUP, _request_reload)
+    except ValueError:
+        logger.warning("Could not install SIGHUP handler for platform registry reload (not in main thread).")
+
+
+def resolve_platform_settings(api_platform, frontend_api_key, frontend_base_url, frontend_model):
+    """Resolve (api_key, base_url, model) for a request: frontend input > .env > platform default > config.py.
+
+    Returns (api_key, base_url, model, error_message); error_message is None when the configuration is usable.
+    Shared by the Flask view, the async server (async_app.py) and the multi-provider router (router.py).
+    The .env/default part comes from the startup-resolved registry, so this is a dict lookup per request.
+    """
+    registry = get_platform_registry()
+    settings = registry.get(api_platform) or registry[CUSTOM_PLATFORM_ID]
+    api_key_to_use = frontend_api_key or settings.api_key
+    base_url_to_use = frontend_base_url or settings.base_url
+    model_to_use = frontend_model or settings.model
+
+    # Validate final configurations
+    if not api_key_to_use:
+        err_msg = f"API Key for platform '{api_platform}' is ultimately missing. Please configure it via UI or .env file."
+        logger.error(err_msg)
+        return None, None, None, err_msg
+    if not base_url_to_use:
+        err_msg = f"Base URL for platform '{api_platform}' is ultimately missing. Please configure it."
+        logger.error(err_msg)
+        return None, None, None, err_msg
+    if not model_to_use:
+        err_msg = f"Model for platform '{api_platform}' is ultimately missing. Please configure it."
+        logger.error(err_msg)
+        return None, None, None, err_msg
+    return api_key_to_use, base_url_to_use, model_to_use, None
+
+
+# --- 翻译器实例缓存 ---
+# 翻译器构造时会创建缓存句柄、查找连接池等；按解析后的配置复用实例，LRU 上限 TRANSLATOR_CACHE_SIZE。
+# 注意：实例在请求之间共享，需要设置 progress_callback / chunk_concurrency 的调用者应先 copy.copy()。
+_translators = OrderedDict()
+_translators_lock = threading.Lock()
+
+
+def get_translator(api_platform, api_key, base_url, model, translator_class=None):
+    """A ready translator for the resolved config, constructed on first use. Raises ValueError like the constructor."""
+    if translator_class is None:
+        from translator import SiliconFlowTranslator # 延迟导入，避免循环依赖
+        translator_class = SiliconFlowTranslator
+    key = (translator_class, api_platform, api_key, base_url, model)
+    with _translators_lock:
+        translator = _translators.get(key)
+        if translator is not None:
+            _translators.move_to_end(key)
+            return translator
+    translator = translator_class(api_key=api_key, base_url=base_url, model=model, platform_id=api_platform)
+    with _translators_lock:
+        translator = _translators.setdefault(key, translator)
+        _translators.move_to_end(key)
+        while len(_translators) > TRANSLATOR_CACHE_SIZE:
+            _translators.popitem(last=False)
+    return translator
+
+
+def clear_translator_cache():
+    with _translators_lock:
+        _translators.clear()
@@ -0,0 +1,408 @@
+# rate_limiter.py
+import contextlib
+import contextvars
+import logging
+import random
+import threading
+import time
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+from tracing import span
+
+try:
+    from config import RATE_LIMIT_DEFAULT, PLATFORM_RATE_LIMITS, AIMD_INITIAL_WINDOW, AIMD_MIN_WINDOW, \
+                       AIMD_MAX_WINDOW, AIMD_DECREASE_FACTOR, RATE_LIMIT_MAX_RETRIES, \
+                       RATE_LIMIT_BACKOFF_BASE, RATE_LIMIT_BACKOFF_MAX, RATE_LIMIT_ACQUIRE_TIMEOUT, \
+                       RATE_LIMIT_MAX_OPEN_STREAMS
+except ImportError:
+    RATE_LIMIT_DEFAULT = {"rpm": 0, "tpm": 0}
+    PLATFORM_RATE_LIMITS = {}
+    AIMD_INITIAL_WINDOW = 4.0
+    AIMD_MIN_WINDOW = 1.0
+    AIMD_MAX_WINDOW = 64.0
+    AIMD_DECREASE_FACTOR = 0.5
+    RATE_LIMIT_MAX_RETRIES = 4
+    RATE_LIMIT_BACKOFF_BASE = 1.0
+    RATE_LIMIT_BACKOFF_MAX = 60.0
+    RATE_LIMIT_ACQUIRE_TIMEOUT = 60.0
+    RATE_LIMIT_MAX_OPEN_STREAMS = 64
+
+logger = logging.getLogger(__name__)
+
+# 这些状态码表示上游过载或限流，值得退避后重试
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+# 延迟超过 EWMA 的这个倍数时视为"不健康"，窗口停止增长
+_LATENCY_TOLERANCE = 2.0
+_EWMA_ALPHA = 0.2
+# 协程等待窗口或流名额时的轮询间隔 (线程通过条件变量等待 release() 的通知)
+_ASYNC_POLL_SECONDS = 0.05
+# 为 True 时 send_with_rate_limit 不重试：调用者 (路由器) 还有别的目标可以切换，重试交给它
+_retries_disabled = contextvars.ContextVar("rate_limit_retries_disabled", default=False)
+
+
+class RateLimitTimeout(Exception):
+    """acquire() could not get capacity within its timeout; the upstream is overloaded (or saturated by open streams)."""
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Retry-After may be a number of seconds or an HTTP date."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    import email.utils  # HTTP 日期格式很少见，延迟导入以免拖慢 CLI 启动
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+def backoff_delay(attempt: int) -> float:
+    """Jittered exponential backoff: base * 2^attempt, scaled by a random factor in [0.5, 1.5), capped."""
+    return min(RATE_LIMIT_BACKOFF_MAX, RATE_LIMIT_BACKOFF_BASE * (2 ** attempt) * random.uniform(0.5, 1.5))
+
+
+class TokenBucket:
+    """Refills continuously at `per_minute / 60` units per second up to `per_minute`. Not thread-safe on its own."""
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.tokens = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until `amount` units are available (0 if they are available now)."""
+        self._refill(now)
+        amount = min(amount, self.capacity)  # 超过容量的请求只需等到桶满
+        return 0.0 if self.tokens >= amount else (amount - self.tokens) / self.rate
+
+    def consume(self, amount: float):
+        self.tokens -= min(amount, self.capacity)
+
+
+class ProviderLimiter:
+    """
+    单个上游 (平台 + base_url) 的限流器，由所有线程和请求共享：
+    RPM/TPM 令牌桶 + Retry-After 冷却 + AIMD 并发窗口 + 打开的流的上限。
+    AIMD 窗口限制等待响应头的请求数；流在响应头到达后归还窗口，但一直占用一个流名额，直到响应体读完或被关闭。
+    """
+
+    def __init__(self, platform_id: str, rpm: float = 0, tpm: float = 0, base_url: str = "",
+                 max_open_streams: int = RATE_LIMIT_MAX_OPEN_STREAMS):
+        self.platform_id = platform_id
+        self.base_url = base_url
+        self.request_bucket = TokenBucket(rpm) if rpm else None
+        self.token_bucket = TokenBucket(tpm) if tpm else None
+        self.window = AIMD_INITIAL_WINDOW
+        self.in_flight = 0
+        self.max_open_streams = max_open_streams
+        self.open_streams = 0
+        self.blocked_until = 0.0
+        self.latency_ewma: Optional[float] = None
+        self.last_decrease = 0.0
+        self.stats = {"requests": 0, "successes": 0, "throttled_429": 0, "server_errors": 0,
+                      "retries": 0, "wait_seconds": 0.0, "acquire_timeouts": 0}
+        self._cond = threading.Condition()
+
+    def _try_acquire(self, estimated_tokens: int, stream: bool, started: float, now: float,
+                     timeout: float) -> Optional[Tuple[float, Optional[float]]]:
+        """
+        With self._cond held: admit one request (returns None), or return (wait, remaining) - seconds until the
+        buckets or cooldown allow it (0 if only the window or stream limit is full) and seconds left before timeout.
+        """
+        wait = self.blocked_until - now
+        if self.request_bucket is not None:
+            wait = max(wait, self.request_bucket.wait_time(1, now))
+        if self.token_bucket is not None:
+            wait = max(wait, self.token_bucket.wait_time(estimated_tokens, now))
+        stream_ok = not stream or not self.max_open_streams or self.open_streams < self.max_open_streams
+        if wait <= 0 and self.in_flight < max(1, int(self.window)) and stream_ok:
+            if self.request_bucket is not None:
+                self.request_bucket.consume(1)
+            if self.token_bucket is not None:
+                self.token_bucket.consume(estimated_tokens)
+            self.in_flight += 1
+            if stream:
+                self.open_streams += 1
+            self.stats["requests"] += 1
+            self.stats["wait_seconds"] += now - started
+            return None
+        remaining = started + timeout - now if timeout > 0 else None
+        if remaining is not None and remaining <= 0:
+            self.stats["acquire_timeouts"] += 1
+            self.stats["wait_seconds"] += now - started
+            raise RateLimitTimeout(f"no capacity for {self.name} within {timeout:g}s "
+                                   f"(in flight {self.in_flight}/{max(1, int(self.window))}, "
+                                   f"open streams {self.open_streams}/{self.max_open_streams or 'unlimited'})")
+        return max(0.0, wait), remaining
+
+    def acquire(self, estimated_tokens: int = 0, stream: bool = False, timeout: float = RATE_LIMIT_ACQUIRE_TIMEOUT):
+        """
+        Block until the buckets, any Retry-After cooldown and the concurrency window (and, for a stream, the open
+        stream limit) all allow one more request. Raises RateLimitTimeout after `timeout` seconds (0 = no limit).
+        A stream admitted here must also be ended with release_stream().
+        """
+        started = time.monotonic()
+        with self._cond:
+            while True:
+                pending = self._try_acquire(estimated_tokens, stream, started, time.monotonic(), timeout)
+                if pending is None:
+                    return
+                wait, remaining = pending
+                # 窗口或流名额已满时等待 release() / release_stream() 的通知；否则等到令牌足够或冷却结束
+                wait = wait or 1.0
+                self._cond.wait(timeout=min(wait, remaining) if remaining is not None else wait)
+
+    async def aacquire(self, estimated_tokens: int = 0, stream: bool = False,
+                       timeout: float = RATE_LIMIT_ACQUIRE_TIMEOUT):
+        """acquire() for coroutines (async_translator.py): sleeps on the event loop instead of blocking a thread."""
+        import asyncio  # 只有异步服务需要，延迟导入以免拖慢 CLI 启动
+        started = time.monotonic()
+        while True:
+            with self._cond:
+                pending = self._try_acquire(estimated_tokens, stream, started, time.monotonic(), timeout)
+            if pending is None:
+                return
+            wait, remaining = pending
+            wait = wait or _ASYNC_POLL_SECONDS
+            await asyncio.sleep(min(wait, remaining) if remaining is not None else wait)
+
+    def release_stream(self):
+        """End a stream admitted with acquire(stream=True): its body has been read to the end or closed."""
+        with self._cond:
+            self.open_streams = max(0, self.open_streams - 1)
+            self._cond.notify_all()
+
+    def release(self, status_code: Optional[int], latency: float, retry_after: Optional[float] = None):
+        """Record the outcome of a request started with acquire() and adjust the window."""
+        with self._cond:
+            self.in_flight = max(0, self.in_flight - 1)
+            now = time.monotonic()
+            if status_code in RETRYABLE_STATUS_CODES:
+                self.stats["throttled_429" if status_code == 429 else "server_errors"] += 1
+                if retry_after:
+                    self.blocked_until = max(self.blocked_until, now + retry_after)
+                # 每个往返时间最多减半一次，避免同一波 429 把窗口压到最小
+                if now - self.last_decrease > (self.latency_ewma or 1.0):
+                    old_window = self.window
+                    self.window = max(AIMD_MIN_WINDOW, self.window * AIMD_DECREASE_FACTOR)
+                    self.last_decrease = now
+                    logger.warning(f"Rate limiter [{self.name}]: HTTP {status_code}, window {old_window:.1f} -> {self.window:.1f}" + (f", cooling down {retry_after:.1f}s" if retry_after else ""))
+            elif status_code is not None and status_code < 400:
+                self.stats["successes"] += 1
+                healthy = self.latency_ewma is None or latency <= self.latency_ewma * _LATENCY_TOLERANCE
+                self.latency_ewma = latency if self.latency_ewma is None else \
+                    (1 - _EWMA_ALPHA) * self.latency_ewma + _EWMA_ALPHA * latency
+                if healthy:
+                    self.window = min(AIMD_MAX_WINDOW, self.window + 1.0 / self.window)
+            self._cond.notify_all()
+
+    @property
+    def name(self) -> str:
+        return f"{self.platform_id}@{self.base_url}" if self.base_url else self.platform_id
+
+    def record_retry(self):
+        with self._cond:
+            self.stats["retries"] += 1
+
+    def snapshot(self) -> dict:
+        with self._cond:
+            now = time.monotonic()
+            return {
+                "platform_id": self.platform_id,
+                "base_url": self.base_url,
+                "window": round(self.window, 2),
+                "in_flight": self.in_flight,
+                "open_streams": self.open_streams,
+                "max_open_streams": self.max_open_streams,
+                "cooldown_remaining": round(max(0.0, self.blocked_until - now), 2),
+                "latency_ewma": round(self.latency_ewma, 3) if self.latency_ewma is not None else None,
+                "rpm_available": round(self.request_bucket.tokens, 1) if self.request_bucket else None,
+                "tpm_available": round(self.token_bucket.tokens, 1) if self.token_bucket else None,
+                "stats": dict(self.stats, wait_seconds=round(self.stats["wait_seconds"], 3)),
+            }
+
+
+_limiters: Dict[Tuple[str, str], ProviderLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(platform_id: str, base_url: Optional[str] = None) -> ProviderLimiter:
+    """
+    The limiter for one upstream. Keyed by (platform_id, base_url): "custom" endpoints (and platforms pointed at a
+    different base_url) get their own buckets and window; the limits come from PLATFORM_RATE_LIMITS[platform_id].
+    """
+    key = (platform_id, (base_url or "").rstrip("/"))
+    limiter = _limiters.get(key)
+    if limiter is None:
+        with _limiters_lock:
+            limiter = _limiters.get(key)
+            if limiter is None:
+                limits = dict(RATE_LIMIT_DEFAULT, **PLATFORM_RATE_LIMITS.get(platform_id, {}))
+                limiter = ProviderLimiter(platform_id, rpm=limits.get("rpm", 0), tpm=limits.get("tpm", 0), base_url=key[1])
+                _limiters[key] = limiter
+                logger.info(f"Rate limiter created for {limiter.name}: rpm={limits.get('rpm') or 'unlimited'}, tpm={limits.get('tpm') or 'unlimited'}, initial window {AIMD_INITIAL_WINDOW}")
+    return limiter
+
+
+def rate_limiter_snapshot() -> Dict[str, dict]:
+    """State of every limiter, for the /debug/rate_limits endpoint and logs."""
+    with _limiters_lock:
+        limiters = list(_limiters.values())
+    return {limiter.name: limiter.snapshot() for limiter in limiters}
+
+
+class _SlotRaw:
+    """
+    Proxy for a streaming response's urllib3 raw object (like metrics.MeteredRaw) that holds the limiter's open
+    stream slot until the body has been read to the end or the response is closed.
+    """
+
+    def __init__(self, raw, release: Callable[[], None]):
+        self._raw = raw
+        self._release = release
+        self._released = False
+        self._lock = threading.Lock()
+
+    def _done(self):
+        with self._lock:
+            if self._released:
+                return
+            self._released = True
+        self._release()
+
+    def stream(self, amt=2 ** 16, decode_content=None):
+        try:
+            yield from self._raw.stream(amt, decode_content=decode_content)
+        finally:
+            self._done()
+
+    def read(self, *args, **kwargs):
+        data = self._raw.read(*args, **kwargs)
+        if not data:
+            self._done()
+        return data
+
+    def close(self):
+        self._done()
+        return self._raw.close()
+
+    def release_conn(self):
+        self._done()
+        release_conn = getattr(self._raw, "release_conn", None)
+        if release_conn is not None:
+            release_conn()
+
+    def __del__(self):
+        self._done()  # 调用者忘记关闭响应时也不能永久占用窗口
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+
+@contextlib.contextmanager
+def without_rate_limit_retries():
+    """Send each request once inside this block; a 429/5xx is returned at once so the caller can fail over instead."""
+    token = _retries_disabled.set(True)
+    try:
+        yield
+    finally:
+        _retries_disabled.reset(token)
+
+
+def send_with_rate_limit(limiter: ProviderLimiter, send: Callable[[], "requests.Response"], estimated_tokens: int = 0,
+                         max_retries: int = RATE_LIMIT_MAX_RETRIES, stream: bool = False):
+    """
+    在限流器的许可下调用 send()，遇到 429/5xx 时按 Retry-After 或带抖动的指数退避重试。
+    返回最后一次的 Response (可能仍是错误状态，交给调用者按原逻辑处理)；网络异常原样抛出，
+    等不到许可时抛出 RateLimitTimeout。
+    stream=True 时并发窗口在响应头到达时归还，成功的响应占用一个流名额，直到响应体读完或响应被关闭。
+    这是唯一的重试层：外层 (分块重试、路由切换、对冲) 不再对 429/5xx 重试同一个目标。
+    """
+    if _retries_disabled.get():
+        max_retries = 0
+    attempt = 0
+    while True:
+        with span("rate_limit_wait", platform=limiter.platform_id):
+            limiter.acquire(estimated_tokens, stream=stream)
+        started = time.monotonic()
+        with span("upstream_request", platform=limiter.platform_id, attempt=attempt + 1) as request_span:
+            sent_at = time.perf_counter()
+            try:
+                response = send()
+            except Exception:
+                limiter.release(None, time.monotonic() - started)
+                if stream:
+                    limiter.release_stream()
+                raise
+            request_span.set(status=response.status_code)
+            elapsed = getattr(response, "elapsed", None)
+            if elapsed is not None:  # requests 从发送到解析完响应头的耗时
+                request_span.mark("response_headers", sent_at + elapsed.total_seconds())
+        retry_after = parse_retry_after(response.headers.get("Retry-After"))
+        latency = time.monotonic() - started
+        final = response.status_code not in RETRYABLE_STATUS_CODES or attempt >= max_retries
+        limiter.release(response.status_code, latency, retry_after)
+        if stream:
+            if final and response.status_code < 400:
+                response.raw = _SlotRaw(response.raw, limiter.release_stream)  # 流名额在流结束时归还
+            else:
+                limiter.release_stream()
+        if final:
+            return response
+        delay = max(retry_after or 0.0, backoff_delay(attempt))
+        attempt += 1
+        limiter.record_retry()
+        logger.warning(f"HTTP {response.status_code} from {limiter.name}; retry {attempt}/{max_retries} in {delay:.1f}s.")
+        response.close()
+        with span("rate_limit_backoff", platform=limiter.platform_id, seconds=delay):
+            time.sleep(delay)
+
+
+async def asend_with_rate_limit(limiter: ProviderLimiter, send: Callable[[], Awaitable["aiohttp.ClientResponse"]],
+                                estimated_tokens: int = 0, max_retries: int = RATE_LIMIT_MAX_RETRIES,
+                                stream: bool = False):
+    """
+    send_with_rate_limit 的 aiohttp 版本：send() 返回未读取的 aiohttp.ClientResponse，重试和退避规则相同。
+    stream=True 且最终响应成功时，调用者在读完或放弃响应体后必须调用 limiter.release_stream()。
+    """
+    import asyncio  # 只有异步服务需要，延迟导入以免拖慢 CLI 启动
+    if _retries_disabled.get():
+        max_retries = 0
+    attempt = 0
+    while True:
+        with span("rate_limit_wait", platform=limiter.platform_id):
+            await limiter.aacquire(estimated_tokens, stream=stream)
+        started = time.monotonic()
+        with span("upstream_request", platform=limiter.platform_id, attempt=attempt + 1) as request_span:
+            try:
+                response = await send()
+            except BaseException:  # 包括客户端断开时的 CancelledError
+                limiter.release(None, time.monotonic() - started)
+                if stream:
+                    limiter.release_stream()
+                raise
+            request_span.set(status=response.status)
+            request_span.mark("response_headers")
+        retry_after = parse_retry_after(response.headers.get("Retry-After"))
+        final = response.status not in RETRYABLE_STATUS_CODES or attempt >= max_retries
+        limiter.release(response.status, time.monotonic() - started, retry_after)
+        if stream and not (final and response.status < 400):
+            limiter.release_stream()
+        if final:
+            return response
+        delay = max(retry_after or 0.0, backoff_delay(attempt))
+        attempt += 1
+        limiter.record_retry()
+        logger.warning(f"HTTP {response.status} from {limiter.name}; retry {attempt}/{max_retries} in {delay:.1f}s.")
+        response.release()
+        with span("rate_limit_backoff", platform=limiter.platform_id, seconds=delay):
+            await asyncio.sleep(delay)
@@ -0,0 +1,292 @@
+# router.py
+import contextlib
+import logging
+import random
+import threading
+import time
+from collections import deque
+from typing import List, Optional
+
+import requests
+
+from platforms import get_translator, on_registry_reload, resolve_platform_settings
+from rate_limiter import without_rate_limit_retries
+from token_budget import max_input_tokens, pack_chunks
+from translator import is_translation_error
+
+try:
+    from config import ROUTING_TARGETS, ROUTING_MODE, ROUTING_HEALTH_WINDOW, CIRCUIT_ERROR_RATE_THRESHOLD, \
+                       CIRCUIT_MIN_SAMPLES, CIRCUIT_CONSECUTIVE_FAILURES, CIRCUIT_OPEN_SECONDS
+except ImportError:
+    ROUTING_TARGETS = ""
+    ROUTING_MODE = "ordered"
+    ROUTING_HEALTH_WINDOW = 50
+    CIRCUIT_ERROR_RATE_THRESHOLD = 0.5
+    CIRCUIT_MIN_SAMPLES = 5
+    CIRCUIT_CONSECUTIVE_FAILURES = 3
+    CIRCUIT_OPEN_SECONDS = 30.0
+
+logger = logging.getLogger(__name__)
+
+ROUTER_PLATFORM_ID = "router"
+ROUTING_MODES = ("ordered", "weighted", "latency")
+
+# 熔断器状态
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class TargetHealth:
+    """Rolling latency/error statistics and a circuit breaker for one (platform, model) target."""
+
+    def __init__(self, window: int = ROUTING_HEALTH_WINDOW):
+        self.samples = deque(maxlen=window)  # (ok, latency)
+        self.consecutive_failures = 0
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def available(self) -> bool:
+        """Whether allow_request() would let a request through right now (no side effects, for ordering)."""
+        with self._lock:
+            if self.state == OPEN:
+                return time.monotonic() - self.opened_at >= CIRCUIT_OPEN_SECONDS
+            return self.state == CLOSED or not self.probe_in_flight
+
+    def allow_request(self) -> bool:
+        """Admit a request; in the half-open state this claims the single probe, so call it only right before trying."""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and time.monotonic() - self.opened_at >= CIRCUIT_OPEN_SECONDS:
+                self.state = HALF_OPEN
+                self.probe_in_flight = False
+            if self.state == HALF_OPEN and not self.probe_in_flight:
+                self.probe_in_flight = True  # 半开状态只放行一个探测请求
+                return True
+            return False
+
+    def record(self, ok: bool, latency: float) -> Optional[str]:
+        """Record an outcome; returns the new breaker state if it changed."""
+        with self._lock:
+            previous = self.state
+            self.samples.append((ok, latency))
+            if ok:
+                self.consecutive_failures = 0
+                if self.state == HALF_OPEN:
+                    self.state = CLOSED
+                    self.samples.clear()
+            else:
+                self.consecutive_failures += 1
+                if self.state == HALF_OPEN or self.consecutive_failures >= CIRCUIT_CONSECUTIVE_FAILURES or \
+                   (len(self.samples) >= CIRCUIT_MIN_SAMPLES and self._error_rate() >= CIRCUIT_ERROR_RATE_THRESHOLD):
+                    self.state = OPEN
+                    self.opened_at = time.monotonic()
+            self.probe_in_flight = False
+            return self.state if self.state != previous else None
+
+    def _error_rate(self) -> float:
+        return sum(1 for ok, _ in self.samples if not ok) / len(self.samples) if self.samples else 0.0
+
+    def latency(self) -> Optional[float]:
+        """Median latency of recent successful requests."""
+        with self._lock:
+            latencies = sorted(latency for ok, latency in self.samples if ok)
+        return latencies[len(latencies) // 2] if latencies else None
+
+    def snapshot(self) -> dict:
+        latency = self.latency()
+        with self._lock:
+            return {"state": self.state, "samples": len(self.samples), "error_rate": round(self._error_rate(), 3),
+                    "consecutive_failures": self.consecutive_failures,
+                    "median_latency": round(latency, 3) if latency is not None else None}
+
+
+class RouteTarget:
+    def __init__(self, translator, weight: float = 1.0):
+        self.translator = translator
+        self.weight = weight
+        self.health = TargetHealth()
+
+    @property
+    def name(self) -> str:
+        return f"{self.translator.platform_id}:{self.translator.model}"
+
+
+class RoutingTranslator:
+    """
+    在一组 (平台, 模型) 目标之间路由翻译请求，对外提供与 SiliconFlowTranslator 相同的接口
+    (translate / translate_chunks / translate_batch / pack_chunks)，所以文件翻译逻辑无需改动。
+
+    每个请求按路由模式挑选目标；失败时透明地切换到下一个健康目标。文件翻译的每个分块
+    都独立路由，因此某个平台在任务中途出问题时，剩余分块会自动转到其他平台。
+    """
+
+    def __init__(self, targets: List[RouteTarget], mode: str = ROUTING_MODE):
+        if not targets:
+            raise ValueError("Routing requires at least one target.")
+        if mode not in ROUTING_MODES:
+            raise ValueError(f"Unknown routing mode '{mode}'. Use one of: {', '.join(ROUTING_MODES)}.")
+        self.targets = targets
+        self.mode = mode
+        self.platform_id = ROUTER_PLATFORM_ID
+        self.model = ",".join(target.name for target in targets)
+        self.cache = None  # 缓存由各目标翻译器自己处理
+        self.chunk_concurrency: Optional[int] = None
+        self.progress_callback = None
+        self.journal = None
+        logger.info(f"Routing translator initialized. Mode: {mode}, targets: {self.model}")
+
+    def _candidates(self) -> List[RouteTarget]:
+        """Targets in the order they should be tried. Targets with an open circuit go last (used only if all else fails)."""
+        if self.mode == "weighted":
+            # 按权重无放回抽样得到尝试顺序
+            pool, ordered = list(self.targets), []
+            while pool:
+                chosen = random.choices(pool, weights=[t.weight for t in pool])[0]
+                pool.remove(chosen)
+                ordered.append(chosen)
+        elif self.mode == "latency":
+            ordered = sorted(self.targets, key=lambda t: (t.health.latency() is None, t.health.latency() or 0.0))
+        else:
+            ordered = list(self.targets)
+        return sorted(ordered, key=lambda t: not t.health.available())
+
+    def _attempts(self):
+        """
+        (target, fallback) pairs to try, lazily: allow_request() runs only when the previous target has failed, so a
+        half-open target's probe slot is not claimed unless it is actually tried. If every circuit refuses, all are tried.
+        `fallback` tells whether another target could still take over; see _attempt_scope().
+        """
+        ordered = self._candidates()
+        refused = []
+        for position, target in enumerate(ordered):
+            if target.health.allow_request():
+                yield target, any(t.health.available() for t in ordered[position + 1:])
+            else:
+                refused.append(target)
+        if len(refused) == len(ordered):
+            for position, target in enumerate(refused):
+                yield target, position < len(refused) - 1
+
+    @staticmethod
+    def _attempt_scope(fallback: bool):
+        """
+        While another target can take over, a 429/5xx fails over at once instead of being retried by the target's
+        rate limiter first; only the last target gets the limiter's retries, so retries never stack with failover.
+        """
+        return without_rate_limit_retries() if fallback else contextlib.nullcontext()
+
+    def _record(self, target: RouteTarget, ok: bool, started: float):
+        new_state = target.health.record(ok, time.monotonic() - started)
+        if new_state == OPEN:
+            logger.warning(f"Circuit OPEN for routing target {target.name}; traffic fails over for {CIRCUIT_OPEN_SECONDS:.0f}s.")
+        elif new_state == CLOSED:
+            logger.info(f"Circuit CLOSED again for routing target {target.name}.")
+
+    def translate(self, text: str, target_lang: str, source_lang: Optional[str] = None, stream: bool = False):
+        last_result = None
+        for target, fallback in self._attempts():
+            started = time.monotonic()
+            with self._attempt_scope(fallback):
+                result = target.translator.translate(text, target_lang, source_lang, stream=stream)
+            # 流式：拿到 requests.Response 即视为成功 (延迟 = 响应头到达时间)；流中途的错误无法再切换
+            ok = isinstance(result, requests.Response) if stream else not is_translation_error(result)
+            self._record(target, ok, started)
+            if ok:
+                return result
+            logger.warning(f"Routing target {target.name} failed; trying next target. Error: {str(result)[:200]}")
+            last_result = result
+        return last_result
+
+    def translate_chunks(self, chunks: List[str], target_lang: str, source_lang: Optional[str] = None,
+                         on_chunk_done=None) -> List[str]:
+        from chunk_executor import translate_chunks # 延迟导入，避免循环依赖
+        return translate_chunks(self, chunks, target_lang, source_lang, on_chunk_done=on_chunk_done)
+
+    def translate_batch(self, segments: List[str], target_lang: str, source_lang: Optional[str] = None) -> List[str]:
+        """Batch on the preferred target; segments that still fail are retried on the following targets."""
+        results = list(segments)
+        pending = list(range(len(segments)))
+        for target, fallback in self._attempts():
+            started = time.monotonic()
+            with self._attempt_scope(fallback):
+                translations = target.translator.translate_batch([segments[i] for i in pending], target_lang, source_lang)
+            failed = []
+            for index, translation in zip(pending, translations):
+                results[index] = translation
+                if is_translation_error(translation):
+                    failed.append(index)
+            self._record(target, len(failed) < len(pending) or not pending, started)
+            if not failed:
+                break
+            logger.warning(f"{len(failed)} segment(s) failed on routing target {target.name}; failing over.")
+            pending = failed
+        return results
+
+    def pack_chunks(self, paragraphs: List[str]) -> List[str]:
+        # 分块必须能被池中任何一个目标处理，所以取最小的预算
+        return pack_chunks(paragraphs, max_tokens=min(max_input_tokens(t.translator.model) for t in self.targets))
+
+    def snapshot(self) -> dict:
+        return {"mode": self.mode, "targets": {t.name: dict(t.health.snapshot(), weight=t.weight) for t in self.targets}}
+
+
+def parse_route_spec(spec: str) -> List[tuple]:
+    """Parse "platform[:model][@weight], ..." into [(platform, model or None, weight), ...]."""
+    entries = []
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        weight = 1.0
+        if "@" in item:
+            item, weight_str = item.rsplit("@", 1)
+            try:
+                weight = float(weight_str)
+            except ValueError:
+                raise ValueError(f"Invalid weight '{weight_str}' in routing target '{item}'.")
+        platform, _, model = item.partition(":")
+        entries.append((platform.strip(), model.strip() or None, weight))
+    return entries
+
+
+# 每个 (spec, mode) 对应一个共享的路由器，让健康统计和熔断状态跨请求保留
+_routers = {}
+_routers_lock = threading.Lock()
+
+
+def get_router(spec: Optional[str] = None, mode: Optional[str] = None) -> RoutingTranslator:
+    """Build (or reuse) a RoutingTranslator; API keys and base URLs are resolved like single-platform requests."""
+    spec = (spec or ROUTING_TARGETS).strip()
+    mode = mode or ROUTING_MODE
+    if not spec:
+        raise ValueError("No routing targets configured. Set ROUTING_TARGETS in .env or pass route targets explicitly.")
+    key = (spec, mode)
+    with _routers_lock:
+        router = _routers.get(key)
+        if router is None:
+            targets = []
+            for platform, model, weight in parse_route_spec(spec):
+                api_key, base_url, resolved_model, error = resolve_platform_settings(platform, "", "", model or "")
+                if error:
+                    raise ValueError(f"Routing target '{platform}': {error}")
+                targets.append(RouteTarget(get_translator(platform, api_key, base_url, resolved_model), weight))
+            router = RoutingTranslator(targets, mode)
+            _routers[key] = router
+        return router
+
+
+def _clear_routers():
+    with _routers_lock:
+        _routers.clear()
+
+
+on_registry_reload(_clear_routers) # 平台配置重新加载后按新的 Key/URL 重建路由器
+
+
+def routing_snapshot() -> dict:
+    with _routers_lock:
+        return {f"{spec} [{mode}]": router.snapshot() for (spec, mode), router in _routers.items()}
@@ -0,0 +1,102 @@
+# serve.py
+"""
+生产服务入口：gunicorn 多进程 (SERVER_WORKERS) + 每进程多线程 (SERVER_THREADS)，默认 gthread worker，
+每个 SSE 流只占用一个线程，不会像 Werkzeug 开发服务器那样在并发流下卡住。
+
+- 共享状态：翻译缓存 (TRANSLATION_CACHE_DB)、任务存储 (JOB_STORE_DB)、上传文件和检查点都在磁盘上，
+  任何 worker 都能查询、推送和续传其他 worker 创建的任务。
+- 优雅关闭 / 重载 (SIGTERM / SIGHUP 给主进程)：worker 停止接受新连接，正在进行的翻译流照常结束，
+  任务事件流让浏览器重连到其他 worker，排队中的任务标记为中断 (可续传)，最多等待 SERVER_GRACEFUL_TIMEOUT 秒。
+- 限流器、连接池和 /metrics 计数是每个 worker 进程各自一份。
+- 不使用 preload_app：每个 worker 在 fork 之后导入 app，各自打开 SQLite 连接。
+
+    python serve.py --workers 4 --threads 64
+    gunicorn -c serve.py app:app        # 也可以直接作为 gunicorn 配置文件
+
+开发时仍可使用 python app.py (调试模式、自动重载、自动打开浏览器)。
+需要 gunicorn (Linux / macOS)：pip install gunicorn
+"""
+import argparse
+import signal
+import sys
+
+try:
+    from config import SERVER_BIND, SERVER_WORKERS, SERVER_THREADS, SERVER_WORKER_CLASS, SERVER_TIMEOUT, \
+                       SERVER_GRACEFUL_TIMEOUT, SERVER_KEEPALIVE
+except ImportError:
+    SERVER_BIND = "0.0.0.0:5000"
+    SERVER_WORKERS = 2
+    SERVER_THREADS = 32
+    SERVER_WORKER_CLASS = "gthread"
+    SERVER_TIMEOUT = 120
+    SERVER_GRACEFUL_TIMEOUT = 60
+    SERVER_KEEPALIVE = 5
+
+# ---- gunicorn 配置 (gunicorn -c serve.py 时按模块变量读取) ----
+bind = SERVER_BIND
+workers = SERVER_WORKERS
+threads = SERVER_THREADS
+worker_class = SERVER_WORKER_CLASS
+timeout = SERVER_TIMEOUT
+graceful_timeout = SERVER_GRACEFUL_TIMEOUT
+keepalive = SERVER_KEEPALIVE
+preload_app = False
+accesslog = "-"
+errorlog = "-"
+
+
+def post_worker_init(worker):
+    """Chain our drain step in front of the worker's SIGTERM handler (graceful stop and reload)."""
+    import app as translator_app
+    stop_worker = worker.handle_exit
+
+    def handle_exit(sig, frame):
+        translator_app.begin_drain()
+        stop_worker(sig, frame)
+
+    signal.signal(signal.SIGTERM, handle_exit)
+    worker.log.info(f"Worker {worker.pid} ready ({worker.cfg.worker_class_str}, {worker.cfg.threads} thread(s)).")
+
+
+def gunicorn_options(args) -> dict:
+    return {
+        "bind": args.bind, "workers": args.workers, "threads": args.threads, "worker_class": args.worker_class,
+        "timeout": timeout, "graceful_timeout": args.graceful_timeout, "keepalive": keepalive,
+        "preload_app": preload_app, "accesslog": accesslog, "errorlog": errorlog,
+        "post_worker_init": post_worker_init,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Production server for the translator web UI (gunicorn).")
+    parser.add_argument("--bind", default=bind, help=f"Address to listen on (default: {bind}).")
+    parser.add_argument("--workers", type=int, default=workers, help=f"Worker processes (default: {workers}).")
+    parser.add_argument("--threads", type=int, default=threads,
+                        help=f"Threads per worker, i.e. concurrent streams per worker (default: {threads}).")
+    parser.add_argument("--worker-class", default=worker_class,
+                        help=f"gunicorn worker class: gthread, or gevent/eventlet if installed (default: {worker_class}).")
+    parser.add_argument("--graceful-timeout", type=int, default=graceful_timeout,
+                        help=f"Seconds to let in-flight streams and jobs finish on shutdown (default: {graceful_timeout}).")
+    args = parser.parse_args()
+
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        print("gunicorn is required for the production server (Linux/macOS): pip install gunicorn\n"
+              "For local development use: python app.py", file=sys.stderr)
+        sys.exit(1)
+
+    class TranslatorApplication(BaseApplication):
+        def load_config(self):
+            for key, value in gunicorn_options(args).items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            from app import app
+            return app
+
+    TranslatorApplication().run()
+
+
+if __name__ == "__main__":
+    main()
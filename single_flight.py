@@ -0,0 +1,275 @@
+# single_flight.py
+"""
+相同请求合并 (single-flight)：键为 (平台、base_url、模型、语言对、文本哈希)，并发的相同请求只发出一个上游调用。
+
+- 非流式：跟随者等待领头请求的结果 (译文或错误字符串)。
+- 流式：每个订阅者拿到自己的 requests.Response，内容来自同一个上游 SSE 流；中途加入的订阅者先收到
+  已缓冲的前缀，再实时收到后续增量。上游由读得最快的订阅者驱动 (不额外开线程)，慢的订阅者从缓冲区回放；
+  最后一个订阅者关闭时才关闭上游连接。
+
+请求结束后立即移出注册表，之后的相同请求由翻译缓存接手。对冲请求 (hedging.py) 用 bypass_single_flight()
+跳过合并，否则对冲的第二个请求会挂到第一个请求上。
+"""
+import contextlib
+import contextvars
+import logging
+import threading
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+try:
+    from config import SINGLE_FLIGHT_ENABLED, SINGLE_FLIGHT_READ_SIZE
+except ImportError:
+    SINGLE_FLIGHT_ENABLED = True
+    SINGLE_FLIGHT_READ_SIZE = 1024
+
+logger = logging.getLogger(__name__)
+
+_bypass: contextvars.ContextVar = contextvars.ContextVar("single_flight_bypass", default=False)
+
+
+@contextlib.contextmanager
+def bypass_single_flight():
+    """Requests made inside this block always go upstream (used for hedge attempts)."""
+    token = _bypass.set(True)
+    try:
+        yield
+    finally:
+        _bypass.reset(token)
+
+
+class SharedStream:
+    """One upstream streaming response fanned out to any number of subscribers, each reading from the first byte."""
+
+    def __init__(self, response, on_finished: Callable[[], None]):
+        self.response = response
+        self._source = response.iter_content(chunk_size=SINGLE_FLIGHT_READ_SIZE)
+        self._chunks = []
+        self._cond = threading.Condition()
+        self._reading = False   # 某个订阅者正在从上游读取下一块
+        self._finished = False  # 上游已读完、出错或被取消
+        self._error = None
+        self._subscribers = 0
+        self._on_finished = on_finished
+
+    @property
+    def subscribers(self) -> int:
+        return self._subscribers
+
+    def subscribe(self):
+        """A new requests.Response over this stream, or None if the stream was already cancelled."""
+        import requests
+        with self._cond:
+            if self._finished and self._error is not None:
+                return None
+            self._subscribers += 1
+        subscriber = requests.Response()
+        subscriber.status_code = self.response.status_code
+        subscriber.headers.update(self.response.headers)
+        subscriber.encoding = self.response.encoding
+        subscriber.url = self.response.url
+        subscriber.raw = _SubscriberRaw(self)
+        return subscriber
+
+    def chunk(self, index: int, reader: "_SubscriberRaw") -> Optional[bytes]:
+        """Chunk number `index`, read from upstream if no other subscriber is already doing so; None at the end."""
+        while True:
+            with self._cond:
+                while index >= len(self._chunks) and self._reading and not self._finished and not reader.closed:
+                    self._cond.wait()
+                if index < len(self._chunks):
+                    return self._chunks[index]
+                if reader.closed:
+                    return None
+                if self._finished:
+                    if self._error is not None:
+                        raise self._error
+                    return None
+                self._reading = True
+            chunk, error = None, None
+            try:
+                chunk = next(self._source, None)
+            except Exception as e:
+                error = e
+            with self._cond:
+                self._reading = False
+                if chunk is None:
+                    self._finished = True
+                    self._error = error
+                elif chunk:
+                    self._chunks.append(chunk)
+                self._cond.notify_all()
+            if chunk is None:
+                self._on_finished()
+
+    def wait_chunk(self, index: int, reader: "_SubscriberRaw", timeout: float) -> bool:
+        """
+        False if chunk `index` did not become readable within timeout: another subscriber's upstream read has not
+        returned, or (when nobody is reading) the upstream socket stayed quiet. True otherwise, including at the end.
+        """
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            if self._reading:
+                self._cond.wait_for(lambda: index < len(self._chunks) or self._finished or reader.closed or
+                                    not self._reading, timeout)
+            if index < len(self._chunks) or self._finished or reader.closed:
+                return True
+            if self._reading:
+                return False
+        from sse_relay import upstream_waiter
+        wait = upstream_waiter(self.response)
+        return wait is None or wait(max(0.0, deadline - time.monotonic()))
+
+    def unsubscribe(self, reader: "_SubscriberRaw"):
+        with self._cond:
+            self._subscribers -= 1
+            cancel = self._subscribers == 0 and not self._finished
+            reading = self._reading
+            if cancel:
+                self._finished = True
+                self._error = ConnectionAbortedError("All subscribers of the shared stream disconnected.")
+            self._cond.notify_all()
+        if cancel:
+            self._on_finished()
+            if reading:
+                from hedging import _abort
+                _abort(self.response)  # 另一个线程正阻塞在上游读取上，只能中断 socket
+            else:
+                self.response.close()
+
+
+class _SubscriberRaw:
+    """Stands in for urllib3's raw response (what requests.Response.iter_content reads) for one subscriber."""
+
+    def __init__(self, shared: SharedStream):
+        self._shared = shared
+        self._index = 0
+        self._pending = b""
+        self.closed = False
+
+    def _next_chunk(self) -> Optional[bytes]:
+        chunk = self._shared.chunk(self._index, self)
+        if chunk is not None:
+            self._index += 1
+        return chunk
+
+    def stream(self, amt=2 ** 16, decode_content=None):
+        if self._pending:
+            pending, self._pending = self._pending, b""
+            yield pending
+        while True:
+            chunk = self._next_chunk()
+            if chunk is None:
+                return
+            yield chunk
+
+    def read(self, amt=None, *args, **kwargs):
+        while amt is None or len(self._pending) < amt:
+            chunk = self._next_chunk()
+            if chunk is None:
+                break
+            self._pending += chunk
+        size = len(self._pending) if amt is None else amt
+        data, self._pending = self._pending[:size], self._pending[size:]
+        return data
+
+    def wait_readable(self, timeout: float) -> bool:
+        """Used by sse_relay.iter_relay_frames to flush buffered text while the shared upstream is quiet."""
+        return bool(self._pending) or self._shared.wait_chunk(self._index, self, timeout)
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self._shared.unsubscribe(self)
+
+    def release_conn(self):
+        pass
+
+
+class _Flight:
+    __slots__ = ("done", "result", "stream", "followers")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None  # 非流式的结果，或流式错误帧列表；领头请求抛出异常时保持 None
+        self.stream: Optional[SharedStream] = None
+        self.followers = 0
+
+
+_flights: Dict[str, _Flight] = {}
+_flights_lock = threading.Lock()
+_counters = {"leaders": 0, "followers": 0}
+
+
+def _forget(key: str, flight: _Flight):
+    with _flights_lock:
+        if _flights.get(key) is flight:
+            del _flights[key]
+
+
+def deduplicate(key: str, call: Callable[[], object], stream: bool = False) -> Tuple[object, bool]:
+    """
+    Run call() once for all concurrent requests with the same key. Returns (result, shared); `shared` is True
+    for requests that attached to another request's upstream call. Streaming results that are responses are
+    fanned out (each caller gets its own Response); error streams are materialized and replayed.
+    """
+    if not SINGLE_FLIGHT_ENABLED or _bypass.get():
+        return call(), False
+    key = f"{key}:{'stream' if stream else 'text'}"
+    while True:
+        with _flights_lock:
+            flight = _flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = _flights[key] = _Flight()
+                _counters["leaders"] += 1
+            else:
+                flight.followers += 1
+                _counters["followers"] += 1
+        if leader:
+            return _lead(key, flight, call, stream)
+        shared = _follow(flight, stream)
+        if shared is not None:
+            return shared, True
+        # 领头请求抛出异常，或上游流在加入前已被取消：重新来过 (可能成为新的领头请求)
+
+
+def _lead(key: str, flight: _Flight, call: Callable[[], object], stream: bool) -> Tuple[object, bool]:
+    try:
+        result = call()
+    except BaseException:
+        _forget(key, flight)
+        flight.done.set()
+        raise
+    if stream and hasattr(result, "iter_content"):
+        flight.stream = SharedStream(result, lambda: _forget(key, flight))
+        subscriber = flight.stream.subscribe()
+        flight.done.set()
+        return subscriber, False
+    if stream:
+        result = list(result)  # 错误帧生成器只能读一次
+    flight.result = result
+    _forget(key, flight)
+    flight.done.set()
+    return (iter(result) if stream else result), False
+
+
+def _follow(flight: _Flight, stream: bool):
+    """The leader's result for this follower, or None if it has to make the call itself."""
+    from tracing import span
+    with span("single_flight_wait", stream=stream):
+        flight.done.wait()
+    if flight.stream is not None:
+        return flight.stream.subscribe()
+    if flight.result is None:
+        return None
+    return iter(flight.result) if stream else flight.result
+
+
+def single_flight_snapshot() -> dict:
+    """In-flight shared calls (followers / stream subscribers) and totals, for /debug/single_flight."""
+    with _flights_lock:
+        flights = [{"key": key[:16], "mode": key.rsplit(":", 1)[1], "followers": flight.followers,
+                    "subscribers": flight.stream.subscribers if flight.stream is not None else None}
+                   for key, flight in _flights.items()]
+        return {"enabled": SINGLE_FLIGHT_ENABLED, "in_flight": flights, **_counters}
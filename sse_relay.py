@@ -0,0 +1,320 @@
+# sse_relay.py
+import json
+import logging
+import select
+import time
+from typing import Callable, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def relay_upstream_line(line: bytes, api_platform: str) -> Tuple[Optional[str], bool]:
+    """
+    把上游 API 的一行 SSE 数据转换成前端 (static/script.js) 使用的 `data:` 帧。
+    Flask 的 generate_translation_stream 和 async_app.py 共用这段逻辑。
+
+    Returns (frame, finished): frame 为 None 表示这一行无需转发；finished 为 True 时调用者应停止读取。
+    """
+    chunk_str = line.decode('utf-8')
+    if chunk_str.startswith("data: "):
+        json_part_str = chunk_str[len("data: "):].strip()
+    elif chunk_str.strip().startswith("{") and chunk_str.strip().endswith("}"):
+        json_part_str = chunk_str.strip()
+        logger.debug(f"Received non-standard JSON line, processing as data: {json_part_str}")
+    else:
+        logger.debug(f"Skipping non-data line from stream: {chunk_str}")
+        return None, False
+    if json_part_str == "[DONE]":
+        logger.info("Stream finished with [DONE] marker from API.")
+        return f"data: {json.dumps({'done': True})}\n\n", True
+    try:
+        json_part = json.loads(json_part_str)
+    except json.JSONDecodeError:
+        logger.warning(f"Could not decode JSON from stream chunk ({api_platform}): {json_part_str}")
+        return None, False
+
+    if json_part.get("choices") and isinstance(json_part["choices"], list) and len(json_part["choices"]) > 0 and \
+       json_part["choices"][0].get("delta") and "content" in json_part["choices"][0]["delta"]:
+        content = json_part["choices"][0]["delta"]["content"]
+        if content is not None:
+            return f"data: {json.dumps({'text_chunk': content})}\n\n", False
+        return None, False
+    if json_part.get("error"):
+        error_detail = json_part["error"].get("message", str(json_part["error"])) if isinstance(json_part["error"], dict) else str(json_part["error"])
+        logger.error(f"Error in stream from API ({api_platform}): {error_detail}")
+        return f"data: {json.dumps({'error': error_detail})}\n\n", True
+    if json_part.get("done") is True:
+        logger.info(f"Stream finished with 'done: true' marker from API ({api_platform}).")
+        return f"data: {json.dumps({'done': True})}\n\n", True
+    return None, False
+
+
+# ==============================================================================
+# 低开销转发路径：直接在原始字节上增量解析 SSE，并把多个增量合并成一个帧。
+try:
+    from config import SSE_COALESCE_MS, SSE_COALESCE_CHARS, SSE_USE_ORJSON
+except ImportError:
+    SSE_COALESCE_MS = 30.0
+    SSE_COALESCE_CHARS = 256
+    SSE_USE_ORJSON = True
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+if orjson is not None and SSE_USE_ORJSON:
+    _loads = orjson.loads
+
+    def _dumps(obj) -> str:
+        return orjson.dumps(obj).decode('utf-8')
+else:
+    _loads = json.loads  # json.loads 同样接受 bytes
+    _dumps = json.dumps
+
+# 没有 orjson 时，普通增量行只扫描 content 字段 (比 json.loads 整行快)；orjson 解析整行本身就更快
+_SCAN_DELTAS = _loads is json.loads
+
+from json.decoder import scanstring as _scanstring
+
+FRAME_FORMAT_JSON = "json"
+FRAME_FORMAT_COMPACT = "compact"
+
+# 上游读取块大小，与 requests 的 iter_lines() 默认值一致
+RELAY_READ_SIZE = 512
+
+
+class StreamRelay:
+    """
+    Incremental relay from raw upstream SSE bytes to frames for the browser.
+
+    feed() accepts arbitrary byte chunks (partial lines are carried over), extracts delta contents and
+    returns the frames that are ready. The first delta is sent immediately; after that deltas are buffered
+    and sent together once SSE_COALESCE_CHARS characters are pending or SSE_COALESCE_MS has passed since
+    the last frame. The window is checked on every upstream read; callers that can wait with a timeout
+    (iter_relay_frames, async_app.py) also call flush() after flush_delay() while upstream is silent, so a
+    stall in model output does not hold back text that has already arrived. close() flushes whatever is left.
+
+    Frame formats:
+      json    - the existing `data: {"text_chunk": ...}` / `{"done": true}` / `{"error": ...}` frames
+      compact - plain SSE: text as `data:` lines (one per text line, no JSON escaping);
+                `event: done` and `event: error` for the terminal frames
+    """
+
+    def __init__(self, api_platform: str, frame_format: str = FRAME_FORMAT_JSON,
+                 coalesce_ms: float = SSE_COALESCE_MS, coalesce_chars: int = SSE_COALESCE_CHARS):
+        self.api_platform = api_platform
+        self.compact = frame_format == FRAME_FORMAT_COMPACT
+        self.coalesce_seconds = coalesce_ms / 1000.0
+        self.coalesce_chars = coalesce_chars
+        self.finished = False
+        self.deltas = 0   # 收到的上游增量数
+        self.frames = 0   # 发出的文本帧数
+        self._partial = b""
+        self._pending = []
+        self._pending_chars = 0
+        self._last_flush = None
+
+    def feed(self, data: bytes) -> List[str]:
+        if self.finished:
+            return []
+        frames = []
+        lines = (self._partial + data).split(b"\n")
+        self._partial = lines.pop()
+        for line in lines:
+            line = line.strip()
+            if not line:
+                continue  # SSE 事件之间的空行
+            self._handle_line(line, frames)
+            if self.finished:
+                return frames
+        if self._pending and (self._last_flush is None or self._pending_chars >= self.coalesce_chars or
+                              time.monotonic() - self._last_flush >= self.coalesce_seconds):
+            frames.append(self._flush())
+        return frames
+
+    def flush_delay(self) -> Optional[float]:
+        """Seconds until buffered text is due (0 if it is due now), or None when nothing is buffered."""
+        if not self._pending or self.finished:
+            return None
+        if self._last_flush is None:
+            return 0.0
+        return max(0.0, self._last_flush + self.coalesce_seconds - time.monotonic())
+
+    def flush(self) -> List[str]:
+        """Send buffered text now (the coalescing window passed without another upstream read)."""
+        if not self._pending or self.finished:
+            return []
+        return [self._flush()]
+
+    def close(self) -> List[str]:
+        """Flush buffered text (and a trailing line without newline) at the end of the upstream stream."""
+        frames = []
+        if self._partial and not self.finished:
+            self._handle_line(self._partial.strip(), frames)
+            self._partial = b""
+        if self._pending:
+            frames.append(self._flush())
+        return frames
+
+    def _handle_line(self, line: bytes, frames: List[str]):
+        if line.startswith(b"data:"):
+            payload = line[5:].strip()
+        elif line.startswith(b"{") and line.endswith(b"}"):
+            payload = line
+        else:
+            return  # 空行、注释 (": keep-alive")、event: 等
+        content = _fast_delta_content(payload) if _SCAN_DELTAS else None
+        if content is not None:
+            if content:
+                self._pending.append(content)
+                self._pending_chars += len(content)
+                self.deltas += 1
+            return
+        if payload == b"[DONE]":
+            logger.info("Stream finished with [DONE] marker from API.")
+            self._finish(frames, self._done_frame())
+            return
+        try:
+            json_part = _loads(payload)
+        except ValueError:
+            logger.warning(f"Could not decode JSON from stream chunk ({self.api_platform}): {payload[:200]!r}")
+            return
+        if not isinstance(json_part, dict):
+            return
+        choices = json_part.get("choices")
+        if choices and isinstance(choices, list):
+            delta = choices[0].get("delta") if isinstance(choices[0], dict) else None
+            content = delta.get("content") if delta else None
+            if content:
+                self._pending.append(content)
+                self._pending_chars += len(content)
+                self.deltas += 1
+            return
+        error = json_part.get("error")
+        if error:
+            error_detail = error.get("message", str(error)) if isinstance(error, dict) else str(error)
+            logger.error(f"Error in stream from API ({self.api_platform}): {error_detail}")
+            self._finish(frames, self._error_frame(error_detail))
+            return
+        if json_part.get("done") is True:
+            logger.info(f"Stream finished with 'done: true' marker from API ({self.api_platform}).")
+            self._finish(frames, self._done_frame())
+
+    def _finish(self, frames: List[str], terminal_frame: str):
+        if self._pending:
+            frames.append(self._flush())
+        frames.append(terminal_frame)
+        self.finished = True
+
+    def _flush(self) -> str:
+        text = "".join(self._pending)
+        self._pending = []
+        self._pending_chars = 0
+        self._last_flush = time.monotonic()
+        self.frames += 1
+        if self.compact:
+            return _compact_data(text) + "\n"
+        return f"data: {_dumps({'text_chunk': text})}\n\n"
+
+    def _done_frame(self) -> str:
+        return "event: done\ndata:\n\n" if self.compact else f"data: {_dumps({'done': True})}\n\n"
+
+    def _error_frame(self, message: str) -> str:
+        return f"event: error\n{_compact_data(message)}\n" if self.compact else f"data: {_dumps({'error': message})}\n\n"
+
+
+def socket_readable(sock, timeout: float) -> bool:
+    """True once `sock` has bytes to read (or has failed, so the next read returns at once); False after `timeout` seconds."""
+    pending = getattr(sock, "pending", None)
+    if pending is not None and pending():
+        return True  # TLS 层已解密但尚未读取的数据不会让 socket 变为可读
+    try:
+        if hasattr(select, "poll"):
+            poller = select.poll()  # poll 没有 select 的 FD_SETSIZE 限制
+            poller.register(sock, select.POLLIN)
+            return bool(poller.poll(timeout * 1000))
+        return bool(select.select([sock], [], [], timeout)[0])
+    except (OSError, ValueError):
+        return True  # socket 已关闭：交给下一次读取报告
+
+
+def upstream_waiter(response) -> Optional[Callable[[float], bool]]:
+    """
+    A wait(timeout) -> bool for a streaming response: True when the next read has something to return, False when
+    nothing arrived within timeout. Sources that buffer upstream themselves (hedging.HedgedStream, single-flight
+    subscribers) provide wait_readable(); a plain upstream response is polled on its socket. None when neither is
+    available, e.g. cache replays, which are already in memory and never stall.
+    """
+    wait = getattr(response, "wait_readable", None)
+    raw = getattr(response, "raw", None)
+    if wait is None and raw is not None:
+        wait = getattr(raw, "wait_readable", None)  # 缓存、限流、metrics 的包装都把属性转发给内层 raw
+    if wait is not None:
+        return wait
+    sock = getattr(getattr(raw, "_connection", None), "sock", None)
+    if sock is None:
+        return None
+    return lambda timeout: socket_readable(sock, timeout)
+
+
+def iter_relay_frames(relay: StreamRelay, response) -> Iterator[str]:
+    """
+    Frames for a streaming response (requests.Response or hedging.HedgedStream), with buffered text flushed on a timer.
+    While text is buffered the generator waits on the upstream (upstream_waiter) for at most the rest of the
+    coalescing window before the next read, so no helper thread is needed. Bytes already buffered inside http.client
+    are invisible to the socket poll; at worst they go out in the next frame. Stops after the terminal frame; the
+    caller closes the response. Upstream exceptions propagate.
+    """
+    wait = upstream_waiter(response)
+    chunks = response.iter_content(chunk_size=RELAY_READ_SIZE)
+    while True:
+        delay = relay.flush_delay()
+        if delay is not None and wait is not None and not wait(delay):
+            yield from relay.flush()  # 上游暂时没有新数据：按时发出已缓冲的译文
+            continue
+        chunk = next(chunks, None)
+        if chunk is None:
+            yield from relay.close()
+            return
+        yield from relay.feed(chunk)
+        if relay.finished:
+            return
+
+
+_CONTENT_KEY = b'"content":'
+
+
+def _fast_delta_content(payload: bytes) -> Optional[str]:
+    """
+    Pull choices[0].delta.content out of a typical delta event without parsing the whole JSON object:
+    find the "content" key and decode only its string value (json's C string scanner).
+    Returns None whenever the line is not a plain string delta, so the caller falls back to a full parse.
+    """
+    if b'"delta"' not in payload or b'"error"' in payload:
+        return None
+    index = payload.find(_CONTENT_KEY)
+    if index < 0:
+        return None
+    index += len(_CONTENT_KEY)
+    while index < len(payload) and payload[index] in b" \t":
+        index += 1
+    if index >= len(payload) or payload[index] != 0x22:  # 不是字符串 (例如 null)
+        return None
+    try:
+        content, _ = _scanstring(payload[index:].decode('utf-8'), 1)
+    except (UnicodeDecodeError, ValueError):
+        return None
+    return content
+
+
+def _compact_data(text: str) -> str:
+    """SSE data lines for text: one `data:` line per line of text, so newlines need no escaping."""
+    return "".join(f"data: {line}\n" for line in text.split("\n"))
+
+
+def error_frame(message: str, frame_format: str = FRAME_FORMAT_JSON) -> str:
+    """A standalone error frame in the requested format (for errors raised before or around the relay)."""
+    if frame_format == FRAME_FORMAT_COMPACT:
+        return f"event: error\n{_compact_data(message)}\n"
+    return f"data: {json.dumps({'error': message})}\n\n"
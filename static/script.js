@@ -14,6 +14,7 @@ document.addEventListener('DOMContentLoaded', function() {
     const fileNameDisplay = document.getElementById('file_name_display');
     const encodingGroup = document.getElementById('encoding_group');
     const translationFormatGroup = document.getElementById('translation_format_group');
+    const chunkConcurrencyGroup = document.getElementById('chunk_concurrency_group');
     const outputFolderPathGroup = document.querySelector('.file-output-path');
     const outputFolderPathInput = document.getElementById('output_folder_path'); 
     const copyDefaultPathButton = document.getElementById('copy_default_path_button'); 
@@ -82,6 +83,11 @@ document.addEventListener('DOMContentLoaded', function() {
             model: "llama3", 
             apiKeyEnvHint: "OLLAMA_API_KEY (通常不需要或任意字符串)"
         },
+        "router": {
+            baseUrl: "",
+            model: "",
+            apiKeyEnvHint: "各路由目标平台的环境变量"
+        },
         "custom": {
             baseUrl: "",
             model: "",
@@ -96,6 +102,8 @@ document.addEventListener('DOMContentLoaded', function() {
         if (apiKeyHint) {
             apiKeyHint.textContent = `留空将使用 .env 环境变量 (例如 ${config.apiKeyEnvHint})。`;
         }
+        const routeConfigGroup = document.getElementById('route_config_group');
+        if (routeConfigGroup) routeConfigGroup.style.display = platform === 'router' ? 'block' : 'none';
         if (apiPlatformSelect) {
             appendLog(`API 平台切换为: ${apiPlatformSelect.options[apiPlatformSelect.selectedIndex].text}. Base URL 和 Model 已更新。`);
         }
@@ -116,6 +124,21 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     }
 
+    // 解析紧凑格式的 SSE 帧 (见 sse_relay.StreamRelay)，转换成与 JSON 帧相同的对象
+    function parseCompactFrame(part) {
+        let eventType = 'message';
+        const dataLines = [];
+        for (const line of part.split('\n')) {
+            if (line.startsWith('event: ')) eventType = line.substring(7);
+            else if (line.startsWith('data: ')) dataLines.push(line.substring(6));
+            else if (line === 'data:') dataLines.push('');
+        }
+        const text = dataLines.join('\n');
+        if (eventType === 'done') return { done: true };
+        if (eventType === 'error') return { error: text };
+        return dataLines.length > 0 ? { text_chunk: text } : null;
+    }
+
     function appendLog(message) {
         if (!logOutputPre) return;
         const now = new Date();
@@ -147,6 +170,7 @@ document.addEventListener('DOMContentLoaded', function() {
         if (outputFolderPathGroup) outputFolderPathGroup.style.display = 'none';
         if (encodingGroup) encodingGroup.style.display = 'none';
         if (translationFormatGroup) translationFormatGroup.style.display = 'none';
+        if (chunkConcurrencyGroup) chunkConcurrencyGroup.style.display = 'none';
         appendLog("切换到文字翻译模式。");
     }
 
@@ -161,7 +185,25 @@ document.addEventListener('DOMContentLoaded', function() {
         appendLog("切换到文档翻译模式。");
     }
 
+    // 并发分块数只对经过分块执行器的后端有效：.txt 和带格式的 .docx
+    function updateChunkConcurrencyVisibility() {
+        if (!chunkConcurrencyGroup) return;
+        const currentFile = fileInput && fileInput.files[0];
+        let applies = false;
+        if (currentFile && modeFileButton && modeFileButton.classList.contains('active')) {
+            const fileExtension = currentFile.name.split('.').pop().toLowerCase();
+            const selectedFormatRadio = document.querySelector('input[name="translation_format"]:checked');
+            applies = fileExtension === 'txt' || (fileExtension === 'docx' && selectedFormatRadio && selectedFormatRadio.value === 'formatted');
+        }
+        chunkConcurrencyGroup.style.display = applies ? 'block' : 'none';
+    }
+
+    document.querySelectorAll('input[name="translation_format"]').forEach(function(radio) {
+        radio.addEventListener('change', updateChunkConcurrencyVisibility);
+    });
+
     function updateFileSpecificOptions() {
+        updateChunkConcurrencyVisibility();
         const currentFile = fileInput && fileInput.files[0];
         if (currentFile && modeFileButton && modeFileButton.classList.contains('active')) {
             const fileExtension = currentFile.name.split('.').pop().toLowerCase();
@@ -185,6 +227,64 @@ document.addEventListener('DOMContentLoaded', function() {
     }
 
 
+    function showDownloadLink(fileUrl) {
+        if (!downloadLink || !downloadArea) return;
+        downloadLink.href = fileUrl;
+        downloadLink.textContent = `下载翻译文件 (${fileUrl.split('/').pop()})`;
+        downloadArea.style.display = 'block';
+        downloadLink.style.display = 'inline-block';
+        appendLog(`文档翻译完成。下载链接: ${fileUrl}`);
+    }
+
+    // 文件翻译在服务器端作为后台任务运行：订阅任务的 SSE 进度事件，直到完成或失败。
+    // EventSource 断线后会自动重连，并通过 Last-Event-ID 从上次收到的事件继续。
+    function followTranslationJob(job) {
+        return new Promise((resolve) => {
+            appendLog(`文档翻译任务已创建: ${job.job_id}`);
+            if (statusMessage) { statusMessage.textContent = '文档翻译任务排队中...'; statusMessage.className = 'status-message'; }
+            const source = new EventSource(job.events_url);
+            source.onmessage = (event) => {
+                let data;
+                try {
+                    data = JSON.parse(event.data);
+                } catch (e) {
+                    appendLog(`无法解析任务事件: ${event.data}`);
+                    return;
+                }
+                if (data.type === 'status' && data.status === 'running') {
+                    if (statusMessage) statusMessage.textContent = '文档翻译中...';
+                    appendLog('文档翻译任务开始执行。');
+                } else if (data.type === 'progress') {
+                    const progressText = data.total ? `${data.done}/${data.total}` : `${data.done}`;
+                    if (statusMessage) statusMessage.textContent = `文档翻译中... 已完成分块 ${progressText}`;
+                } else if (data.type === 'info' && data.message) {
+                    appendLog(`任务消息: ${data.message}`);
+                } else if (data.type === 'done') {
+                    source.close();
+                    if (statusMessage) { statusMessage.textContent = '翻译成功！'; statusMessage.className = 'status-message success'; }
+                    if (data.translated_file_url) showDownloadLink(data.translated_file_url);
+                    if (data.incremental) {
+                        appendLog(`增量翻译：共 ${data.incremental.segments} 个片段，复用上一版 ${data.incremental.reused} 个，新翻译 ${data.incremental.translated} 个，从断点恢复 ${data.incremental.resumed} 个。`);
+                    }
+                    resolve();
+                } else if (data.type === 'error') {
+                    source.close();
+                    if (statusMessage) { statusMessage.textContent = `错误：${data.error}`; statusMessage.className = 'status-message error'; }
+                    appendLog(`文档翻译任务失败: ${data.error}`);
+                    if (job.resume_url) appendLog(`已完成的分块已保存：重新上传同一文件，或 POST ${job.resume_url} 即可从断点继续。`);
+                    resolve();
+                }
+            };
+            source.onerror = () => {
+                if (source.readyState === EventSource.CLOSED) {
+                    appendLog(`任务进度连接已关闭。可通过 ${job.status_url} 查询任务状态。`);
+                    resolve();
+                }
+            };
+        });
+    }
+
+
     // --- 初始状态设置 ---
     populateLanguageSelect(sourceLangSelect, LANGUAGES, true); 
     populateLanguageSelect(targetLangSelect, LANGUAGES, false); 
@@ -423,6 +523,7 @@ document.addEventListener('DOMContentLoaded', function() {
             const targetLang = targetLangSelect ? targetLangSelect.value : '';
             const encodingValue = document.getElementById('encoding') ? document.getElementById('encoding').value : 'utf-8';
             const outputFolderPathValue = outputFolderPathInput ? outputFolderPathInput.value : ''; 
+            const chunkConcurrencyValue = document.getElementById('chunk_concurrency') ? document.getElementById('chunk_concurrency').value : '';
 
             if (!targetLang) {
                 if (statusMessage) {
@@ -441,6 +542,15 @@ document.addEventListener('DOMContentLoaded', function() {
             formData.append('model', model);
             formData.append('target_lang', targetLang);
             formData.append('source_lang', sourceLang);
+            formData.append('frame_format', 'compact'); // 紧凑 SSE 帧：服务器不再为每个文本块做 JSON 转义
+            const hedgeCheckbox = document.getElementById('hedge_requests');
+            if (hedgeCheckbox && hedgeCheckbox.checked) formData.append('hedge', '1');
+            if (selectedPlatform === 'router') {
+                const routeTargetsInput = document.getElementById('route_targets');
+                const routeModeSelect = document.getElementById('route_mode');
+                formData.append('route_targets', routeTargetsInput ? routeTargetsInput.value : '');
+                formData.append('route_mode', routeModeSelect ? routeModeSelect.value : '');
+            }
             
             let isFileTranslation = false;
             let translationFormat = 'unformatted'; 
@@ -463,6 +573,16 @@ document.addEventListener('DOMContentLoaded', function() {
                 }
                 formData.append('translation_format', translationFormat);
                 formData.append('output_folder_path', outputFolderPathValue);
+                if (chunkConcurrencyGroup && chunkConcurrencyGroup.style.display !== 'none') {
+                    formData.append('chunk_concurrency', chunkConcurrencyValue);
+                }
+                const incrementalCheckbox = document.getElementById('incremental_translation');
+                if (incrementalCheckbox && incrementalCheckbox.checked) {
+                    const incrementalNameInput = document.getElementById('incremental_name');
+                    formData.append('incremental', '1');
+                    formData.append('incremental_name', incrementalNameInput ? incrementalNameInput.value : '');
+                    appendLog('增量翻译：只翻译相对上一版变化的段落。');
+                }
                 
             } else if (modeTextButton && modeTextButton.classList.contains('active')) { 
                 const textToTranslate = textInput ? textInput.value : '';
@@ -508,6 +628,8 @@ document.addEventListener('DOMContentLoaded', function() {
                     // console.log("DEBUG: Stream reader created."); // DEBUG
 
                     let streamCancelledInternally = false;
+                    // 服务器按请求的 frame_format 回传实际使用的帧格式
+                    const compactFrames = response.headers.get('X-Frame-Format') === 'compact';
 
                     while (true) {
                         try { 
@@ -528,7 +650,10 @@ document.addEventListener('DOMContentLoaded', function() {
                             accumulatedText = parts.pop() || ""; 
                             for (const part of parts) {
                                 // console.log("DEBUG: Processing stream part:", part);
-                                if (part.startsWith('data: ')) {
+                                let data = null;
+                                if (compactFrames) {
+                                    data = parseCompactFrame(part);
+                                } else if (part.startsWith('data: ')) {
                                     const jsonDataString = part.substring(6);
                                     // console.log("DEBUG: Raw JSON data string from stream:", jsonDataString); 
                                     if (jsonDataString.trim() === "[DONE]") {
@@ -540,35 +665,36 @@ document.addEventListener('DOMContentLoaded', function() {
                                         break; 
                                     }
                                     try {
-                                        const data = JSON.parse(jsonDataString);
+                                        data = JSON.parse(jsonDataString);
                                         // console.log("DEBUG: Parsed JSON data from stream:", data);
-                                        if (data.text_chunk && translatedTextDisplay) {
-                                            translatedTextDisplay.value += data.text_chunk;
-                                            translatedTextDisplay.scrollTop = translatedTextDisplay.scrollHeight; 
-                                            receivedAnyChunk = true; 
-                                        } else if (data.error) {
-                                            if (statusMessage) { statusMessage.textContent = `错误：${data.error}`; statusMessage.className = 'status-message error';}
-                                            appendLog(`流中错误: ${data.error}`);
-                                            // console.error("DEBUG: Error in stream from API:", data.error);
-                                            if (!reader.closed) await reader.cancel();
-                                            streamCancelledInternally = true;
-                                            break; 
-                                        } else if (data.done) { 
-                                             if (statusMessage) { statusMessage.textContent = receivedAnyChunk ? '翻译完成!' : '翻译完成 (API标记done:true)。'; statusMessage.className = 'status-message success';}
-                                            appendLog(receivedAnyChunk ? "文字翻译流由 API JSON 'done:true' 标记结束。" : "文字翻译流由 API JSON 'done:true' 标记结束 (未收到有效文本块)。");
-                                            // console.log("DEBUG: Stream ended by API JSON 'done:true'. Received any chunk:", receivedAnyChunk);
-                                            if (!reader.closed) await reader.cancel();
-                                            streamCancelledInternally = true;
-                                            break;
-                                        } else if (Object.keys(data).length > 0 && !data.text_chunk) {
-                                            // console.warn("DEBUG: Received unexpected JSON structure in stream:", data);
-                                            appendLog(`流中收到意外JSON结构: ${JSON.stringify(data)}`);
-                                        }
                                     } catch (e) {
                                         appendLog(`无法解析流数据块: ${jsonDataString} - ${e}`);
                                         // console.error("DEBUG: JSON parsing error in stream:", e, "Data:", jsonDataString);
                                     }
-                                } 
+                                }
+                                if (!data) continue;
+                                if (data.text_chunk && translatedTextDisplay) {
+                                    translatedTextDisplay.value += data.text_chunk;
+                                    translatedTextDisplay.scrollTop = translatedTextDisplay.scrollHeight; 
+                                    receivedAnyChunk = true; 
+                                } else if (data.error) {
+                                    if (statusMessage) { statusMessage.textContent = `错误：${data.error}`; statusMessage.className = 'status-message error';}
+                                    appendLog(`流中错误: ${data.error}`);
+                                    // console.error("DEBUG: Error in stream from API:", data.error);
+                                    if (!reader.closed) await reader.cancel();
+                                    streamCancelledInternally = true;
+                                    break; 
+                                } else if (data.done) { 
+                                     if (statusMessage) { statusMessage.textContent = receivedAnyChunk ? '翻译完成!' : '翻译完成 (API标记done:true)。'; statusMessage.className = 'status-message success';}
+                                    appendLog(receivedAnyChunk ? "文字翻译流由 API JSON 'done:true' 标记结束。" : "文字翻译流由 API JSON 'done:true' 标记结束 (未收到有效文本块)。");
+                                    // console.log("DEBUG: Stream ended by API JSON 'done:true'. Received any chunk:", receivedAnyChunk);
+                                    if (!reader.closed) await reader.cancel();
+                                    streamCancelledInternally = true;
+                                    break;
+                                } else if (Object.keys(data).length > 0 && !data.text_chunk) {
+                                    // console.warn("DEBUG: Received unexpected JSON structure in stream:", data);
+                                    appendLog(`流中收到意外JSON结构: ${JSON.stringify(data)}`);
+                                }
                             } 
                             if (streamCancelledInternally) { break; }
                         } catch (readError) {
@@ -580,13 +706,12 @@ document.addEventListener('DOMContentLoaded', function() {
                     } 
                 } else if (isFileTranslation) {
                     const result = await response.json();
-                    if (statusMessage) { statusMessage.textContent = '翻译成功！'; statusMessage.className = 'status-message success';}
-                    if (result.translated_file_url && downloadLink && downloadArea) {
-                        downloadLink.href = result.translated_file_url;
-                        downloadLink.textContent = `下载翻译文件 (${result.translated_file_url.split('/').pop()})`;
-                        downloadArea.style.display = 'block';
-                        downloadLink.style.display = 'inline-block';
-                        appendLog(`文档翻译完成。下载链接: ${result.translated_file_url}`);
+                    if (result.job_id) {
+                        await followTranslationJob(result);
+                    } else if (result.translated_file_url) {
+                        if (statusMessage) { statusMessage.textContent = '翻译成功！'; statusMessage.className = 'status-message success';}
+                        if (result.cached) appendLog('该文件已用相同设置翻译过，直接返回已有结果 (未调用 API)。');
+                        showDownloadLink(result.translated_file_url);
                     } else if (result.message && translatedTextDisplay) { 
                         translatedTextDisplay.value = result.message;
                         appendLog(`文档翻译消息: ${result.message}`);
@@ -0,0 +1,47 @@
+# test_batch_translator.py
+"""批量翻译：<<<n>>> 编号的解析，以及回复对不上时只对出错的范围二分重试。"""
+from batch_translator import parse_batch_reply, translate_batch
+from mock_openai_server import MockSettings, start_mock_server
+from translator import SiliconFlowTranslator
+
+
+def test_parse_batch_reply_splits_on_markers():
+    reply = "Here you go:\n<<<1>>>\nBonjour\n<<< 2 >>>\n  le monde  \n<<<3>>>\nfin\n"
+    assert parse_batch_reply(reply, 3) == ["Bonjour", "le monde", "fin"]
+
+
+def test_parse_batch_reply_rejects_misaligned_replies():
+    assert parse_batch_reply("<<<1>>>\na\n<<<2>>>\nb", 3) is None            # 缺少片段
+    assert parse_batch_reply("<<<1>>>\na\n<<<3>>>\nc\n<<<2>>>\nb", 3) is None  # 顺序错乱
+    assert parse_batch_reply("<<<1>>>\na\n<<<1>>>\na\n<<<2>>>\nb", 2) is None  # 重复编号
+    assert parse_batch_reply("<<<1>>>\n\n<<<2>>>\nb", 2) is None             # 空译文
+    assert parse_batch_reply("a and b", 2) is None
+
+
+def test_translate_batch_sends_one_request_for_aligned_reply():
+    settings = MockSettings(reply_prefix="")  # 模拟服务器原样回显，批量回复与编号完全对齐
+    server, base_url = start_mock_server(settings)
+    try:
+        translator = SiliconFlowTranslator(api_key="k", base_url=base_url, model="m", platform_id="custom",
+                                           use_cache=False)
+        results = translate_batch(translator, ["  one ", "", "two", "three\n"], "French")
+        assert results == ["  one ", "", "two", "three\n"]  # 空白片段原样返回，首尾空白保留
+        assert settings.snapshot()["requests"] == 1
+    finally:
+        server.shutdown()
+
+
+def test_translate_batch_bisects_only_the_misaligned_half():
+    settings = MockSettings(reply_prefix="")
+    server, base_url = start_mock_server(settings)
+    try:
+        translator = SiliconFlowTranslator(api_key="k", base_url=base_url, model="m", platform_id="custom",
+                                           use_cache=False)
+        # 最后一个片段自带一行编号，回显的批量回复因此对不上
+        segments = ["alpha", "beta", "gamma", "<<<9>>>\ndelta"]
+        results = translate_batch(translator, segments, "French")
+        assert results == segments
+        # 整批 1 次，[alpha, beta] 1 次，[gamma, delta] 1 次，再各自单独翻译 2 次
+        assert settings.snapshot()["requests"] == 5
+    finally:
+        server.shutdown()
@@ -0,0 +1,83 @@
+# test_docx_full_translator.py
+"""保留格式的 docx 翻译：相邻 run 按格式合并成组 (忽略 rsid)，<gN> 标记把译文放回各组，其余 XML 原样复制。"""
+import io
+import os
+import zipfile
+
+from docx_full_translator import _Span, iter_part_pieces, translate_docx_file_formatted
+from mock_openai_server import MockSettings, start_mock_server
+from translator import SiliconFlowTranslator
+
+W = 'xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"'
+BOLD = "<w:rPr><w:b/></w:rPr>"
+DOCUMENT = (
+    f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n<w:document {W}><w:body>'
+    # 普通 / 加粗 / 普通：三组
+    f'<w:p><w:pPr><w:jc w:val="center"/></w:pPr>'
+    f'<w:r><w:t xml:space="preserve">Hello </w:t></w:r>'
+    f'<w:r><w:rPr><w:b/></w:rPr><w:t>big</w:t></w:r>'
+    f'<w:r><w:t xml:space="preserve"> world</w:t></w:r></w:p>'
+    # 两个格式相同、只有 rsid 不同的 run：合并为一组，直接翻译文本
+    f'<w:p><w:r w:rsidR="00A1"><w:rPr><w:b/></w:rPr><w:t xml:space="preserve">Bold </w:t></w:r>'
+    f'<w:r w:rsidR="00B2"><w:rPr><w:b/></w:rPr><w:proofErr w:type="spellStart"/><w:t>text</w:t></w:r></w:p>'
+    # 含图片的 run 原样保留，并把片段断开
+    f'<w:p><w:r><w:t>Before</w:t></w:r><w:r><w:drawing><wp:inline xmlns:wp="urn:wp"/></w:drawing></w:r>'
+    f'<w:r><w:t>After</w:t></w:r></w:p>'
+    f'</w:body></w:document>'
+).encode("utf-8")
+
+
+def _spans(xml: bytes, read_size: int = 7):
+    pieces = list(iter_part_pieces(io.BytesIO(xml), read_size))  # 很小的读取块：片段跨越多个块
+    return pieces, [piece for piece in pieces if isinstance(piece, _Span)]
+
+
+def test_runs_are_merged_into_formatting_groups():
+    pieces, spans = _spans(DOCUMENT)
+    assert [span.source for span in spans] == [
+        "<g1>Hello </g1><g2>big</g2><g3> world</g3>", "Bold text", "Before", "After"]
+    # 片段之外的字节原样复制
+    raw = b"".join(piece for piece in pieces if isinstance(piece, bytes))
+    assert b'<w:pPr><w:jc w:val="center"/></w:pPr>' in raw
+    assert b'<w:drawing><wp:inline xmlns:wp="urn:wp"/></w:drawing>' in raw
+
+
+def test_translation_is_put_back_into_each_group():
+    _, spans = _spans(DOCUMENT)
+    rendered = spans[0].render("<g1>Bonjour </g1><g2>grand</g2><g3> monde</g3>").decode("utf-8")
+    assert '<w:r><w:t xml:space="preserve">Bonjour </w:t></w:r>' in rendered
+    assert f'<w:r>{BOLD}<w:t xml:space="preserve">grand</w:t></w:r>' in rendered
+    assert '<w:t xml:space="preserve"> monde</w:t>' in rendered
+
+    rendered = spans[1].render("Texte gras").decode("utf-8")
+    assert rendered == f'<w:r w:rsidR="00A1">{BOLD}<w:t xml:space="preserve">Texte gras</w:t></w:r>'
+
+
+def test_mismatched_markers_fall_back_to_the_unformatted_group():
+    _, spans = _spans(DOCUMENT)
+    rendered = spans[0].render("Bonjour <g2>grand monde").decode("utf-8")
+    assert rendered == '<w:r><w:t xml:space="preserve">Bonjour grand monde</w:t></w:r>'
+
+
+def test_translate_docx_file_formatted_through_the_batch_translator(tmp_path):
+    source = tmp_path / "doc.docx"
+    with zipfile.ZipFile(source, "w") as docx:
+        docx.writestr("[Content_Types].xml", "<Types/>")
+        docx.writestr("word/document.xml", DOCUMENT)
+        docx.writestr("word/media/image1.png", b"\x89PNG")
+    settings = MockSettings(reply_prefix="")  # 原样回显：译文等于原文，便于检查结构
+    server, base_url = start_mock_server(settings)
+    try:
+        translator = SiliconFlowTranslator(api_key="k", base_url=base_url, model="m", platform_id="custom",
+                                           use_cache=False)
+        output = translate_docx_file_formatted(str(source), str(tmp_path / "out"), "French", translator)
+        assert os.path.exists(output), output
+        assert settings.snapshot()["requests"] == 1  # 四个片段一批发送
+        with zipfile.ZipFile(output) as docx:
+            assert docx.read("word/media/image1.png") == b"\x89PNG"
+            xml = docx.read("word/document.xml").decode("utf-8")
+        assert f'<w:r>{BOLD}<w:t xml:space="preserve">big</w:t></w:r>' in xml
+        assert '<w:t xml:space="preserve">Bold text</w:t>' in xml
+        assert "<w:drawing>" in xml and "proofErr" not in xml
+    finally:
+        server.shutdown()
@@ -0,0 +1,104 @@
+# test_incremental.py
+"""增量翻译：新版本只翻译新增或修改的片段，清单只保留最新版本，失败时保留旧清单，分块边界与上一版对齐。"""
+import json
+import zipfile
+
+from docx_full_translator import translate_docx_file_formatted
+from incremental import IncrementalManifest, is_chunk_anchor, open_incremental_manifest
+from mock_openai_server import MockSettings, start_mock_server
+from text_stream_translator import iter_stream_chunks
+from translator import SiliconFlowTranslator
+
+SETTINGS = {"platform": "custom", "model": "m", "target_lang": "French", "source_lang": ""}
+
+
+def _entries(path) -> list:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f][1:]
+
+
+def test_unchanged_segments_are_reused_and_the_manifest_is_pruned(tmp_path):
+    path = str(tmp_path / "doc.manifest.jsonl")
+    first = IncrementalManifest(path, SETTINGS)
+    assert first.get("kept") is None
+    first.record("kept", "gardé")
+    first.record("removed", "supprimé")
+    assert first.commit()["translated"] == 2
+
+    second = IncrementalManifest(path, SETTINGS)
+    assert second.get("kept") == "gardé"
+    assert second.get("new") is None
+    second.record("new", "nouveau")
+    summary = second.commit()
+    assert (summary["reused"], summary["translated"]) == (1, 1)
+    # 清单只包含这一版用到的片段
+    assert sorted(entry["t"] for entry in _entries(path)) == ["gardé", "nouveau"]
+
+
+def test_manifest_from_other_settings_is_ignored(tmp_path):
+    path = str(tmp_path / "doc.manifest.jsonl")
+    first = IncrementalManifest(path, SETTINGS)
+    first.record("text", "texte")
+    first.commit()
+    other = IncrementalManifest(path, dict(SETTINGS, target_lang="German"))
+    assert other.get("text") is None
+    other.abort()
+
+
+def test_failed_run_keeps_the_previous_manifest(tmp_path):
+    path = str(tmp_path / "doc.manifest.jsonl")
+    first = IncrementalManifest(path, SETTINGS)
+    first.record("text", "texte")
+    first.commit()
+    failed = IncrementalManifest(path, SETTINGS)
+    failed.record("other", "autre")
+    failed.abort()
+    assert [entry["t"] for entry in _entries(path)] == ["texte"]
+    assert not (tmp_path / "doc.manifest.jsonl.next").exists()
+
+
+def test_anchored_chunks_stay_aligned_after_an_insertion():
+    paragraphs = [f"Paragraph number {i} of the document." for i in range(60)]
+    inserted = next(f"Inserted paragraph {i}." for i in range(100) if not is_chunk_anchor(f"Inserted paragraph {i}."))
+
+    def chunks(texts):
+        return [chunk for chunk, _ in iter_stream_chunks([(text, "\n\n") for text in texts], "m", 100000,
+                                                         is_chunk_anchor)]
+
+    before, after = chunks(paragraphs), chunks([inserted] + paragraphs)
+    assert len(before) > 1
+    # 只有包含插入段落的第一个分块改变，后面的分块与上一版完全相同
+    assert after[1:] == before[1:]
+    assert after[0] != before[0]
+
+
+def _docx(path, paragraphs):
+    body = "".join(f"<w:p><w:r><w:t>{text}</w:t></w:r></w:p>" for text in paragraphs)
+    with zipfile.ZipFile(path, "w") as docx:
+        docx.writestr("word/document.xml", '<w:document xmlns:w="http://schemas.openxmlformats.org/'
+                                           f'wordprocessingml/2006/main"><w:body>{body}</w:body></w:document>')
+
+
+def test_second_version_sends_only_changed_segments(tmp_path):
+    settings = MockSettings(reply_prefix="")
+    server, base_url = start_mock_server(settings)
+    try:
+        translator = SiliconFlowTranslator(api_key="k", base_url=base_url, model="m", platform_id="custom",
+                                           use_cache=False)
+        path = str(tmp_path / "contract.manifest.jsonl")
+        versions = [["Intro", "Terms", "Signature"], ["Intro", "Revised terms", "Signature"]]
+        summaries = []
+        for number, paragraphs in enumerate(versions, 1):
+            source = tmp_path / f"contract_v{number}.docx"
+            _docx(source, paragraphs)
+            translator.journal = open_incremental_manifest(path, translator, "French", file_type="docx")
+            output = translate_docx_file_formatted(str(source), str(tmp_path / "out"), "French", translator)
+            assert output.endswith(".docx"), output
+            summaries.append(translator.journal.commit())
+        assert (summaries[0]["translated"], summaries[0]["reused"]) == (3, 0)
+        assert (summaries[1]["translated"], summaries[1]["reused"]) == (1, 2)
+        assert settings.snapshot()["requests"] == 2  # 第一版一批，第二版只发送修改的片段
+        with zipfile.ZipFile(output) as docx:
+            assert "Revised terms" in docx.read("word/document.xml").decode("utf-8")
+    finally:
+        server.shutdown()
@@ -0,0 +1,97 @@
+# test_rate_limiter.py
+"""限流器：Retry-After 解析与冷却、AIMD 并发窗口、等待超时、打开的流的上限，以及 429 时的重试。"""
+import email.utils
+import time
+
+import pytest
+import requests
+
+import rate_limiter
+from mock_openai_server import MockSettings, start_mock_server
+from rate_limiter import (AIMD_DECREASE_FACTOR, AIMD_MIN_WINDOW, ProviderLimiter, RateLimitTimeout,
+                          parse_retry_after, send_with_rate_limit, without_rate_limit_retries)
+
+
+def test_parse_retry_after_accepts_seconds_and_http_dates():
+    assert parse_retry_after("2") == 2.0
+    assert parse_retry_after("-1") == 0.0
+    assert parse_retry_after(None) is None
+    assert parse_retry_after("soon") is None
+    retry_at = email.utils.formatdate(time.time() + 10, usegmt=True)
+    assert 8.0 <= parse_retry_after(retry_at) <= 10.0
+
+
+def test_aimd_window_halves_once_per_round_trip_and_grows_on_success():
+    limiter = ProviderLimiter("aimd")
+    initial = limiter.window
+    limiter.acquire()
+    limiter.release(429, 0.1)
+    decreased = max(AIMD_MIN_WINDOW, initial * AIMD_DECREASE_FACTOR)
+    assert limiter.window == decreased
+    limiter.acquire()
+    limiter.release(503, 0.1)  # 同一波过载：一个往返时间内不再减半
+    assert limiter.window == decreased
+
+    limiter.acquire()
+    limiter.release(200, 0.1)
+    assert limiter.window == pytest.approx(decreased + 1.0 / decreased)
+    assert limiter.in_flight == 0
+    assert limiter.stats["throttled_429"] == 1 and limiter.stats["server_errors"] == 1
+
+
+def test_retry_after_holds_back_the_next_request():
+    limiter = ProviderLimiter("cooldown")
+    limiter.acquire()
+    limiter.release(429, 0.01, retry_after=0.3)
+    started = time.monotonic()
+    limiter.acquire()
+    assert time.monotonic() - started >= 0.25
+
+
+def test_acquire_times_out_when_the_window_is_full():
+    limiter = ProviderLimiter("full")
+    limiter.window = 1
+    limiter.acquire()
+    with pytest.raises(RateLimitTimeout):
+        limiter.acquire(timeout=0.1)
+    assert limiter.stats["acquire_timeouts"] == 1
+    limiter.release(200, 0.01)
+    limiter.acquire(timeout=0.1)
+
+
+def test_open_streams_are_limited_separately_from_the_window():
+    limiter = ProviderLimiter("streams", max_open_streams=1)
+    limiter.acquire(stream=True)
+    limiter.release(200, 0.01)  # 响应头已到：归还窗口，但流名额一直占用到流结束
+    assert limiter.in_flight == 0 and limiter.open_streams == 1
+    with pytest.raises(RateLimitTimeout):
+        limiter.acquire(stream=True, timeout=0.1)
+    limiter.acquire(timeout=0.1)  # 非流式请求不受流名额限制
+    limiter.release(200, 0.01)
+    limiter.release_stream()
+    limiter.acquire(stream=True, timeout=0.1)
+
+
+def test_send_with_rate_limit_retries_429_after_retry_after(monkeypatch):
+    monkeypatch.setattr(rate_limiter, "backoff_delay", lambda attempt: 0.0)
+    settings = MockSettings(rate_limit_rate=1.0, retry_after=0.2)
+    server, base_url = start_mock_server(settings)
+    try:
+        limiter = ProviderLimiter("mock", base_url=base_url)
+
+        def send():
+            return requests.post(f"{base_url}/chat/completions", json={"model": "m", "messages": []}, timeout=10)
+
+        started = time.monotonic()
+        response = send_with_rate_limit(limiter, send, max_retries=2)
+        assert response.status_code == 429  # 重试用完后返回最后一次的响应
+        assert time.monotonic() - started >= 0.35  # 每次重试前等待 Retry-After
+        assert settings.snapshot()["requests"] == 3
+        assert limiter.stats["retries"] == 2 and limiter.stats["throttled_429"] == 3
+        assert limiter.in_flight == 0
+
+        with without_rate_limit_retries():  # 路由器还能切换目标时只发送一次
+            assert send_with_rate_limit(limiter, send, max_retries=2).status_code == 429
+        assert settings.snapshot()["requests"] == 4
+    finally:
+        server.shutdown()
@@ -0,0 +1,75 @@
+# test_router.py
+"""路由器的熔断器：连续失败后熔断，冷却结束后半开状态只放行一个探测请求，探测成功恢复、失败重新熔断。"""
+import time
+
+import router
+from mock_openai_server import MockSettings, start_mock_server
+from router import CLOSED, HALF_OPEN, OPEN, RouteTarget, RoutingTranslator, TargetHealth
+from translator import SiliconFlowTranslator
+
+
+def _open(health: TargetHealth):
+    for _ in range(router.CIRCUIT_CONSECUTIVE_FAILURES):
+        health.record(False, 0.01)
+    assert health.state == OPEN
+
+
+def test_half_open_admits_a_single_probe(monkeypatch):
+    monkeypatch.setattr(router, "CIRCUIT_OPEN_SECONDS", 0.05)
+    health = TargetHealth()
+    _open(health)
+    assert not health.available() and not health.allow_request()
+
+    time.sleep(0.06)
+    assert health.available()
+    assert health.allow_request()       # 探测请求
+    assert health.state == HALF_OPEN
+    assert not health.allow_request()   # 探测进行中：其他请求继续被拒绝
+    assert not health.available()
+
+    assert health.record(True, 0.01) == CLOSED
+    assert health.allow_request() and health.allow_request()
+
+
+def test_failed_probe_opens_the_circuit_again(monkeypatch):
+    monkeypatch.setattr(router, "CIRCUIT_OPEN_SECONDS", 0.05)
+    health = TargetHealth()
+    _open(health)
+    time.sleep(0.06)
+    assert health.allow_request()
+    assert health.record(False, 0.01) == OPEN  # 半开状态下一次失败就重新熔断
+    assert not health.allow_request()
+    time.sleep(0.06)
+    assert health.allow_request()
+
+
+def test_router_fails_over_and_probes_the_recovered_target(monkeypatch):
+    monkeypatch.setattr(router, "CIRCUIT_OPEN_SECONDS", 0.2)
+    broken = MockSettings(error_rate=1.0)
+    healthy = MockSettings()
+    broken_server, broken_url = start_mock_server(broken)
+    healthy_server, healthy_url = start_mock_server(healthy)
+    try:
+        primary = SiliconFlowTranslator(api_key="k", base_url=broken_url, model="m", platform_id="primary",
+                                        use_cache=False)
+        secondary = SiliconFlowTranslator(api_key="k", base_url=healthy_url, model="m", platform_id="secondary",
+                                          use_cache=False)
+        routing = RoutingTranslator([RouteTarget(primary), RouteTarget(secondary)], mode="ordered")
+
+        for i in range(router.CIRCUIT_CONSECUTIVE_FAILURES):
+            assert routing.translate(f"text {i}", "French") == f"T:text {i}"
+        # 还能切换目标时限流器不重试：每次失败只打到主目标一次
+        assert broken.snapshot()["requests"] == router.CIRCUIT_CONSECUTIVE_FAILURES
+        assert routing.targets[0].health.state == OPEN
+
+        routing.translate("skipped", "French")  # 熔断期间不再尝试主目标
+        assert broken.snapshot()["requests"] == router.CIRCUIT_CONSECUTIVE_FAILURES
+
+        broken.error_rate = 0.0
+        time.sleep(0.25)
+        assert routing.translate("probe", "French") == "T:probe"
+        assert broken.snapshot()["requests"] == router.CIRCUIT_CONSECUTIVE_FAILURES + 1
+        assert routing.targets[0].health.state == CLOSED
+    finally:
+        broken_server.shutdown()
+        healthy_server.shutdown()
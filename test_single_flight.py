@@ -0,0 +1,90 @@
+# test_single_flight.py
+"""相同请求合并：并发的相同请求只发出一个上游调用；流式订阅者各自收到完整的流，全部断开时上游被取消。"""
+import json
+import threading
+
+from mock_openai_server import MockSettings, start_mock_server
+from single_flight import single_flight_snapshot
+from sse_relay import StreamRelay, iter_relay_frames
+from translator import SiliconFlowTranslator
+
+
+def _translator(base_url: str) -> SiliconFlowTranslator:
+    return SiliconFlowTranslator(api_key="k", base_url=base_url, model="m", platform_id="custom", use_cache=False)
+
+
+def _concurrently(count: int, call):
+    """Run call() on `count` threads released together; returns their results in thread order."""
+    barrier = threading.Barrier(count)
+    results = [None] * count
+
+    def run(index):
+        barrier.wait()
+        results[index] = call()
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=30)
+    return results
+
+
+def _relay_text(response) -> str:
+    relay = StreamRelay("custom", coalesce_ms=0)
+    try:
+        frames = list(iter_relay_frames(relay, response))
+    finally:
+        response.close()
+    return "".join(json.loads(frame[len("data: "):]).get("text_chunk", "") for frame in frames)
+
+
+def test_concurrent_identical_requests_share_one_upstream_call():
+    settings = MockSettings(latency_ms=300)  # 领头请求等待上游时，其余请求都能加入
+    server, base_url = start_mock_server(settings)
+    try:
+        translator = _translator(base_url)
+        results = _concurrently(4, lambda: translator.translate("Same text", "French"))
+        assert results == ["T:Same text"] * 4
+        assert settings.snapshot()["requests"] == 1
+        assert single_flight_snapshot()["in_flight"] == []
+    finally:
+        server.shutdown()
+
+
+def test_stream_is_fanned_out_to_every_subscriber():
+    settings = MockSettings(latency_ms=300, tokens_per_second=100)
+    server, base_url = start_mock_server(settings)
+    try:
+        translator = _translator(base_url)
+        texts = _concurrently(3, lambda: _relay_text(translator.translate("one two three four", "French", stream=True)))
+        assert settings.snapshot()["requests"] == 1
+        assert texts == ["T:one two three four"] * 3
+    finally:
+        server.shutdown()
+
+
+def test_upstream_is_cancelled_only_when_the_last_subscriber_leaves():
+    settings = MockSettings(latency_ms=300, tokens_per_second=50)
+    server, base_url = start_mock_server(settings)
+    try:
+        translator = _translator(base_url)
+        text = "a b c d e f g h"
+        leaver, stayer = _concurrently(2, lambda: translator.translate(text, "French", stream=True))
+        assert settings.snapshot()["requests"] == 1
+
+        next(leaver.iter_content(chunk_size=64))
+        leaver.close()  # 一个订阅者提前断开：另一个仍然收到完整的流
+        assert _relay_text(stayer) == f"T:{text}"
+
+        first, second = _concurrently(2, lambda: translator.translate(text, "French", stream=True))
+        assert settings.snapshot()["requests"] == 2
+        next(first.iter_content(chunk_size=64))
+        first.close()
+        second.close()  # 最后一个订阅者离开：上游连接关闭，请求移出注册表
+        assert single_flight_snapshot()["in_flight"] == []
+
+        translator.translate(text, "French", stream=True).close()  # 之后的相同请求重新发往上游
+        assert settings.snapshot()["requests"] == 3
+    finally:
+        server.shutdown()
@@ -0,0 +1,92 @@
+# test_sse_relay.py
+"""SSE 转发：按任意字节块增量解析上游事件，增量按时间窗口/长度合并成帧，上游停顿时按时发出已缓冲的译文。"""
+import json
+
+import requests
+
+from mock_openai_server import MockSettings, start_mock_server
+from sse_relay import FRAME_FORMAT_COMPACT, StreamRelay, iter_relay_frames, upstream_waiter
+
+
+def _delta(content: str) -> bytes:
+    event = {"id": "x", "choices": [{"index": 0, "delta": {"content": content}, "finish_reason": None}]}
+    return f"data: {json.dumps(event, ensure_ascii=False)}\n\n".encode("utf-8")
+
+
+def _texts(frames):
+    return [json.loads(frame[len("data: "):])["text_chunk"] for frame in frames if "text_chunk" in frame]
+
+
+def test_parser_handles_arbitrary_chunk_boundaries():
+    body = _delta("Hé") + b": keep-alive\n\n" + _delta("llo 世界") + b"data: [DONE]\n\n"
+    relay = StreamRelay("test", coalesce_ms=60000)
+    frames = []
+    for i in range(0, len(body), 3):  # 三字节一块：行和多字节字符都被切开
+        frames.extend(relay.feed(body[i:i + 3]))
+    assert relay.finished
+    assert "".join(_texts(frames)) == "Héllo 世界"
+    assert json.loads(frames[-1][len("data: "):]) == {"done": True}
+    assert relay.deltas == 2
+
+
+def test_deltas_are_coalesced_until_the_window_or_size_limit():
+    relay = StreamRelay("test", coalesce_ms=60000, coalesce_chars=10)
+    assert _texts(relay.feed(_delta("first"))) == ["first"]  # 第一个增量立即发出
+    assert relay.feed(_delta("a")) == []
+    assert relay.feed(_delta("b")) == []
+    assert relay.flush_delay() > 0
+    assert _texts(relay.feed(_delta("cdefghijk"))) == ["abcdefghijk"]  # 达到长度上限
+    assert relay.feed(_delta("tail")) == []
+    assert _texts(relay.close()) == ["tail"]
+    assert relay.frames == 3
+
+
+def test_error_events_end_the_stream():
+    relay = StreamRelay("test", FRAME_FORMAT_COMPACT, coalesce_ms=60000)
+    assert relay.feed(_delta("partial")) == ["data: partial\n\n"]
+    frames = relay.feed(_delta(" text\nmore") + b'data: {"error": {"message": "overloaded"}}\n\n' + _delta("ignored"))
+    assert relay.finished
+    # 已缓冲的译文先发出，再发出错误帧；之后的增量被忽略
+    assert frames == ["data:  text\ndata: more\n\n", "event: error\ndata: overloaded\n\n"]
+
+
+class _PausingResponse:
+    """Upstream that goes quiet after each chunk: wait_readable always times out."""
+
+    def __init__(self):
+        self.waits = []
+
+    def wait_readable(self, timeout: float) -> bool:
+        self.waits.append(timeout)
+        return False
+
+    def iter_content(self, chunk_size=None):
+        yield _delta("a")
+        yield _delta("b")
+        yield _delta("c") + b"data: [DONE]\n\n"
+
+
+def test_buffered_text_is_flushed_while_upstream_is_quiet():
+    response = _PausingResponse()
+    relay = StreamRelay("test", coalesce_ms=60000)
+    frames = list(iter_relay_frames(relay, response))
+    # "a" 立即发出；"b" 在上游停顿时由定时刷新发出，不必等到流结束
+    assert _texts(frames) == ["a", "b", "c"]
+    assert len(response.waits) == 1  # 只有缓冲区非空时才等待上游
+
+
+def test_relay_over_a_real_upstream_socket():
+    server, base_url = start_mock_server(MockSettings(tokens_per_second=200))
+    try:
+        response = requests.post(f"{base_url}/chat/completions", stream=True, timeout=10, json={
+            "model": "m", "stream": True, "messages": [{"role": "user", "content": "Translate:\n\nquick brown fox"}]})
+        try:
+            assert upstream_waiter(response) is not None  # 没有辅助线程：直接在 socket 上等待
+            relay = StreamRelay("test", coalesce_ms=20)
+            frames = list(iter_relay_frames(relay, response))
+        finally:
+            response.close()
+        assert "".join(_texts(frames)) == "T:quick brown fox"
+        assert relay.finished
+    finally:
+        server.shutdown()
@@ -0,0 +1,44 @@
+# test_translation_cache.py
+"""流式翻译写入缓存：消费者在 [DONE] 处停止读取并关闭响应，第二次相同请求应命中缓存。"""
+from mock_openai_server import MockSettings, start_mock_server
+from sse_relay import RELAY_READ_SIZE, StreamRelay
+from translation_cache import TranslationCache
+from translator import SiliconFlowTranslator
+
+
+def _relay_stream(response) -> str:
+    """Consume a streamed translation the way app.py does: stop at [DONE], then close the response."""
+    relay = StreamRelay("custom")
+    frames = []
+    try:
+        for chunk in response.iter_content(chunk_size=RELAY_READ_SIZE):
+            frames.extend(relay.feed(chunk))
+            if relay.finished:
+                break
+        else:
+            frames.extend(relay.close())
+    finally:
+        response.close()
+    return "".join(frames)
+
+
+def test_streamed_translation_is_cached_when_consumer_stops_at_done():
+    settings = MockSettings()
+    server, base_url = start_mock_server(settings)
+    try:
+        translator = SiliconFlowTranslator(api_key="k", base_url=base_url, model="m", platform_id="custom",
+                                           use_cache=False)
+        translator.cache = TranslationCache(db_path=None)
+
+        first = _relay_stream(translator.translate("Hello cache", "Chinese", stream=True))
+        assert settings.snapshot()["requests"] == 1
+        assert translator.cache.stats()["sets"] == 1
+
+        replay = translator.translate("Hello cache", "Chinese", stream=True)
+        assert replay.headers.get("X-Translation-Cache") == "HIT"
+        second = _relay_stream(replay)
+        assert settings.snapshot()["requests"] == 1
+        assert translator.cache.stats()["memory_hits"] == 1
+        assert "Hello cache" in first and "Hello cache" in second
+    finally:
+        server.shutdown()
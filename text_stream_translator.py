@@ -0,0 +1,197 @@
+# text_stream_translator.py
+"""
+大 .txt 文件的流式翻译：按块读取 + 增量解码，按段落切分并按 token 预算装箱，
+通过有界窗口并发翻译 (chunk_executor.iter_translated_chunks)，结果按原始顺序边完成边写出。
+内存占用只取决于读取块大小、分块预算和窗口大小，与文件大小无关。
+"""
+import codecs
+import logging
+import os
+import re
+from collections import deque
+from typing import BinaryIO, Callable, Iterable, Iterator, Optional, Tuple
+
+from chunk_executor import iter_translated_chunks
+from token_budget import estimate_tokens, get_model_budget, max_input_tokens, pack_chunks
+from translator import is_translation_error
+
+try:
+    from config import TEXT_STREAM_THRESHOLD_BYTES, TEXT_STREAM_READ_SIZE, TEXT_STREAM_WINDOW
+except ImportError:
+    TEXT_STREAM_THRESHOLD_BYTES = 16 * 1024 * 1024
+    TEXT_STREAM_READ_SIZE = 64 * 1024
+    TEXT_STREAM_WINDOW = 0
+
+logger = logging.getLogger(__name__)
+
+# 段落分隔：一个或多个空行 (空行中允许空格/制表符)
+_BLANK_LINES_RE = re.compile(r"\n[ \t]*\n(?:[ \t]*\n)*")
+
+# 每写出这么多个分块记录一次进度日志
+LOG_EVERY_CHUNKS = 100
+
+
+def should_stream(filepath: str) -> bool:
+    """Whether a .txt file is large enough to use the streaming pipeline automatically."""
+    try:
+        return os.path.getsize(filepath) > TEXT_STREAM_THRESHOLD_BYTES
+    except OSError:
+        return False
+
+
+def _split_trailing_whitespace(text: str) -> Tuple[str, str]:
+    stripped = text.rstrip()
+    return stripped, text[len(stripped):]
+
+
+def iter_paragraphs(stream: BinaryIO, encoding: str, max_chars: int,
+                    read_size: int = TEXT_STREAM_READ_SIZE) -> Iterator[Tuple[str, str]]:
+    """
+    Yield (paragraph, separator) pairs from a binary stream, where separator is the exact whitespace that
+    followed the paragraph in the source, so that joining all pairs reproduces the text (line endings normalized
+    to \\n). A paragraph longer than max_chars is cut at its last line break (or space) before the limit, which
+    keeps line-oriented files such as logs bounded too.
+    """
+    decoder = codecs.getincrementaldecoder(encoding)()
+    buffer = ""
+    eof = False
+    while not eof:
+        block = stream.read(read_size)
+        eof = not block
+        buffer += decoder.decode(block, final=eof)
+        hold = ""
+        if not eof and buffer.endswith("\r"):
+            buffer, hold = buffer[:-1], "\r"  # 可能是被读取块切开的 \r\n，留到下一轮
+        buffer = buffer.replace("\r\n", "\n")
+
+        position = 0
+        while True:
+            match = _BLANK_LINES_RE.search(buffer, position)
+            if match is None or (match.end() == len(buffer) and not eof):
+                break  # 位于缓冲区末尾的空行可能还会延续到下一块
+            yield buffer[position:match.start()], match.group()
+            position = match.end()
+        buffer = buffer[position:]
+
+        while len(buffer) > max_chars:
+            cut = buffer.rfind("\n", 0, max_chars)
+            if cut > 0:
+                yield buffer[:cut], "\n"
+                buffer = buffer[cut + 1:]
+                continue
+            cut = buffer.rfind(" ", 0, max_chars)
+            cut = cut + 1 if cut > 0 else max_chars
+            yield _split_trailing_whitespace(buffer[:cut])
+            buffer = buffer[cut:]
+        buffer += hold
+    if buffer:
+        yield _split_trailing_whitespace(buffer)
+
+
+def iter_stream_chunks(paragraphs: Iterable[Tuple[str, str]], model: Optional[str] = None,
+                       max_tokens: Optional[int] = None,
+                       anchor: Optional[Callable[[str], bool]] = None) -> Iterator[Tuple[str, str]]:
+    """
+    Pack (paragraph, separator) pairs into (chunk, separator) pairs within the model's token budget, keeping the
+    original separators inside each chunk. Oversized paragraphs are split on sentences like token_budget.pack_chunks.
+    Blank paragraphs are folded into the preceding separator; leading blank lines of the file are dropped.
+    With `anchor`, a chunk also ends after every paragraph for which anchor(paragraph) is true (incremental mode).
+    """
+    limit = max_tokens or max_input_tokens(model)
+    parts = []
+    tokens = 0
+    separator = ""
+    cut = False  # 上一个段落是锚点：下一个段落开始新的分块
+    for text, text_separator in paragraphs:
+        if not text.strip():
+            if parts:
+                separator += text + text_separator
+            continue
+        text_tokens = estimate_tokens(text, model)
+        if text_tokens > limit:
+            if parts:
+                yield "".join(parts), separator
+            pieces = pack_chunks([text], model, limit)
+            for piece in pieces[:-1]:
+                yield piece, ""
+            parts, tokens, separator = [pieces[-1]], limit, text_separator
+            cut = False
+            continue
+        if parts and (cut or tokens + text_tokens > limit):
+            yield "".join(parts), separator
+            parts, tokens = [], 0
+        if parts:
+            parts.append(separator)
+        parts.append(text)
+        tokens += text_tokens
+        separator = text_separator
+        cut = anchor is not None and anchor(text)
+    if parts:
+        yield "".join(parts), separator
+
+
+def output_filename(input_filepath: str, target_lang: str, base: Optional[str] = None, extension: str = ".txt") -> str:
+    """Output naming shared by the file translators: {stem}_translated_{lang}{extension}."""
+    stem = base or os.path.splitext(os.path.basename(input_filepath))[0]
+    lang = re.sub(r"[^\w\-]+", "_", target_lang.strip().lower()).strip("_") or "translated"
+    return f"{stem}_translated_{lang}{extension}"
+
+
+def translate_text_file_streaming(input_filepath: str, output_dir: str, target_lang: str, translator,
+                                  source_lang: Optional[str] = None, encoding: str = 'utf-8',
+                                  base: Optional[str] = None) -> str:
+    """
+    Constant-memory counterpart of file_translator.translate_text_file.
+    Returns the output path, or an "Error: ..." string (no partial output file is left behind).
+    """
+    try:
+        codecs.lookup(encoding)
+    except LookupError:
+        return f"Error: Unknown encoding '{encoding}'."
+    os.makedirs(output_dir, exist_ok=True)
+    output_filepath = os.path.join(output_dir, output_filename(input_filepath, target_lang, base))
+    partial_filepath = output_filepath + ".part"
+
+    budget = get_model_budget(translator.model)
+    limit = max_input_tokens(translator.model)
+    max_chars = int(limit * budget.other_chars_per_token)
+    separators = deque()  # 与在途分块一一对应，长度不超过窗口大小
+
+    logger.info(f"Streaming translation of '{input_filepath}' ({os.path.getsize(input_filepath)} bytes, {encoding}) "
+                f"to {target_lang}; chunk budget {limit} tokens.")
+    try:
+        with open(input_filepath, 'rb') as source, open(partial_filepath, 'w', encoding=encoding, newline='') as output:
+            def chunk_texts():
+                # 增量模式 (translator.journal 为 incremental.IncrementalManifest) 下按段落内容切分，分块与上一版对齐
+                chunks = iter_stream_chunks(iter_paragraphs(source, encoding, max_chars), translator.model, limit,
+                                            getattr(translator.journal, "anchor", None))
+                for chunk, separator in chunks:
+                    separators.append(separator)
+                    yield chunk
+
+            written = 0
+            for translation in iter_translated_chunks(translator, chunk_texts(), target_lang, source_lang,
+                                                      window=TEXT_STREAM_WINDOW or None):
+                if is_translation_error(translation):
+                    logger.error(f"Streaming translation stopped at chunk {written + 1}: {translation[:200]}")
+                    return f"Error: Translation failed at chunk {written + 1}: {translation}"
+                output.write(translation)
+                output.write(separators.popleft())
+                written += 1
+                if written % LOG_EVERY_CHUNKS == 0:
+                    logger.info(f"Streaming translation: {written} chunks written, {source.tell()} bytes read.")
+        os.replace(partial_filepath, output_filepath)
+        logger.info(f"Streaming translation complete: {written} chunks written to '{output_filepath}'.")
+        return output_filepath
+    except UnicodeDecodeError as e:
+        logger.error(f"Could not decode '{input_filepath}' as {encoding}: {e}")
+        return f"Error: Could not decode the file with encoding '{encoding}'. Try another encoding (e.g. gbk, latin-1). Details: {e}"
+    except UnicodeEncodeError as e:
+        logger.error(f"Could not encode translation as {encoding}: {e}")
+        return f"Error: The translation cannot be written with encoding '{encoding}'. Use utf-8 instead. Details: {e}"
+    except OSError as e:
+        logger.error(f"File error during streaming translation of '{input_filepath}': {e}")
+        return f"Error: File error during streaming translation: {e}"
+    finally:
+        if os.path.exists(partial_filepath):
+            os.remove(partial_filepath)
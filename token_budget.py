@@ -0,0 +1,134 @@
+# token_budget.py
+import logging
+import re
+from typing import Iterable, List, NamedTuple, Optional
+
+try:
+    from config import TRANSLATION_OUTPUT_EXPANSION, TOKEN_BUDGET_SAFETY_MARGIN
+except ImportError:
+    TRANSLATION_OUTPUT_EXPANSION = 1.3
+    TOKEN_BUDGET_SAFETY_MARGIN = 0.85
+
+logger = logging.getLogger(__name__)
+
+
+class ModelBudget(NamedTuple):
+    context_tokens: int          # 上下文窗口 (输入 + 输出)
+    max_output_tokens: int       # 单次回复的最大输出 token
+    cjk_tokens_per_char: float   # 中日韩字符的平均 token 数
+    other_chars_per_token: float # 其他字符 (拉丁字母、数字、标点、空白) 每个 token 的平均字符数
+
+
+# 按模型名称匹配的模型家族 (按顺序匹配第一个)。数值是保守估计，不需要精确。
+MODEL_FAMILY_BUDGETS = [
+    (re.compile(r"gpt-4o|gpt-4\.1|(^|/)o[134](-|$)", re.I), ModelBudget(128000, 16384, 0.8, 4.0)),
+    (re.compile(r"gpt-4", re.I), ModelBudget(128000, 4096, 1.2, 4.0)),
+    (re.compile(r"gpt-3\.5", re.I), ModelBudget(16385, 4096, 1.2, 4.0)),
+    (re.compile(r"deepseek", re.I), ModelBudget(65536, 8192, 0.6, 3.8)),
+    (re.compile(r"moonshot-v1-128k|kimi", re.I), ModelBudget(131072, 8192, 0.7, 3.8)),
+    (re.compile(r"moonshot-v1-32k", re.I), ModelBudget(32768, 8192, 0.7, 3.8)),
+    (re.compile(r"moonshot", re.I), ModelBudget(8192, 4096, 0.7, 3.8)),
+    (re.compile(r"qwen", re.I), ModelBudget(32768, 8192, 0.7, 3.8)),
+    (re.compile(r"glm", re.I), ModelBudget(32768, 4096, 0.7, 3.8)),
+    (re.compile(r"gemini", re.I), ModelBudget(1048576, 8192, 0.7, 4.0)),
+    (re.compile(r"claude", re.I), ModelBudget(200000, 8192, 1.0, 3.5)),
+    # 开源模型按上下文版本区分：Llama 3.1+ / Llama 4 / Gemma 3 为 128k，Mistral 系列为 32k，其余 (Llama 2/3、Gemma 1/2) 为 8k
+    (re.compile(r"llama-?3\.[1-9]|llama-?4(?!\d)|gemma-?3", re.I), ModelBudget(131072, 4096, 1.0, 3.8)),
+    (re.compile(r"mistral|mixtral|ministral|codestral", re.I), ModelBudget(32768, 4096, 1.0, 3.8)),
+    (re.compile(r"llama|gemma", re.I), ModelBudget(8192, 2048, 1.0, 3.8)),
+]
+# 未知模型：沿用 translate() 以前固定的 max_tokens=4000
+DEFAULT_MODEL_BUDGET = ModelBudget(8192, 4000, 1.2, 3.5)
+# 系统提示词 + 翻译指令 + 消息格式的开销
+PROMPT_OVERHEAD_TOKENS = 100
+
+_CJK_RE = re.compile(r"[぀-ヿ㐀-䶿一-鿿가-힯豈-﫿＀-￯]")
+# 句子结束符 (中英文) 之后切分；结束符后可能跟着引号/括号
+_SENTENCE_END_RE = re.compile(r"(?<=[。！？!?；;])[”’」』）)\"']*|(?<=[.])[”’\"')]*(?=\s)")
+
+
+def get_model_budget(model: Optional[str]) -> ModelBudget:
+    for pattern, budget in MODEL_FAMILY_BUDGETS:
+        if model and pattern.search(model):
+            return budget
+    return DEFAULT_MODEL_BUDGET
+
+
+def estimate_tokens(text: str, model: Optional[str] = None) -> int:
+    """Rough token count for `text` under the model family's tokenizer."""
+    budget = get_model_budget(model)
+    cjk_chars = len(_CJK_RE.findall(text))
+    other_chars = len(text) - cjk_chars
+    return int(cjk_chars * budget.cjk_tokens_per_char + other_chars / budget.other_chars_per_token) + 1
+
+
+def max_input_tokens(model: Optional[str]) -> int:
+    """
+    单个分块的输入 token 上限：翻译结果 (约为输入的 TRANSLATION_OUTPUT_EXPANSION 倍) 必须装得进
+    max_output_tokens，并且 提示词 + 输入 + 输出 必须装得进上下文窗口。
+    """
+    budget = get_model_budget(model)
+    by_output = budget.max_output_tokens / TRANSLATION_OUTPUT_EXPANSION
+    by_context = (budget.context_tokens - PROMPT_OVERHEAD_TOKENS) / (1 + TRANSLATION_OUTPUT_EXPANSION)
+    return max(64, int(min(by_output, by_context) * TOKEN_BUDGET_SAFETY_MARGIN))
+
+
+def split_sentences(text: str) -> List[str]:
+    """Split on sentence terminators, keeping each terminator (and any closing quote) with its sentence."""
+    sentences = []
+    start = 0
+    for match in _SENTENCE_END_RE.finditer(text):
+        end = match.end()
+        if end > start:
+            sentences.append(text[start:end])
+            start = end
+    if start < len(text):
+        sentences.append(text[start:])
+    return [s for s in sentences if s.strip()]
+
+
+def pack_chunks(paragraphs: Iterable[str], model: Optional[str] = None, max_tokens: Optional[int] = None,
+                separator: str = "\n\n") -> List[str]:
+    """
+    把段落尽量装满到 token 预算内组成分块。
+    超出预算的段落按句子拆分后再装箱；单个句子即使超出预算也保持完整，绝不在句子中间切断。
+    """
+    limit = max_tokens or max_input_tokens(model)
+    separator_tokens = estimate_tokens(separator, model)
+    chunks: List[str] = []
+    current: List[str] = []
+    current_tokens = 0
+
+    def flush():
+        nonlocal current, current_tokens
+        if current:
+            chunks.append(separator.join(current))
+        current, current_tokens = [], 0
+
+    for paragraph in paragraphs:
+        if not paragraph.strip():
+            continue
+        paragraph_tokens = estimate_tokens(paragraph, model)
+        if paragraph_tokens > limit:
+            # 长段落：先结束当前分块，再按句子装箱 (句子之间不插入分隔符，保持段落原样)
+            flush()
+            sentence_chunk, sentence_tokens = "", 0
+            for sentence in split_sentences(paragraph):
+                tokens = estimate_tokens(sentence, model)
+                if sentence_chunk and sentence_tokens + tokens > limit:
+                    chunks.append(sentence_chunk)
+                    sentence_chunk, sentence_tokens = "", 0
+                sentence_chunk += sentence
+                sentence_tokens += tokens
+            if sentence_chunk:
+                chunks.append(sentence_chunk)
+            continue
+        added_tokens = paragraph_tokens + (separator_tokens if current else 0)
+        if current and current_tokens + added_tokens > limit:
+            flush()
+            added_tokens = paragraph_tokens
+        current.append(paragraph)
+        current_tokens += added_tokens
+    flush()
+    logger.debug(f"Packed paragraphs into {len(chunks)} chunk(s) with a budget of {limit} tokens for model {model}.")
+    return chunks
@@ -0,0 +1,207 @@
+# tracing.py
+"""
+翻译请求生命周期的钩子与 span：translate()、限流等待、建立连接、每次上游请求、响应头、首个增量、生成阶段、
+后处理，以及文件翻译中的每个分块。监听器 (TraceListener) 在 span 开始/结束时收到回调；
+内置的 ChromeTraceExporter 把 span 写成 Chrome trace / Perfetto 可直接打开的 JSON。
+
+没有任何监听器时 span() 返回一个共享的空对象，开销只有一次 ContextVar 查询。
+监听器可以全局注册 (add_listener)，也可以只对当前上下文生效 (trace_to，例如单个任务)；
+chunk_executor、batch_translator 和 hedging 把上下文复制到各自的工作线程，所以并发的分块、批次和对冲请求会出现在同一条时间线上。
+"""
+import contextvars
+import json
+import os
+import threading
+import time
+from typing import List, Optional
+
+_global_listeners: List["TraceListener"] = []
+_context_listeners: contextvars.ContextVar = contextvars.ContextVar("trace_listeners", default=())
+_current_span: contextvars.ContextVar = contextvars.ContextVar("trace_span", default=None)
+
+
+class TraceListener:
+    """Base class for span listeners; override what you need. Called on the thread that owns the span."""
+
+    def on_span_start(self, span: "Span"):
+        pass
+
+    def on_span_end(self, span: "Span"):
+        pass
+
+
+class Span:
+    """A timed section (time.perf_counter seconds) with attributes and instant marks inside it."""
+
+    __slots__ = ("name", "category", "attrs", "start", "end", "marks", "parent", "thread_id", "thread_name",
+                 "_listeners", "_token")
+
+    def __init__(self, name: str, category: str, attrs: dict, listeners, start: Optional[float] = None):
+        self.name = name
+        self.category = category
+        self.attrs = attrs
+        self.start = time.perf_counter() if start is None else start
+        self.end = None
+        self.marks = []  # [(name, ts, attrs)]
+        self.parent = _current_span.get()
+        thread = threading.current_thread()
+        self.thread_id = thread.ident
+        self.thread_name = thread.name
+        self._listeners = listeners
+        self._token = None
+
+    @property
+    def duration(self) -> Optional[float]:
+        return None if self.end is None else self.end - self.start
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def mark(self, name: str, ts: Optional[float] = None, **attrs):
+        """Instant event inside this span (e.g. response headers, first delta); ts defaults to now."""
+        self.marks.append((name, time.perf_counter() if ts is None else ts, attrs))
+
+    def __enter__(self):
+        self._token = _current_span.set(self)
+        _notify(self._listeners, "on_span_start", self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.end = time.perf_counter()
+        if exc_type is not None:
+            self.attrs["error"] = f"{exc_type.__name__}: {exc}"
+        _current_span.reset(self._token)
+        _notify(self._listeners, "on_span_end", self)
+        return False
+
+
+class _NoopSpan:
+    """Returned by span() when nobody is listening."""
+
+    __slots__ = ()
+
+    def set(self, **attrs):
+        pass
+
+    def mark(self, name, ts=None, **attrs):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+def _active_listeners():
+    context_listeners = _context_listeners.get()
+    if not _global_listeners:
+        return context_listeners
+    return tuple(_global_listeners) + context_listeners
+
+
+def _notify(listeners, method: str, span: Span):
+    for listener in listeners:
+        try:
+            getattr(listener, method)(span)
+        except Exception:
+            pass  # 监听器的错误不能影响翻译
+
+
+def is_tracing() -> bool:
+    return bool(_global_listeners or _context_listeners.get())
+
+
+def span(name: str, category: str = "translator", **attrs):
+    """`with span("chunk", index=3) as s: ...` - times the block and reports it to the active listeners."""
+    listeners = _active_listeners()
+    if not listeners:
+        return _NOOP_SPAN
+    return Span(name, category, attrs, listeners)
+
+
+def record_span(name: str, start: float, end: float, category: str = "translator", marks=(), **attrs):
+    """Report a section that was timed elsewhere (e.g. a stream consumed by another component)."""
+    listeners = _active_listeners()
+    if not listeners:
+        return
+    finished = Span(name, category, attrs, listeners, start)
+    finished.marks.extend(marks)
+    _notify(listeners, "on_span_start", finished)
+    finished.end = end
+    _notify(listeners, "on_span_end", finished)
+
+
+def current_span():
+    return _current_span.get() or _NOOP_SPAN
+
+
+def add_listener(listener: TraceListener):
+    """Register a process-wide listener (sees every span from every thread)."""
+    _global_listeners.append(listener)
+
+
+def remove_listener(listener: TraceListener):
+    if listener in _global_listeners:
+        _global_listeners.remove(listener)
+
+
+class trace_to:
+    """Context manager: send spans created in this context (and in contexts copied from it) to `listener`."""
+
+    def __init__(self, listener: TraceListener):
+        self.listener = listener
+        self._token = None
+
+    def __enter__(self):
+        self._token = _context_listeners.set(_context_listeners.get() + (self.listener,))
+        return self.listener
+
+    def __exit__(self, exc_type, exc, tb):
+        _context_listeners.reset(self._token)
+        return False
+
+
+class ChromeTraceExporter(TraceListener):
+    """
+    Collects finished spans as Chrome trace events ("X" complete events, "i" instant events for marks, thread
+    name metadata). Open the written file in chrome://tracing or https://ui.perfetto.dev.
+    """
+
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self.pid = os.getpid()
+        self.events = []
+        self._threads = {}
+        self._lock = threading.Lock()
+
+    def _ts(self, value: float) -> float:
+        return round((value - self.origin) * 1e6, 1)
+
+    def on_span_end(self, span: Span):
+        args = {key: value if isinstance(value, (str, int, float, bool)) or value is None else str(value)
+                for key, value in span.attrs.items()}
+        events = [{"name": span.name, "cat": span.category, "ph": "X", "ts": self._ts(span.start),
+                   "dur": round((span.end - span.start) * 1e6, 1), "pid": self.pid, "tid": span.thread_id, "args": args}]
+        for name, ts, attrs in span.marks:
+            events.append({"name": name, "cat": span.category, "ph": "i", "s": "t", "ts": self._ts(ts),
+                           "pid": self.pid, "tid": span.thread_id, "args": attrs})
+        with self._lock:
+            self.events.extend(events)
+            self._threads.setdefault(span.thread_id, span.thread_name)
+
+    def to_json(self) -> dict:
+        with self._lock:
+            metadata = [{"name": "thread_name", "ph": "M", "pid": self.pid, "tid": tid, "args": {"name": name}}
+                        for tid, name in self._threads.items()]
+            return {"traceEvents": metadata + sorted(self.events, key=lambda event: event["ts"]),
+                    "displayTimeUnit": "ms"}
+
+    def write(self, path: str):
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_json(), f)
@@ -0,0 +1,330 @@
+# translation_cache.py
+import hashlib
+import io
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Callable, List, Optional
+
+if TYPE_CHECKING:
+    import requests
+
+try:
+    from config import TRANSLATION_CACHE_ENABLED, TRANSLATION_CACHE_DB, TRANSLATION_CACHE_MEMORY_ENTRIES, \
+                       TRANSLATION_CACHE_DISK_MAX_ENTRIES, TRANSLATION_CACHE_TTL_SECONDS
+except ImportError:
+    TRANSLATION_CACHE_ENABLED = True
+    TRANSLATION_CACHE_DB = os.path.join("cache", "translation_cache.sqlite3")
+    TRANSLATION_CACHE_MEMORY_ENTRIES = 2048
+    TRANSLATION_CACHE_DISK_MAX_ENTRIES = 200000
+    TRANSLATION_CACHE_TTL_SECONDS = 30 * 24 * 3600
+
+logger = logging.getLogger(__name__)
+
+# 修改提示词或输出后处理时递增此版本号，旧的缓存条目会自然失效
+CACHE_KEY_VERSION = 2
+# 每写入这么多次才检查一次磁盘条目数量，避免每次 set 都执行 COUNT(*)
+_DISK_EVICTION_CHECK_INTERVAL = 256
+# 合成 SSE 流中每个 delta 帧携带的最大字符数
+_REPLAY_FRAME_CHARS = 256
+
+
+def normalize_text(text: str) -> str:
+    """Normalization applied before hashing: NFC, unified newlines, trimmed ends."""
+    return unicodedata.normalize("NFC", text).replace("\r\n", "\n").replace("\r", "\n").strip()
+
+
+class TranslationCache:
+    """Two-tier translation memory: an in-process LRU in front of an on-disk SQLite table."""
+
+    def __init__(self, db_path: Optional[str] = TRANSLATION_CACHE_DB,
+                 max_memory_entries: int = TRANSLATION_CACHE_MEMORY_ENTRIES,
+                 max_disk_entries: int = TRANSLATION_CACHE_DISK_MAX_ENTRIES,
+                 ttl_seconds: int = TRANSLATION_CACHE_TTL_SECONDS):
+        self.db_path = db_path
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_entries = max_disk_entries
+        self.ttl_seconds = ttl_seconds
+
+        self._memory = OrderedDict()  # key -> (value, created_at)
+        self._lock = threading.Lock()
+        self._writes_since_check = 0
+        self._counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "sets": 0, "expired": 0, "evicted": 0}
+
+        self._conn = None
+        if db_path:
+            db_dir = os.path.dirname(db_path)
+            if db_dir:
+                os.makedirs(db_dir, exist_ok=True)
+            self._conn = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+            self._conn.execute("PRAGMA journal_mode=WAL")  # 允许多个进程/线程同时读
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS translations ("
+                " key TEXT PRIMARY KEY, value TEXT NOT NULL,"
+                " created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_translations_accessed ON translations(accessed_at)")
+            self._conn.commit()
+        logger.info(f"Translation cache initialized. Disk store: {db_path or 'disabled'}, memory entries: {max_memory_entries}, disk entries: {max_disk_entries}, TTL: {ttl_seconds}s")
+
+    @staticmethod
+    def make_key(platform_id: str, base_url: str, model: str, source_lang: Optional[str], target_lang: str, text: str) -> str:
+        # base_url 也是键的一部分：同一个平台 ID 可能先后指向不同的上游 (自定义端点、重新加载的平台配置)
+        text_hash = hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+        raw_key = json.dumps([CACHE_KEY_VERSION, platform_id, (base_url or "").rstrip("/"), model, source_lang or "",
+                              target_lang, text_hash])
+        return hashlib.sha256(raw_key.encode("utf-8")).hexdigest()
+
+    def _is_expired(self, created_at: float, now: float) -> bool:
+        return self.ttl_seconds > 0 and now - created_at > self.ttl_seconds
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                value, created_at = entry
+                if not self._is_expired(created_at, now):
+                    self._memory.move_to_end(key)
+                    self._counters["memory_hits"] += 1
+                    return value
+                del self._memory[key]
+                self._counters["expired"] += 1
+
+            if self._conn is not None:
+                row = self._conn.execute("SELECT value, created_at FROM translations WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    value, created_at = row
+                    if not self._is_expired(created_at, now):
+                        self._conn.execute("UPDATE translations SET accessed_at = ? WHERE key = ?", (now, key))
+                        self._conn.commit()
+                        self._remember(key, value, created_at)
+                        self._counters["disk_hits"] += 1
+                        return value
+                    self._conn.execute("DELETE FROM translations WHERE key = ?", (key,))
+                    self._conn.commit()
+                    self._counters["expired"] += 1
+
+            self._counters["misses"] += 1
+            return None
+
+    def set(self, key: str, value: str):
+        if not value:
+            return
+        now = time.time()
+        with self._lock:
+            self._remember(key, value, now)
+            self._counters["sets"] += 1
+            if self._conn is not None:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO translations (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                    (key, value, now, now),
+                )
+                self._conn.commit()
+                self._writes_since_check += 1
+                if self._writes_since_check >= _DISK_EVICTION_CHECK_INTERVAL:
+                    self._writes_since_check = 0
+                    self._evict_disk(now)
+
+    def _remember(self, key: str, value: str, created_at: float):
+        """Insert into the in-memory LRU. Caller must hold self._lock."""
+        self._memory[key] = (value, created_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+            self._counters["evicted"] += 1
+
+    def _evict_disk(self, now: float):
+        """Drop expired rows, then the least recently used rows beyond max_disk_entries. Caller must hold self._lock."""
+        removed = 0
+        if self.ttl_seconds > 0:
+            removed += self._conn.execute("DELETE FROM translations WHERE created_at < ?", (now - self.ttl_seconds,)).rowcount
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM translations").fetchone()
+        overflow = count - self.max_disk_entries
+        if overflow > 0:
+            removed += self._conn.execute(
+                "DELETE FROM translations WHERE key IN (SELECT key FROM translations ORDER BY accessed_at ASC LIMIT ?)",
+                (overflow,),
+            ).rowcount
+        self._conn.commit()
+        if removed:
+            self._counters["evicted"] += removed
+            logger.info(f"Translation cache evicted {removed} disk entries.")
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._counters)
+            stats["memory_entries"] = len(self._memory)
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = round((stats["memory_hits"] + stats["disk_hits"]) / lookups, 4) if lookups else 0.0
+        return stats
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            if self._conn is not None:
+                self._conn.execute("DELETE FROM translations")
+                self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    # ---- 流式 (stream=True) 支持 ----
+
+    def wrap_stream(self, response: "requests.Response", key: str) -> "requests.Response":
+        """Record a live SSE response as it is consumed; store the text once the stream completes cleanly."""
+        response.raw = _RecordingRaw(response.raw, lambda body: self.store_stream_body(key, body))
+        return response
+
+    def store_stream_body(self, key: str, body: bytes):
+        text, complete = collect_sse_text(body)
+        if complete and text.strip():
+            self.set(key, text.strip())
+        else:
+            logger.debug("Streamed translation not cached (incomplete stream or error).")
+
+
+def collect_sse_text(body: bytes):
+    """Concatenate delta contents of an OpenAI-style SSE body. Returns (text, completed_without_error)."""
+    parts = []
+    complete = False
+    for line in body.decode("utf-8", errors="replace").splitlines():
+        line = line.strip()
+        if line.startswith("data: "):
+            line = line[len("data: "):].strip()
+        elif not (line.startswith("{") and line.endswith("}")):
+            continue
+        if line == "[DONE]":
+            complete = True
+            break
+        try:
+            event = json.loads(line)
+        except json.JSONDecodeError:
+            continue
+        if event.get("error"):
+            return "", False
+        choices = event.get("choices") or []
+        if choices:
+            content = (choices[0].get("delta") or {}).get("content")
+            if content:
+                parts.append(content)
+            if choices[0].get("finish_reason") == "stop":
+                complete = True
+        if event.get("done") is True:
+            complete = True
+    return "".join(parts), complete
+
+
+class _RecordingRaw:
+    """
+    Proxy for urllib3's raw response that keeps a copy of the bytes handed to requests.
+    Consumers stop reading at "data: [DONE]" and close the response, so the body is stored as soon as the terminator
+    has been read, or at the latest when the response is closed (incomplete bodies are rejected by store_stream_body).
+    """
+
+    _TERMINATOR = b"[DONE]"
+
+    def __init__(self, raw, on_complete: Callable[[bytes], None]):
+        self._raw = raw
+        self._on_complete = on_complete
+        self._buffer = bytearray()
+        self._finished = False
+
+    def _record(self, data: bytes):
+        if self._finished or not data:
+            return
+        # 只在新数据 (加上可能跨块的终止符前缀) 中查找终止符
+        search_from = max(0, len(self._buffer) - len(self._TERMINATOR))
+        self._buffer.extend(data)
+        if self._buffer.find(self._TERMINATOR, search_from) != -1:
+            self._finish()
+
+    def stream(self, amt=2 ** 16, decode_content=None):
+        for chunk in self._raw.stream(amt, decode_content=decode_content):
+            self._record(chunk)
+            yield chunk
+        self._finish()
+
+    def read(self, *args, **kwargs):
+        data = self._raw.read(*args, **kwargs)
+        if data:
+            self._record(data)
+        else:
+            self._finish()
+        return data
+
+    def close(self):
+        self._finish()
+        self._raw.close()
+
+    def release_conn(self):
+        self._finish()
+        release_conn = getattr(self._raw, "release_conn", None)
+        if release_conn is not None:
+            release_conn()
+
+    def _finish(self):
+        if self._finished:
+            return
+        self._finished = True
+        try:
+            self._on_complete(bytes(self._buffer))
+        except Exception as e:
+            logger.warning(f"Failed to store streamed translation in cache: {e}")
+        self._buffer = bytearray()
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+
+def sse_frames(text: str) -> List[str]:
+    """Split a translation into OpenAI-style SSE delta frames, terminated by [DONE]."""
+    frames = []
+    for i in range(0, len(text), _REPLAY_FRAME_CHARS):
+        delta = {"choices": [{"index": 0, "delta": {"content": text[i:i + _REPLAY_FRAME_CHARS]}, "finish_reason": None}]}
+        frames.append(f"data: {json.dumps(delta, ensure_ascii=False)}\n\n")
+    frames.append("data: [DONE]\n\n")
+    return frames
+
+
+def make_sse_response(text: str) -> "requests.Response":
+    """Build a requests.Response that replays a cached translation as an OpenAI-style SSE stream."""
+    import requests  # 延迟导入，纯缓存命中的非流式调用不需要 requests
+    frames = sse_frames(text)
+
+    response = requests.Response()
+    response.status_code = 200
+    response.headers["Content-Type"] = "text/event-stream"
+    response.headers["X-Translation-Cache"] = "HIT"
+    response.encoding = "utf-8"
+    response.raw = io.BytesIO("".join(frames).encode("utf-8"))
+    return response
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_default_cache() -> Optional[TranslationCache]:
+    """Process-wide cache shared by all translator instances, or None if disabled in config."""
+    global _default_cache
+    if not TRANSLATION_CACHE_ENABLED:
+        return None
+    if _default_cache is None:
+        with _default_cache_lock:
+            if _default_cache is None:
+                try:
+                    _default_cache = TranslationCache()
+                except (sqlite3.Error, OSError) as e:
+                    logger.warning(f"Could not open translation cache database '{TRANSLATION_CACHE_DB}': {e}. Falling back to memory-only cache.")
+                    _default_cache = TranslationCache(db_path=None)
+    return _default_cache
@@ -1,8 +1,17 @@
 # translator.py
-import requests
 import json
 import logging
-from typing import Optional
+import re
+import threading
+import time
+from typing import List, Optional
+
+from translation_cache import TranslationCache, get_default_cache, make_sse_response
+from token_budget import get_model_budget, pack_chunks, estimate_tokens, TRANSLATION_OUTPUT_EXPANSION
+from rate_limiter import RateLimitTimeout, get_rate_limiter, send_with_rate_limit
+from metrics import MeteredRaw, record_request
+from tracing import span
+from single_flight import deduplicate
 
 # 从 config.py 导入配置 (这些现在只作为绝对的后备，如果调用者完全没提供)
 # 更好的做法是让调用者 (app.py) 总是提供这些，或者在 Translator 初始化时就报错
@@ -18,9 +27,45 @@ except ImportError:
 
 logger = logging.getLogger(__name__)
 
+# translate() 在失败时返回 (而不是抛出) 以这些前缀开头的错误字符串
+TRANSLATION_ERROR_PREFIXES = (
+    "Error:",
+    "API HTTP Error",
+    "API Error",
+    "Network/Request Error",
+    "Rate Limit Error",
+    "JSON Decode Error",
+    "Unexpected error in translator",
+)
+
+# 上游过载的错误信息：429/5xx (send_with_rate_limit 已经退避重试过)，或限流器等不到许可
+_OVERLOAD_ERROR_PATTERN = re.compile(r"^(?:(?:API HTTP Error|API Error) (?:429|5\d\d)\b|Rate Limit Error)")
+
+# 当前线程最近一次非流式 translate() 的 token 用量 (翻译器实例在线程间共享，所以按线程记录)
+_thread_usage = threading.local()
+
+
+def last_call_usage() -> Optional[dict]:
+    """
+    Token usage of the last non-streaming translate() made by the calling thread: the API's `usage` object, or an
+    estimate ({"prompt_tokens", "completion_tokens", "estimated": True}) when the API did not return one.
+    None after a cache hit or a failed call.
+    """
+    return getattr(_thread_usage, "usage", None)
+
+
+def is_translation_error(result) -> bool:
+    """判断 translate() 的非流式返回值是否为错误信息"""
+    return not isinstance(result, str) or result.startswith(TRANSLATION_ERROR_PREFIXES)
+
+
+def is_upstream_overload_error(result) -> bool:
+    """判断错误信息是否表示上游过载 (429/5xx 或限流等待超时)：调用者不应再重试同一个目标"""
+    return isinstance(result, str) and bool(_OVERLOAD_ERROR_PATTERN.match(result))
+
 # 考虑将类名改为更通用的，例如 LLMAPITranslator 或 APITranslator
 class SiliconFlowTranslator: # Or GenericLLMTranslator
-    def __init__(self, api_key: str, base_url: str, model: str, platform_id: Optional[str] = None): # platform_id is new
+    def __init__(self, api_key: str, base_url: str, model: str, platform_id: Optional[str] = None, use_cache: bool = True): # platform_id is new
         # 现在强制要求调用者 (app.py) 提供这些值
         if not api_key:
             raise ValueError("API Key must be provided for translator initialization.")
@@ -33,6 +78,14 @@ class SiliconFlowTranslator: # Or GenericLLMTranslator
         self.base_url = base_url
         self.model = model
         self.platform_id = platform_id if platform_id else self._infer_platform_from_url(base_url) # Infer platform if not given
+        # 翻译记忆缓存 (进程内 LRU + SQLite)，在配置中禁用时为 None
+        self.cache = get_default_cache() if use_cache else None
+        # 文件分块的并发数；None 表示使用平台默认值 (见 chunk_executor.get_chunk_concurrency)
+        self.chunk_concurrency: Optional[int] = None
+        # 可选的进度回调 progress_callback(done, total)，由 translate_chunks 在每个分块完成时调用 (后台任务用它汇报进度)
+        self.progress_callback = None
+        # 可选的断点续传日志 (checkpoints.ChunkJournal)，由文件翻译的调用者设置；translate_chunks 会跳过其中已完成的分块
+        self.journal = None
 
         # Headers 将在 _make_request 中动态构建
         # self.headers 不再在这里固定设置
@@ -90,14 +143,8 @@ class SiliconFlowTranslator: # Or GenericLLMTranslator
         
         return common_headers
 
-    def translate(self, text: str, target_lang: str, source_lang: Optional[str] = None, stream: bool = False):
-        if not text:
-            logger.warning("Attempted translation with empty text.") # Changed to warning
-            return "Error: Text to translate cannot be empty." if not stream else self._yield_error_stream("Text to translate cannot be empty.")
-        if not target_lang:
-            logger.warning("Attempted translation with empty target language.")
-            return "Error: Target language cannot be empty." if not stream else self._yield_error_stream("Target language cannot be empty.")
-
+    def _build_payload(self, text: str, target_lang: str, source_lang: Optional[str], stream: bool) -> dict:
+        """构造 chat/completions 请求体 (同步与异步翻译器共用)"""
         messages = [
             {"role": "system", "content": "You are a professional and helpful translator. Translate accurately and naturally."},
         ]
@@ -116,12 +163,60 @@ class SiliconFlowTranslator: # Or GenericLLMTranslator
         # 一些平台可能需要不同的temperature/max_tokens默认值或不支持它们
         if self.platform_id not in ["ollama"]: # Ollama 的 /api/chat 不直接支持这些顶级参数
             payload["temperature"] = 0.7
-            payload["max_tokens"] = 4000 # 增加一些以防长文本被截断
+            payload["max_tokens"] = get_model_budget(self.model).max_output_tokens # 按模型家族的输出上限，避免长文本被截断
+        return payload
 
+    def _chat_completions_url(self) -> str:
         api_endpoint = "/chat/completions" # 大多数 OpenAI 兼容 API 使用此端点
-        full_api_url = f"{self.base_url.rstrip('/')}{api_endpoint}"
+        return f"{self.base_url.rstrip('/')}{api_endpoint}"
+
+    def translate(self, text: str, target_lang: str, source_lang: Optional[str] = None, stream: bool = False):
+        # 生命周期 span：限流等待、建立连接、上游请求 (响应头)、后处理；流式的生成阶段由 MeteredRaw 记录
+        with span("translate", platform=self.platform_id, model=self.model, stream=stream, chars=len(text or "")):
+            return self._translate(text, target_lang, source_lang, stream)
+
+    def _translate(self, text: str, target_lang: str, source_lang: Optional[str], stream: bool):
+        _thread_usage.usage = None
+        if not text:
+            logger.warning("Attempted translation with empty text.") # Changed to warning
+            return "Error: Text to translate cannot be empty." if not stream else self._yield_error_stream("Text to translate cannot be empty.")
+        if not target_lang:
+            logger.warning("Attempted translation with empty target language.")
+            return "Error: Target language cannot be empty." if not stream else self._yield_error_stream("Target language cannot be empty.")
+
+        cache_key = None
+        if self.cache is not None:
+            cache_key = self.cache.make_key(self.platform_id, self.base_url, self.model, source_lang, target_lang, text)
+            cached_translation = self.cache.get(cache_key)
+            if cached_translation is not None:
+                record_request(self.platform_id, self.model, "stream" if stream else "non_stream", "cache_hit")
+                logger.info(f"Translation cache HIT for platform {self.platform_id} with model {self.model} ({'STREAM replay' if stream else 'NON-STREAM'}).")
+                # 流式调用者收到一个合成的 SSE Response，app.py 的流处理逻辑无需任何改动
+                return make_sse_response(cached_translation) if stream else cached_translation
+
+        payload = self._build_payload(text, target_lang, source_lang, stream)
+        # 相同的并发请求 (例如多人同时粘贴同一段文字、同一文档连续上传两次) 共用一个上游调用
+        flight_key = TranslationCache.make_key(self.platform_id, self.base_url, self.model, source_lang, target_lang, text)
+        result, shared = deduplicate(flight_key, lambda: self._post_chat(payload, stream, cache_key), stream)
+        if shared:
+            record_request(self.platform_id, self.model, "stream" if stream else "non_stream", "shared")
+            logger.info(f"Joined an identical in-flight request for platform {self.platform_id} with model {self.model} ({'STREAM' if stream else 'NON-STREAM'}).")
+        return result
+
+    def _post_chat(self, payload: dict, stream: bool, cache_key: Optional[str] = None):
+        """
+        发送 chat/completions 请求并处理所有错误 (translate 与批量翻译共用)。
+        非流式返回回复文本或错误字符串；流式返回 requests.Response 或错误 SSE 生成器。
+        """
+        # 延迟导入：命中缓存的调用 (例如脚本反复执行的 main.py -t) 不需要加载 requests/urllib3
+        import requests
+        from http_pool import get_session, get_timeout
+
+        full_api_url = self._chat_completions_url()
         
         request_headers = self._get_headers() # 动态获取 Headers
+        mode = "stream" if stream else "non_stream"
+        started = time.perf_counter() # 指标：总耗时、首 token 时间 (见 metrics.py)
 
         try:
             # Log a part of the key for verification, but not the whole thing
@@ -130,68 +225,125 @@ class SiliconFlowTranslator: # Or GenericLLMTranslator
             # logger.debug(f"Request Headers: {request_headers}") # 打印实际发送的头
             # logger.debug(f"Request Payload: {json.dumps(payload)}")
 
+            # 复用进程级连接池中的 keep-alive 连接，而不是每次 requests.post 都重新握手
+            session = get_session(self.base_url, self.platform_id)
+            # 按上游 (平台 + base_url) 共享的限流器：RPM/TPM 令牌桶、AIMD 并发窗口，429/5xx 时按 Retry-After 或退避重试
+            limiter = get_rate_limiter(self.platform_id, self.base_url)
+            prompt_tokens = sum(estimate_tokens(m.get("content", ""), self.model) for m in payload.get("messages", []))
+            estimated_tokens = int(prompt_tokens * (1 + TRANSLATION_OUTPUT_EXPANSION))
             if stream:
-                response = requests.post(full_api_url, headers=request_headers, json=payload, stream=True, timeout=(10, 180)) # 增加读超时
+                response = send_with_rate_limit(limiter, lambda: session.post(full_api_url, headers=request_headers, json=payload, stream=True, timeout=get_timeout(stream=True)), estimated_tokens, stream=True)
                 # 对于流，我们不在获得初始响应时就 raise_for_status，因为错误可能在流的中间
                 # 但可以检查初始状态码
                 if response.status_code >= 400:
                     error_content = response.text # 尝试读取错误响应体
                     response.close() # 确保关闭连接
+                    record_request(self.platform_id, self.model, mode, "error", time.perf_counter() - started, response.status_code)
                     logger.error(f"Initial API HTTP Error {response.status_code} for STREAM request to {full_api_url}. Platform: {self.platform_id}. Response: {error_content[:500]}")
                     # 返回一个可迭代的错误，这样 app.py 中的流处理逻辑可以接收到它
                     return self._yield_error_stream(f"API Error {response.status_code}: {error_content[:200]}")
+                # 流结束 (或被提前关闭) 时记录首 token 时间、耗时和 token 数
+                response.raw = MeteredRaw(response.raw, self.platform_id, self.model, started, response.status_code, prompt_tokens)
+                if cache_key is not None:
+                    # 边转发边记录，流正常结束后写入缓存
+                    return self.cache.wrap_stream(response, cache_key)
                 return response # 返回原始的 requests.Response 对象
             else: # Non-stream
-                response = requests.post(full_api_url, headers=request_headers, json=payload, timeout=60) # 增加超时
+                response = send_with_rate_limit(limiter, lambda: session.post(full_api_url, headers=request_headers, json=payload, timeout=get_timeout(stream=False)), estimated_tokens)
                 response.raise_for_status() # This will raise HTTPError for 4xx/5xx
-                data = response.json()
-                # logger.debug(f"Received NON-STREAM response: {json.dumps(data)}")
-                if data and data.get("choices") and data["choices"][0].get("message") and data["choices"][0]["message"].get("content"):
-                    translated_text = data["choices"][0]["message"]["content"].strip()
-                    return translated_text
-                else:
-                    error_msg = f"No translation found in non-stream response or unexpected format from {self.platform_id}. Raw: {json.dumps(data, indent=2)[:500]}"
-                    logger.error(error_msg)
-                    return f"Error: {error_msg}"
+                with span("post_process"): # 解析 JSON、记录用量和写缓存
+                    data = response.json()
+                    # logger.debug(f"Received NON-STREAM response: {json.dumps(data)}")
+                    if data and data.get("choices") and data["choices"][0].get("message") and data["choices"][0]["message"].get("content"):
+                        translated_text = data["choices"][0]["message"]["content"].strip()
+                        _thread_usage.usage = data.get("usage") or {
+                            "prompt_tokens": prompt_tokens, "completion_tokens": estimate_tokens(translated_text, self.model),
+                            "estimated": True,
+                        }
+                        record_request(self.platform_id, self.model, mode, "success", time.perf_counter() - started,
+                                       response.status_code, _thread_usage.usage)
+                        if cache_key is not None:
+                            self.cache.set(cache_key, translated_text)
+                        return translated_text
+                    else:
+                        error_msg = f"No translation found in non-stream response or unexpected format from {self.platform_id}. Raw: {json.dumps(data, indent=2)[:500]}"
+                        logger.error(error_msg)
+                        record_request(self.platform_id, self.model, mode, "error", time.perf_counter() - started, response.status_code)
+                        return f"Error: {error_msg}"
 
         except requests.exceptions.HTTPError as e:
             status_code = e.response.status_code if e.response is not None else "Unknown"
             response_text = e.response.text if e.response is not None else "No response text"
-            try:
-                # 尝试解析JSON错误体
-                error_details_json = e.response.json() if e.response is not None else {}
-                message = error_details_json.get("error", {}).get("message", response_text) # OpenAI style
-                if not message or message == response_text: # Try other common error structures
-                    message = error_details_json.get("errors", {}).get("message", response_text) # ModelScope style
-                if not message or message == response_text:
-                    message = error_details_json.get("detail", response_text) # Some other APIs
-                detail_json_str = json.dumps(error_details_json) if error_details_json else response_text
-            except json.JSONDecodeError:
-                message = response_text
-                detail_json_str = response_text
-
-            error_msg_prefix = f"API HTTP Error {status_code}"
-            specific_error_msg = self._get_specific_http_error_message(status_code)
-            
-            full_error_output = f"{error_msg_prefix}: {specific_error_msg}\nDetails: {message}"
+            full_error_output, detail_json_str = self._format_http_error(status_code, response_text)
+            record_request(self.platform_id, self.model, mode, "error", time.perf_counter() - started, status_code)
             logger.error(f"HTTPError for {self.platform_id}: {full_error_output}. Raw response: {detail_json_str[:500]}")
             return full_error_output if not stream else self._yield_error_stream(full_error_output)
 
         except requests.exceptions.RequestException as e: # Catches ConnectionError, Timeout, etc.
             error_msg = f"Network/Request Error for {self.platform_id}: {type(e).__name__} - {e}"
             logger.error(error_msg)
+            record_request(self.platform_id, self.model, mode, "error", time.perf_counter() - started, "network")
+            return error_msg if not stream else self._yield_error_stream(error_msg)
+        except RateLimitTimeout as e: # 限流器在 RATE_LIMIT_ACQUIRE_TIMEOUT 内等不到许可：按上游过载处理
+            error_msg = f"Rate Limit Error for {self.platform_id}: {e}"
+            logger.error(error_msg)
+            record_request(self.platform_id, self.model, mode, "error", time.perf_counter() - started, "rate_limit")
             return error_msg if not stream else self._yield_error_stream(error_msg)
         except json.JSONDecodeError as e: # Should be caught by non-stream part primarily
             raw_response_text = response.text if 'response' in locals() and hasattr(response, 'text') else 'No response text available.'
             error_msg = f"JSON Decode Error from {self.platform_id}: Could not decode API response. {e}. Raw: {raw_response_text[:200]}"
             logger.error(error_msg)
+            record_request(self.platform_id, self.model, mode, "error", time.perf_counter() - started)
             return error_msg if not stream else self._yield_error_stream(error_msg)
         except Exception as e: # Catch-all for other unexpected errors
             import traceback
             error_msg = f"Unexpected error in translator for {self.platform_id}: {type(e).__name__} - {e}"
             logger.error(f"{error_msg}\n{traceback.format_exc()}")
+            record_request(self.platform_id, self.model, mode, "error", time.perf_counter() - started)
             return error_msg if not stream else self._yield_error_stream(error_msg)
 
+    def pack_chunks(self, paragraphs: List[str]) -> List[str]:
+        """按本模型的 token 预算把段落装箱成分块 (取代按字符数分块，见 token_budget.py)"""
+        return pack_chunks(paragraphs, self.model)
+
+    def translate_chunks(self, chunks: List[str], target_lang: str, source_lang: Optional[str] = None,
+                         on_chunk_done=None) -> List[str]:
+        """
+        并发翻译文件的多个分块并按原顺序返回 (文件翻译模块应调用此方法而不是逐个 translate)。
+        并发数取 self.chunk_concurrency，未设置时使用平台默认值；失败的分块单独重试。
+        """
+        from chunk_executor import translate_chunks # 延迟导入，避免循环依赖
+        return translate_chunks(self, chunks, target_lang, source_lang, on_chunk_done=on_chunk_done)
+
+    def translate_batch(self, segments: List[str], target_lang: str, source_lang: Optional[str] = None) -> List[str]:
+        """
+        把多个短片段编号后合并到尽量少的请求中翻译，返回与 segments 一一对应的译文。
+        回复的编号对不上时只对出错的范围二分重试 (见 batch_translator.py)。
+        """
+        from batch_translator import translate_batch # 延迟导入，避免循环依赖
+        return translate_batch(self, segments, target_lang, source_lang)
+
+    def _format_http_error(self, status_code, response_text: str):
+        """("API HTTP Error <code>: ...\nDetails: <message>", raw details for the log) for a non-stream error response."""
+        try:
+            # 尝试解析JSON错误体
+            error_details_json = json.loads(response_text) if response_text else {}
+            if not isinstance(error_details_json, dict):
+                raise ValueError("not an error object")
+            message = error_details_json.get("error", {}).get("message", response_text) # OpenAI style
+            if not message or message == response_text: # Try other common error structures
+                message = error_details_json.get("errors", {}).get("message", response_text) # ModelScope style
+            if not message or message == response_text:
+                message = error_details_json.get("detail", response_text) # Some other APIs
+            detail_json_str = json.dumps(error_details_json) if error_details_json else response_text
+        except (ValueError, AttributeError): # json.JSONDecodeError 是 ValueError；"error" 不是对象时为 AttributeError
+            message = response_text
+            detail_json_str = response_text
+
+        error_msg_prefix = f"API HTTP Error {status_code}"
+        specific_error_msg = self._get_specific_http_error_message(status_code)
+        return f"{error_msg_prefix}: {specific_error_msg}\nDetails: {message}", detail_json_str
+
     def _get_specific_http_error_message(self, status_code: int) -> str:
         """Helper to get a more specific message based on status code."""
         if status_code == 401: return "Unauthorized. API Key is invalid, missing, or expired."